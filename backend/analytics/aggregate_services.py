@@ -0,0 +1,391 @@
+import math
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from django.db.models import Count, FloatField, Max, Min, Q, Sum
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder as Medication
+from notifications.models import ClinicalAlert
+from gitdm.models import PatientProfile as Patient
+from .models import PatientAnalytics, PatientDailyAggregate, PatientAnalyticsState
+from .services import AnalyticsService, PatientAnalyticsService, GLUCOSE_LOINC_CODES, HBA1C_LOINC_CODES
+
+
+# فاصله‌های مرزی (روز) که در آن‌ها ورود یا خروج یک روز از پنجره‌ها، آنالیتیکس را تغییر می‌دهد
+WINDOW_BOUNDARY_OFFSETS = [0, 30, 60, 91, 120, 210]
+
+# ستون‌هایی که خالی بودن آن‌ها معنادار است (به صفر تبدیل نمی‌شوند)
+NULLABLE_FIELDS = {'glucose_min', 'glucose_max', 'hba1c_last_taken_at'}
+
+
+def _lab_aggregates() -> Dict:
+    """عبارت‌های تجمیع نتایج آزمایش برای یک روز"""
+    value = Cast('value', FloatField())
+    glucose = Q(loinc__in=GLUCOSE_LOINC_CODES) & ~Q(value=0)
+    hba1c = Q(loinc__in=HBA1C_LOINC_CODES) & ~Q(value=0)
+    return {
+        'lab_tests_count': Count('id'),
+        'glucose_count': Count('id', filter=glucose),
+        'glucose_sum': Sum(value, filter=glucose),
+        'glucose_sum_sq': Sum(value * value, filter=glucose),
+        'glucose_min': Min(value, filter=glucose),
+        'glucose_max': Max(value, filter=glucose),
+        'hba1c_count': Count('id', filter=hba1c),
+        'hba1c_sum': Sum(value, filter=hba1c),
+        'hba1c_last_taken_at': Max('taken_at', filter=Q(loinc__in=HBA1C_LOINC_CODES)),
+    }
+
+
+def _alert_aggregates() -> Dict:
+    """عبارت‌های تجمیع هشدارها برای یک روز"""
+    return {
+        'alerts_count': Count('id'),
+        'unacknowledged_alerts_count': Count('id', filter=Q(acknowledged_at__isnull=True)),
+    }
+
+
+def _clean(values: Dict) -> Dict:
+    """جایگزینی مقادیر خالی مجموع‌ها با صفر"""
+    return {
+        key: 0 if value is None and key not in NULLABLE_FIELDS else value
+        for key, value in values.items()
+    }
+
+
+class IncrementalAnalyticsService:
+    """
+    سرویس آنالیتیکس افزایشی بیماران.
+
+    هر نوشتن روی LabResult، Encounter، MedicationOrder و ClinicalAlert فقط ردیف
+    تجمیع همان روز بیمار را بازسازی می‌کند و بیمار را «کثیف» علامت می‌زند.
+    محاسبه روزانه آنالیتیکس فقط برای بیماران کثیف و از روی ردیف‌های تجمیع
+    (حداکثر 211 ردیف برای هر بیمار) انجام می‌شود.
+    """
+
+    def __init__(self):
+        self.analytics_service = AnalyticsService()
+
+    # ------------------------------------------------------------------
+    # نگهداری ردیف‌های تجمیع
+    # ------------------------------------------------------------------
+
+    # پارامتر create=False برای مسیر حذف است: ممکن است بیمار در حال حذف آبشاری باشد
+    # و ایجاد ردیف جدید برای او حذف را با خطای کلید خارجی مواجه کند.
+
+    def refresh_lab_bucket(self, patient_id: int, day: date, create: bool = True) -> None:
+        """بازسازی ستون‌های آزمایش برای یک بیمار و یک روز"""
+        self.refresh_bucket(patient_id, day, ['lab'], create)
+
+    def refresh_encounter_bucket(self, patient_id: int, day: date, create: bool = True) -> None:
+        """بازسازی تعداد ویزیت‌ها برای یک بیمار و یک روز"""
+        self.refresh_bucket(patient_id, day, ['encounter'], create)
+
+    def refresh_medication_bucket(self, patient_id: int, day: date, create: bool = True) -> None:
+        """بازسازی تعداد داروها برای یک بیمار و یک روز"""
+        self.refresh_bucket(patient_id, day, ['medication'], create)
+
+    def refresh_alert_bucket(self, patient_id: int, day: date, create: bool = True) -> None:
+        """بازسازی شمارش هشدارها برای یک بیمار و یک روز"""
+        self.refresh_bucket(patient_id, day, ['alert'], create)
+
+    def refresh_bucket(self, patient_id: int, day: date, sources: Iterable[str],
+                       create: bool = True, mark: bool = True) -> None:
+        """
+        بازسازی ستون‌های چند منبع (lab، encounter، medication، alert) در یک ردیف تجمیع
+
+        با mark=False علامت‌گذاری بیمار به فراخواننده سپرده می‌شود (مثلاً یک بار برای چند ردیف).
+        """
+        values = {}
+        for source in sources:
+            values.update(getattr(self, f'_{source}_bucket_values')(patient_id, day))
+        self._store_bucket(patient_id, day, values, create)
+        if mark:
+            self.mark_dirty([patient_id], create=create)
+
+    @staticmethod
+    def _lab_bucket_values(patient_id: int, day: date) -> Dict:
+        return _clean(LabResult.objects.filter(
+            patient_id=patient_id,
+            taken_at__date=day
+        ).aggregate(**_lab_aggregates()))
+
+    @staticmethod
+    def _encounter_bucket_values(patient_id: int, day: date) -> Dict:
+        return {'encounters_count': Encounter.objects.filter(patient_id=patient_id, occurred_at__date=day).count()}
+
+    @staticmethod
+    def _medication_bucket_values(patient_id: int, day: date) -> Dict:
+        return {'medications_count': Medication.objects.filter(patient_id=patient_id, start_date=day).count()}
+
+    @staticmethod
+    def _alert_bucket_values(patient_id: int, day: date) -> Dict:
+        return ClinicalAlert.objects.filter(
+            patient_id=patient_id,
+            created_at__date=day
+        ).aggregate(**_alert_aggregates())
+
+    def _store_bucket(self, patient_id: int, day: date, values: Dict, create: bool = True) -> None:
+        if create and any(values.values()):
+            # upsert در یک کوئری؛ روزی که داده‌ای ندارد ردیف جدید نمی‌گیرد
+            PatientDailyAggregate.objects.bulk_create(
+                [PatientDailyAggregate(patient_id=patient_id, date=day, **values)],
+                update_conflicts=True,
+                unique_fields=['patient', 'date'],
+                update_fields=[*values, 'updated_at'],
+            )
+        else:
+            # update() فیلد auto_now را تنظیم نمی‌کند؛ updated_at نشانه تغییر برای اثر انگشت گزارش‌هاست
+            PatientDailyAggregate.objects.filter(patient_id=patient_id, date=day).update(
+                updated_at=timezone.now(), **values
+            )
+
+    @staticmethod
+    def mark_dirty(patient_ids: Iterable[int], create: bool = True) -> None:
+        """علامت‌گذاری بیماران برای محاسبه مجدد در اجرای بعدی"""
+        patient_ids = set(patient_ids)
+        if create:
+            PatientAnalyticsState.objects.bulk_create(
+                [PatientAnalyticsState(patient_id=pid, is_dirty=True) for pid in patient_ids],
+                update_conflicts=True,
+                unique_fields=['patient'],
+                update_fields=['is_dirty'],
+            )
+        else:
+            PatientAnalyticsState.objects.filter(patient_id__in=patient_ids, is_dirty=False).update(is_dirty=True)
+
+    def rebuild_buckets(self, patient_ids: List[int]) -> int:
+        """
+        بازسازی کامل ردیف‌های تجمیع از داده‌های خام با چند کوئری گروهی.
+
+        برای بیمارانی که هنوز ردیف تجمیع ندارند یا پس از بارگذاری دسته‌ای داده
+        (که سیگنال ارسال نمی‌کند) استفاده می‌شود.
+        """
+        buckets: Dict[Tuple[int, date], Dict] = {}
+
+        def merge(rows, day_field='day'):
+            for row in rows:
+                key = (row.pop('patient_id'), row.pop(day_field))
+                buckets.setdefault(key, {}).update(_clean(row))
+
+        merge(
+            LabResult.objects.filter(patient_id__in=patient_ids)
+            .annotate(day=TruncDate('taken_at')).order_by()
+            .values('patient_id', 'day').annotate(**_lab_aggregates())
+        )
+        merge(
+            Encounter.objects.filter(patient_id__in=patient_ids)
+            .annotate(day=TruncDate('occurred_at')).order_by()
+            .values('patient_id', 'day').annotate(encounters_count=Count('id'))
+        )
+        merge(
+            Medication.objects.filter(patient_id__in=patient_ids).order_by()
+            .values('patient_id', 'start_date').annotate(medications_count=Count('id')),
+            day_field='start_date'
+        )
+        merge(
+            ClinicalAlert.objects.filter(patient_id__in=patient_ids)
+            .annotate(day=TruncDate('created_at')).order_by()
+            .values('patient_id', 'day').annotate(**_alert_aggregates())
+        )
+
+        PatientDailyAggregate.objects.filter(patient_id__in=patient_ids).delete()
+        PatientDailyAggregate.objects.bulk_create(
+            [
+                PatientDailyAggregate(patient_id=patient_id, date=day, **values)
+                for (patient_id, day), values in buckets.items()
+            ],
+            batch_size=1000
+        )
+        self.mark_dirty(patient_ids)
+        return len(buckets)
+
+    # ------------------------------------------------------------------
+    # محاسبه آنالیتیکس از روی ردیف‌های تجمیع
+    # ------------------------------------------------------------------
+
+    def get_dirty_patient_ids(self, target_date: Optional[date] = None) -> List[int]:
+        """
+        بیمارانی که آنالیتیکس آن‌ها باید دوباره محاسبه شود:
+        بیماران علامت‌خورده، بیمارانی که هرگز محاسبه نشده‌اند و بیمارانی که
+        از آخرین محاسبه، یکی از روزهای دارای داده آن‌ها از مرز پنجره‌ها عبور کرده است.
+        """
+        if not target_date:
+            target_date = timezone.now().date()
+
+        dirty: Set[int] = set(
+            PatientAnalyticsState.objects.filter(
+                Q(is_dirty=True) | Q(last_calculated_on__isnull=True)
+            ).values_list('patient_id', flat=True)
+        )
+        dirty.update(
+            Patient.objects.filter(analytics_state__isnull=True).values_list('id', flat=True)
+        )
+
+        since = PatientAnalyticsState.objects.filter(
+            is_dirty=False
+        ).aggregate(since=Min('last_calculated_on'))['since']
+        if since and since < target_date:
+            boundary = Q()
+            for offset in WINDOW_BOUNDARY_OFFSETS:
+                boundary |= Q(
+                    date__gte=since - timedelta(days=offset + 1),
+                    date__lte=target_date - timedelta(days=offset)
+                )
+            dirty.update(
+                PatientDailyAggregate.objects.filter(boundary).values_list('patient_id', flat=True).distinct()
+            )
+
+        return sorted(dirty)
+
+    def calculate_dirty_patient_analytics(self, target_date: Optional[date] = None,
+                                          batch_size: int = 1000) -> int:
+        """محاسبه آنالیتیکس فقط برای بیماران کثیف"""
+        if not target_date:
+            target_date = timezone.now().date()
+
+        patient_ids = self.get_dirty_patient_ids(target_date)
+        self.rebuild_missing_buckets(patient_ids, batch_size)
+        return self.calculate_patient_analytics_from_buckets(patient_ids, target_date, batch_size)
+
+    def rebuild_missing_buckets(self, patient_ids: List[int], batch_size: int = 1000) -> int:
+        """
+        ساخت ردیف‌های تجمیع بیمارانی که هنوز وضعیت محاسبه ندارند
+
+        این بیماران (مثلاً درج شده با bulk_create یا پیش از راه‌اندازی تجمیع) ردیف تجمیع هم
+        ندارند و محاسبه از روی ردیف‌ها برای آن‌ها خالی است.
+        """
+        never_seen = sorted(set(patient_ids) - set(
+            PatientAnalyticsState.objects.filter(patient_id__in=patient_ids).values_list('patient_id', flat=True)
+        ))
+        for offset in range(0, len(never_seen), batch_size):
+            self.rebuild_buckets(never_seen[offset:offset + batch_size])
+        return len(never_seen)
+
+    def calculate_patient_analytics_from_buckets(self, patient_ids: List[int],
+                                                 target_date: Optional[date] = None,
+                                                 batch_size: int = 1000) -> int:
+        """محاسبه و upsert رکوردهای PatientAnalytics از روی ردیف‌های تجمیع"""
+        if not target_date:
+            target_date = timezone.now().date()
+
+        written = 0
+        for offset in range(0, len(patient_ids), batch_size):
+            chunk = patient_ids[offset:offset + batch_size]
+            rows = self._build_analytics_from_buckets(chunk, target_date)
+            PatientAnalytics.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['patient', 'date'],
+                update_fields=PatientAnalyticsService.BULK_UPDATE_FIELDS,
+            )
+            PatientAnalyticsState.objects.filter(patient_id__in=chunk).update(
+                is_dirty=False,
+                last_calculated_on=target_date
+            )
+            written += len(rows)
+
+        return written
+
+    def _build_analytics_from_buckets(self, patient_ids: List[int], target_date: date) -> List[PatientAnalytics]:
+        # بازه‌ها همانند calculate_patient_analytics؛ بازه‌های datetime تا نیمه‌شب روز پایانی
+        # معادل روزهای [شروع، پایان) هستند و بازه‌های date شامل روز پایانی‌اند
+        def days(start: int, end: int) -> Q:
+            return Q(date__gte=target_date - timedelta(days=start), date__lt=target_date - timedelta(days=end))
+
+        current = days(30, 0)
+        previous = days(60, 30)
+        hba1c_current = days(120, 0)
+        hba1c_previous = days(210, 120)
+        inclusive = Q(date__gte=target_date - timedelta(days=30), date__lte=target_date)
+        with_glucose = Q(glucose_count__gt=0)
+
+        buckets = PatientDailyAggregate.objects.filter(
+            patient_id__in=patient_ids,
+            date__gte=target_date - timedelta(days=210),
+            date__lte=target_date
+        )
+        stats = {
+            row.pop('patient_id'): row
+            for row in buckets.order_by().values('patient_id').annotate(
+                glucose_n=Sum('glucose_count', filter=current),
+                glucose_total=Sum('glucose_sum', filter=current),
+                glucose_total_sq=Sum('glucose_sum_sq', filter=current),
+                glucose_low=Min('glucose_min', filter=current & with_glucose),
+                glucose_high=Max('glucose_max', filter=current & with_glucose),
+                previous_glucose_n=Sum('glucose_count', filter=previous),
+                previous_glucose_total=Sum('glucose_sum', filter=previous),
+                hba1c_n=Sum('hba1c_count', filter=hba1c_current),
+                hba1c_total=Sum('hba1c_sum', filter=hba1c_current),
+                previous_hba1c_n=Sum('hba1c_count', filter=hba1c_previous),
+                previous_hba1c_total=Sum('hba1c_sum', filter=hba1c_previous),
+                encounters=Sum('encounters_count', filter=current),
+                lab_tests=Sum('lab_tests_count', filter=current),
+                medications=Sum('medications_count', filter=inclusive),
+                alerts=Sum('alerts_count', filter=inclusive),
+                unacknowledged=Sum('unacknowledged_alerts_count', filter=inclusive),
+            )
+        }
+        last_hba1c = dict(
+            PatientDailyAggregate.objects.filter(
+                patient_id__in=patient_ids,
+                hba1c_last_taken_at__isnull=False
+            ).order_by().values('patient_id').annotate(
+                last=Max('hba1c_last_taken_at')
+            ).values_list('patient_id', 'last')
+        )
+
+        today = timezone.now().date()
+        compliance_scores = PatientAnalyticsService._compliance_scores_from_arrays(
+            np.array([stats.get(pid, {}).get('encounters') or 0 for pid in patient_ids]),
+            np.array([
+                (today - last_hba1c[pid].date()).days if pid in last_hba1c else np.nan
+                for pid in patient_ids
+            ], dtype=float),
+            np.array([stats.get(pid, {}).get('unacknowledged') or 0 for pid in patient_ids]),
+        )
+
+        rows = []
+        for patient_id, compliance_score in zip(patient_ids, compliance_scores.tolist()):
+            row = stats.get(patient_id, {})
+            analytics = PatientAnalytics(patient_id=patient_id, date=target_date)
+
+            glucose_n = row.get('glucose_n') or 0
+            if glucose_n:
+                mean = row['glucose_total'] / glucose_n
+                variance = max(row['glucose_total_sq'] / glucose_n - mean * mean, 0.0)
+                analytics.avg_glucose = mean
+                analytics.min_glucose = row['glucose_low']
+                analytics.max_glucose = row['glucose_high']
+                analytics.glucose_std_dev = math.sqrt(variance)
+
+                if row.get('previous_glucose_n'):
+                    analytics.glucose_trend = self.analytics_service.calculate_trend(
+                        mean,
+                        row['previous_glucose_total'] / row['previous_glucose_n']
+                    )
+
+            hba1c_n = row.get('hba1c_n') or 0
+            if hba1c_n:
+                analytics.avg_hba1c = row['hba1c_total'] / hba1c_n
+
+                if row.get('previous_hba1c_n'):
+                    analytics.hba1c_trend = self.analytics_service.calculate_trend(
+                        analytics.avg_hba1c,
+                        row['previous_hba1c_total'] / row['previous_hba1c_n'],
+                        threshold=3.0
+                    )
+
+            analytics.encounters_count = row.get('encounters') or 0
+            analytics.medications_count = row.get('medications') or 0
+            analytics.lab_tests_count = row.get('lab_tests') or 0
+            analytics.alerts_count = row.get('alerts') or 0
+            analytics.compliance_score = compliance_score
+
+            rows.append(analytics)
+
+        return rows
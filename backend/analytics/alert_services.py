@@ -0,0 +1,158 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from notifications.models import ClinicalAlert
+from gitdm.models import PatientProfile
+from .aggregate_services import IncrementalAnalyticsService
+from .cohort import CohortIndexService
+from .dashboard_services import DashboardSummaryService
+from .models import PatientAnalytics, TaskWatermark
+from .rollup_services import CounterRollupService
+
+logger = logging.getLogger(__name__)
+
+CRITICAL_VALUES_WATERMARK = 'check_critical_values'
+
+# آستانه‌های مقادیر بحرانی آنالیتیکس روزانه
+CRITICAL_HBA1C = 10
+CRITICAL_GLUCOSE_LOW = 50
+CRITICAL_GLUCOSE_HIGH = 400
+
+# ردیفی که updated_at آن پیش از watermark است ولی پس از اجرای قبلی commit شده،
+# با این همپوشانی دوباره بررسی می‌شود؛ هشدار تکراری با حذف تکرار ساخته نمی‌شود
+DEFAULT_WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+class CriticalValueAlertService:
+    """
+    ایجاد هشدار بالینی برای مقادیر بحرانی آنالیتیکس روزانه بیماران.
+
+    هر اجرا فقط ردیف‌های PatientAnalytics امروز را که پس از watermark اجرای قبلی
+    به‌روز شده‌اند و یکی از آستانه‌ها را رد کرده‌اند با یک کوئری می‌خواند، هشدارهای
+    فعال موجود را با یک کوئری کنار می‌گذارد و هشدارهای جدید را با bulk_create می‌سازد؛
+    بنابراین هزینه آن متناسب با تعداد بیماران تغییر کرده است، نه کل بیماران.
+    """
+
+    def __init__(self, overlap: Optional[timedelta] = None):
+        self.overlap = overlap if overlap is not None else getattr(
+            settings, 'CRITICAL_VALUES_WATERMARK_OVERLAP', DEFAULT_WATERMARK_OVERLAP
+        )
+
+    def get_watermark(self) -> Optional[datetime]:
+        return TaskWatermark.objects.filter(name=CRITICAL_VALUES_WATERMARK).values_list('value', flat=True).first()
+
+    def set_watermark(self, value: datetime) -> None:
+        TaskWatermark.objects.update_or_create(name=CRITICAL_VALUES_WATERMARK, defaults={'value': value})
+
+    def find_breaches(self, since: Optional[datetime] = None, today=None) -> List[Dict]:
+        """ردیف‌های آنالیتیکس امروز که از آستانه‌های بحرانی عبور کرده‌اند"""
+        today = today or timezone.localdate()
+        queryset = PatientAnalytics.objects.filter(date=today).filter(
+            Q(avg_hba1c__gt=CRITICAL_HBA1C) |
+            Q(avg_glucose__lt=CRITICAL_GLUCOSE_LOW) |
+            Q(avg_glucose__gt=CRITICAL_GLUCOSE_HIGH)
+        )
+        if since is not None:
+            queryset = queryset.filter(updated_at__gt=since - self.overlap)
+        return list(queryset.order_by().values('patient_id', 'avg_hba1c', 'avg_glucose'))
+
+    @staticmethod
+    def build_alerts(row: Dict) -> List[ClinicalAlert]:
+        """هشدارهای (ذخیره نشده) یک ردیف آنالیتیکس"""
+        alerts = []
+        hba1c = row['avg_hba1c']
+        glucose = row['avg_glucose']
+
+        if hba1c is not None and hba1c > CRITICAL_HBA1C:
+            alerts.append(ClinicalAlert(
+                patient_id=row['patient_id'],
+                alert_type=ClinicalAlert.AlertType.HIGH_HBA1C,
+                severity='CRITICAL',
+                trigger_value=round(hba1c, 4),
+                threshold_value=CRITICAL_HBA1C,
+                message=f'HbA1c بحرانی: {hba1c}% - نیاز به اقدام فوری'
+            ))
+
+        if glucose is not None and (glucose < CRITICAL_GLUCOSE_LOW or glucose > CRITICAL_GLUCOSE_HIGH):
+            is_high = glucose > CRITICAL_GLUCOSE_HIGH
+            alerts.append(ClinicalAlert(
+                patient_id=row['patient_id'],
+                alert_type=ClinicalAlert.AlertType.HIGH_GLUCOSE if is_high else ClinicalAlert.AlertType.LOW_GLUCOSE,
+                severity='CRITICAL',
+                trigger_value=round(glucose, 4),
+                threshold_value=CRITICAL_GLUCOSE_HIGH if is_high else CRITICAL_GLUCOSE_LOW,
+                message=f'قند خون بحرانی: {glucose} mg/dL'
+            ))
+
+        return alerts
+
+    @staticmethod
+    def _active_alert_keys(patient_ids: List[int]) -> set:
+        """(بیمار، نوع هشدار) هشدارهای بحرانی فعال موجود"""
+        return set(ClinicalAlert.objects.filter(
+            patient_id__in=patient_ids,
+            alert_type__in=[
+                ClinicalAlert.AlertType.HIGH_HBA1C,
+                ClinicalAlert.AlertType.HIGH_GLUCOSE,
+                ClinicalAlert.AlertType.LOW_GLUCOSE,
+            ],
+            severity='CRITICAL',
+            is_active=True
+        ).order_by().values_list('patient_id', 'alert_type'))
+
+    def run(self) -> int:
+        """بررسی تغییرات از اجرای قبلی و ایجاد هشدارهای جدید؛ تعداد هشدارهای ساخته شده برگردانده می‌شود"""
+        started_at = timezone.now()
+        breaches = self.find_breaches(since=self.get_watermark())
+
+        candidates = [alert for row in breaches for alert in self.build_alerts(row)]
+        new_alerts = []
+        if candidates:
+            existing = self._active_alert_keys([alert.patient_id for alert in candidates])
+            new_alerts = [alert for alert in candidates if (alert.patient_id, alert.alert_type) not in existing]
+
+        with transaction.atomic():
+            if new_alerts:
+                ClinicalAlert.objects.bulk_create(new_alerts)
+                self._after_bulk_create(new_alerts)
+            self.set_watermark(started_at)
+
+        logger.info(f"Critical value check: {len(breaches)} breaching patients, {len(new_alerts)} new alerts")
+        return len(new_alerts)
+
+    @staticmethod
+    def _after_bulk_create(alerts: List[ClinicalAlert]) -> None:
+        """
+        کارهایی که سیگنال‌های post_save برای هر هشدار انجام می‌دهند و bulk_create آن‌ها را اجرا نمی‌کند:
+        شمارنده روزانه، ردیف تجمیع روز بیمار، شاخص cohort (open_alerts) و باطل کردن خلاصه داشبورد پزشک معالج
+        """
+        by_day: Dict[Tuple[int, object], int] = defaultdict(int)
+        for alert in alerts:
+            by_day[(alert.patient_id, timezone.localtime(alert.created_at).date())] += 1
+
+        rollups = CounterRollupService()
+        per_day: Dict[object, int] = defaultdict(int)
+        for (_, day), count in by_day.items():
+            per_day[day] += count
+        for day, count in per_day.items():
+            rollups.record('alerts', day, inserted=count)
+
+        incremental = IncrementalAnalyticsService()
+        for patient_id, day in by_day:
+            incremental.refresh_alert_bucket(patient_id, day)
+
+        patient_ids = {alert.patient_id for alert in alerts}
+        CohortIndexService().refresh_patients(patient_ids)
+
+        DashboardSummaryService.invalidate(
+            PatientProfile.objects.filter(pk__in=patient_ids).values_list(
+                'primary_doctor_id', flat=True
+            )
+        )
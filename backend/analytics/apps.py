@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
-    verbose_name = 'Analytics Dashboard'
\ No newline at end of file
+    verbose_name = 'Analytics Dashboard'
+    
+    def ready(self):
+        import analytics.checks
+        import analytics.signals
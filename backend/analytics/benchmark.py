@@ -0,0 +1,523 @@
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models, transaction
+from django.db.models import Count
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder
+from gitdm.models import DoctorProfile, PatientProfile
+
+logger = logging.getLogger(__name__)
+
+# دامنه ایمیل پزشکان ساختگی؛ داده‌های بنچمارک با آن شناسایی و پاک می‌شوند
+BENCHMARK_EMAIL_DOMAIN = 'benchmark.invalid'
+
+INSERT_BATCH_SIZE = 10000
+
+# تعداد بیماران هر دسته حذف در SyntheticClinicGenerator.clear
+DELETE_BATCH_SIZE = 1000
+
+# LOINC -> (سهم از کل آزمایش‌ها، واحد، میانگین، انحراف معیار، حداقل، حداکثر)
+LAB_DISTRIBUTION = {
+    '2345-7': (0.30, 'mg/dL', 145, 45, 40, 600),    # قند ناشتا
+    '2339-0': (0.14, 'mg/dL', 170, 55, 40, 600),    # قند تصادفی
+    '1558-6': (0.08, 'mg/dL', 190, 60, 40, 600),    # قند پس از غذا
+    '4548-4': (0.16, '%', 7.6, 1.4, 4.5, 15),       # HbA1c
+    '17856-6': (0.02, '%', 7.6, 1.4, 4.5, 15),      # HbA1c (HPLC)
+    '2093-3': (0.07, 'mg/dL', 190, 40, 90, 350),    # کلسترول کل
+    '2571-8': (0.06, 'mg/dL', 165, 70, 40, 600),    # تری‌گلیسرید
+    '2085-9': (0.05, 'mg/dL', 45, 12, 15, 100),     # HDL
+    '13457-7': (0.05, 'mg/dL', 110, 35, 30, 250),   # LDL
+    '2160-0': (0.07, 'mg/dL', 1.0, 0.35, 0.4, 6),   # کراتینین
+}
+
+# ATC -> (سهم از کل داروها، نام، دوز)
+MEDICATION_DISTRIBUTION = {
+    'A10BA02': (0.38, 'Metformin', '500mg'),
+    'A10AB01': (0.08, 'Insulin regular', '10units'),
+    'A10AE04': (0.09, 'Insulin glargine', '20units'),
+    'A10BB12': (0.08, 'Glimepiride', '2mg'),
+    'A10BH01': (0.07, 'Sitagliptin', '100mg'),
+    'A10BK01': (0.06, 'Dapagliflozin', '10mg'),
+    'A10BJ02': (0.04, 'Liraglutide', '1.2mg'),
+    'C09AA05': (0.10, 'Ramipril', '5mg'),
+    'C10AA05': (0.10, 'Atorvastatin', '20mg'),
+}
+
+FREQUENCIES = ['QD', 'BID', 'TID']
+
+
+def require_benchmark_database() -> None:
+    """
+    جلوگیری از ساخت، حذف یا اجرای بنچمارک روی پایگاه داده عملیاتی.
+
+    داده‌ساز سیگنال‌ها را دور می‌زند و جدول‌های مشتق را بازسازی می‌کند و سناریوها
+    آنالیتیکس روزانه را می‌نویسند؛ خارج از DEBUG فقط با ALLOW_ANALYTICS_BENCHMARK مجاز است.
+    """
+    if not getattr(settings, 'ALLOW_ANALYTICS_BENCHMARK', settings.DEBUG):
+        raise ImproperlyConfigured(
+            'Analytics benchmark is disabled on this database; set DJANGO_ALLOW_BENCHMARK=True '
+            'only on a dedicated benchmark database.'
+        )
+
+
+def _raw_delete(queryset: models.QuerySet, removed: Counter) -> None:
+    """
+    حذف ردیف‌های queryset و ردیف‌های وابسته (CASCADE) آن‌ها با DELETE مستقیم.
+
+    ردیف‌ها بارگذاری نمی‌شوند و سیگنال‌های حذف اجرا نمی‌شوند؛ کلیدهای SET_NULL با
+    UPDATE خالی می‌شوند. ردیف‌های حذف شده هر مدل به removed افزوده می‌شود.
+    """
+    for relation in get_candidate_relations_to_delete(queryset.model._meta):
+        related = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset})
+        if relation.on_delete is models.CASCADE:
+            if related.exists():
+                _raw_delete(related, removed)
+        elif relation.on_delete is models.SET_NULL:
+            related.update(**{relation.field.name: None})
+    removed[queryset.model._meta.label] += queryset._raw_delete(queryset.db)
+
+
+@dataclass
+class DatasetSpec:
+    """اندازه داده‌های ساختگی (پیش‌فرض: یک کلینیک بزرگ)"""
+    patients: int = 100_000
+    lab_results: int = 5_000_000
+    encounters: int = 1_000_000
+    medications: int = 1_000_000
+    patients_per_doctor: int = 500
+    days: int = 365
+    seed: int = 42
+
+    def scaled(self, factor: float) -> 'DatasetSpec':
+        return DatasetSpec(
+            patients=max(1, int(self.patients * factor)),
+            lab_results=int(self.lab_results * factor),
+            encounters=int(self.encounters * factor),
+            medications=int(self.medications * factor),
+            patients_per_doctor=self.patients_per_doctor,
+            days=self.days,
+            seed=self.seed,
+        )
+
+
+class SyntheticClinicGenerator:
+    """
+    تولید داده‌های ساختگی تکرارپذیر (با seed) برای بنچمارک آنالیتیکس.
+
+    ردیف‌ها با bulk_create درج می‌شوند و سیگنال‌ها اجرا نمی‌شوند؛ جدول‌های مشتق
+    (ردیف‌های تجمیع روزانه، شاخص cohort و شمارنده‌ها) پس از درج یک‌جا بازسازی می‌شوند. فعالیت
+    بیماران نامتوازن است (توزیع گاما) تا مانند داده واقعی چند بیمار پرمراجعه داشته باشیم.
+    """
+
+    def __init__(self, spec: DatasetSpec, stdout: Optional[Callable[[str], None]] = None):
+        self.spec = spec
+        self.rng = np.random.default_rng(spec.seed)
+        self.now = timezone.now()
+        self.log = stdout or logger.info
+
+    def generate(self, rebuild_derived: bool = True) -> Dict[str, int]:
+        require_benchmark_database()
+        doctor_user_ids = self._create_doctors()
+        patient_ids = self._create_patients(doctor_user_ids)
+        doctor_of = dict(PatientProfile.objects.filter(pk__in=patient_ids).values_list('pk', 'primary_doctor_id'))
+
+        # وزن فعالیت هر بیمار
+        weights = self.rng.gamma(shape=1.5, scale=1.0, size=len(patient_ids))
+        weights /= weights.sum()
+
+        encounter_ids = self._create_encounters(patient_ids, weights, doctor_of)
+        self._create_lab_results(patient_ids, weights, encounter_ids)
+        self._create_medications(patient_ids, weights)
+
+        if rebuild_derived:
+            self._rebuild_derived(patient_ids, doctor_user_ids)
+
+        return {
+            'doctors': len(doctor_user_ids),
+            'patients': len(patient_ids),
+            'encounters': self.spec.encounters,
+            'lab_results': self.spec.lab_results,
+            'medications': self.spec.medications,
+        }
+
+    # ------------------------------------------------------------------
+
+    def _random_times(self, size: int) -> List[datetime]:
+        """زمان‌های تصادفی در days روز گذشته؛ حدود 1٪ در همین روز تا آنالیتیکس روزانه داده داشته باشد"""
+        seconds = self.rng.integers(0, self.spec.days * 86400, size=size)
+        today = self.rng.random(size) < 0.01
+        seconds[today] = self.rng.integers(0, 3600, size=int(today.sum()))
+        return [self.now - timedelta(seconds=int(s)) for s in seconds]
+
+    def _insert_chunks(self, model, size: int, build: Callable[[int], List], label: str) -> None:
+        """درج size ردیف در دسته‌های INSERT_BATCH_SIZE؛ build(n) ردیف‌های هر دسته را می‌سازد"""
+        for start in range(0, size, INSERT_BATCH_SIZE):
+            rows = build(min(INSERT_BATCH_SIZE, size - start))
+            with transaction.atomic():
+                model.objects.bulk_create(rows)
+        self.log(f'{label}: {size}')
+
+    def _create_doctors(self) -> List[int]:
+        User = get_user_model()
+        count = max(1, -(-self.spec.patients // self.spec.patients_per_doctor))
+        password = make_password(None)
+        offset = User.objects.filter(email__endswith=f'@{BENCHMARK_EMAIL_DOMAIN}').count()
+        emails = [f'doctor{offset + i}@{BENCHMARK_EMAIL_DOMAIN}' for i in range(count)]
+        User.objects.bulk_create([
+            User(email=email, password=password, is_doctor=True, is_patient=False, full_name=f'پزشک {offset + i}')
+            for i, email in enumerate(emails)
+        ], batch_size=INSERT_BATCH_SIZE)
+        user_ids = list(User.objects.filter(email__in=emails).order_by('id').values_list('id', flat=True))
+        DoctorProfile.objects.bulk_create(
+            [DoctorProfile(user_id=user_id, medical_code=f'{90000 + offset + i}') for i, user_id in enumerate(user_ids)],
+            batch_size=INSERT_BATCH_SIZE
+        )
+        self.log(f'doctors: {count}')
+        return user_ids
+
+    def _create_patients(self, doctor_user_ids: List[int]) -> List[int]:
+        today = self.now.date()
+        first_id = (PatientProfile.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+        def build(n):
+            doctors = self.rng.choice(doctor_user_ids, size=n)
+            ages = self.rng.integers(25, 85, size=n)
+            sexes = self.rng.choice(['MALE', 'FEMALE'], size=n)
+            return [
+                PatientProfile(
+                    full_name=f'بیمار {i}',
+                    dob=today - timedelta(days=int(ages[i]) * 365),
+                    sex=str(sexes[i]),
+                    primary_doctor_id=int(doctors[i]),
+                )
+                for i in range(n)
+            ]
+
+        self._insert_chunks(PatientProfile, self.spec.patients, build, 'patients')
+        return list(PatientProfile.objects.filter(
+            id__gte=first_id, primary_doctor_id__in=doctor_user_ids
+        ).order_by('id').values_list('id', flat=True))
+
+    def _create_encounters(self, patient_ids: List[int], weights: np.ndarray,
+                           doctor_of: Dict[int, int]) -> Dict[int, int]:
+        """ویزیت‌ها؛ شناسه یکی از ویزیت‌های هر بیمار برای اتصال آزمایش‌ها برگردانده می‌شود"""
+        first_id = (Encounter.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+        def build(n):
+            patients = self.rng.choice(patient_ids, size=n, p=weights)
+            return [
+                Encounter(patient_id=int(patient), created_by_id=doctor_of[int(patient)], occurred_at=occurred_at)
+                for patient, occurred_at in zip(patients, self._random_times(n))
+            ]
+
+        self._insert_chunks(Encounter, self.spec.encounters, build, 'encounters')
+        return dict(Encounter.objects.filter(id__gte=first_id).values_list('patient_id', 'id'))
+
+    def _create_lab_results(self, patient_ids: List[int], weights: np.ndarray,
+                            encounter_ids: Dict[int, int]) -> None:
+        codes = list(LAB_DISTRIBUTION)
+        shares = np.array([LAB_DISTRIBUTION[code][0] for code in codes])
+        shares = shares / shares.sum()
+
+        def build(n):
+            loincs = self.rng.choice(len(codes), size=n, p=shares)
+            patients = self.rng.choice(patient_ids, size=n, p=weights)
+            noise = self.rng.standard_normal(n)
+            rows = []
+            for i, taken_at in enumerate(self._random_times(n)):
+                code = codes[loincs[i]]
+                _, unit, mean, sd, low, high = LAB_DISTRIBUTION[code]
+                value = min(max(mean + sd * noise[i], low), high)
+                patient = int(patients[i])
+                rows.append(LabResult(
+                    patient_id=patient,
+                    encounter_id=encounter_ids.get(patient),
+                    loinc=code,
+                    value=Decimal(f'{value:.2f}'),
+                    unit=unit,
+                    taken_at=taken_at,
+                ))
+            return rows
+
+        self._insert_chunks(LabResult, self.spec.lab_results, build, 'lab_results')
+
+    def _create_medications(self, patient_ids: List[int], weights: np.ndarray) -> None:
+        codes = list(MEDICATION_DISTRIBUTION)
+        shares = np.array([MEDICATION_DISTRIBUTION[code][0] for code in codes])
+        shares = shares / shares.sum()
+
+        def build(n):
+            atcs = self.rng.choice(len(codes), size=n, p=shares)
+            patients = self.rng.choice(patient_ids, size=n, p=weights)
+            frequencies = self.rng.choice(FREQUENCIES, size=n)
+            stopped = self.rng.random(n) < 0.3
+            rows = []
+            for i, started_at in enumerate(self._random_times(n)):
+                _, name, dose = MEDICATION_DISTRIBUTION[codes[atcs[i]]]
+                start_date = started_at.date()
+                rows.append(MedicationOrder(
+                    patient_id=int(patients[i]),
+                    atc=codes[atcs[i]],
+                    name=name,
+                    dose=dose,
+                    frequency=str(frequencies[i]),
+                    start_date=start_date,
+                    end_date=start_date + timedelta(days=90) if stopped[i] else None,
+                ))
+            return rows
+
+        self._insert_chunks(MedicationOrder, self.spec.medications, build, 'medications')
+
+    def _rebuild_derived(self, patient_ids: List[int], doctor_user_ids: List[int]) -> None:
+        from .aggregate_services import IncrementalAnalyticsService
+        from .cohort import CohortIndexService
+
+        service = IncrementalAnalyticsService()
+        cohort = CohortIndexService()
+        for start in range(0, len(patient_ids), 1000):
+            chunk = patient_ids[start:start + 1000]
+            with transaction.atomic():
+                service.rebuild_buckets(chunk)
+                cohort.refresh_patients(chunk)
+        _refresh_shared_state(doctor_user_ids)
+        self.log('derived tables rebuilt')
+
+    @staticmethod
+    def clear() -> Dict[str, int]:
+        """
+        حذف همه داده‌های ساختگی (بیماران پزشکان بنچمارک و خود پزشکان)
+
+        حذف در دسته‌های بیماران و بدون سیگنال انجام می‌شود (سیگنال‌ها برای هر ردیف ساختارهای
+        مشتق و شمارنده‌های روزانه را می‌نوشتند)؛ سپس شمارنده‌ها از داده‌های باقی‌مانده بازسازی می‌شوند.
+        """
+        require_benchmark_database()
+        User = get_user_model()
+        doctor_user_ids = list(
+            User.objects.filter(email__endswith=f'@{BENCHMARK_EMAIL_DOMAIN}').values_list('pk', flat=True)
+        )
+        patient_ids = list(
+            PatientProfile.objects.filter(primary_doctor__in=doctor_user_ids).values_list('pk', flat=True)
+        )
+
+        removed = Counter()
+        for start in range(0, len(patient_ids), DELETE_BATCH_SIZE):
+            with transaction.atomic():
+                _raw_delete(
+                    PatientProfile.objects.filter(pk__in=patient_ids[start:start + DELETE_BATCH_SIZE]), removed
+                )
+        with transaction.atomic():
+            # created_by ویزیت PROTECT است
+            _raw_delete(Encounter.objects.filter(created_by__in=doctor_user_ids), removed)
+            _raw_delete(User.objects.filter(pk__in=doctor_user_ids), removed)
+
+        _refresh_shared_state(doctor_user_ids, reset=True)
+        return {
+            'encounters': removed[Encounter._meta.label],
+            'patients': removed[PatientProfile._meta.label],
+            'doctors': removed[User._meta.label],
+        }
+
+
+def _refresh_shared_state(doctor_user_ids: List[int], reset: bool = False) -> None:
+    """
+    بازسازی شمارنده‌های روزانه و باطل کردن کش‌های وابسته به داده‌های بنچمارک
+
+    فقط کلیدهای همین داده‌ها باطل می‌شوند؛ کش پیش‌فرض بین فرایندها مشترک است و نباید پاک شود.
+    """
+    from .cohort import CohortIndexService
+    from .dashboard_services import DashboardSummaryService
+    from .rollup_services import CounterRollupService
+    from .services import SYSTEM_OVERVIEW_CACHE, DoctorAnalyticsService
+
+    CounterRollupService().backfill()
+    if reset:
+        CohortIndexService.notify(reset=True)
+    SYSTEM_OVERVIEW_CACHE.invalidate()
+    DashboardSummaryService.invalidate(doctor_user_ids)
+    for doctor_user_id in doctor_user_ids:
+        DoctorAnalyticsService.invalidate_patient_distribution(doctor_user_id)
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    timings: List[float] = field(default_factory=list)
+    queries: int = 0
+
+    def as_dict(self) -> Dict:
+        return {
+            'median': round(statistics.median(self.timings), 4),
+            'min': round(min(self.timings), 4),
+            'max': round(max(self.timings), 4),
+            'runs': len(self.timings),
+            'queries': self.queries,
+        }
+
+
+def _busiest_doctor() -> Optional[DoctorProfile]:
+    """پزشک با بیشترین بیمار (بدترین حالت داشبورد و گزارش)"""
+    row = PatientProfile.objects.order_by().values('primary_doctor_id').annotate(
+        patients=Count('id')
+    ).order_by('-patients').first()
+    if not row:
+        return None
+    return DoctorProfile.objects.select_related('user').filter(user_id=row['primary_doctor_id']).first()
+
+
+class AnalyticsBenchmark:
+    """
+    اجرای سناریوهای بنچمارک آنالیتیکس و مقایسه با baseline.
+
+    هر سناریو repeat بار اجرا می‌شود؛ میانه زمان و تعداد کوئری‌های اجرای آخر ثبت
+    می‌شود. سناریویی که میانه زمانش بیش از tolerance از baseline کندتر باشد یا کوئری
+    بیشتری اجرا کند پسرفت گزارش می‌شود.
+    """
+
+    def __init__(self, repeat: int = 3, tolerance: float = 0.2):
+        self.repeat = repeat
+        self.tolerance = tolerance
+
+    def scenarios(self) -> Dict[str, Callable[[], None]]:
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .dashboard_services import DashboardSummaryService
+        from .services import SYSTEM_OVERVIEW_CACHE, SystemAnalyticsService
+        from .tasks import calculate_daily_analytics
+        from .views import PatientAnalyticsViewSet
+
+        doctor = _busiest_doctor()
+        system_service = SystemAnalyticsService()
+        dashboard_service = DashboardSummaryService()
+
+        def batch_analytics():
+            request = APIRequestFactory().get('/api/analytics/patient-analytics/batch_analytics/', {'page_size': 100})
+            force_authenticate(request, user=doctor.user)
+            PatientAnalyticsViewSet.as_view({'get': 'batch_analytics'})(request)
+
+        def cached_overview():
+            system_service.get_system_overview_data()
+
+        scenarios = {
+            'calculate_daily_analytics[bulk]': lambda: calculate_daily_analytics('bulk'),
+            'calculate_daily_analytics[incremental]': lambda: calculate_daily_analytics('incremental'),
+            'system_overview[cold]': lambda: (SYSTEM_OVERVIEW_CACHE.invalidate(),
+                                              system_service.get_system_overview_data()),
+            'system_overview[cached]': cached_overview,
+        }
+        if doctor:
+            scenarios.update({
+                'batch_analytics': batch_analytics,
+                'dashboard_summary[cold]': lambda: dashboard_service.calculate_summary(doctor),
+                'dashboard_summary[cached]': lambda: dashboard_service.get_summary(doctor),
+                'doctor_report[csv]': lambda: self._generate_report(doctor, 'csv'),
+                'doctor_report[pdf]': lambda: self._generate_report(doctor, 'pdf'),
+            })
+        return scenarios
+
+    @staticmethod
+    def _generate_report(doctor: DoctorProfile, report_format: str) -> None:
+        from .models import Report
+        from .report_service import ReportGenerationService
+
+        service = ReportGenerationService()
+        # بنچمارک هزینه تولید را می‌سنجد، نه استفاده دوباره از خروجی قبلی
+        service.memo.lookup = lambda fingerprint: None
+        report = Report.objects.create(report_type='doctor_performance', format=report_format, doctor=doctor)
+        try:
+            service.generate_report(report)
+        finally:
+            report.delete()
+
+    def run(self, only: Optional[List[str]] = None) -> Dict:
+        require_benchmark_database()
+        media_root = tempfile.mkdtemp(prefix='analytics-benchmark-')
+        results = {}
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for name, scenario in self.scenarios().items():
+                    if only and name not in only:
+                        continue
+                    results[name] = self._measure(name, scenario).as_dict()
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        return {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'repeat': self.repeat,
+                'rows': {
+                    'patients': PatientProfile.objects.count(),
+                    'lab_results': LabResult.objects.count(),
+                    'encounters': Encounter.objects.count(),
+                    'medications': MedicationOrder.objects.count(),
+                },
+            },
+            'results': results,
+        }
+
+    def _measure(self, name: str, scenario: Callable[[], None]) -> BenchmarkResult:
+        result = BenchmarkResult(name)
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                scenario()
+                result.timings.append(time.perf_counter() - started)
+            result.queries = len(queries)
+        return result
+
+    def compare(self, current: Dict, baseline: Dict) -> List[Dict]:
+        """مقایسه نتایج با baseline؛ برای هر سناریوی مشترک نسبت زمان و وضعیت پسرفت برگردانده می‌شود"""
+        rows = []
+        for name, result in current['results'].items():
+            previous = baseline.get('results', {}).get(name)
+            if not previous:
+                continue
+            ratio = result['median'] / previous['median'] if previous['median'] else 1.0
+            rows.append({
+                'name': name,
+                'baseline': previous['median'],
+                'current': result['median'],
+                'ratio': round(ratio, 2),
+                'baseline_queries': previous['queries'],
+                'queries': result['queries'],
+                'regression': ratio > 1 + self.tolerance or result['queries'] > previous['queries'],
+            })
+        return rows
+
+
+def default_baseline_path() -> str:
+    return getattr(settings, 'ANALYTICS_BENCHMARK_BASELINE',
+                   os.path.join(settings.BASE_DIR, 'benchmarks', 'analytics_baseline.json'))
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# مدت نگهداری قفل محاسبه؛ اگر فرایند محاسبه‌کننده از بین برود، پس از این مدت فرایند دیگری محاسبه می‌کند
+DEFAULT_LOCK_TIMEOUT = 60
+
+# حداکثر انتظار درخواستی که کش خالی پیدا کرده و محاسبه را به فرایند دیگری سپرده است
+DEFAULT_WAIT_TIMEOUT = 10
+WAIT_INTERVAL = 0.1
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """pool کوچک برای بازسازی پس‌زمینه مقادیر کهنه"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ANALYTICS_CACHE_REFRESH_WORKERS', 2),
+                thread_name_prefix='analytics-cache'
+            )
+        return _executor
+
+
+class RefreshingCache:
+    """
+    لایه cache-aside با قفل تک‌پرواز و سرو مقدار کهنه هنگام بازسازی (stale-while-revalidate).
+
+    هر مقدار همراه با زمان تازگی‌اش ذخیره می‌شود و تا fresh_timeout + stale_timeout در کش
+    می‌ماند. پس از پایان تازگی، مقدار کهنه فوراً برگردانده می‌شود و فقط یک درخواست (دارنده
+    قفل) بازسازی را در پس‌زمینه آغاز می‌کند. وقتی کش خالی است، دارنده قفل مقدار را محاسبه
+    می‌کند و بقیه منتظر نتیجه او می‌مانند. با فراخوانی refresh از یک task زمان‌بندی شده،
+    مقدار پیش از کهنه شدن بازسازی می‌شود و هیچ درخواستی هزینه محاسبه را نمی‌پردازد.
+
+    Example:
+        overview_cache = RefreshingCache('system_overview_data', fresh_timeout=300)
+        data = overview_cache.get_or_compute(self._calculate_system_overview_data)
+    """
+
+    def __init__(self, key: str, fresh_timeout: int, stale_timeout: Optional[int] = None,
+                 lock_timeout: int = DEFAULT_LOCK_TIMEOUT, wait_timeout: float = DEFAULT_WAIT_TIMEOUT):
+        self.key = key
+        self.fresh_timeout = fresh_timeout
+        self.stale_timeout = stale_timeout if stale_timeout is not None else fresh_timeout * 12
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+
+    @property
+    def lock_key(self) -> str:
+        return f"{self.key}:lock"
+
+    def _store(self, value: Any) -> None:
+        entry = {'value': value, 'fresh_until': time.time() + self.fresh_timeout}
+        cache.set(self.key, entry, self.fresh_timeout + self.stale_timeout)
+
+    def _acquire(self) -> Optional[str]:
+        token = uuid.uuid4().hex
+        return token if cache.add(self.lock_key, token, self.lock_timeout) else None
+
+    def _release(self, token: str) -> None:
+        # قفلی که منقضی و توسط فرایند دیگری گرفته شده آزاد نمی‌شود
+        if cache.get(self.lock_key) == token:
+            cache.delete(self.lock_key)
+
+    def refresh(self, compute: Callable[[], Any]) -> Any:
+        """محاسبه و ذخیره مقدار بدون توجه به تازگی فعلی (برای task زمان‌بندی شده)"""
+        value = compute()
+        self._store(value)
+        return value
+
+    def invalidate(self) -> None:
+        cache.delete(self.key)
+
+    def get_or_compute(self, compute: Callable[[], Any]) -> Any:
+        """مقدار کش شده، مقدار کهنه همراه با بازسازی پس‌زمینه یا محاسبه تک‌پرواز مقدار جدید"""
+        entry = cache.get(self.key)
+        if entry is not None:
+            if time.time() >= entry['fresh_until']:
+                token = self._acquire()
+                if token:
+                    self._schedule_refresh(compute, token)
+            return entry['value']
+
+        token = self._acquire()
+        if token is None:
+            entry = self._wait_for_value()
+            if entry is not None:
+                return entry['value']
+            # دارنده قفل در زمان مقرر نتیجه‌ای ذخیره نکرد
+            logger.warning(f"Timed out waiting for cache key {self.key}; computing inline")
+            return compute()
+
+        try:
+            return self.refresh(compute)
+        finally:
+            self._release(token)
+
+    def _wait_for_value(self) -> Optional[Dict]:
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            entry = cache.get(self.key)
+            if entry is not None:
+                return entry
+            if cache.get(self.lock_key) is None:
+                # دارنده قفل بدون ذخیره نتیجه (مثلاً با خطا) کار را تمام کرده است
+                return None
+        return None
+
+    def _schedule_refresh(self, compute: Callable[[], Any], token: str) -> None:
+        if getattr(settings, 'ANALYTICS_CACHE_REFRESH_WORKERS', 2) == 0:
+            # بدون pool (تست یا اجرای تک‌فرایندی) بازسازی همین‌جا انجام می‌شود
+            self._refresh_locked(compute, token)
+        else:
+            _get_executor().submit(self._refresh_in_pool, compute, token)
+
+    def _refresh_in_pool(self, compute: Callable[[], Any], token: str) -> None:
+        close_old_connections()
+        try:
+            self._refresh_locked(compute, token)
+        finally:
+            close_old_connections()
+
+    def _refresh_locked(self, compute: Callable[[], Any], token: str) -> None:
+        try:
+            self.refresh(compute)
+        except Exception as e:
+            # مقدار کهنه تا بازسازی بعدی سرو می‌شود
+            logger.error(f"Background refresh of cache key {self.key} failed: {e}")
+        finally:
+            self._release(token)
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# نسخه کلید؛ با تغییر کد رسم نمودارها افزایش دهید تا تصاویر قدیمی دوباره استفاده نشوند
+CHART_CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def chart_cache_key(kind: str, chart_data: Dict, style: Dict) -> str:
+    """کلید محتوایی نمودار: hash داده‌ها و سبک رسم"""
+    payload = json.dumps(
+        {'kind': kind, 'data': chart_data, 'style': style, 'version': CHART_CACHE_VERSION},
+        sort_keys=True,
+        default=str,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ChartCache:
+    """
+    کش دیسکی تصاویر نمودار با کلید محتوایی و حذف LRU بر اساس حجم.
+
+    زمان آخرین استفاده هر فایل در mtime آن نگهداری می‌شود؛ هنگام عبور از سقف حجم،
+    قدیمی‌ترین فایل‌ها حذف می‌شوند. چون نام فایل همان hash محتواست، چند فرایند
+    می‌توانند بدون هماهنگی از یک پوشه استفاده کنند.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = str(directory or getattr(
+            settings, 'REPORT_CHART_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'charts', 'cache')
+        ))
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(
+            settings, 'REPORT_CHART_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES
+        )
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key: str) -> Optional[str]:
+        """مسیر نمودار کش شده یا None؛ استفاده، فایل را تازه‌ترین مورد LRU می‌کند"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, render: Callable[[str], Any]) -> str:
+        """
+        رسم نمودار در یک فایل موقت و جایگزینی اتمیک آن در مسیر نهایی.
+
+        render مسیر فایل را می‌گیرد و تصویر را در آن ذخیره می‌کند.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.png', dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            render(tmp_path)
+            path = self.path_for(key)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+        return path
+
+    def get_or_render(self, kind: str, chart_data: Dict, style: Dict,
+                      render: Callable[[str], Any]) -> str:
+        """بازگرداندن نمودار کش شده یا رسم و ذخیره آن"""
+        key = chart_cache_key(kind, chart_data, style)
+        return self.get(key) or self.put(key, render)
+
+    def evict(self) -> int:
+        """حذف قدیمی‌ترین نمودارها تا حجم پوشه به زیر سقف برسد؛ تعداد فایل‌های حذف شده برگردانده می‌شود"""
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.png') or entry.name.startswith('.tmp-'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            removed = 0
+            if total <= self.max_bytes:
+                return removed
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            logger.info(f"Chart cache evicted {removed} files from {self.directory}")
+            return removed
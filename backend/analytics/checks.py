@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# کش‌هایی که بین فرایندها مشترک نیستند
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    کش پیش‌فرض باید بین همه فرایندهای وب و worker مشترک باشد.
+
+    سری‌های آزمایش، شاخص cohort، شاخص منابع بالینی و خلاصه داشبورد پزشک با
+    شمارنده‌های نسخه در این کش باطل می‌شوند؛ با کش محلی، نوشتن در یک فرایند
+    نسخه درون حافظه فرایندهای دیگر را تا راه‌اندازی مجدد کهنه نگه می‌دارد.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS or getattr(settings, 'ALLOW_PROCESS_LOCAL_CACHE', False):
+        return []
+    return [Error(
+        f'The default cache ({backend}) is not shared between processes.',
+        hint='Set DJANGO_CACHE_URL to a shared cache such as redis://host:6379/1, or set '
+             'DJANGO_ALLOW_LOCAL_CACHE=True for a single-process deployment.',
+        id='analytics.E001',
+    )]
@@ -0,0 +1,427 @@
+import logging
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder
+from notifications.models import ClinicalAlert
+from gitdm.models import PatientProfile
+from .models import PatientMetricIndex
+from .services import GLUCOSE_LOINC_CODES, HBA1C_LOINC_CODES
+
+logger = logging.getLogger(__name__)
+
+COHORT_INDEX_VERSION_KEY = 'analytics:cohort_index:version'
+COHORT_INDEX_RESET_KEY = 'analytics:cohort_index:reset'
+
+# بازه میانگین قند خون در شاخص
+GLUCOSE_WINDOW_DAYS = 90
+
+# ردیف‌هایی که updated_at آن‌ها کمی پیش از آخرین بارگذاری است دوباره خوانده می‌شوند (تراکنش‌های طولانی)
+PATCH_OVERLAP = timedelta(minutes=5)
+
+REBUILD_BATCH_SIZE = 1000
+
+# گروه دارویی -> پیشوندهای ATC؛ ترتیب، شماره بیت گروه در active_med_classes است
+MEDICATION_CLASSES = {
+    'metformin': ('A10BA',),
+    'sulfonylurea': ('A10BB',),
+    'dpp4_inhibitor': ('A10BH',),
+    'sglt2_inhibitor': ('A10BK',),
+    'glp1_agonist': ('A10BJ',),
+    'insulin': ('A10A',),
+    'statin': ('C10AA',),
+    'ace_inhibitor': ('C09A', 'C09B'),
+    'arb': ('C09C', 'C09D'),
+}
+MEDICATION_CLASS_BITS = {name: 1 << bit for bit, name in enumerate(MEDICATION_CLASSES)}
+
+# شاخص‌های عددی قابل فیلتر
+NUMERIC_METRICS = ('latest_hba1c', 'avg_glucose', 'days_since_encounter', 'open_alerts')
+COMPARISONS = {
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+    'eq': np.equal,
+    'ne': np.not_equal,
+}
+
+
+class CohortQueryError(ValueError):
+    """شرط نامعتبر در درخواست cohort"""
+
+
+def medication_class_bits(atc: str) -> int:
+    """بیت‌های گروه‌های دارویی یک کد ATC"""
+    bits = 0
+    for name, prefixes in MEDICATION_CLASSES.items():
+        if atc and atc.startswith(prefixes):
+            bits |= MEDICATION_CLASS_BITS[name]
+    return bits
+
+
+def _bump(key: str) -> None:
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+class CohortIndexService:
+    """
+    نگهداری جدول PatientMetricIndex.
+
+    شاخص‌های چند بیمار با چند کوئری گروهی محاسبه و upsert می‌شوند؛ همین مسیر برای
+    به‌روزرسانی افزایشی یک بیمار پس از هر نوشتن و بازسازی کامل شبانه (برای شاخص‌های
+    وابسته به زمان مانند میانگین ۹۰ روزه و داروهای پایان یافته) استفاده می‌شود.
+    """
+
+    UPDATE_FIELDS = [
+        'primary_doctor', 'latest_hba1c', 'latest_hba1c_at', 'avg_glucose',
+        'last_encounter_at', 'active_med_classes', 'open_alerts', 'updated_at',
+    ]
+
+    @staticmethod
+    def notify(reset: bool = False) -> None:
+        """
+        اعلام تغییر شاخص‌ها به نمونه‌های CohortIndex همه فرایندها (همین لحظه و پس از commit)
+
+        reset=True (مثلاً پس از حذف بیمار یا بازسازی کامل) بارگذاری کامل آرایه‌ها را لازم می‌کند.
+        """
+        key = COHORT_INDEX_RESET_KEY if reset else COHORT_INDEX_VERSION_KEY
+        _bump(key)
+        transaction.on_commit(lambda: _bump(key))
+
+    def compute(self, patient_ids: List[int]) -> Dict[int, Dict]:
+        """محاسبه شاخص‌های بیماران با یک کوئری برای هر شاخص"""
+        now = timezone.now()
+        rows = {
+            patient_id: {
+                'primary_doctor_id': doctor_id,
+                'latest_hba1c': None,
+                'latest_hba1c_at': None,
+                'avg_glucose': None,
+                'last_encounter_at': None,
+                'active_med_classes': 0,
+                'open_alerts': 0,
+            }
+            for patient_id, doctor_id in PatientProfile.objects.filter(
+                pk__in=patient_ids
+            ).values_list('pk', 'primary_doctor_id')
+        }
+        if not rows:
+            return rows
+        patient_ids = list(rows)
+
+        latest_hba1c = LabResult.objects.filter(
+            patient_id__in=patient_ids,
+            loinc__in=HBA1C_LOINC_CODES
+        ).annotate(
+            latest_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('patient_id')],
+                order_by=[F('taken_at').desc(), F('id').desc()]
+            )
+        ).filter(latest_rank=1).values_list('patient_id', 'value', 'taken_at')
+        for patient_id, value, taken_at in latest_hba1c:
+            rows[patient_id]['latest_hba1c'] = float(value)
+            rows[patient_id]['latest_hba1c_at'] = taken_at
+
+        glucose = LabResult.objects.filter(
+            patient_id__in=patient_ids,
+            loinc__in=GLUCOSE_LOINC_CODES,
+            taken_at__gte=now - timedelta(days=GLUCOSE_WINDOW_DAYS)
+        ).order_by().values('patient_id').annotate(avg=Avg('value'))
+        for row in glucose:
+            rows[row['patient_id']]['avg_glucose'] = float(row['avg']) if row['avg'] is not None else None
+
+        encounters = Encounter.objects.filter(patient_id__in=patient_ids).order_by().values(
+            'patient_id'
+        ).annotate(last=Max('occurred_at'))
+        for row in encounters:
+            rows[row['patient_id']]['last_encounter_at'] = row['last']
+
+        active_medications = MedicationOrder.objects.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=now.date()),
+            patient_id__in=patient_ids,
+            start_date__lte=now.date()
+        ).order_by().values_list('patient_id', 'atc').distinct()
+        for patient_id, atc in active_medications:
+            rows[patient_id]['active_med_classes'] |= medication_class_bits(atc)
+
+        alerts = ClinicalAlert.objects.filter(
+            patient_id__in=patient_ids,
+            is_active=True,
+            acknowledged_at__isnull=True
+        ).order_by().values('patient_id').annotate(count=Count('id'))
+        for row in alerts:
+            rows[row['patient_id']]['open_alerts'] = row['count']
+
+        return rows
+
+    def refresh_patients(self, patient_ids: Iterable[Optional[int]], create: bool = True) -> int:
+        """
+        بازسازی شاخص‌های چند بیمار
+
+        با create=False (مسیر حذف) فقط ردیف‌های موجود به‌روز می‌شوند، چون ممکن است بیمار
+        در حال حذف آبشاری باشد.
+        """
+        patient_ids = [patient_id for patient_id in set(patient_ids) if patient_id is not None]
+        if not patient_ids:
+            return 0
+
+        values = self.compute(patient_ids)
+        now = timezone.now()
+        objects = [
+            PatientMetricIndex(patient_id=patient_id, updated_at=now, **row)
+            for patient_id, row in values.items()
+        ]
+        if create:
+            PatientMetricIndex.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=['patient'],
+                update_fields=self.UPDATE_FIELDS,
+            )
+        else:
+            existing = dict(PatientMetricIndex.objects.filter(
+                patient_id__in=[obj.patient_id for obj in objects]
+            ).values_list('patient_id', 'pk'))
+            objects = [obj for obj in objects if obj.patient_id in existing]
+            for obj in objects:
+                obj.pk = existing[obj.patient_id]
+            PatientMetricIndex.objects.bulk_update(objects, self.UPDATE_FIELDS)
+
+        self.notify()
+        return len(objects)
+
+    def rebuild(self, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+        """بازسازی کامل شاخص همه بیماران در دسته‌های شناسه"""
+        patient_ids = list(PatientProfile.objects.order_by('id').values_list('id', flat=True))
+        written = 0
+        for start in range(0, len(patient_ids), batch_size):
+            with transaction.atomic():
+                written += self.refresh_patients(patient_ids[start:start + batch_size])
+        self.notify(reset=True)
+        return written
+
+
+@dataclass(frozen=True)
+class _Columns:
+    """ستون‌های شاخص به ترتیب شناسه بیمار"""
+    patient_ids: np.ndarray
+    doctor_ids: np.ndarray
+    latest_hba1c: np.ndarray
+    avg_glucose: np.ndarray
+    last_encounter: np.ndarray  # ثانیه از epoch؛ NaN برای بدون ویزیت
+    med_classes: np.ndarray
+    open_alerts: np.ndarray
+
+    FIELDS = ('patient_id', 'primary_doctor_id', 'latest_hba1c', 'avg_glucose',
+              'last_encounter_at', 'active_med_classes', 'open_alerts')
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple]) -> '_Columns':
+        def floats(index):
+            return np.array([row[index] if row[index] is not None else np.nan for row in rows], dtype=np.float64)
+
+        return cls(
+            patient_ids=np.array([row[0] for row in rows], dtype=np.int64),
+            doctor_ids=np.array([row[1] if row[1] is not None else -1 for row in rows], dtype=np.int64),
+            latest_hba1c=floats(2),
+            avg_glucose=floats(3),
+            last_encounter=np.array(
+                [row[4].timestamp() if row[4] is not None else np.nan for row in rows], dtype=np.float64
+            ),
+            med_classes=np.array([row[5] for row in rows], dtype=np.int64),
+            open_alerts=np.array([row[6] for row in rows], dtype=np.float64),
+        )
+
+    def patch(self, rows: List[Tuple]) -> Optional['_Columns']:
+        """
+        ستون‌های جدید با مقادیر ردیف‌های تغییر کرده؛ اگر بیماری در ستون‌ها نباشد None
+        (بیمار جدید نیاز به بارگذاری کامل دارد).
+        """
+        if not rows:
+            return self
+        changed = _Columns.from_rows(rows)
+        positions = np.searchsorted(self.patient_ids, changed.patient_ids)
+        if np.any(positions >= len(self.patient_ids)) or np.any(self.patient_ids[positions] != changed.patient_ids):
+            return None
+
+        # کپی ستون‌ها تا خواننده‌های همزمان نسخه قبلی را دست‌نخورده ببینند
+        columns = {}
+        for name in ('doctor_ids', 'latest_hba1c', 'avg_glucose', 'last_encounter', 'med_classes', 'open_alerts'):
+            column = getattr(self, name).copy()
+            column[positions] = getattr(changed, name)
+            columns[name] = column
+        return replace(self, **columns)
+
+
+class CohortIndex:
+    """
+    نسخه ستونی (NumPy) شاخص بیماران در حافظه هر فرایند برای فیلتر سریع cohort.
+
+    هر درخواست فقط شمارنده‌های نسخه را از کش می‌خواند. با تغییر نسخه، فقط ردیف‌هایی که
+    پس از آخرین بارگذاری به‌روز شده‌اند خوانده و در ستون‌ها جایگزین می‌شوند؛ با reset
+    (حذف بیمار، بازسازی کامل) یا بیمار جدید، ستون‌ها کامل بارگذاری می‌شوند.
+
+    شرط‌ها به صورت درختی از all/any/not و شرط‌های برگ هستند:
+        {"all": [{"metric": "latest_hba1c", "op": "gt", "value": 9},
+                 {"metric": "days_since_encounter", "op": "gt", "value": 90}]}
+    """
+
+    def __init__(self):
+        self._columns: Optional[_Columns] = None
+        self._version = None
+        self._loaded_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def _counters(self) -> Tuple[int, int]:
+        values = cache.get_many([COHORT_INDEX_VERSION_KEY, COHORT_INDEX_RESET_KEY])
+        return values.get(COHORT_INDEX_VERSION_KEY, 0), values.get(COHORT_INDEX_RESET_KEY, 0)
+
+    @staticmethod
+    def _rows(queryset) -> List[Tuple]:
+        return list(queryset.order_by('patient_id').values_list(*_Columns.FIELDS))
+
+    def columns(self) -> _Columns:
+        """ستون‌های به‌روز شاخص"""
+        version = self._counters()
+        with self._lock:
+            if self._columns is not None and self._version == version:
+                return self._columns
+
+            started_at = timezone.now()
+            columns = None
+            if self._columns is not None and self._version[1] == version[1]:
+                changed = self._rows(PatientMetricIndex.objects.filter(
+                    updated_at__gte=self._loaded_at - PATCH_OVERLAP
+                ))
+                columns = self._columns.patch(changed)
+            if columns is None:
+                columns = _Columns.from_rows(self._rows(PatientMetricIndex.objects.all()))
+
+            self._columns = columns
+            self._version = version
+            self._loaded_at = started_at
+            return columns
+
+    def clear(self) -> None:
+        with self._lock:
+            self._columns = None
+            self._version = None
+
+    # ------------------------------------------------------------------
+
+    def _metric(self, columns: _Columns, metric: str, now: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(مقادیر، ماسک مقدار نامعلوم) یک شاخص عددی"""
+        if metric == 'days_since_encounter':
+            missing = np.isnan(columns.last_encounter)
+            # بیمار بدون ویزیت بی‌نهایت روز است که ویزیت نداشته است
+            days = np.where(missing, np.inf, (now - columns.last_encounter) / 86400)
+            return days, missing
+        values = getattr(columns, metric)
+        return values, np.isnan(values)
+
+    def evaluate(self, predicate: Dict, columns: _Columns, now: Optional[float] = None) -> np.ndarray:
+        """ماسک بولی بیمارانی که شرط را دارند"""
+        now = now if now is not None else timezone.now().timestamp()
+        if not isinstance(predicate, dict):
+            raise CohortQueryError('هر شرط باید یک شیء باشد')
+
+        if 'all' in predicate or 'any' in predicate:
+            key = 'all' if 'all' in predicate else 'any'
+            children = predicate[key]
+            if not isinstance(children, list) or not children:
+                raise CohortQueryError(f'{key} باید فهرستی از شرط‌ها باشد')
+            masks = [self.evaluate(child, columns, now) for child in children]
+            return np.logical_and.reduce(masks) if key == 'all' else np.logical_or.reduce(masks)
+        if 'not' in predicate:
+            return ~self.evaluate(predicate['not'], columns, now)
+
+        metric = predicate.get('metric')
+        op = predicate.get('op')
+        value = predicate.get('value')
+
+        if metric == 'med_class':
+            names = value if isinstance(value, list) else [value]
+            unknown = [name for name in names if name not in MEDICATION_CLASS_BITS]
+            if unknown or not names:
+                raise CohortQueryError(f'گروه دارویی نامعتبر: {unknown}')
+            bits = 0
+            for name in names:
+                bits |= MEDICATION_CLASS_BITS[name]
+            if op == 'has':
+                return (columns.med_classes & bits) == bits
+            if op == 'has_any':
+                return (columns.med_classes & bits) != 0
+            if op == 'lacks':
+                return (columns.med_classes & bits) == 0
+            raise CohortQueryError(f'عملگر نامعتبر برای med_class: {op}')
+
+        if metric not in NUMERIC_METRICS:
+            raise CohortQueryError(f'شاخص نامعتبر: {metric}')
+        values, missing = self._metric(columns, metric, now)
+
+        if op == 'is_null':
+            return missing if value in (None, True) else ~missing
+        # بیمار بدون ویزیت با مقدار inf مقایسه می‌شود (gt 90 را دارد، lte 90 را ندارد)؛
+        # مقدار نامعلوم سایر شاخص‌ها در هیچ مقایسه‌ای صدق نمی‌کند
+        known = ~missing if metric != 'days_since_encounter' else np.ones_like(missing)
+        try:
+            if op == 'between':
+                low, high = (float(bound) for bound in value)
+                return known & (values >= low) & (values <= high)
+            if op in COMPARISONS:
+                return known & COMPARISONS[op](values, float(value))
+        except (TypeError, ValueError) as exc:
+            raise CohortQueryError(f'مقدار نامعتبر برای {metric}') from exc
+        raise CohortQueryError(f'عملگر نامعتبر: {op}')
+
+    def query(self, predicate: Dict, doctor_user_id: Optional[int] = None,
+              after_patient_id: Optional[int] = None, page_size: int = 100) -> Dict:
+        """
+        شناسه بیماران یک cohort به ترتیب شناسه با صفحه‌بندی cursor.
+
+        doctor_user_id نتیجه را به بیماران یک پزشک محدود می‌کند.
+        """
+        columns = self.columns()
+        mask = self.evaluate(predicate, columns)
+        if doctor_user_id is not None:
+            mask &= columns.doctor_ids == doctor_user_id
+
+        patient_ids = columns.patient_ids[mask]
+        start = int(np.searchsorted(patient_ids, after_patient_id, 'right')) if after_patient_id is not None else 0
+        page = patient_ids[start:start + page_size]
+        has_more = start + page_size < len(patient_ids)
+        return {
+            'count': int(len(patient_ids)),
+            'patient_ids': page.tolist(),
+            'next_after': int(page[-1]) if has_more and len(page) else None,
+        }
+
+
+_index: Optional[CohortIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_cohort_index() -> CohortIndex:
+    """نمونه مشترک فرایند"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CohortIndex()
+        return _index
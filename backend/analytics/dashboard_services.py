@@ -0,0 +1,133 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from encounters.models import Encounter
+from notifications.models import ClinicalAlert
+from gitdm.models import DoctorProfile, PatientProfile
+from .models import DoctorAnalytics
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_SUMMARY_CACHE_PREFIX = 'analytics:dashboard_summary:'
+
+# کلید شامل تاریخ روز است و با تغییر روز خودبه‌خود عوض می‌شود؛ این زمان فقط برای پاک شدن کلیدهای قدیمی است
+DASHBOARD_SUMMARY_CACHE_TIMEOUT = 86400
+
+METRIC_NAMES = ('hits', 'misses', 'invalidations')
+
+
+def _incr(key: str) -> int:
+    """افزایش اتمیک شمارنده در کش (ساخت آن در صورت نبود)"""
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # کلید بین add و incr حذف شده است
+        cache.set(key, 1, None)
+        return 1
+
+
+class DashboardSummaryService:
+    """
+    خلاصه داشبورد پزشک با کش مبتنی بر نسخه.
+
+    هر پزشک یک شماره نسخه در کش دارد که با ثبت، ویرایش یا حذف ویزیت‌ها، هشدارها،
+    انتساب بیماران و آنالیتیکس پزشک افزایش می‌یابد (analytics/signals.py). خلاصه زیر
+    کلید (نسخه، روز) ذخیره می‌شود، پس مقداری که همزمان با یک تغییر محاسبه شده
+    هیچ‌گاه جایگزین مقدار تازه نمی‌شود و نیازی به TTL کوتاه نیست.
+    """
+
+    @staticmethod
+    def _version_key(doctor_user_id: int) -> str:
+        return f"{DASHBOARD_SUMMARY_CACHE_PREFIX}version:{doctor_user_id}"
+
+    @staticmethod
+    def _metric_key(name: str) -> str:
+        return f"{DASHBOARD_SUMMARY_CACHE_PREFIX}metrics:{name}"
+
+    def _summary_key(self, doctor_user_id: int, day) -> str:
+        version = cache.get(self._version_key(doctor_user_id))
+        if version is None:
+            cache.add(self._version_key(doctor_user_id), 1, None)
+            version = cache.get(self._version_key(doctor_user_id), 1)
+        return f"{DASHBOARD_SUMMARY_CACHE_PREFIX}{doctor_user_id}:{version}:{day.isoformat()}"
+
+    @classmethod
+    def invalidate(cls, doctor_user_ids: Iterable[Optional[int]]) -> None:
+        """
+        باطل کردن خلاصه کش شده پزشکان (شناسه کاربر پزشک) پس از commit تراکنش جاری.
+
+        باطل کردن پس از commit مانع می‌شود که درخواستی همزمان، داده‌های commit نشده قبلی را دوباره کش کند.
+        """
+        doctor_user_ids = {doctor_id for doctor_id in doctor_user_ids if doctor_id is not None}
+        if not doctor_user_ids:
+            return
+
+        def bump():
+            for doctor_id in doctor_user_ids:
+                _incr(cls._version_key(doctor_id))
+                _incr(cls._metric_key('invalidations'))
+
+        transaction.on_commit(bump)
+
+    def get_summary(self, doctor: DoctorProfile) -> Dict:
+        """خلاصه داشبورد پزشک از کش یا محاسبه و ذخیره آن"""
+        today = timezone.localdate()
+        cache_key = self._summary_key(doctor.user_id, today)
+
+        summary = cache.get(cache_key)
+        if summary is not None:
+            _incr(self._metric_key('hits'))
+            return summary
+
+        _incr(self._metric_key('misses'))
+        summary = self.calculate_summary(doctor, today)
+        cache.set(cache_key, summary, DASHBOARD_SUMMARY_CACHE_TIMEOUT)
+        return summary
+
+    def calculate_summary(self, doctor: DoctorProfile, today=None) -> Dict:
+        """محاسبه خلاصه داشبورد پزشک از پایگاه داده"""
+        today = today or timezone.localdate()
+        doctor_user = doctor.user_id
+
+        summary = {
+            'total_patients': PatientProfile.objects.filter(primary_doctor_id=doctor_user).count(),
+            'active_patients': Encounter.objects.filter(
+                patient__primary_doctor_id=doctor_user,
+                occurred_at__date__gte=today - timedelta(days=30)
+            ).values('patient_id').distinct().count(),
+            'total_encounters_today': Encounter.objects.filter(
+                created_by_id=doctor_user,
+                occurred_at__date=today
+            ).count(),
+            'pending_alerts': ClinicalAlert.objects.filter(
+                patient__primary_doctor_id=doctor_user,
+                is_active=True,
+                acknowledged_at__isnull=True
+            ).count(),
+        }
+
+        latest_analytics = DoctorAnalytics.objects.filter(doctor=doctor).order_by('-date').first()
+        if latest_analytics:
+            summary.update({
+                'avg_hba1c': latest_analytics.avg_patient_hba1c or 0,
+                'goal_achievement_rate': (
+                    latest_analytics.patients_at_goal / latest_analytics.active_patients * 100
+                ) if latest_analytics.active_patients > 0 else 0,
+                'performance_score': latest_analytics.performance_score or 0,
+            })
+
+        return summary
+
+    def get_metrics(self) -> Dict:
+        """آمار کش: تعداد hit، miss، باطل‌سازی و نرخ hit"""
+        values = cache.get_many([self._metric_key(name) for name in METRIC_NAMES])
+        metrics = {name: values.get(self._metric_key(name), 0) for name in METRIC_NAMES}
+        lookups = metrics['hits'] + metrics['misses']
+        metrics['hit_rate'] = round(metrics['hits'] / lookups * 100, 2) if lookups else 0
+        return metrics
@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import date
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from gitdm.models import PatientProfile
+from .aggregate_services import IncrementalAnalyticsService
+from .cohort import CohortIndexService
+from .dashboard_services import DashboardSummaryService
+from .rollup_services import CounterRollupService
+from .services import DoctorAnalyticsService
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _pending(key: Hashable, factory: Callable, exact: bool = False) -> Tuple[object, bool]:
+    """
+    کار در انتظار commit تراکنش جاری با کلید key؛ (کار، تازه ساخته شده)
+
+    کار قبلی همان کلید فقط وقتی دوباره استفاده می‌شود که اجرا نشده باشد و هر savepoint
+    که تغییر جدید را برگرداند، کار قبلی را هم برگرداند (savepointهای آن زیرمجموعه
+    savepointهای فعال باشد؛ با exact=True دقیقاً همان‌ها). کارهای savepointهای برگشت
+    خورده یا تراکنش‌های قبلی هرگز دوباره استفاده نمی‌شوند.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return factory(), True
+
+    outer = connection.atomic_blocks[0]
+    state = getattr(_local, 'pending', None)
+    if state is None or state[0] is not outer:
+        state = _local.pending = (outer, {})
+    entries = state[1]
+
+    active = frozenset(connection.savepoint_ids)
+    entry = entries.get(key)
+    if entry is not None:
+        savepoints, work = entry
+        if not work.done and (savepoints == active if exact else savepoints <= active):
+            return work, False
+
+    work = factory()
+    entries[key] = (active, work)
+    return work, True
+
+
+class PatientRefresh:
+    """
+    بازسازی ساختارهای مشتق یک بیمار پس از commit: ردیف‌های تجمیع روزانه، علامت کثیف،
+    شاخص cohort، کش توزیع HbA1c و خلاصه داشبورد پزشک معالج.
+
+    همه نوشتن‌های یک بیمار در یک تراکنش (مثلاً آزمایش و هشداری که برای آن ساخته می‌شود)
+    در یک نمونه جمع و یک بار اجرا می‌شوند. همه مقادیر از داده‌های فعلی پایگاه داده محاسبه
+    می‌شوند، پس اجرای دوباره فقط محاسبه تکراری است.
+    """
+
+    def __init__(self, patient_id: int):
+        self.patient_id = patient_id
+        self.buckets: Dict[date, Set[str]] = defaultdict(set)
+        self.hba1c = False
+        self.dashboard = False
+        self.doctor_ids: Set[int] = set()
+        self.done = False
+
+    @classmethod
+    def schedule(cls, patient_id: Optional[int], buckets: Iterable[Tuple[date, str]] = (),
+                 hba1c: bool = False, dashboard: bool = False, doctor_ids: Iterable[Optional[int]] = ()) -> None:
+        """
+        افزودن تغییرات یک بیمار به بازسازی در انتظار commit تراکنش جاری
+
+        buckets: (روز، منبع) ردیف‌های تجمیع تغییر کرده؛ منبع یکی از lab، encounter، medication و alert
+        hba1c: کش توزیع HbA1c پزشک معالج باطل شود
+        dashboard: خلاصه داشبورد پزشک معالج باطل شود
+        doctor_ids: پزشکان دیگری (شناسه کاربر) که خلاصه داشبورد آن‌ها باطل شود
+        """
+        if patient_id is None:
+            return
+        refresh, created = _pending(('patient', patient_id), lambda: cls(patient_id))
+        for day, source in buckets:
+            if day is not None:
+                refresh.buckets[day].add(source)
+        refresh.hba1c |= hba1c
+        refresh.dashboard |= dashboard
+        refresh.doctor_ids.update(doctor_id for doctor_id in doctor_ids if doctor_id is not None)
+        if created:
+            transaction.on_commit(refresh.run)
+
+    def run(self) -> None:
+        self.done = True
+        doctor_ids = set(self.doctor_ids)
+        # بیمار ممکن است پیش از commit حذف شده باشد (حذف آبشاری)
+        primary = list(PatientProfile.objects.filter(pk=self.patient_id).values_list('primary_doctor_id', flat=True))
+
+        if primary:
+            self._step('daily aggregates', self._refresh_buckets)
+            self._step('cohort index', lambda: CohortIndexService().refresh_patients([self.patient_id]))
+            if self.hba1c:
+                DoctorAnalyticsService.invalidate_patient_distribution(primary[0])
+            if self.dashboard:
+                doctor_ids.add(primary[0])
+
+        DashboardSummaryService.invalidate(doctor_ids)
+
+    def _refresh_buckets(self) -> None:
+        if not self.buckets:
+            return
+        incremental = IncrementalAnalyticsService()
+        for day, sources in self.buckets.items():
+            incremental.refresh_bucket(self.patient_id, day, sources, mark=False)
+        incremental.mark_dirty([self.patient_id])
+
+    def _step(self, name: str, func: Callable) -> None:
+        try:
+            with transaction.atomic():
+                func()
+        except Exception as e:
+            logger.error(f"Failed to refresh {name} for patient {self.patient_id}: {e}")
+
+
+class RollupDelta:
+    """
+    تغییرات شمارنده روزانه یک موجودیت در تراکنش جاری؛ پس از commit با یک UPDATE ثبت می‌شوند.
+
+    تغییرات فقط با تغییرات همان savepointها جمع می‌شوند تا برگشت یک savepoint فقط
+    تغییرات خودش را حذف کند.
+    """
+
+    def __init__(self, entity: str, day: date):
+        self.entity = entity
+        self.day = day
+        self.inserted = 0
+        self.deleted = 0
+        self.done = False
+
+    @classmethod
+    def schedule(cls, entity: str, day: Optional[date] = None, inserted: int = 0, deleted: int = 0) -> None:
+        day = day or timezone.localdate()
+        delta, created = _pending(('rollup', entity, day), lambda: cls(entity, day), exact=True)
+        delta.inserted += inserted
+        delta.deleted += deleted
+        if created:
+            transaction.on_commit(delta.run)
+
+    def run(self) -> None:
+        self.done = True
+        try:
+            with transaction.atomic():
+                CounterRollupService().record(self.entity, self.day, inserted=self.inserted, deleted=self.deleted)
+        except Exception as e:
+            logger.error(f"Failed to update daily counter rollup: {e}")
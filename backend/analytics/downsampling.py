@@ -0,0 +1,80 @@
+from typing import Sequence
+
+import numpy as np
+
+# روش‌های کاهش نقاط نمودار
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+# کمترین تعداد نقاط معنادار (اولین، آخرین و حداقل یک نقطه میانی)
+MIN_POINTS = 3
+
+
+def lttb_indices(x: Sequence[float], y: Sequence[float], max_points: int) -> np.ndarray:
+    """
+    اندیس نقاط انتخاب شده با الگوریتم Largest-Triangle-Three-Buckets.
+
+    نقاط میانی به max_points - 2 دسته تقسیم می‌شوند و از هر دسته نقطه‌ای انتخاب می‌شود
+    که با نقطه انتخاب شده قبلی و میانگین دسته بعدی بزرگ‌ترین مثلث را بسازد؛ بنابراین
+    قله‌ها و دره‌های تیز حفظ می‌شوند. اولین و آخرین نقطه همیشه انتخاب می‌شوند.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    max_points = max(max_points, MIN_POINTS)
+
+    # مرزهای دسته‌ها روی نقاط 1 تا n-2؛ چون n > max_points هیچ دسته‌ای خالی نیست
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    buckets = max_points - 2
+    for i in range(buckets):
+        start, end = edges[i], edges[i + 1]
+        if i + 1 < buckets:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - next_x) * (y[start:end] - ay) - (ax - x[start:end]) * (next_y - ay))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def minmax_indices(x: Sequence[float], y: Sequence[float], max_points: int) -> np.ndarray:
+    """
+    اندیس کمینه و بیشینه هر دسته (max_points / 2 دسته با تعداد نقاط برابر).
+
+    همه مقادیر حدی حفظ می‌شوند؛ برای داده‌های پرنوسان مانند CGM که هیچ قله‌ای نباید حذف شود مناسب است.
+    """
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+
+    bucket_count = max(max_points // 2, 1)
+    starts = np.linspace(0, n, bucket_count + 1).astype(int)[:-1]
+    indices = []
+    for start, end in zip(starts, np.append(starts[1:], n)):
+        segment = y[start:end]
+        indices.append(start + int(np.argmin(segment)))
+        indices.append(start + int(np.argmax(segment)))
+    return np.unique(indices)
+
+
+def downsample_indices(x: Sequence[float], y: Sequence[float], max_points: int,
+                       method: str = 'lttb') -> np.ndarray:
+    """اندیس‌های مرتب نقاطی که پس از کاهش به حداکثر max_points نقطه باقی می‌مانند"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"روش کاهش نقاط نامعتبر است: {method}")
+    if method == 'minmax':
+        return minmax_indices(x, y, max_points)
+    return lttb_indices(x, y, max_points)
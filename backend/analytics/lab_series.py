@@ -0,0 +1,236 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from laboratory.models import LabResult
+
+logger = logging.getLogger(__name__)
+
+LAB_SERIES_VERSION_PREFIX = 'analytics:lab_series:'
+
+# تعداد سری‌های (بیمار، LOINC) نگهداری شده در حافظه هر فرایند
+DEFAULT_MAX_SERIES = 4096
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _to_micros(value: datetime) -> int:
+    """زمان aware به میکروثانیه از epoch (UTC)"""
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+@dataclass(frozen=True)
+class LabSeries:
+    """
+    سری زمانی فشرده آزمایش‌ها: آرایه‌های مرتب زمان (میکروثانیه UTC)، مقدار float64 و شناسه.
+
+    آرایه‌ها فقط‌خواندنی هستند و بین درخواست‌ها به اشتراک گذاشته می‌شوند؛ برش‌ها کپی نمی‌سازند.
+    """
+    times: np.ndarray
+    values: np.ndarray
+    ids: np.ndarray
+
+    @classmethod
+    def empty(cls) -> 'LabSeries':
+        return cls._frozen(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, datetime, object]]) -> 'LabSeries':
+        """ساخت سری از ردیف‌های (id، taken_at، value) بدون ساخت شیء مدل"""
+        ids, times, values = [], [], []
+        for row_id, taken_at, value in rows:
+            ids.append(row_id)
+            times.append(_to_micros(taken_at))
+            values.append(float(value) if value is not None else np.nan)
+        series = cls(np.array(times, dtype=np.int64), np.array(values, dtype=np.float64),
+                     np.array(ids, dtype=np.int64))
+        return series.sorted()
+
+    @classmethod
+    def _frozen(cls, times, values, ids) -> 'LabSeries':
+        for array in (times, values, ids):
+            array.flags.writeable = False
+        return cls(times, values, ids)
+
+    @classmethod
+    def merge(cls, series: Sequence['LabSeries']) -> 'LabSeries':
+        """ادغام چند سری (مثلاً کدهای مختلف LOINC قند خون) به ترتیب زمان"""
+        series = [s for s in series if len(s)]
+        if not series:
+            return cls.empty()
+        if len(series) == 1:
+            return series[0]
+        merged = cls(np.concatenate([s.times for s in series]), np.concatenate([s.values for s in series]),
+                     np.concatenate([s.ids for s in series]))
+        return merged.sorted()
+
+    def sorted(self) -> 'LabSeries':
+        order = np.lexsort((self.ids, self.times))
+        return self._frozen(self.times[order], self.values[order], self.ids[order])
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> 'LabSeries':
+        """برش [start, end] با جستجوی دودویی"""
+        lo = np.searchsorted(self.times, _to_micros(start), 'left') if start else 0
+        hi = np.searchsorted(self.times, _to_micros(end), 'right') if end else len(self.times)
+        return LabSeries(self.times[lo:hi], self.values[lo:hi], self.ids[lo:hi])
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """زمان‌ها به ثانیه از epoch (برای محاسبات عددی و کاهش نقاط)"""
+        return self.times / 1e6
+
+    def datetimes(self) -> List[datetime]:
+        """زمان‌ها به صورت datetime aware (UTC)"""
+        return [_EPOCH + timedelta(microseconds=t) for t in self.times.tolist()]
+
+    def date_labels(self) -> List[str]:
+        """تاریخ هر نقطه به صورت YYYY-MM-DD (UTC)"""
+        return np.datetime_as_string(self.times.astype('datetime64[us]'), unit='D').tolist()
+
+
+@dataclass
+class _Entry:
+    series: LabSeries
+    inserts: int
+    changes: int
+    # زمان ایجاد بیمار؛ اگر شناسه بیمار حذف شده دوباره استفاده شود، سری قبلی معتبر نیست
+    generation: datetime
+
+
+class LabSeriesStore:
+    """
+    کش LRU سری‌های زمانی آزمایش هر (بیمار، LOINC) در حافظه فرایند.
+
+    هر بیمار دو شمارنده مشترک در کش Django دارد: درج‌ها و تغییرات (ویرایش/حذف)
+    که سیگنال‌های LabResult افزایش می‌دهند. خواندن سری داغ فقط یک
+    get_many از کش است و هیچ کوئری یا شیء ORM نمی‌سازد. با تغییر شمارنده درج فقط
+    ردیف‌های جدید (id بزرگ‌تر) خوانده و به سری اضافه می‌شوند؛ با تغییر شمارنده
+    تغییرات سری از نو ساخته می‌شود.
+    """
+
+    def __init__(self, max_series: Optional[int] = None):
+        self.max_series = max_series or getattr(settings, 'LAB_SERIES_CACHE_SIZE', DEFAULT_MAX_SERIES)
+        self._entries: 'OrderedDict[Tuple[int, str], _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _counter_keys(patient_id: int) -> Tuple[str, str]:
+        return (f"{LAB_SERIES_VERSION_PREFIX}{patient_id}:inserts",
+                f"{LAB_SERIES_VERSION_PREFIX}{patient_id}:changes")
+
+    def _counters(self, patient_id: int) -> Tuple[int, int]:
+        inserts_key, changes_key = self._counter_keys(patient_id)
+        values = cache.get_many([inserts_key, changes_key])
+        return values.get(inserts_key, 0), values.get(changes_key, 0)
+
+    @classmethod
+    def notify(cls, patient_id: Optional[int], inserted: bool) -> None:
+        """
+        اعلام درج یا تغییر آزمایش بیمار به همه فرایندها.
+
+        شمارنده یک بار همان لحظه (برای خواندن‌های همین تراکنش) و یک بار پس از commit
+        افزایش می‌یابد تا سری‌ای که پیش از commit از داده‌های قبلی ساخته شده معتبر نماند.
+        """
+        if patient_id is None:
+            return
+        inserts_key, changes_key = cls._counter_keys(patient_id)
+        key = inserts_key if inserted else changes_key
+
+        def bump():
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    def get(self, patient, loinc: str) -> LabSeries:
+        """سری کامل آزمایش یک کد LOINC بیمار (PatientProfile)"""
+        patient_id = patient.pk
+        key = (patient_id, loinc)
+        inserts, changes = self._counters(patient_id)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and entry.generation != patient.created_at:
+            entry = None
+        if entry is not None and (entry.inserts, entry.changes) == (inserts, changes):
+            self.hits += 1
+            return entry.series
+
+        self.misses += 1
+        if entry is not None and entry.changes == changes:
+            series = self._extend(patient_id, loinc, entry.series)
+        else:
+            series = self._load(patient_id, loinc)
+
+        with self._lock:
+            self._entries[key] = _Entry(series, inserts, changes, patient.created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_series:
+                self._entries.popitem(last=False)
+        return series
+
+    def get_many(self, patient, loincs: Iterable[str]) -> LabSeries:
+        """سری ادغام شده چند کد LOINC (مثلاً همه کدهای قند خون)"""
+        return LabSeries.merge([self.get(patient, loinc) for loinc in loincs])
+
+    def _rows(self, patient_id: int, loinc: str):
+        return LabResult.objects.filter(patient_id=patient_id, loinc=loinc).values_list(
+            'id', 'taken_at', 'value'
+        ).order_by('taken_at', 'id')
+
+    def _load(self, patient_id: int, loinc: str) -> LabSeries:
+        return LabSeries.from_rows(self._rows(patient_id, loinc).iterator())
+
+    def _extend(self, patient_id: int, loinc: str, series: LabSeries) -> LabSeries:
+        """افزودن ردیف‌های جدید به سری موجود"""
+        last_id = int(series.ids.max()) if len(series) else 0
+        new_rows = LabSeries.from_rows(self._rows(patient_id, loinc).filter(id__gt=last_id))
+        extended = LabSeries.merge([series, new_rows])
+
+        # ردیفی با id کوچک‌تر که دیرتر commit شده از این روش جا می‌ماند؛ تعداد ردیف‌ها آن را آشکار می‌کند
+        if len(extended) != self._rows(patient_id, loinc).count():
+            return self._load(patient_id, loinc)
+        return extended
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {'series': len(self._entries), 'max_series': self.max_series,
+                'hits': self.hits, 'misses': self.misses}
+
+
+_store: Optional[LabSeriesStore] = None
+_store_lock = threading.Lock()
+
+
+def get_lab_series_store() -> LabSeriesStore:
+    """نمونه مشترک فرایند"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LabSeriesStore()
+        return _store
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from analytics.retention import RETENTION_POLICIES, RetentionService
+
+
+class Command(BaseCommand):
+    help = 'حذف دسته‌ای داده‌های قدیمی جداول آنالیتیکس و فقط‌افزودنی بر اساس سیاست‌های نگهداری'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            choices=[policy.model for policy in RETENTION_POLICIES],
+            help='جدول (قابل تکرار). در صورت عدم تعیین، سیاست‌های آنالیتیکس و جداولی که در RETENTION_DAYS آمده‌اند اجرا می‌شوند'
+        )
+        parser.add_argument('--batch-size', type=int, help='تعداد ردیف هر دسته حذف')
+        parser.add_argument('--pause', type=float, help='مکث بین دسته‌ها (ثانیه)')
+        parser.add_argument('--archive-dir', help='بایگانی ردیف‌ها در JSONL فشرده پیش از حذف')
+
+    def handle(self, *args, **options):
+        service = RetentionService(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            archive_dir=options['archive_dir']
+        )
+        removed = service.run(models_filter=options['models'])
+
+        for model, rows in removed.items():
+            self.stdout.write(f'{model}: {rows} ردیف')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{sum(removed.values())} ردیف قدیمی حذف شد')
+        )
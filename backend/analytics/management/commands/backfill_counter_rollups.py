@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollup_services import BACKFILL_SOURCES, CounterRollupService
+
+
+class Command(BaseCommand):
+    help = 'ساخت شمارنده‌های روزانه آمار سیستم از داده‌های موجود (یک بار پس از مهاجرت یا برای اصلاح انحراف شمارنده‌ها)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--entity',
+            action='append',
+            dest='entities',
+            choices=list(BACKFILL_SOURCES),
+            help='موجودیت (قابل تکرار). در صورت عدم تعیین، همه موجودیت‌ها بازسازی می‌شوند'
+        )
+
+    def handle(self, *args, **options):
+        created = CounterRollupService().backfill(options['entities'])
+
+        for entity, rows in created.items():
+            self.stdout.write(f'{entity}: {rows} روز')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'شمارنده‌های {len(created)} موجودیت بازسازی شد')
+        )
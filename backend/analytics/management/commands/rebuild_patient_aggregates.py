@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from gitdm.models import PatientProfile
+from analytics.aggregate_services import IncrementalAnalyticsService
+
+
+class Command(BaseCommand):
+    help = 'بازسازی جدول تجمیع روزانه بیماران از داده‌های خام (برای راه‌اندازی اولیه یا پس از بارگذاری دسته‌ای)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--patient',
+            type=int,
+            action='append',
+            dest='patient_ids',
+            help='شناسه بیمار (قابل تکرار). در صورت عدم تعیین، همه بیماران بازسازی می‌شوند'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='تعداد بیماران در هر دسته'
+        )
+
+    def handle(self, *args, **options):
+        patient_ids = options['patient_ids'] or list(
+            PatientProfile.objects.order_by('id').values_list('id', flat=True)
+        )
+        batch_size = options['batch_size']
+        service = IncrementalAnalyticsService()
+
+        buckets = 0
+        for offset in range(0, len(patient_ids), batch_size):
+            chunk = patient_ids[offset:offset + batch_size]
+            buckets += service.rebuild_buckets(chunk)
+            self.stdout.write(f'{min(offset + batch_size, len(patient_ids))}/{len(patient_ids)} بیمار')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{buckets} ردیف تجمیع برای {len(patient_ids)} بیمار بازسازی شد')
+        )
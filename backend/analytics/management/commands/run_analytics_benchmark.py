@@ -0,0 +1,51 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.benchmark import (
+    AnalyticsBenchmark, default_baseline_path, load_baseline, require_benchmark_database, save_baseline
+)
+
+
+class Command(BaseCommand):
+    help = 'اندازه‌گیری زمان و تعداد کوئری سناریوهای آنالیتیکس و مقایسه با baseline ذخیره شده'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios', help='سناریو (قابل تکرار)')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--tolerance', type=float, default=0.2, help='کندی مجاز نسبت به baseline (0.2 یعنی 20٪)')
+        parser.add_argument('--baseline', default=None, help='مسیر فایل baseline')
+        parser.add_argument('--save-baseline', action='store_true', help='ذخیره نتایج این اجرا به عنوان baseline')
+        parser.add_argument('--fail-on-regression', action='store_true', help='خروج با خطا در صورت پسرفت')
+
+    def handle(self, *args, **options):
+        try:
+            require_benchmark_database()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        benchmark = AnalyticsBenchmark(repeat=options['repeat'], tolerance=options['tolerance'])
+        results = benchmark.run(only=options['scenarios'])
+
+        for name, result in results['results'].items():
+            self.stdout.write(f"{name:<42} {result['median']:>9.4f}s  {result['queries']:>6} queries")
+
+        path = options['baseline'] or default_baseline_path()
+        baseline = load_baseline(path)
+        regressions = []
+        if baseline:
+            self.stdout.write(f'\nمقایسه با {path}:')
+            for row in benchmark.compare(results, baseline):
+                line = (f"{row['name']:<42} {row['baseline']:>9.4f}s -> {row['current']:>9.4f}s "
+                        f"(x{row['ratio']})  queries {row['baseline_queries']} -> {row['queries']}")
+                if row['regression']:
+                    regressions.append(row['name'])
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+
+        if options['save_baseline']:
+            save_baseline(path, results)
+            self.stdout.write(self.style.SUCCESS(f'baseline در {path} ذخیره شد'))
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"پسرفت در {len(regressions)} سناریو: {', '.join(regressions)}")
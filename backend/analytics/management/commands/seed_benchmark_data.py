@@ -0,0 +1,48 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.benchmark import DatasetSpec, SyntheticClinicGenerator, require_benchmark_database
+
+
+class Command(BaseCommand):
+    help = 'ساخت داده‌های ساختگی تکرارپذیر یک کلینیک بزرگ برای بنچمارک آنالیتیکس (فقط پایگاه داده غیرعملیاتی)'
+
+    def add_arguments(self, parser):
+        defaults = DatasetSpec()
+        parser.add_argument('--patients', type=int, default=defaults.patients)
+        parser.add_argument('--lab-results', type=int, default=defaults.lab_results)
+        parser.add_argument('--encounters', type=int, default=defaults.encounters)
+        parser.add_argument('--medications', type=int, default=defaults.medications)
+        parser.add_argument('--patients-per-doctor', type=int, default=defaults.patients_per_doctor)
+        parser.add_argument('--days', type=int, default=defaults.days, help='بازه زمانی داده‌ها (روز)')
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--scale', type=float, default=1.0, help='ضریب اندازه همه جدول‌ها (مثلاً 0.01)')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='عدم بازسازی ردیف‌های تجمیع و شمارنده‌ها پس از درج')
+        parser.add_argument('--clear', action='store_true', help='حذف داده‌های ساختگی قبلی و خروج')
+
+    def handle(self, *args, **options):
+        try:
+            require_benchmark_database()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        if options['clear']:
+            removed = SyntheticClinicGenerator.clear()
+            self.stdout.write(self.style.SUCCESS(f'داده‌های بنچمارک حذف شد: {removed}'))
+            return
+
+        spec = DatasetSpec(
+            patients=options['patients'],
+            lab_results=options['lab_results'],
+            encounters=options['encounters'],
+            medications=options['medications'],
+            patients_per_doctor=options['patients_per_doctor'],
+            days=options['days'],
+            seed=options['seed'],
+        ).scaled(options['scale'])
+
+        created = SyntheticClinicGenerator(spec, stdout=self.stdout.write).generate(
+            rebuild_derived=not options['skip_derived']
+        )
+        self.stdout.write(self.style.SUCCESS(f'داده‌های بنچمارک ساخته شد: {created}'))
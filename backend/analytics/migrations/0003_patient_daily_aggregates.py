@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_report_alter_doctoranalytics_options_and_more'),
+        ('gitdm', '0005_doctorprofile_role_alter_doctorprofile_medical_code_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientAnalyticsState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_dirty', models.BooleanField(db_index=True, default=True, verbose_name='نیاز به محاسبه مجدد')),
+                ('last_calculated_on', models.DateField(blank=True, null=True, verbose_name='تاریخ آخرین محاسبه')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_state', to='gitdm.patientprofile', verbose_name='بیمار')),
+            ],
+            options={
+                'verbose_name': 'وضعیت آنالیتیکس بیمار',
+                'verbose_name_plural': 'وضعیت آنالیتیکس بیماران',
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='تاریخ')),
+                ('glucose_count', models.IntegerField(default=0, verbose_name='تعداد قند خون')),
+                ('glucose_sum', models.FloatField(default=0, verbose_name='مجموع قند خون')),
+                ('glucose_sum_sq', models.FloatField(default=0, verbose_name='مجموع مربعات قند خون')),
+                ('glucose_min', models.FloatField(blank=True, null=True, verbose_name='حداقل قند خون')),
+                ('glucose_max', models.FloatField(blank=True, null=True, verbose_name='حداکثر قند خون')),
+                ('hba1c_count', models.IntegerField(default=0, verbose_name='تعداد HbA1c')),
+                ('hba1c_sum', models.FloatField(default=0, verbose_name='مجموع HbA1c')),
+                ('hba1c_last_taken_at', models.DateTimeField(blank=True, null=True, verbose_name='آخرین HbA1c')),
+                ('lab_tests_count', models.IntegerField(default=0, verbose_name='تعداد آزمایش\u200cها')),
+                ('encounters_count', models.IntegerField(default=0, verbose_name='تعداد ویزیت\u200cها')),
+                ('medications_count', models.IntegerField(default=0, verbose_name='تعداد داروها')),
+                ('alerts_count', models.IntegerField(default=0, verbose_name='تعداد هشدارها')),
+                ('unacknowledged_alerts_count', models.IntegerField(default=0, verbose_name='هشدارهای تایید نشده')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_aggregates', to='gitdm.patientprofile', verbose_name='بیمار')),
+            ],
+            options={
+                'verbose_name': 'تجمیع روزانه بیمار',
+                'verbose_name_plural': 'تجمیع\u200cهای روزانه بیماران',
+                'indexes': [models.Index(fields=['date'], name='analytics_p_date_def1b8_idx')],
+                'unique_together': {('patient', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_patient_daily_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyEntityCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('users', 'کاربران فعال'), ('doctors', 'پزشکان'), ('patients', 'بیماران'), ('encounters', 'ویزیت\u200cها'), ('lab_tests', 'آزمایش\u200cها'), ('medications', 'داروها'), ('alerts', 'هشدارها'), ('last_login', 'آخرین ورود کاربران')], max_length=20, verbose_name='موجودیت')),
+                ('date', models.DateField(verbose_name='تاریخ')),
+                ('inserted', models.IntegerField(default=0, verbose_name='تعداد درج')),
+                ('deleted', models.IntegerField(default=0, verbose_name='تعداد حذف')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'شمارنده روزانه',
+                'verbose_name_plural': 'شمارنده\u200cهای روزانه',
+                'unique_together': {('entity', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_report_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='اثر انگشت'),
+        ),
+    ]
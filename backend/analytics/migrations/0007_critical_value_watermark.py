@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_report_fingerprint'),
+        ('gitdm', '0005_doctorprofile_role_alter_doctorprofile_medical_code_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='نام')),
+                ('value', models.DateTimeField(verbose_name='مقدار')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'نقطه پیشرفت task',
+                'verbose_name_plural': 'نقاط پیشرفت taskها',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='patientanalytics',
+            index=models.Index(fields=['date', 'updated_at'], name='analytics_p_date_2ccab8_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_critical_value_watermark'),
+        ('gitdm', '0005_doctorprofile_role_alter_doctorprofile_medical_code_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientMetricIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latest_hba1c', models.FloatField(blank=True, null=True, verbose_name='آخرین HbA1c')),
+                ('latest_hba1c_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان آخرین HbA1c')),
+                ('avg_glucose', models.FloatField(blank=True, null=True, verbose_name='میانگین قند خون (۹۰ روز)')),
+                ('last_encounter_at', models.DateTimeField(blank=True, null=True, verbose_name='آخرین ویزیت')),
+                ('active_med_classes', models.BigIntegerField(default=0, verbose_name='گروه\u200cهای دارویی فعال')),
+                ('open_alerts', models.IntegerField(default=0, verbose_name='هشدارهای باز')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metric_index', to='gitdm.patientprofile', verbose_name='بیمار')),
+                ('primary_doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='پزشک معالج')),
+            ],
+            options={
+                'verbose_name': 'شاخص بیمار',
+                'verbose_name_plural': 'شاخص\u200cهای بیماران',
+            },
+        ),
+    ]
@@ -129,6 +129,7 @@ class PatientAnalytics(models.Model):
         indexes = [
             models.Index(fields=['patient', '-date']),
             models.Index(fields=['date']),
+            models.Index(fields=['date', 'updated_at']),
         ]
     
     def __str__(self):
@@ -324,6 +325,196 @@ class SystemAnalytics(models.Model):
         return f"آمار سیستم - {self.date}"
 
 
+class PatientDailyAggregate(models.Model):
+    """
+    تجمیع روزانه داده‌های بالینی هر بیمار.
+    
+    برای هر بیمار و هر روز، مجموع، تعداد و مجموع مربعات مقادیر نگهداری می‌شود تا
+    آنالیتیکس بازه‌های 30/90/180 روزه از جمع چند ردیف محاسبه شود و نیازی به
+    اسکن دوباره نتایج آزمایش‌ها نباشد.
+    """
+    
+    patient = models.ForeignKey(
+        'gitdm.PatientProfile',
+        on_delete=models.CASCADE,
+        related_name='daily_aggregates',
+        verbose_name='بیمار'
+    )
+    
+    date = models.DateField(verbose_name='تاریخ')
+    
+    # قند خون
+    glucose_count = models.IntegerField(default=0, verbose_name='تعداد قند خون')
+    glucose_sum = models.FloatField(default=0, verbose_name='مجموع قند خون')
+    glucose_sum_sq = models.FloatField(default=0, verbose_name='مجموع مربعات قند خون')
+    glucose_min = models.FloatField(null=True, blank=True, verbose_name='حداقل قند خون')
+    glucose_max = models.FloatField(null=True, blank=True, verbose_name='حداکثر قند خون')
+    
+    # HbA1c
+    hba1c_count = models.IntegerField(default=0, verbose_name='تعداد HbA1c')
+    hba1c_sum = models.FloatField(default=0, verbose_name='مجموع HbA1c')
+    hba1c_last_taken_at = models.DateTimeField(null=True, blank=True, verbose_name='آخرین HbA1c')
+    
+    # شمارش‌ها
+    lab_tests_count = models.IntegerField(default=0, verbose_name='تعداد آزمایش‌ها')
+    encounters_count = models.IntegerField(default=0, verbose_name='تعداد ویزیت‌ها')
+    medications_count = models.IntegerField(default=0, verbose_name='تعداد داروها')
+    alerts_count = models.IntegerField(default=0, verbose_name='تعداد هشدارها')
+    unacknowledged_alerts_count = models.IntegerField(default=0, verbose_name='هشدارهای تایید نشده')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'تجمیع روزانه بیمار'
+        verbose_name_plural = 'تجمیع‌های روزانه بیماران'
+        unique_together = ['patient', 'date']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        return f"تجمیع {self.patient_id} - {self.date}"
+
+
+class PatientAnalyticsState(models.Model):
+    """وضعیت محاسبه افزایشی آنالیتیکس هر بیمار"""
+    
+    patient = models.OneToOneField(
+        'gitdm.PatientProfile',
+        on_delete=models.CASCADE,
+        related_name='analytics_state',
+        verbose_name='بیمار'
+    )
+    
+    is_dirty = models.BooleanField(
+        default=True,
+        db_index=True,
+        verbose_name='نیاز به محاسبه مجدد'
+    )
+    
+    last_calculated_on = models.DateField(
+        null=True,
+        blank=True,
+        verbose_name='تاریخ آخرین محاسبه'
+    )
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'وضعیت آنالیتیکس بیمار'
+        verbose_name_plural = 'وضعیت آنالیتیکس بیماران'
+    
+    def __str__(self):
+        return f"وضعیت آنالیتیکس {self.patient_id}"
+
+
+class DailyEntityCounter(models.Model):
+    """
+    شمارنده روزانه درج و حذف هر موجودیت سیستم.
+    
+    تعداد کل یک موجودیت تا یک تاریخ برابر جمع (inserted - deleted) ردیف‌های تا آن
+    تاریخ است. برای موجودیت last_login، هر ورود کاربر در روز جدید یک درج در آن روز
+    و یک حذف در روز ورود قبلی ثبت می‌کند؛ بنابراین inserted هر روز تعداد کاربران
+    فعال همان روز است و جمع خالص یک بازه، تعداد کاربرانی است که آخرین ورودشان در آن بازه است.
+    """
+    
+    ENTITY_CHOICES = [
+        ('users', 'کاربران فعال'),
+        ('doctors', 'پزشکان'),
+        ('patients', 'بیماران'),
+        ('encounters', 'ویزیت‌ها'),
+        ('lab_tests', 'آزمایش‌ها'),
+        ('medications', 'داروها'),
+        ('alerts', 'هشدارها'),
+        ('last_login', 'آخرین ورود کاربران'),
+    ]
+    
+    entity = models.CharField(
+        max_length=20,
+        choices=ENTITY_CHOICES,
+        verbose_name='موجودیت'
+    )
+    
+    date = models.DateField(verbose_name='تاریخ')
+    
+    inserted = models.IntegerField(default=0, verbose_name='تعداد درج')
+    deleted = models.IntegerField(default=0, verbose_name='تعداد حذف')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'شمارنده روزانه'
+        verbose_name_plural = 'شمارنده‌های روزانه'
+        unique_together = ['entity', 'date']
+    
+    def __str__(self):
+        return f"{self.entity} - {self.date}: +{self.inserted}/-{self.deleted}"
+
+
+class PatientMetricIndex(models.Model):
+    """
+    شاخص‌های خلاصه هر بیمار برای جستجوی گروه بیماران (cohort).
+    
+    با هر نوشتن روی آزمایش‌ها، ویزیت‌ها، داروها و هشدارهای بیمار بازسازی می‌شود (signals).
+    """
+    
+    patient = models.OneToOneField(
+        'gitdm.PatientProfile',
+        on_delete=models.CASCADE,
+        related_name='metric_index',
+        verbose_name='بیمار'
+    )
+    
+    primary_doctor = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='پزشک معالج'
+    )
+    
+    latest_hba1c = models.FloatField(null=True, blank=True, verbose_name='آخرین HbA1c')
+    latest_hba1c_at = models.DateTimeField(null=True, blank=True, verbose_name='زمان آخرین HbA1c')
+    avg_glucose = models.FloatField(null=True, blank=True, verbose_name='میانگین قند خون (۹۰ روز)')
+    last_encounter_at = models.DateTimeField(null=True, blank=True, verbose_name='آخرین ویزیت')
+    
+    # بیت‌های گروه‌های دارویی فعال (analytics.cohort.MEDICATION_CLASSES)
+    active_med_classes = models.BigIntegerField(default=0, verbose_name='گروه‌های دارویی فعال')
+    
+    open_alerts = models.IntegerField(default=0, verbose_name='هشدارهای باز')
+    
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'شاخص بیمار'
+        verbose_name_plural = 'شاخص‌های بیماران'
+    
+    def __str__(self):
+        return f"شاخص بیمار {self.patient_id}"
+
+
+class TaskWatermark(models.Model):
+    """آخرین نقطه پردازش شده یک task دوره‌ای (برای پردازش فقط تغییرات جدید در اجرای بعدی)"""
+    
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='نام'
+    )
+    
+    value = models.DateTimeField(verbose_name='مقدار')
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'نقطه پیشرفت task'
+        verbose_name_plural = 'نقاط پیشرفت taskها'
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
 class Report(models.Model):
     """مدل برای ذخیره گزارش‌های تولید شده"""
     
@@ -426,7 +617,23 @@ class Report(models.Model):
         verbose_name='متادیتا'
     )
     
+    progress = models.PositiveSmallIntegerField(
+        default=0,
+        validators=[MaxValueValidator(100)],
+        verbose_name='درصد پیشرفت'
+    )
+    
+    # hash ورودی‌ها و داده‌های منبع برای استفاده دوباره از خروجی (report_memo)
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='اثر انگشت'
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
@@ -0,0 +1,232 @@
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from gitdm.models import DoctorProfile
+from .models import DoctorAnalytics, Report
+from .services import DoctorAnalyticsService
+from .shard_services import PROGRESS_TIMEOUT, _init_worker
+
+logger = logging.getLogger(__name__)
+
+# تعداد تلاش مجدد تولید گزارش هر پزشک پس از خطا
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 5
+
+REPORT_PERIOD_DAYS = 30
+
+_report_service = None
+
+
+def _get_report_service():
+    """یک ReportGenerationService برای هر فرایند (ثبت فونت و کش‌ها فقط یک بار)"""
+    global _report_service
+    if _report_service is None:
+        from .report_service import ReportGenerationService
+        _report_service = ReportGenerationService()
+    return _report_service
+
+
+def _progress_key(run_id: str) -> str:
+    return f'analytics_monthly_reports:{run_id}'
+
+
+def get_monthly_reports_progress(run_id: str) -> Dict:
+    """وضعیت پیشرفت یک اجرای گزارش‌های ماهانه: تعداد کل، تکمیل شده و ناموفق"""
+    keys = {name: f'{_progress_key(run_id)}:{name}' for name in ('total', 'completed', 'failed')}
+    values = cache.get_many(list(keys.values()))
+    return {name: values.get(key, 0) for name, key in keys.items()}
+
+
+def _count_progress(run_id: Optional[str], name: str) -> None:
+    if not run_id:
+        return
+    key = f'{_progress_key(run_id)}:{name}'
+    cache.add(key, 0, PROGRESS_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, PROGRESS_TIMEOUT)
+
+
+def _run_doctor_in_worker(doctor_id: int, start_date: str, end_date: str, run_id: Optional[str],
+                          prefetched: Optional[Dict]) -> Dict:
+    # پیشرفت را فرایند والد از نتیجه هر future می‌شمارد؛ کش فرزند ممکن است با والد مشترک نباشد
+    try:
+        return MonthlyDoctorReportService().run_doctor(doctor_id, start_date, end_date, None, prefetched)
+    finally:
+        connections.close_all()
+
+
+class MonthlyDoctorReportService:
+    """
+    تولید موازی گزارش ماهانه عملکرد پزشکان.
+
+    داده‌هایی که برای همه پزشکان مشترک است (آخرین DoctorAnalytics و هیستوگرام کنترل
+    دیابت بیماران) یک بار با کوئری‌های گروهی جمع‌آوری و به هر گزارش داده می‌شود. گزارش
+    هر پزشک مستقل تولید و در صورت خطا چند بار دوباره تلاش می‌شود؛ Report پزشک در
+    تلاش‌های بعدی و اجرای مجدد همان دوره دوباره استفاده می‌شود، نه ساخته.
+    """
+
+    def __init__(self, retries: Optional[int] = None, backoff: Optional[float] = None):
+        self.retries = retries if retries is not None else getattr(settings, 'MONTHLY_REPORT_RETRIES', DEFAULT_RETRIES)
+        self.backoff = backoff if backoff is not None else RETRY_BACKOFF_SECONDS
+
+    def get_doctors(self) -> List[DoctorProfile]:
+        return list(DoctorProfile.objects.filter(user__is_active=True).select_related('user').order_by('id'))
+
+    def collect_shared_data(self, doctors: List[DoctorProfile]) -> Dict[int, Dict]:
+        """داده‌های پیش‌محاسبه شده هر پزشک با دو کوئری برای همه پزشکان"""
+        latest_analytics = dict(
+            DoctorAnalytics.objects.filter(doctor__in=doctors).annotate(
+                latest_rank=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('doctor_id')],
+                    order_by=[F('date').desc(), F('id').desc()]
+                )
+            ).filter(latest_rank=1).values_list('doctor_id', 'id')
+        )
+        histograms = DoctorAnalyticsService().calculate_hba1c_control_histograms(
+            [doctor.user_id for doctor in doctors]
+        )
+        return {
+            doctor.id: {
+                'analytics_id': latest_analytics.get(doctor.id),
+                'histogram': histograms[doctor.user_id],
+            }
+            for doctor in doctors
+        }
+
+    def _get_or_create_report(self, doctor: DoctorProfile, start_date: date, end_date: date) -> Report:
+        """Report زمان‌بندی شده پزشک برای این دوره (در اجرای مجدد دوباره ساخته نمی‌شود)"""
+        report = Report.objects.filter(
+            report_type='doctor_performance',
+            doctor=doctor,
+            start_date=start_date,
+            end_date=end_date,
+            metadata__scheduled=True
+        ).order_by('-id').first()
+        if report:
+            return report
+        return Report.objects.create(
+            report_type='doctor_performance',
+            format='pdf',
+            requested_by=doctor.user,
+            doctor=doctor,
+            start_date=start_date,
+            end_date=end_date,
+            metadata={
+                'scheduled': True,
+                'report_period': 'monthly'
+            }
+        )
+
+    def run_doctor(self, doctor_id: int, start_date, end_date, run_id: Optional[str] = None,
+                   prefetched: Optional[Dict] = None) -> Dict:
+        """تولید و ارسال گزارش یک پزشک با تلاش مجدد پس از خطا"""
+        start_date = date.fromisoformat(start_date) if isinstance(start_date, str) else start_date
+        end_date = date.fromisoformat(end_date) if isinstance(end_date, str) else end_date
+        service = _get_report_service()
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * attempt)
+            try:
+                doctor = DoctorProfile.objects.select_related('user').get(pk=doctor_id)
+                report = self._get_or_create_report(doctor, start_date, end_date)
+                emailed = report.metadata.get('emailed', False)
+
+                if report.status != 'completed':
+                    service.generate_report(report, prefetched)
+
+                if doctor.user.email and not emailed:
+                    service.send_report_email(report, [doctor.user.email])
+                    report.metadata['emailed'] = True
+                    report.save(update_fields=['metadata'])
+
+                _count_progress(run_id, 'completed')
+                return {'doctor_id': doctor_id, 'report_id': report.id, 'status': 'completed', 'attempts': attempt + 1}
+            except DoctorProfile.DoesNotExist:
+                error = 'doctor not found'
+                break
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Monthly report for doctor {doctor_id} failed (attempt {attempt + 1}): {e}")
+
+        logger.error(f"Monthly report for doctor {doctor_id} failed: {error}")
+        _count_progress(run_id, 'failed')
+        return {'doctor_id': doctor_id, 'status': 'failed', 'error': error}
+
+    def plan(self, end_date: Optional[date] = None, run_id: Optional[str] = None):
+        """
+        جمع‌آوری داده‌های مشترک و آرگومان‌های گزارش هر پزشک برای یک اجرا.
+
+        Returns:
+            (run_id، لیست آرگومان‌های run_doctor برای هر پزشک)
+        """
+        end_date = end_date or timezone.now().date()
+        start_date = end_date - timedelta(days=REPORT_PERIOD_DAYS)
+        run_id = run_id or uuid.uuid4().hex
+
+        doctors = self.get_doctors()
+        shared = self.collect_shared_data(doctors)
+        cache.set(f'{_progress_key(run_id)}:total', len(doctors), PROGRESS_TIMEOUT)
+        args = [(doctor.id, start_date.isoformat(), end_date.isoformat(), run_id, shared[doctor.id])
+                for doctor in doctors]
+        return run_id, args
+
+    def run(self, workers: Optional[int] = None, end_date: Optional[date] = None,
+            run_id: Optional[str] = None) -> Dict:
+        """
+        تولید گزارش همه پزشکان فعال روی یک process pool محدود.
+
+        با workers=1 گزارش‌ها به ترتیب در همین فرایند تولید می‌شوند (مناسب تست و SQLite).
+        """
+        workers = workers or getattr(settings, 'MONTHLY_REPORT_WORKERS', None) or os.cpu_count() or 1
+        run_id, args = self.plan(end_date, run_id)
+
+        results: List[Dict] = []
+        if workers <= 1 or len(args) <= 1:
+            for doctor_args in args:
+                results.append(self.run_doctor(*doctor_args))
+        else:
+            # اتصال‌های باز نباید به فرایندهای فرزند به ارث برسند
+            connections.close_all()
+            context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+            with ProcessPoolExecutor(max_workers=min(workers, len(args)), mp_context=context,
+                                     initializer=_init_worker) as pool:
+                futures = {pool.submit(_run_doctor_in_worker, *doctor_args): doctor_args for doctor_args in args}
+                crashed = []
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Monthly report worker for doctor {futures[future][0]} crashed: {e}")
+                        crashed.append(futures[future])
+                        continue
+                    results.append(result)
+                    _count_progress(run_id, result['status'])
+
+            # فرایند از کار افتاده (نه خطای تولید گزارش) یک بار دیگر در همین فرایند اجرا می‌شود
+            for doctor_args in crashed:
+                results.append(self.run_doctor(*doctor_args))
+
+        return {
+            'run_id': run_id,
+            'doctors': len(args),
+            'completed': sum(1 for result in results if result['status'] == 'completed'),
+            'failed': [result['doctor_id'] for result in results if result['status'] == 'failed'],
+        }
@@ -0,0 +1,151 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .models import Report
+
+logger = logging.getLogger(__name__)
+
+# وضعیت‌هایی که گزارش هنوز در صف یا در حال تولید است
+ACTIVE_STATUSES = ('pending', 'processing')
+
+# گزارش فعالی که بیش از این مدت در صف یا در حال تولید مانده (مثلاً job آن با ری‌استارت worker از دست
+# رفته) در سهمیه کاربر شمرده نمی‌شود و با fail_stale ناموفق علامت می‌خورد
+STALE_AFTER = timedelta(hours=1)
+
+STALE_ERROR_MESSAGE = 'تولید گزارش متوقف شد (مثلاً با ری‌استارت سرور)؛ لطفاً دوباره درخواست دهید'
+
+# صف Celery برای گزارش‌ها (CELERY_TASK_ROUTES)؛ تعداد workerهای این صف همان محدودیت همزمانی کل است
+REPORT_QUEUE = 'reports'
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """pool محدود محلی برای زمانی که broker تنظیم نشده است"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORT_JOB_WORKERS', 2),
+                thread_name_prefix='report-job'
+            )
+        return _executor
+
+
+def run_report_job(report_id: int) -> Optional[str]:
+    """
+    اجرای یک job تولید گزارش.
+
+    وضعیت، پیشرفت و خطا روی خود Report ثبت می‌شود، بنابراین خطا به فراخواننده برگردانده نمی‌شود.
+    """
+    from .report_service import ReportGenerationService
+
+    # برداشتن اتمیک job تا دو worker یک گزارش را همزمان تولید نکنند
+    claimed = Report.objects.filter(pk=report_id, status='pending').update(
+        status='processing', started_at=timezone.now()
+    )
+    if not claimed:
+        # گزارش حذف شده یا توسط worker دیگری برداشته شده است
+        return None
+    report = Report.objects.get(pk=report_id)
+
+    try:
+        return ReportGenerationService().generate_report(report)
+    except Exception as e:
+        logger.error(f"Report job {report_id} failed: {e}")
+        return None
+
+
+def _run_in_pool(report_id: int) -> None:
+    close_old_connections()
+    try:
+        run_report_job(report_id)
+    finally:
+        close_old_connections()
+
+
+class ReportJobService:
+    """
+    صف‌بندی تولید گزارش‌ها با سقف گزارش‌های فعال هر کاربر.
+
+    سقف REPORT_MAX_ACTIVE_PER_USER هنگام ثبت درخواست اعمال می‌شود (درخواست اضافه با 429 رد
+    می‌شود) و صف را برای هر کاربر کوتاه نگه می‌دارد؛ همزمانی اجرای کل با تعداد workerها
+    (REPORT_JOB_WORKERS یا workerهای صف reports) محدود است.
+    """
+
+    def get_active_jobs_count(self, user) -> int:
+        """تعداد گزارش‌های در صف یا در حال تولید کاربر"""
+        return Report.objects.filter(
+            requested_by=user,
+            status__in=ACTIVE_STATUSES,
+            created_at__gte=timezone.now() - STALE_AFTER
+        ).count()
+
+    def fail_stale(self, queryset: Optional[QuerySet] = None) -> int:
+        """
+        ناموفق علامت زدن گزارش‌هایی که بیش از STALE_AFTER در صف یا در حال تولید مانده‌اند.
+
+        بدون broker، jobها در thread pool همان فرایند هستند و با ری‌استارت worker از دست
+        می‌روند؛ این گزارش‌ها بدون این مرحله برای همیشه pending می‌مانند. تعداد گزارش‌ها برگردانده می‌شود.
+        """
+        now = timezone.now()
+        cutoff = now - STALE_AFTER
+        queryset = Report.objects.all() if queryset is None else queryset
+        return queryset.filter(
+            Q(status='pending', created_at__lt=cutoff) |
+            Q(status='processing', started_at__lt=cutoff)
+        ).update(status='failed', error_message=STALE_ERROR_MESSAGE, completed_at=now)
+
+    def fail_if_stale(self, report: Report) -> None:
+        """بررسی یک گزارش هنگام مشاهده وضعیت یا دانلود آن"""
+        if report.status in ACTIVE_STATUSES and self.fail_stale(Report.objects.filter(pk=report.pk)):
+            report.refresh_from_db()
+
+    def can_submit(self, user) -> bool:
+        """آیا کاربر می‌تواند گزارش جدیدی در صف قرار دهد"""
+        limit = getattr(settings, 'REPORT_MAX_ACTIVE_PER_USER', 2)
+        return self.get_active_jobs_count(user) < limit
+
+    def create(self, report: Report) -> bool:
+        """
+        ذخیره گزارش جدید و قرار دادن آن در صف، در صورتی که کاربر به سقف گزارش‌های همزمان نرسیده باشد.
+
+        شمارش و ذخیره زیر قفل ردیف کاربر انجام می‌شوند تا درخواست‌های همزمان یک کاربر
+        نتوانند هر دو از سقف عبور کنند.
+        """
+        with transaction.atomic():
+            get_user_model().objects.select_for_update().only('pk').get(pk=report.requested_by_id)
+            if not self.can_submit(report.requested_by):
+                return False
+            report.save()
+            self.submit(report)
+        return True
+
+    def submit(self, report: Report) -> None:
+        """
+        قرار دادن گزارش در صف پس از commit تراکنش جاری.
+
+        با broker واقعی، گزارش به صف Celery فرستاده می‌شود. در غیر این صورت روی
+        یک thread pool محدود در همین فرایند اجرا می‌شود. با REPORT_JOB_WORKERS=0
+        گزارش همان لحظه تولید می‌شود (مناسب تست و اجرای تک‌فرایندی).
+        """
+        transaction.on_commit(lambda: self._dispatch(report.pk))
+
+    def _dispatch(self, report_id: int) -> None:
+        if getattr(settings, 'CELERY_BROKER_URL', None):
+            from .tasks import generate_report_job
+            generate_report_job.delay(report_id)
+        elif getattr(settings, 'REPORT_JOB_WORKERS', 2) == 0:
+            run_report_job(report_id)
+        else:
+            _get_executor().submit(_run_in_pool, report_id)
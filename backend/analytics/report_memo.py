@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db.models import Count, Max, Q, QuerySet
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder
+from notifications.models import ClinicalAlert
+from gitdm.models import DoctorProfile, PatientProfile
+from .models import Report, PatientAnalytics, DoctorAnalytics, PatientDailyAggregate
+
+logger = logging.getLogger(__name__)
+
+# نسخه اثر انگشت؛ با تغییر قالب یا محتوای گزارش‌ها افزایش دهید تا خروجی‌های قبلی دوباره استفاده نشوند
+REPORT_FINGERPRINT_VERSION = 1
+
+# گزارش‌هایی که خروجی آن‌ها فقط به داده‌های یک بیمار یا پزشک وابسته است
+MEMOIZED_REPORT_TYPES = ('patient_summary', 'doctor_performance')
+
+# بازه پیش‌فرض هر نوع گزارش؛ باید با _collect_patient_data و _collect_doctor_data یکسان باشد
+DEFAULT_RANGE_DAYS = {
+    'patient_summary': 90,
+    'doctor_performance': 30,
+}
+
+DEFAULT_QUOTA_BYTES = 1024 * 1024 * 1024
+
+
+def _queryset_watermark(queryset: QuerySet) -> Dict:
+    """
+    بیشترین id، تعداد و (در صورت وجود) آخرین updated_at ردیف‌ها.
+
+    تعداد ردیف‌ها حذف‌ها را و بیشترین id درج‌ها را نشان می‌دهد؛ ویرایش درجای مدل‌هایی
+    که updated_at ندارند (مانند LabResult) از این‌جا دیده نمی‌شود و با updated_at
+    ردیف‌های PatientDailyAggregate بیماران (get_watermark) پوشش داده می‌شود.
+    """
+    aggregates = {'max_id': Max('pk'), 'count': Count('pk')}
+    if any(field.name == 'updated_at' for field in queryset.model._meta.concrete_fields):
+        aggregates['updated_at'] = Max('updated_at')
+    return queryset.order_by().aggregate(**aggregates)
+
+
+def _profile_digest(queryset: QuerySet, fields) -> str:
+    """
+    hash فیلدهای پروفایلی که در گزارش چاپ می‌شوند (نام، کد ملی، تاریخ تولد و ...)
+
+    PatientProfile و User فیلد updated_at ندارند، پس ویرایش این فیلدها فقط با
+    خواندن خود مقادیر در اثر انگشت دیده می‌شود.
+    """
+    digest = hashlib.sha256()
+    for row in queryset.order_by('pk').values_list('pk', *fields).iterator():
+        digest.update(json.dumps(row, default=str, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ReportMemoService:
+    """
+    استفاده دوباره از خروجی گزارش‌ها با اثر انگشت ورودی‌ها و داده‌های منبع.
+
+    اثر انگشت از نوع و فرمت گزارش، بیمار/پزشک، بازه تاریخ و watermark داده‌های
+    منبع ساخته می‌شود؛ تا زمانی که داده‌ای اضافه، حذف یا به‌روز نشود همان فایل قبلی
+    برگردانده می‌شود. حجم پوشه خروجی‌ها با REPORT_OUTPUT_QUOTA_BYTES محدود است.
+    """
+
+    def __init__(self, directory: Optional[str] = None, quota_bytes: Optional[int] = None):
+        self.directory = str(directory or os.path.join(settings.MEDIA_ROOT, 'reports'))
+        self.quota_bytes = quota_bytes if quota_bytes is not None else getattr(
+            settings, 'REPORT_OUTPUT_QUOTA_BYTES', DEFAULT_QUOTA_BYTES
+        )
+
+    def is_memoizable(self, report: Report) -> bool:
+        return report.report_type in MEMOIZED_REPORT_TYPES
+
+    def get_watermark(self, report: Report) -> Dict:
+        """
+        watermark داده‌هایی که گزارش از آن‌ها ساخته می‌شود
+
+        سیگنال‌ها با هر ثبت، ویرایش یا حذف آزمایش، ویزیت، دارو و هشدار (از جمله تأیید هشدار)
+        ردیف تجمیع همان روز بیمار را بازنویسی می‌کنند؛ بیشترین updated_at این ردیف‌ها
+        ویرایش‌های درجای مدل‌های بدون updated_at را در اثر انگشت وارد می‌کند. فیلدهای
+        پروفایل چاپ شده در گزارش (بیمار، پزشک) با hash مقادیرشان وارد می‌شوند.
+        """
+        if report.report_type == 'patient_summary':
+            patient = report.patient_id
+            profiles = {
+                'patient': _profile_digest(
+                    PatientProfile.objects.filter(pk=patient),
+                    ['full_name', 'national_id', 'dob', 'sex', 'primary_doctor__full_name', 'primary_doctor__email']
+                ),
+            }
+            sources = {
+                'encounters': Encounter.objects.filter(patient_id=patient),
+                'labs': LabResult.objects.filter(patient_id=patient),
+                'medications': MedicationOrder.objects.filter(patient_id=patient),
+                'alerts': ClinicalAlert.objects.filter(patient_id=patient),
+                'analytics': PatientAnalytics.objects.filter(patient_id=patient),
+                'edits': PatientDailyAggregate.objects.filter(patient_id=patient),
+            }
+        else:
+            doctor_user = report.doctor.user_id
+            profiles = {
+                'doctor': _profile_digest(
+                    DoctorProfile.objects.filter(pk=report.doctor_id),
+                    ['medical_code', 'user__full_name', 'user__email']
+                ),
+                # بیماران پزشک و بیماران ویزیت‌های او (نام و کد ملی در جدول‌ها)
+                'patients': _profile_digest(
+                    PatientProfile.objects.filter(
+                        Q(primary_doctor_id=doctor_user) |
+                        Q(pk__in=Encounter.objects.filter(created_by_id=doctor_user).values('patient_id'))
+                    ),
+                    ['full_name', 'national_id']
+                ),
+            }
+            sources = {
+                'patients': PatientProfile.objects.filter(primary_doctor_id=doctor_user),
+                'encounters': Encounter.objects.filter(created_by_id=doctor_user),
+                'labs': LabResult.objects.filter(patient__primary_doctor_id=doctor_user),
+                'medications': MedicationOrder.objects.filter(patient__primary_doctor_id=doctor_user),
+                'alerts': ClinicalAlert.objects.filter(patient__primary_doctor_id=doctor_user),
+                'analytics': DoctorAnalytics.objects.filter(doctor_id=report.doctor_id),
+                'edits': PatientDailyAggregate.objects.filter(patient__primary_doctor_id=doctor_user),
+                # ویزیت‌های این پزشک برای بیماران پزشکان دیگر
+                'encounter_edits': PatientDailyAggregate.objects.filter(
+                    patient_id__in=Encounter.objects.filter(created_by_id=doctor_user).values('patient_id')
+                ),
+            }
+        watermark = {name: _queryset_watermark(queryset) for name, queryset in sources.items()}
+        watermark['profiles'] = profiles
+        return watermark
+
+    def get_fingerprint(self, report: Report) -> Optional[str]:
+        """اثر انگشت گزارش یا None اگر این نوع گزارش قابل استفاده دوباره نیست"""
+        if not self.is_memoizable(report):
+            return None
+
+        # بازه باز به همان شکلی که هنگام جمع‌آوری داده‌ها بسته می‌شود تعیین می‌شود؛
+        # نمودارهای گزارش نسبت به امروز محاسبه می‌شوند، پس تاریخ امروز هم جزو کلید است
+        today = timezone.localdate()
+        end_date = report.end_date or today
+        start_date = report.start_date or end_date - timedelta(days=DEFAULT_RANGE_DAYS[report.report_type])
+
+        payload = json.dumps({
+            'version': REPORT_FINGERPRINT_VERSION,
+            'report_type': report.report_type,
+            'format': report.format,
+            'patient': report.patient_id,
+            'doctor': report.doctor_id,
+            'start_date': start_date,
+            'end_date': end_date,
+            'as_of': today,
+            'watermark': self.get_watermark(report),
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, fingerprint: str) -> Optional[str]:
+        """مسیر خروجی قبلی با همین اثر انگشت، در صورتی که فایل هنوز روی دیسک باشد"""
+        candidates = Report.objects.filter(
+            fingerprint=fingerprint, status='completed', file_path__isnull=False
+        ).order_by('-completed_at').values_list('file_path', flat=True)
+
+        for file_path in candidates[:5]:
+            try:
+                # استفاده دوباره فایل را تازه‌ترین مورد در حذف بر اساس سهمیه می‌کند
+                os.utime(file_path)
+            except FileNotFoundError:
+                continue
+            return file_path
+        return None
+
+    def enforce_quota(self) -> int:
+        """
+        حذف خروجی‌های قدیمی تا حجم پوشه گزارش‌ها به زیر سهمیه برسد.
+
+        فایل‌هایی که هیچ گزارش تکمیل شده‌ای به آن‌ها اشاره نمی‌کند زودتر حذف می‌شوند و
+        پس از آن کم‌استفاده‌ترین فایل‌ها بر اساس mtime. تعداد فایل‌های حذف شده برگردانده می‌شود.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.quota_bytes:
+            return 0
+
+        referenced = set(Report.objects.filter(
+            status='completed', file_path__in=[path for _, _, path in entries]
+        ).values_list('file_path', flat=True))
+        entries.sort(key=lambda entry: (entry[2] in referenced, entry[0]))
+
+        removed = []
+        for _, size, path in entries:
+            if total <= self.quota_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed.append(path)
+
+        # گزارش‌هایی که فایلشان حذف شده دیگر قابل استفاده دوباره نیستند
+        Report.objects.filter(file_path__in=removed).update(fingerprint='')
+
+        logger.info(f"Report output quota evicted {len(removed)} files from {self.directory}")
+        return len(removed)
@@ -1,5 +1,7 @@
 import io
 import os
+import threading
+import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from django.conf import settings
@@ -17,12 +19,6 @@ from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
-# Import for Excel generation
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
-
 # Import for charts
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
@@ -36,6 +32,27 @@ from gitdm.models import PatientProfile as Patient
 from gitdm.models import DoctorProfile
 from .models import Report, PatientAnalytics, DoctorAnalytics, SystemAnalytics
 from .services import PatientAnalyticsService, DoctorAnalyticsService, SystemAnalyticsService
+from .report_writers import ReportSection, iter_rows, write_csv, write_excel
+from .chart_cache import ChartCache
+from .report_memo import ReportMemoService
+
+_PYPLOT_LOCK = threading.Lock()
+
+# سبک نمودارها؛ بخشی از کلید کش است و هر تغییر آن نمودارها را دوباره رسم می‌کند
+GLUCOSE_CHART_STYLE = {
+    'figsize': (10, 6),
+    'dpi': 150,
+    'xlabel': 'تاریخ',
+    'ylabel': 'قند خون (mg/dL)',
+    'title': 'روند قند خون',
+}
+DISTRIBUTION_CHART_STYLE = {
+    'figsize': (8, 5),
+    'dpi': 150,
+    'ylabel': 'تعداد بیماران',
+    'title': 'توزیع بیماران بر اساس کنترل دیابت',
+    'colors': ['#4bc0c0', '#36a2eb', '#ffce56', '#ff6384'],
+}
 
 
 class ReportGenerationService:
@@ -45,6 +62,8 @@ class ReportGenerationService:
         self.patient_service = PatientAnalyticsService()
         self.doctor_service = DoctorAnalyticsService()
         self.system_service = SystemAnalyticsService()
+        self.chart_cache = ChartCache()
+        self.memo = ReportMemoService()
         
         # تنظیمات فونت فارسی برای PDF
         self._setup_persian_font()
@@ -62,35 +81,77 @@ class ReportGenerationService:
         except:
             self.persian_font = 'Helvetica'
     
-    def generate_report(self, report: Report) -> str:
-        """تولید گزارش بر اساس نوع و فرمت"""
+    def generate_report(self, report: Report, prefetched: Optional[Dict] = None) -> str:
+        """
+        تولید گزارش بر اساس نوع و فرمت
+        
+        prefetched داده‌هایی است که برای چند گزارش یک‌جا جمع‌آوری شده‌اند
+        (مثلاً آنالیتیکس و هیستوگرام پزشکان در گزارش‌های ماهانه).
+        """
         try:
             report.status = 'processing'
+            report.started_at = timezone.now()
+            report.progress = 5
             report.save()
             
-            # تولید گزارش بر اساس نوع
-            if report.report_type == 'patient_summary':
+            # خروجی قبلی با همان ورودی‌ها و داده‌های منبع دوباره استفاده می‌شود
+            fingerprint = self.memo.get_fingerprint(report)
+            file_path = self.memo.lookup(fingerprint) if fingerprint else None
+            if file_path:
+                report.metadata['memoized'] = True
+            elif report.report_type == 'patient_summary':
                 file_path = self._generate_patient_summary(report)
             elif report.report_type == 'doctor_performance':
-                file_path = self._generate_doctor_performance(report)
+                file_path = self._generate_doctor_performance(report, prefetched)
             elif report.report_type == 'system_overview':
                 file_path = self._generate_system_overview(report)
             else:
                 file_path = self._generate_custom_report(report)
             
             report.file_path = file_path
+            report.fingerprint = fingerprint or ''
             report.status = 'completed'
+            report.progress = 100
             report.completed_at = timezone.now()
             report.save()
             
+            self.memo.enforce_quota()
+            
             return file_path
             
         except Exception as e:
             report.status = 'failed'
             report.error_message = str(e)
+            report.completed_at = timezone.now()
             report.save()
             raise
     
+    def get_report_sections(self, report: Report) -> List[ReportSection]:
+        """
+        جدول‌های گزارش برای خروجی Excel/CSV.
+        
+        report لازم نیست ذخیره شده باشد؛ از این متد برای خروجی مستقیم (StreamingHttpResponse) هم استفاده می‌شود.
+        """
+        if report.report_type == 'patient_summary':
+            if not report.patient:
+                raise ValueError("بیمار برای گزارش مشخص نشده است")
+            data = self._collect_patient_data(report.patient, report.start_date, report.end_date)
+            return self._patient_sections(report.patient, data)
+        
+        if report.report_type == 'doctor_performance':
+            if not report.doctor:
+                raise ValueError("پزشک برای گزارش مشخص نشده است")
+            data = self._collect_doctor_data(report.doctor, report.start_date, report.end_date)
+            return self._doctor_sections(report.doctor, data)
+        
+        data = self._collect_system_data(report.start_date, report.end_date)
+        return self.system_sections(data, report.metadata.get('include_detailed_data', False))
+    
+    def _update_progress(self, report: Report, progress: int) -> None:
+        """ثبت درصد پیشرفت گزارش بدون بازنویسی سایر فیلدها"""
+        report.progress = progress
+        Report.objects.filter(pk=report.pk).update(progress=progress)
+    
     def _generate_patient_summary(self, report: Report) -> str:
         """تولید گزارش خلاصه بیمار"""
         patient = report.patient
@@ -99,6 +160,7 @@ class ReportGenerationService:
         
         # جمع‌آوری داده‌ها
         data = self._collect_patient_data(patient, report.start_date, report.end_date)
+        self._update_progress(report, 40)
         
         # تولید گزارش بر اساس فرمت
         if report.format == 'pdf':
@@ -119,13 +181,13 @@ class ReportGenerationService:
         # مواجهات
         encounters = Encounter.objects.filter(
             patient=patient,
-            occurred_at__range=[start_date, end_date]
+            occurred_at__date__range=[start_date, end_date]
         ).order_by('-occurred_at')
         
         # آزمایش‌ها
         lab_results = LabResult.objects.filter(
             patient=patient,
-            taken_at__range=[start_date, end_date]
+            taken_at__date__range=[start_date, end_date]
         ).order_by('-taken_at')
         
         # داروها
@@ -158,9 +220,7 @@ class ReportGenerationService:
     def _generate_patient_pdf(self, patient: Patient, data: Dict, report: Report) -> str:
         """تولید PDF برای گزارش بیمار"""
         # ایجاد مسیر فایل
-        filename = f"patient_report_{patient.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        file_path = os.path.join(settings.MEDIA_ROOT, 'reports', filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        file_path = self._report_file_path(f"patient_report_{patient.id}", 'pdf')
         
         # ایجاد PDF
         doc = SimpleDocTemplate(file_path, pagesize=A4)
@@ -201,10 +261,10 @@ class ReportGenerationService:
         # اطلاعات بیمار
         patient_info = [
             ['نام و نام خانوادگی:', patient.full_name],
-            ['کد ملی:', patient.national_id],
-            ['تاریخ تولد:', patient.date_of_birth.strftime('%Y-%m-%d') if patient.date_of_birth else '-'],
-            ['جنسیت:', patient.get_gender_display()],
-            ['پزشک معالج:', patient.primary_doctor.user.get_full_name() if patient.primary_doctor else '-']
+            ['کد ملی:', patient.national_id or '-'],
+            ['تاریخ تولد:', patient.dob.strftime('%Y-%m-%d') if patient.dob else '-'],
+            ['جنسیت:', patient.get_sex_display() if patient.sex else '-'],
+            ['پزشک معالج:', patient.primary_doctor.get_full_name() if patient.primary_doctor else '-']
         ]
         
         patient_table = Table(patient_info, colWidths=[2*inch, 4*inch])
@@ -251,6 +311,7 @@ class ReportGenerationService:
             story.append(Spacer(1, 0.3*inch))
         
         # نمودار قند خون
+        self._update_progress(report, 60)
         if report.metadata.get('include_charts', True):
             story.append(Paragraph("روند قند خون", heading_style))
             
@@ -289,123 +350,89 @@ class ReportGenerationService:
             story.append(lab_table)
         
         # ایجاد PDF
+        self._update_progress(report, 80)
         doc.build(story)
         
         return file_path
     
-    def _generate_patient_excel(self, patient: Patient, data: Dict, report: Report) -> str:
-        """تولید Excel برای گزارش بیمار"""
-        filename = f"patient_report_{patient.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    def _report_file_path(self, prefix: str, extension: str) -> str:
+        """
+        مسیر فایل خروجی گزارش در MEDIA_ROOT/reports.
+        
+        پسوند تصادفی مانع بازنویسی خروجی دیگری در همان ثانیه می‌شود؛ فایل‌های قبلی
+        ممکن است توسط گزارش‌های بعدی دوباره استفاده شوند.
+        """
+        filename = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{extension}"
         file_path = os.path.join(settings.MEDIA_ROOT, 'reports', filename)
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        # ایجاد Excel writer
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            # برگه اطلاعات بیمار
-            patient_info = {
-                'عنوان': ['نام و نام خانوادگی', 'کد ملی', 'تاریخ تولد', 'جنسیت', 'پزشک معالج'],
-                'مقدار': [
-                    patient.full_name,
-                    patient.national_id,
-                    patient.date_of_birth.strftime('%Y-%m-%d') if patient.date_of_birth else '-',
-                    patient.get_gender_display(),
-                    patient.primary_doctor.user.get_full_name() if patient.primary_doctor else '-'
-                ]
-            }
-            df_info = pd.DataFrame(patient_info)
-            df_info.to_excel(writer, sheet_name='اطلاعات بیمار', index=False)
-            
-            # برگه آزمایش‌ها
-            lab_records = []
-            for result in data['lab_results']:
-                lab_records.append({
-                    'تاریخ': result.taken_at.strftime('%Y-%m-%d'),
-                    'LOINC': result.loinc,
-                    'نتیجه': result.value,
-                    'واحد': result.unit or '-',
-                })
-            
-            if lab_records:
-                df_labs = pd.DataFrame(lab_records)
-                df_labs.to_excel(writer, sheet_name='آزمایش‌ها', index=False)
-            
-            # برگه داروها
-            med_records = []
-            for med in data['medications']:
-                med_records.append({
-                    'تاریخ تجویز': med.prescribed_date.strftime('%Y-%m-%d'),
-                    'نام دارو': med.medication_name,
-                    'دوز': med.dosage,
-                    'تناوب': med.get_frequency_display(),
-                    'مدت': f"{med.duration} روز" if med.duration else '-',
-                    'وضعیت': med.get_status_display()
-                })
-            
-            if med_records:
-                df_meds = pd.DataFrame(med_records)
-                df_meds.to_excel(writer, sheet_name='داروها', index=False)
-            
-            # برگه خلاصه آماری
-            if data['analytics']:
-                summary_data = {
-                    'شاخص': [
-                        'میانگین قند خون',
-                        'حداقل قند خون',
-                        'حداکثر قند خون',
-                        'میانگین HbA1c',
-                        'تعداد ویزیت‌ها',
-                        'تعداد آزمایش‌ها',
-                        'امتیاز پایبندی'
-                    ],
-                    'مقدار': [
-                        f"{data['analytics'].avg_glucose:.1f}" if data['analytics'].avg_glucose else '-',
-                        f"{data['analytics'].min_glucose:.1f}" if data['analytics'].min_glucose else '-',
-                        f"{data['analytics'].max_glucose:.1f}" if data['analytics'].max_glucose else '-',
-                        f"{data['analytics'].avg_hba1c:.1f}" if data['analytics'].avg_hba1c else '-',
-                        data['analytics'].encounters_count,
-                        data['analytics'].lab_tests_count,
-                        f"{data['analytics'].compliance_score:.0f}" if data['analytics'].compliance_score else '-'
+        return file_path
+    
+    def _patient_sections(self, patient: Patient, data: Dict) -> List[ReportSection]:
+        """جدول‌های گزارش بیمار؛ آزمایش‌ها و داروها به صورت دسته‌ای از پایگاه داده خوانده می‌شوند"""
+        patient_info = [
+            ['نام و نام خانوادگی', patient.full_name],
+            ['کد ملی', patient.national_id or '-'],
+            ['تاریخ تولد', patient.dob.strftime('%Y-%m-%d') if patient.dob else '-'],
+            ['جنسیت', patient.get_sex_display() if patient.sex else '-'],
+            ['پزشک معالج', patient.primary_doctor.get_full_name() if patient.primary_doctor else '-'],
+        ]
+        sections = [
+            ReportSection('اطلاعات بیمار', ['عنوان', 'مقدار'], patient_info, column_widths=[24, 40]),
+            ReportSection(
+                'آزمایش‌ها',
+                ['تاریخ', 'LOINC', 'نتیجه', 'واحد'],
+                iter_rows(
+                    data['lab_results'],
+                    lambda result: [result.taken_at.strftime('%Y-%m-%d'), result.loinc, float(result.value), result.unit or '-']
+                ),
+            ),
+            ReportSection(
+                'داروها',
+                ['تاریخ شروع', 'تاریخ پایان', 'نام دارو', 'ATC', 'دوز', 'تناوب'],
+                iter_rows(
+                    data['medications'],
+                    lambda med: [
+                        med.start_date.strftime('%Y-%m-%d'),
+                        med.end_date.strftime('%Y-%m-%d') if med.end_date else '-',
+                        med.name, med.atc, med.dose, med.get_frequency_display()
                     ]
-                }
-                df_summary = pd.DataFrame(summary_data)
-                df_summary.to_excel(writer, sheet_name='خلاصه آماری', index=False)
-            
-            # قالب‌بندی
-            workbook = writer.book
-            for sheet_name in workbook.sheetnames:
-                worksheet = workbook[sheet_name]
-                
-                # تنظیم عرض ستون‌ها
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = get_column_letter(column[0].column)
-                    
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-                
-                # قالب‌بندی هدر
-                for cell in worksheet[1]:
-                    cell.font = Font(bold=True, color="FFFFFF")
-                    cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    cell.alignment = Alignment(horizontal="center", vertical="center")
+                ),
+            ),
+        ]
         
-        return file_path
+        analytics = data['analytics']
+        if analytics:
+            sections.append(ReportSection('خلاصه آماری', ['شاخص', 'مقدار'], [
+                ['میانگین قند خون', f"{analytics.avg_glucose:.1f}" if analytics.avg_glucose else '-'],
+                ['حداقل قند خون', f"{analytics.min_glucose:.1f}" if analytics.min_glucose else '-'],
+                ['حداکثر قند خون', f"{analytics.max_glucose:.1f}" if analytics.max_glucose else '-'],
+                ['میانگین HbA1c', f"{analytics.avg_hba1c:.1f}" if analytics.avg_hba1c else '-'],
+                ['تعداد ویزیت‌ها', analytics.encounters_count],
+                ['تعداد آزمایش‌ها', analytics.lab_tests_count],
+                ['امتیاز پایبندی', f"{analytics.compliance_score:.0f}" if analytics.compliance_score else '-'],
+            ], column_widths=[24, 18]))
+        
+        return sections
+    
+    def _generate_patient_excel(self, patient: Patient, data: Dict, report: Report) -> str:
+        """تولید Excel برای گزارش بیمار"""
+        file_path = self._report_file_path(f"patient_report_{patient.id}", 'xlsx')
+        return write_excel(file_path, self._patient_sections(patient, data))
+    
+    def _generate_patient_csv(self, patient: Patient, data: Dict, report: Report) -> str:
+        """تولید CSV برای گزارش بیمار"""
+        file_path = self._report_file_path(f"patient_report_{patient.id}", 'csv')
+        return write_csv(file_path, self._patient_sections(patient, data))
     
-    def _generate_doctor_performance(self, report: Report) -> str:
+    def _generate_doctor_performance(self, report: Report, prefetched: Optional[Dict] = None) -> str:
         """تولید گزارش عملکرد پزشک"""
         doctor = report.doctor
         if not doctor:
             raise ValueError("پزشک برای گزارش مشخص نشده است")
         
         # جمع‌آوری داده‌ها
-        data = self._collect_doctor_data(doctor, report.start_date, report.end_date)
+        data = self._collect_doctor_data(doctor, report.start_date, report.end_date, prefetched)
+        self._update_progress(report, 40)
         
         # تولید گزارش بر اساس فرمت
         if report.format == 'pdf':
@@ -416,29 +443,38 @@ class ReportGenerationService:
             return self._generate_doctor_csv(doctor, data, report)
     
     def _collect_doctor_data(self, doctor: DoctorProfile, start_date: Optional[datetime.date],
-                           end_date: Optional[datetime.date]) -> Dict:
-        """جمع‌آوری داده‌های عملکرد پزشک"""
+                           end_date: Optional[datetime.date], prefetched: Optional[Dict] = None) -> Dict:
+        """
+        جمع‌آوری داده‌های عملکرد پزشک
+        
+        prefetched می‌تواند شامل analytics_id (آخرین DoctorAnalytics) و histogram
+        (هیستوگرام کنترل دیابت) باشد که برای همه پزشکان یک‌جا محاسبه شده‌اند.
+        """
+        prefetched = prefetched or {}
         if not end_date:
             end_date = timezone.now().date()
         if not start_date:
             start_date = end_date - timedelta(days=30)
         
         # آنالیتیکس پزشک
-        latest_analytics = DoctorAnalytics.objects.filter(
-            doctor=doctor
-        ).order_by('-date').first()
+        if 'analytics_id' in prefetched:
+            latest_analytics = DoctorAnalytics.objects.filter(pk=prefetched['analytics_id']).first()
+        else:
+            latest_analytics = DoctorAnalytics.objects.filter(
+                doctor=doctor
+            ).order_by('-date').first()
         
-        # لیست بیماران
-        patients = Patient.objects.filter(primary_doctor=doctor)
+        # لیست بیماران (primary_doctor به کاربر پزشک اشاره می‌کند)
+        patients = Patient.objects.filter(primary_doctor=doctor.user).order_by('id')
         
         # ویزیت‌های دوره
         encounters = Encounter.objects.filter(
-            doctor=doctor,
-            encounter_date__range=[start_date, end_date]
-        ).select_related('patient')
+            created_by=doctor.user,
+            occurred_at__date__range=[start_date, end_date]
+        ).select_related('patient').order_by('-occurred_at')
         
         # نمودار توزیع بیماران
-        distribution_chart = self.doctor_service.get_patient_distribution_data(doctor)
+        distribution_chart = self.doctor_service.get_patient_distribution_data(doctor, prefetched.get('histogram'))
         
         return {
             'doctor': doctor,
@@ -450,10 +486,123 @@ class ReportGenerationService:
             'end_date': end_date
         }
     
+    def _generate_doctor_pdf(self, doctor: DoctorProfile, data: Dict, report: Report) -> str:
+        """تولید PDF برای گزارش عملکرد پزشک"""
+        file_path = self._report_file_path(f"doctor_report_{doctor.id}", 'pdf')
+        
+        doc = SimpleDocTemplate(file_path, pagesize=A4)
+        story = []
+        styles = getSampleStyleSheet()
+        
+        title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#2c3e50'),
+            spaceAfter=30,
+            alignment=TA_CENTER,
+            fontName=self.persian_font
+        )
+        
+        heading_style = ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            textColor=colors.HexColor('#34495e'),
+            spaceAfter=12,
+            fontName=self.persian_font
+        )
+        
+        # عنوان گزارش
+        story.append(Paragraph("گزارش عملکرد پزشک", title_style))
+        story.append(Spacer(1, 0.2*inch))
+        
+        # خلاصه عملکرد (همان جدول خروجی Excel/CSV)
+        summary = self._doctor_sections(doctor, data)[0]
+        summary_table = Table([list(summary.headers)] + [list(row) for row in summary.rows],
+                              colWidths=[3*inch, 3*inch])
+        summary_table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), self.persian_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#bdc3c7')),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#ecf0f1')]),
+        ]))
+        story.append(summary_table)
+        story.append(Spacer(1, 0.3*inch))
+        
+        # نمودار توزیع بیماران
+        self._update_progress(report, 60)
+        if report.metadata.get('include_charts', True):
+            story.append(Paragraph("توزیع بیماران بر اساس کنترل دیابت", heading_style))
+            
+            chart_path = self._create_distribution_chart(data['distribution_chart'])
+            if chart_path and os.path.exists(chart_path):
+                story.append(Image(chart_path, width=6*inch, height=3.75*inch))
+                story.append(Spacer(1, 0.2*inch))
+        
+        self._update_progress(report, 80)
+        doc.build(story)
+        
+        return file_path
+    
+    def _doctor_sections(self, doctor: DoctorProfile, data: Dict) -> List[ReportSection]:
+        """جدول‌های گزارش عملکرد پزشک"""
+        analytics = data['analytics']
+        summary = [['پزشک', doctor.user.get_full_name()], ['کد نظام پزشکی', doctor.medical_code or '-']]
+        if analytics:
+            summary += [
+                ['تعداد بیماران', analytics.total_patients],
+                ['بیماران فعال', analytics.active_patients],
+                ['تعداد ویزیت‌ها', analytics.total_encounters],
+                ['میانگین HbA1c بیماران', f"{analytics.avg_patient_hba1c:.1f}" if analytics.avg_patient_hba1c else '-'],
+                ['امتیاز عملکرد', analytics.performance_score],
+            ]
+        return [
+            ReportSection('خلاصه عملکرد', ['شاخص', 'مقدار'], summary, column_widths=[28, 30]),
+            ReportSection(
+                'توزیع کنترل دیابت',
+                ['وضعیت', 'تعداد بیماران'],
+                zip(data['distribution_chart']['labels'], data['distribution_chart']['datasets'][0]['data']),
+                column_widths=[20, 16],
+            ),
+            ReportSection(
+                'بیماران',
+                ['شناسه', 'نام', 'کد ملی', 'تاریخ ثبت'],
+                iter_rows(
+                    data['patients'],
+                    lambda patient: [patient.id, patient.full_name, patient.national_id or '-',
+                                     patient.created_at.strftime('%Y-%m-%d')]
+                ),
+            ),
+            ReportSection(
+                'ویزیت‌ها',
+                ['تاریخ', 'بیمار'],
+                iter_rows(
+                    data['encounters'],
+                    lambda encounter: [encounter.occurred_at.strftime('%Y-%m-%d %H:%M'), encounter.patient.full_name]
+                ),
+            ),
+        ]
+    
+    def _generate_doctor_excel(self, doctor: DoctorProfile, data: Dict, report: Report) -> str:
+        """تولید Excel برای گزارش عملکرد پزشک"""
+        file_path = self._report_file_path(f"doctor_report_{doctor.id}", 'xlsx')
+        return write_excel(file_path, self._doctor_sections(doctor, data))
+    
+    def _generate_doctor_csv(self, doctor: DoctorProfile, data: Dict, report: Report) -> str:
+        """تولید CSV برای گزارش عملکرد پزشک"""
+        file_path = self._report_file_path(f"doctor_report_{doctor.id}", 'csv')
+        return write_csv(file_path, self._doctor_sections(doctor, data))
+    
     def _generate_system_overview(self, report: Report) -> str:
         """تولید گزارش نمای کلی سیستم"""
         # جمع‌آوری داده‌ها
         data = self._collect_system_data(report.start_date, report.end_date)
+        self._update_progress(report, 40)
         
         # تولید گزارش بر اساس فرمت
         if report.format == 'pdf':
@@ -481,46 +630,150 @@ class ReportGenerationService:
         user_trend = self.system_service.get_trend_chart_data('users', 'month')
         patient_trend = self.system_service.get_trend_chart_data('patients', 'month')
         
+        # آمار روزانه سیستم و بیماران در بازه (برای خروجی جدولی)
+        history = SystemAnalytics.objects.filter(
+            date__range=[start_date, end_date]
+        ).order_by('date')
+        patient_analytics = PatientAnalytics.objects.filter(
+            date__range=[start_date, end_date]
+        ).order_by('date', 'patient_id')
+        
         return {
             'analytics': latest_analytics,
             'overview': overview_data,
             'user_trend': user_trend,
             'patient_trend': patient_trend,
+            'history': history,
+            'patient_analytics': patient_analytics,
             'start_date': start_date,
             'end_date': end_date
         }
     
-    def _create_glucose_chart(self, chart_data: Dict, patient_id: int) -> str:
-        """ایجاد نمودار قند خون"""
+    def system_sections(self, data: Dict, include_detailed_data: bool = False) -> List[ReportSection]:
+        """
+        جدول‌های گزارش نمای کلی سیستم.
+        
+        با include_detailed_data آنالیتیکس روزانه همه بیماران هم اضافه می‌شود؛ این جدول
+        با values_list و به صورت دسته‌ای خوانده می‌شود تا حجم آن روی حافظه اثر نگذارد.
+        """
+        overview = data['overview']
+        sections = [
+            ReportSection('نمای کلی', ['شاخص', 'مقدار'], [
+                ['تعداد بیماران', overview['total_patients']],
+                ['بیماران فعال', overview['active_patients']],
+                ['ویزیت‌های امروز', overview['total_encounters_today']],
+                ['هشدارهای در انتظار', overview['pending_alerts']],
+                ['میانگین HbA1c', round(overview['avg_hba1c'], 2)],
+                ['نرخ دستیابی به هدف', round(overview['goal_achievement_rate'], 2)],
+            ], column_widths=[24, 18]),
+            ReportSection(
+                'آمار روزانه سیستم',
+                ['تاریخ', 'کاربران', 'پزشکان', 'بیماران', 'ویزیت‌ها', 'آزمایش‌ها', 'کاربران فعال روزانه', 'میانگین HbA1c'],
+                iter_rows(
+                    data['history'].values_list(
+                        'date', 'total_users', 'total_doctors', 'total_patients',
+                        'total_encounters', 'total_lab_tests', 'daily_active_users', 'avg_system_hba1c'
+                    ),
+                    lambda row: [row[0].strftime('%Y-%m-%d'), *row[1:]]
+                ),
+            ),
+        ]
+        
+        if include_detailed_data:
+            sections.append(ReportSection(
+                'آنالیتیکس بیماران',
+                ['تاریخ', 'شناسه بیمار', 'میانگین قند خون', 'میانگین HbA1c', 'ویزیت‌ها', 'آزمایش‌ها', 'امتیاز پایبندی'],
+                iter_rows(
+                    data['patient_analytics'].values_list(
+                        'date', 'patient_id', 'avg_glucose', 'avg_hba1c',
+                        'encounters_count', 'lab_tests_count', 'compliance_score'
+                    ),
+                    lambda row: [row[0].strftime('%Y-%m-%d'), *row[1:]]
+                ),
+            ))
+        
+        return sections
+    
+    def _generate_system_excel(self, data: Dict, report: Report) -> str:
+        """تولید Excel برای گزارش نمای کلی سیستم"""
+        file_path = self._report_file_path('system_report', 'xlsx')
+        return write_excel(file_path, self.system_sections(data, report.metadata.get('include_detailed_data', False)))
+    
+    def _generate_system_csv(self, data: Dict, report: Report) -> str:
+        """تولید CSV برای گزارش نمای کلی سیستم"""
+        file_path = self._report_file_path('system_report', 'csv')
+        return write_csv(file_path, self.system_sections(data, report.metadata.get('include_detailed_data', False)))
+    
+    def _create_glucose_chart(self, chart_data: Dict, patient_id: int) -> Optional[str]:
+        """ایجاد نمودار قند خون (از کش در صورت تکرار همان داده‌ها)"""
         try:
-            plt.figure(figsize=(10, 6))
-            
-            # استخراج داده‌ها
-            for dataset in chart_data['datasets']:
-                x_values = [d['x'] for d in dataset['data']]
-                y_values = [d['y'] for d in dataset['data']]
-                
-                plt.plot(x_values, y_values, marker='o', label=dataset['label'])
-            
-            plt.xlabel('تاریخ')
-            plt.ylabel('قند خون (mg/dL)')
-            plt.title('روند قند خون')
-            plt.legend()
-            plt.grid(True, alpha=0.3)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-            # ذخیره نمودار
-            chart_path = os.path.join(settings.MEDIA_ROOT, 'charts', f'glucose_{patient_id}_{datetime.now().timestamp()}.png')
-            os.makedirs(os.path.dirname(chart_path), exist_ok=True)
-            plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-            plt.close()
-            
-            return chart_path
+            return self.chart_cache.get_or_render(
+                'glucose', chart_data, GLUCOSE_CHART_STYLE,
+                lambda path: self._render_chart(self._plot_glucose_chart, chart_data, GLUCOSE_CHART_STYLE, path)
+            )
+        except Exception as e:
+            print(f"Error creating chart: {e}")
+            return None
+    
+    def _create_distribution_chart(self, chart_data: Dict) -> Optional[str]:
+        """ایجاد نمودار توزیع بیماران بر اساس کنترل دیابت (از کش در صورت تکرار همان داده‌ها)"""
+        try:
+            return self.chart_cache.get_or_render(
+                'distribution', chart_data, DISTRIBUTION_CHART_STYLE,
+                lambda path: self._render_chart(self._plot_distribution_chart, chart_data, DISTRIBUTION_CHART_STYLE, path)
+            )
         except Exception as e:
             print(f"Error creating chart: {e}")
             return None
     
+    def _render_chart(self, plot, chart_data: Dict, style: Dict, path: str) -> None:
+        """
+        رسم و ذخیره یک نمودار با pyplot.
+        
+        pyplot وضعیت سراسری دارد و گزارش‌ها ممکن است همزمان در چند thread تولید شوند،
+        بنابراین رسم زیر قفل _PYPLOT_LOCK انجام می‌شود.
+        """
+        with _PYPLOT_LOCK:
+            try:
+                plt.figure(figsize=style['figsize'])
+                plot(chart_data, style)
+                plt.tight_layout()
+                plt.savefig(path, format='png', dpi=style['dpi'], bbox_inches='tight')
+            finally:
+                plt.close()
+    
+    def _plot_glucose_chart(self, chart_data: Dict, style: Dict) -> None:
+        for dataset in chart_data['datasets']:
+            x_values = [d['x'] for d in dataset['data']]
+            y_values = [d['y'] for d in dataset['data']]
+            
+            plt.plot(x_values, y_values, marker='o', label=dataset['label'])
+        
+        plt.xlabel(style['xlabel'])
+        plt.ylabel(style['ylabel'])
+        plt.title(style['title'])
+        plt.legend()
+        plt.grid(True, alpha=0.3)
+        plt.xticks(rotation=45)
+    
+    def _plot_distribution_chart(self, chart_data: Dict, style: Dict) -> None:
+        plt.bar(chart_data['labels'], chart_data['datasets'][0]['data'], color=style['colors'])
+        plt.ylabel(style['ylabel'])
+        plt.title(style['title'])
+        plt.grid(True, axis='y', alpha=0.3)
+    
+    def prerender_doctor_report_charts(self, doctor: DoctorProfile) -> int:
+        """
+        گرم کردن کش نمودارهای گزارش ماهانه یک پزشک پیش از اجرای زمان‌بندی شده.
+        
+        Returns:
+            int: تعداد نمودارهای آماده شده
+        """
+        rendered = 0
+        if self._create_distribution_chart(self.doctor_service.get_patient_distribution_data(doctor)):
+            rendered += 1
+        return rendered
+    
     def _get_glucose_status(self, value: Optional[float]) -> str:
         """تعیین وضعیت قند خون"""
         if not value:
@@ -0,0 +1,119 @@
+import csv
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+# تعداد ردیف‌هایی که هر بار از پایگاه داده خوانده می‌شود
+CHUNK_SIZE = 2000
+
+# عرض ستون‌ها در حالت write-only باید قبل از نوشتن ردیف‌ها مشخص شود
+DEFAULT_COLUMN_WIDTH = 18
+
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+
+
+@dataclass
+class ReportSection:
+    """
+    یک جدول از گزارش (یک برگه Excel یا یک بخش CSV).
+
+    rows یک iterable تنبل است و فقط یک بار هنگام نوشتن پیمایش می‌شود.
+    """
+    title: str
+    headers: Sequence[str]
+    rows: Iterable[Sequence[Any]]
+    column_widths: Optional[Sequence[int]] = None
+
+
+def iter_rows(queryset, row_builder: Callable[[Any], Sequence[Any]],
+              chunk_size: int = CHUNK_SIZE) -> Iterator[Sequence[Any]]:
+    """پیمایش queryset به صورت دسته‌ای بدون نگهداری کل نتایج در حافظه"""
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield row_builder(obj)
+
+
+class StreamingExcelWriter:
+    """
+    نوشتن فایل Excel در حالت write-only کتابخانه openpyxl.
+
+    ردیف‌ها به محض دریافت روی دیسک نوشته می‌شوند و مصرف حافظه به تعداد ردیف‌ها بستگی ندارد.
+    """
+
+    def __init__(self):
+        self.workbook = openpyxl.Workbook(write_only=True)
+
+    def add_section(self, section: ReportSection) -> int:
+        """افزودن یک برگه و بازگرداندن تعداد ردیف‌های داده نوشته شده"""
+        # نام برگه در Excel حداکثر 31 کاراکتر است
+        worksheet = self.workbook.create_sheet(title=section.title[:31])
+
+        widths = section.column_widths or [DEFAULT_COLUMN_WIDTH] * len(section.headers)
+        for index, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(index)].width = width
+
+        header = []
+        for title in section.headers:
+            cell = WriteOnlyCell(worksheet, value=title)
+            cell.font = HEADER_FONT
+            cell.fill = HEADER_FILL
+            cell.alignment = HEADER_ALIGNMENT
+            header.append(cell)
+        worksheet.append(header)
+
+        written = 0
+        for row in section.rows:
+            worksheet.append(list(row))
+            written += 1
+        return written
+
+    def save(self, file_path: str) -> None:
+        self.workbook.save(file_path)
+
+
+def write_excel(file_path: str, sections: Iterable[ReportSection]) -> str:
+    """نوشتن بخش‌های گزارش در یک فایل Excel"""
+    writer = StreamingExcelWriter()
+    for section in sections:
+        writer.add_section(section)
+    writer.save(file_path)
+    return file_path
+
+
+class _EchoBuffer:
+    """buffer ساختگی که مقدار نوشته شده را برمی‌گرداند تا csv.writer در یک generator استفاده شود"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(sections: Iterable[ReportSection]) -> Iterator[str]:
+    """
+    تولید خط به خط CSV از بخش‌های گزارش.
+
+    هر بخش با عنوان خودش شروع و با یک خط خالی از بخش بعدی جدا می‌شود.
+    خروجی را می‌توان مستقیماً به StreamingHttpResponse داد.
+    """
+    writer = csv.writer(_EchoBuffer())
+    # BOM برای نمایش درست حروف فارسی در Excel
+    yield '\ufeff'
+    for index, section in enumerate(sections):
+        if index:
+            yield writer.writerow([])
+        yield writer.writerow([section.title])
+        yield writer.writerow(section.headers)
+        for row in section.rows:
+            yield writer.writerow(row)
+
+
+def write_csv(file_path: str, sections: Iterable[ReportSection]) -> str:
+    """نوشتن بخش‌های گزارش در یک فایل CSV روی دیسک"""
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        for line in iter_csv(sections):
+            f.write(line)
+    return file_path
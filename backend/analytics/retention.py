@@ -0,0 +1,184 @@
+import gzip
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, QuerySet
+from django.db.models.deletion import Collector
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# مکث بین دسته‌ها تا قفل‌ها آزاد و WAL/replication فرصت هم‌گام شدن داشته باشند
+DEFAULT_PAUSE_SECONDS = 0.1
+
+
+def _older_versions_only(queryset: QuerySet) -> QuerySet:
+    """آخرین نسخه هر رکورد، هر قدر قدیمی، نگه داشته می‌شود"""
+    newer = queryset.model.objects.filter(
+        resource_type=OuterRef('resource_type'),
+        resource_id=OuterRef('resource_id'),
+        version__gt=OuterRef('version'),
+    )
+    return queryset.filter(Exists(newer))
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    سیاست نگهداری یک جدول: ردیف‌هایی که date_field آن‌ها قدیمی‌تر از days روز است حذف می‌شوند.
+
+    model به صورت 'app_label.ModelName' است؛ سیاست مدلی که در این پروژه نصب نیست با هشدار
+    در لاگ نادیده گرفته می‌شود.
+    scope در صورت وجود، ردیف‌های قابل حذف را محدودتر می‌کند.
+    opt_in: سیاست فقط با ورودی صریح در RETENTION_DAYS یا انتخاب با apply_retention --model اجرا
+    می‌شود (جداول غیر آنالیتیکس مانند لاگ ممیزی و تاریخچه نسخه‌ها).
+    """
+    model: str
+    date_field: str
+    days: int
+    scope: Optional[Callable[[QuerySet], QuerySet]] = None
+    opt_in: bool = False
+
+    def get_model(self) -> Optional[type]:
+        app_label, model_name = self.model.split('.')
+        try:
+            return apps.get_model(app_label, model_name)
+        except LookupError:
+            return None
+
+    def is_enabled(self) -> bool:
+        """آیا سیاست بدون انتخاب صریح جدول اجرا می‌شود"""
+        return not self.opt_in or self.model in getattr(settings, 'RETENTION_DAYS', {})
+
+    def get_days(self) -> int:
+        """روزهای نگهداری؛ با RETENTION_DAYS = {'app_label.Model': days} قابل تغییر است"""
+        return getattr(settings, 'RETENTION_DAYS', {}).get(self.model, self.days)
+
+    def get_queryset(self, model: type, now: datetime) -> QuerySet:
+        cutoff = now - timedelta(days=self.get_days())
+        if isinstance(model._meta.get_field(self.date_field), models.DateTimeField):
+            lookup = {f'{self.date_field}__lt': cutoff}
+        else:
+            lookup = {f'{self.date_field}__lt': timezone.localdate(cutoff)}
+        queryset = model.objects.filter(**lookup)
+        return self.scope(queryset) if self.scope else queryset
+
+
+RETENTION_POLICIES: List[RetentionPolicy] = [
+    RetentionPolicy('analytics.PatientAnalytics', 'date', 365),
+    RetentionPolicy('analytics.DoctorAnalytics', 'date', 365),
+    RetentionPolicy('analytics.SystemAnalytics', 'date', 365),
+    # لاگ ممیزی، تاریخچه نسخه‌ها و اعلان‌ها هرگز به طور پیش‌فرض حذف نمی‌شوند
+    RetentionPolicy('security.AuditLog', 'created_at', 365, opt_in=True),
+    RetentionPolicy('versioning.RecordVersion', 'changed_at', 730, scope=_older_versions_only, opt_in=True),
+    RetentionPolicy('notifications.Notification', 'created_at', 180, opt_in=True),
+]
+
+# سیاست‌های جداول آنالیتیکس؛ تنها سیاست‌هایی که cleanup_old_analytics اجرا می‌کند
+ANALYTICS_RETENTION_POLICIES: List[RetentionPolicy] = [
+    policy for policy in RETENTION_POLICIES if policy.model.startswith('analytics.')
+]
+
+
+class RetentionService:
+    """
+    حذف دسته‌ای داده‌های قدیمی بر اساس ترتیب کلید اصلی.
+
+    هر دسته با ORDER BY pk LIMIT روی ایندکس کلید اصلی انتخاب و در یک تراکنش کوتاه حذف
+    می‌شود (برای جداول بدون سیگنال حذف و وابستگی، با DELETE مستقیم)؛ در جداول فقط‌افزودنی ردیف‌های قدیمی در ابتدای ایندکس هستند و پیمایش از آخرین
+    کلید حذف شده ادامه می‌یابد. در صورت تعیین archive_dir، ردیف‌های هر دسته پیش از حذف در
+    فایل JSONL فشرده (gzip) همان جدول نوشته می‌شوند.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, pause: Optional[float] = None,
+                 archive_dir: Optional[str] = None):
+        self.batch_size = batch_size or getattr(settings, 'RETENTION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.pause = pause if pause is not None else getattr(settings, 'RETENTION_PAUSE_SECONDS', DEFAULT_PAUSE_SECONDS)
+        self.archive_dir = archive_dir
+
+    def run(self, policies: Iterable[RetentionPolicy] = RETENTION_POLICIES,
+            models_filter: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        اجرای سیاست‌ها؛ تعداد ردیف‌های حذف شده هر جدول برگردانده می‌شود
+
+        بدون models_filter فقط سیاست‌های فعال (is_enabled) اجرا می‌شوند؛ جدولی که صریحاً در
+        models_filter آمده، حتی اگر opt_in باشد، اجرا می‌شود.
+        """
+        now = timezone.now()
+        selected = set(models_filter) if models_filter else None
+        removed = {}
+        for policy in policies:
+            if selected is not None and policy.model not in selected:
+                continue
+            if selected is None and not policy.is_enabled():
+                continue
+            model = policy.get_model()
+            if model is None:
+                logger.warning(f"Retention policy for {policy.model} skipped: model is not installed")
+                continue
+            removed[policy.model] = self.purge(policy, model, now)
+        return removed
+
+    def purge(self, policy: RetentionPolicy, model: type, now: datetime) -> int:
+        queryset = policy.get_queryset(model, now)
+        # جدول بدون سیگنال حذف و وابستگی آبشاری با DELETE مستقیم و بدون Collector پاک می‌شود
+        raw = Collector(using=queryset.db, origin=None).can_fast_delete(queryset)
+        archive = None
+        total = 0
+        last_pk = None
+        try:
+            while True:
+                batch = queryset.order_by('pk')
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                if self.archive_dir:
+                    rows = list(batch.values()[:self.batch_size])
+                    pks = [row[model._meta.pk.attname] for row in rows]
+                else:
+                    rows = None
+                    pks = list(batch.values_list('pk', flat=True)[:self.batch_size])
+                if not pks:
+                    break
+
+                if rows:
+                    if archive is None:
+                        archive = self._open_archive(policy, now)
+                    for row in rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                    archive.flush()
+
+                with transaction.atomic():
+                    rows_to_delete = model._base_manager.filter(pk__in=pks)
+                    if raw:
+                        rows_to_delete._raw_delete(rows_to_delete.db)
+                    else:
+                        rows_to_delete.delete()
+
+                total += len(pks)
+                last_pk = pks[-1]
+                if len(pks) < self.batch_size:
+                    break
+                if self.pause:
+                    time.sleep(self.pause)
+        finally:
+            if archive is not None:
+                archive.close()
+
+        logger.info(f"Retention removed {total} rows from {policy.model}")
+        return total
+
+    def _open_archive(self, policy: RetentionPolicy, now: datetime):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{policy.model}-{now.strftime('%Y%m%d%H%M%S')}.jsonl.gz")
+        return gzip.open(path, 'at', encoding='utf-8')
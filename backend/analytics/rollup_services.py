@@ -0,0 +1,149 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder
+from notifications.models import ClinicalAlert
+from gitdm.models import DoctorProfile, PatientProfile
+from .models import DailyEntityCounter
+
+# موجودیت‌هایی که تعداد کل آن‌ها از جمع شمارنده‌ها محاسبه می‌شود
+TOTAL_ENTITIES = ['users', 'doctors', 'patients', 'encounters', 'lab_tests', 'medications', 'alerts']
+
+# موجودیت -> (queryset ردیف‌های موجود، فیلد تاریخ) برای پرکردن شمارنده‌ها از داده‌های قبلی.
+# سیگنال‌ها هم هر ردیف را در روز همین فیلد می‌شمارند (rollup_day) تا شمارنده‌های زنده و پرشده یکی باشند.
+BACKFILL_SOURCES = {
+    'users': (lambda: get_user_model().objects.filter(is_active=True), 'date_joined'),
+    'doctors': (lambda: DoctorProfile.objects.all(), 'user__date_joined'),
+    'patients': (lambda: PatientProfile.objects.all(), 'created_at'),
+    'encounters': (lambda: Encounter.objects.all(), 'occurred_at'),
+    'lab_tests': (lambda: LabResult.objects.all(), 'taken_at'),
+    'medications': (lambda: MedicationOrder.objects.all(), 'start_date'),
+    'alerts': (lambda: ClinicalAlert.objects.all(), 'created_at'),
+    'last_login': (lambda: get_user_model().objects.filter(last_login__isnull=False), 'last_login'),
+}
+
+
+def _to_day(value) -> Optional[date]:
+    """تبدیل مقدار تاریخ/زمان به روز تقویمی در منطقه زمانی جاری"""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.date()
+    return value
+
+
+def rollup_day(entity: str, instance) -> Optional[date]:
+    """روز شمارنده یک ردیف: روز همان فیلد تاریخی که backfill ردیف‌ها را بر اساس آن می‌شمارد"""
+    value = instance
+    for name in BACKFILL_SOURCES[entity][1].split('__'):
+        try:
+            value = getattr(value, name)
+        except ObjectDoesNotExist:
+            return None
+    return _to_day(value)
+
+
+class CounterRollupService:
+    """سرویس شمارنده‌های روزانه درج/حذف برای آمار کلی سیستم بدون COUNT(*) روی جداول بزرگ"""
+
+    def record(self, entity: str, day: Optional[date] = None, inserted: int = 0, deleted: int = 0) -> None:
+        """افزایش اتمیک شمارنده‌های یک موجودیت در یک روز"""
+        if not inserted and not deleted:
+            return
+        day = _to_day(day) or timezone.localdate()
+
+        counters = DailyEntityCounter.objects.filter(entity=entity, date=day)
+        changes = {
+            'inserted': F('inserted') + inserted,
+            'deleted': F('deleted') + deleted,
+            'updated_at': timezone.now(),
+        }
+        if counters.update(**changes):
+            return
+
+        try:
+            with transaction.atomic():
+                DailyEntityCounter.objects.create(entity=entity, date=day, inserted=inserted, deleted=deleted)
+        except IntegrityError:
+            # ردیف همزمان توسط درخواست دیگری ساخته شده است
+            counters.update(**changes)
+
+    def record_login(self, previous_login: Optional[datetime], current_login: Optional[datetime]) -> None:
+        """
+        ثبت ورود کاربر: درج در روز ورود فعلی و حذف از روز ورود قبلی.
+
+        ورود دوباره در همان روز تغییری ایجاد نمی‌کند.
+        """
+        previous_day = _to_day(previous_login)
+        current_day = _to_day(current_login)
+        if current_day is None or previous_day == current_day:
+            return
+        self.record('last_login', current_day, inserted=1)
+        if previous_day is not None:
+            self.record('last_login', previous_day, deleted=1)
+
+    def get_totals(self, as_of: Optional[date] = None,
+                   entities: Iterable[str] = TOTAL_ENTITIES) -> Dict[str, int]:
+        """تعداد کل هر موجودیت تا پایان روز as_of با یک کوئری گروهی"""
+        as_of = as_of or timezone.localdate()
+        totals = dict.fromkeys(entities, 0)
+        rows = DailyEntityCounter.objects.filter(
+            entity__in=list(totals), date__lte=as_of
+        ).values('entity').annotate(net=Sum(F('inserted') - F('deleted')))
+        for row in rows:
+            totals[row['entity']] = row['net'] or 0
+        return totals
+
+    def get_inserted(self, entity: str, start_date: date, end_date: date) -> int:
+        """تعداد درج‌های یک موجودیت در بازه [start_date, end_date]"""
+        return DailyEntityCounter.objects.filter(
+            entity=entity, date__range=[start_date, end_date]
+        ).aggregate(total=Sum('inserted'))['total'] or 0
+
+    def get_net(self, entity: str, start_date: date, end_date: date) -> int:
+        """جمع خالص (درج - حذف) یک موجودیت در بازه [start_date, end_date]"""
+        return DailyEntityCounter.objects.filter(
+            entity=entity, date__range=[start_date, end_date]
+        ).aggregate(total=Sum(F('inserted') - F('deleted')))['total'] or 0
+
+    def backfill(self, entities: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        بازسازی شمارنده‌ها از داده‌های موجود.
+
+        شمارنده‌های قبلی هر موجودیت حذف و تعداد ردیف‌های فعلی بر اساس روز فیلد تاریخ
+        BACKFILL_SOURCES به عنوان درج ثبت می‌شوند؛ حذف‌های قبل از پرکردن قابل بازسازی نیستند.
+
+        Returns:
+            Dict[str, int]: تعداد ردیف‌های شمارنده ساخته شده برای هر موجودیت
+        """
+        created = {}
+        for entity in entities or list(BACKFILL_SOURCES):
+            queryset_factory, date_field = BACKFILL_SOURCES[entity]
+            queryset = queryset_factory()
+
+            # فیلدهای DateField (مانند start_date دارو) نیازی به تبدیل ندارند
+            if '__' not in date_field and not isinstance(
+                    queryset.model._meta.get_field(date_field), models.DateTimeField):
+                queryset = queryset.annotate(day=F(date_field))
+            else:
+                queryset = queryset.annotate(day=TruncDate(date_field))
+
+            rows = [
+                DailyEntityCounter(entity=entity, date=row['day'], inserted=row['count'])
+                for row in queryset.order_by().values('day').annotate(count=Count('pk'))
+                if row['day'] is not None
+            ]
+            with transaction.atomic():
+                DailyEntityCounter.objects.filter(entity=entity).delete()
+                DailyEntityCounter.objects.bulk_create(rows, batch_size=1000)
+            created[entity] = len(rows)
+        return created
@@ -1,3 +1,4 @@
+from django.urls import reverse
 from rest_framework import serializers
 from .models import PatientAnalytics, DoctorAnalytics, SystemAnalytics, Report
 
@@ -145,19 +146,28 @@ class ReportSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
     doctor_name = serializers.CharField(source='doctor.user.get_full_name', read_only=True)
     duration = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Report
         fields = [
-            'id', 'report_type', 'format', 'status',
+            'id', 'report_type', 'format', 'status', 'progress',
             'requested_by', 'requested_by_name',
             'start_date', 'end_date',
             'patient', 'patient_name',
             'doctor', 'doctor_name',
-            'file_path', 'error_message', 'metadata',
-            'created_at', 'completed_at', 'duration'
+            'file_path', 'download_url', 'error_message', 'metadata',
+            'created_at', 'started_at', 'completed_at', 'duration'
         ]
-        read_only_fields = ['file_path', 'error_message', 'created_at', 'completed_at']
+        read_only_fields = ['file_path', 'error_message', 'progress', 'created_at', 'started_at', 'completed_at']
+    
+    def get_download_url(self, obj):
+        """لینک دانلود گزارش تکمیل شده"""
+        if obj.status != 'completed':
+            return None
+        url = reverse('analytics:reports-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
     
     def get_duration(self, obj):
         """محاسبه مدت زمان تولید گزارش"""
@@ -208,27 +218,27 @@ class ReportRequestSerializer(serializers.Serializer):
 
 
 class DashboardSummarySerializer(serializers.Serializer):
-    """سریالایزر برای خلاصه داشبورد"""
+    """سریالایزر برای خلاصه داشبورد (فیلدهایی که در خلاصه پزشک یا ادمین نیستند حذف می‌شوند)"""
     
     # آمار کلی
-    total_patients = serializers.IntegerField()
-    active_patients = serializers.IntegerField()
-    total_encounters_today = serializers.IntegerField()
-    pending_alerts = serializers.IntegerField()
+    total_patients = serializers.IntegerField(required=False)
+    active_patients = serializers.IntegerField(required=False)
+    total_encounters_today = serializers.IntegerField(required=False)
+    pending_alerts = serializers.IntegerField(required=False)
     
     # میانگین‌ها
-    avg_hba1c = serializers.FloatField()
-    avg_glucose = serializers.FloatField()
+    avg_hba1c = serializers.FloatField(required=False)
+    avg_glucose = serializers.FloatField(required=False)
     
     # روندها
-    patient_trend = TrendAnalysisSerializer()
-    hba1c_trend = TrendAnalysisSerializer()
-    glucose_trend = TrendAnalysisSerializer()
+    patient_trend = TrendAnalysisSerializer(required=False)
+    hba1c_trend = TrendAnalysisSerializer(required=False)
+    glucose_trend = TrendAnalysisSerializer(required=False)
     
     # توزیع‌ها
-    hba1c_distribution = serializers.DictField()
-    alert_distribution = serializers.DictField()
+    hba1c_distribution = serializers.DictField(required=False)
+    alert_distribution = serializers.DictField(required=False)
     
     # عملکرد
-    goal_achievement_rate = serializers.FloatField()
-    compliance_rate = serializers.FloatField()
\ No newline at end of file
+    goal_achievement_rate = serializers.FloatField(required=False)
+    compliance_rate = serializers.FloatField(required=False)
\ No newline at end of file
@@ -1,7 +1,8 @@
 import numpy as np
 from datetime import datetime, timedelta, date
 from typing import Dict, List, Optional, Tuple
-from django.db.models import Avg, Count, Sum, Q, F, Max, Min, StdDev
+from django.db.models import Avg, Count, Sum, Q, F, Max, Min, StdDev, FloatField, Exists, OuterRef, QuerySet, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
 from django.core.cache import cache
 
@@ -10,6 +11,30 @@ from laboratory.models import LabResult
 from pharmacy.models import MedicationOrder as Medication
 from notifications.models import ClinicalAlert
 from .models import PatientAnalytics, DoctorAnalytics, SystemAnalytics
+from .rollup_services import CounterRollupService
+from .cache_layer import RefreshingCache
+from .downsampling import downsample_indices
+from .lab_series import get_lab_series_store
+
+# کدهای LOINC مورد استفاده در محاسبات
+GLUCOSE_LOINC_CODES = ['2345-7', '2339-0', '1558-6']
+HBA1C_LOINC_CODES = ['4548-4', '17856-6']
+
+# مرزهای کنترل دیابت (عالی <7، خوب 7-8، متوسط 8-9، ضعیف >=9) و کش توزیع پنل پزشک
+HBA1C_CONTROL_BINS = [7, 8, 9]
+HBA1C_DISTRIBUTION_CACHE_PREFIX = 'analytics:hba1c_distribution:'
+HBA1C_DISTRIBUTION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# نمای کلی سیستم: 5 دقیقه تازه، و تا یک ساعت مقدار کهنه هنگام بازسازی سرو می‌شود
+SYSTEM_OVERVIEW_CACHE = RefreshingCache('system_overview_data', fresh_timeout=300, stale_timeout=3600)
+
+
+def _day_bounds(start_date: date, end_date: date) -> Tuple[datetime, datetime]:
+    """ابتدای روز start_date تا انتهای روز end_date در منطقه زمانی جاری"""
+    return (
+        timezone.make_aware(datetime.combine(start_date, datetime.min.time())),
+        timezone.make_aware(datetime.combine(end_date, datetime.max.time())),
+    )
 
 
 class AnalyticsService:
@@ -167,72 +192,344 @@ class PatientAnalyticsService:
     
     def _calculate_compliance_score(self, patient: Patient, start_date: date, end_date: date) -> float:
         """محاسبه امتیاز پایبندی به درمان"""
-        score = 100.0
-        
-        # کاهش امتیاز برای ویزیت‌های از دست رفته
-        expected_encounters = 1  # حداقل یک ویزیت در ماه
         actual_encounters = Encounter.objects.filter(
             patient=patient,
             occurred_at__range=[start_date, end_date]
         ).count()
         
-        if actual_encounters < expected_encounters:
-            score -= 20
-        
-        # کاهش امتیاز برای آزمایش‌های انجام نشده
-        # فرض: حداقل یک آزمایش HbA1c در 3 ماه
         last_hba1c = LabResult.objects.filter(
             patient=patient,
             loinc__in=['4548-4', '17856-6']
         ).order_by('-taken_at').first()
         
-        if last_hba1c:
-            days_since_last_hba1c = (timezone.now().date() - last_hba1c.taken_at.date()).days
+        # هشدارهای تایید نشده (acknowledged_at خالی)
+        unacknowledged_alerts = ClinicalAlert.objects.filter(
+            patient=patient,
+            acknowledged_at__isnull=True,
+            created_at__date__range=[start_date, end_date]
+        ).count()
+        
+        return self._compliance_score_from_inputs(
+            actual_encounters,
+            last_hba1c.taken_at if last_hba1c else None,
+            unacknowledged_alerts
+        )
+    
+    @staticmethod
+    def _compliance_score_from_inputs(actual_encounters: int, last_hba1c_at: Optional[datetime],
+                                      unacknowledged_alerts: int) -> float:
+        """محاسبه امتیاز پایبندی از ورودی‌های از پیش شمارش شده"""
+        score = 100.0
+        
+        # کاهش امتیاز برای ویزیت‌های از دست رفته
+        expected_encounters = 1  # حداقل یک ویزیت در ماه
+        if actual_encounters < expected_encounters:
+            score -= 20
+        
+        # کاهش امتیاز برای آزمایش‌های انجام نشده
+        # فرض: حداقل یک آزمایش HbA1c در 3 ماه
+        if last_hba1c_at:
+            days_since_last_hba1c = (timezone.now().date() - last_hba1c_at.date()).days
             if days_since_last_hba1c > 90:
                 score -= 15
         else:
             score -= 30
         
         # کاهش امتیاز برای هشدارهای بدون پاسخ
-        unacknowledged_alerts = ClinicalAlert.objects.filter(
-            patient=patient,
-            is_acknowledged=False,
-            created_at__date__range=[start_date, end_date]
-        ).count()
-        
         score -= min(unacknowledged_alerts * 5, 20)
         
         return max(0, score)
     
-    def get_glucose_chart_data(self, patient: Patient, period: str = 'month') -> Dict:
-        """داده‌های نمودار قند خون"""
-        start_date, end_date = self.analytics_service.get_date_range(period)
+    @staticmethod
+    def _compliance_scores_from_arrays(actual_encounters: np.ndarray, days_since_last_hba1c: np.ndarray,
+                                       unacknowledged_alerts: np.ndarray) -> np.ndarray:
+        """
+        نسخه برداری _compliance_score_from_inputs برای چند بیمار به صورت یکجا.
+        
+        days_since_last_hba1c برای بیماران بدون HbA1c برابر NaN است.
+        """
+        score = np.full(len(actual_encounters), 100.0)
+        score -= np.where(actual_encounters < 1, 20, 0)
+        score -= np.where(
+            np.isnan(days_since_last_hba1c),
+            30,
+            np.where(days_since_last_hba1c > 90, 15, 0)
+        )
+        score -= np.minimum(unacknowledged_alerts * 5, 20)
+        return np.maximum(score, 0)
+    
+    def calculate_compliance_scores(self, patient_ids: Optional[List[int]] = None,
+                                    doctor: Optional[DoctorProfile] = None,
+                                    target_date: Optional[date] = None) -> Dict[int, float]:
+        """
+        محاسبه امتیاز پایبندی برای گروهی از بیماران یا همه بیماران یک پزشک.
+        
+        سه ورودی امتیاز (تعداد ویزیت، آخرین HbA1c و هشدارهای تایید نشده) هر کدام با
+        یک کوئری گروهی خوانده می‌شوند و امتیازها با NumPy در یک مرحله محاسبه می‌شوند.
+        نتیجه با _calculate_compliance_score یکسان است.
+        
+        Returns:
+            Dict[int, float]: امتیاز پایبندی به ازای شناسه بیمار
+        """
+        if patient_ids is None and doctor is None:
+            raise ValueError("patient_ids یا doctor باید مشخص شود")
+        if not target_date:
+            target_date = timezone.now().date()
         
-        results = LabResult.objects.filter(
-            patient=patient,
-            loinc__in=['2345-7', '2339-0', '1558-6'],
-            taken_at__range=[start_date, end_date]
-        ).order_by('taken_at')
+        end_date = target_date
+        start_date = end_date - timedelta(days=30)
+        
+        if doctor is not None:
+            panel = Q(patient__primary_doctor=doctor.user)
+            if patient_ids is None:
+                patient_ids = list(
+                    Patient.objects.filter(primary_doctor=doctor.user).order_by('id').values_list('id', flat=True)
+                )
+        else:
+            panel = Q(patient_id__in=patient_ids)
+        
+        if not patient_ids:
+            return {}
+        
+        encounter_counts = self._group_by_patient(
+            Encounter.objects.filter(panel, occurred_at__range=[start_date, end_date]),
+            count=Count('id'),
+        )
+        last_hba1c = self._group_by_patient(
+            LabResult.objects.filter(panel, loinc__in=HBA1C_LOINC_CODES),
+            last_taken_at=Max('taken_at'),
+        )
+        unacknowledged = self._group_by_patient(
+            ClinicalAlert.objects.filter(
+                panel,
+                acknowledged_at__isnull=True,
+                created_at__date__range=[start_date, end_date]
+            ),
+            count=Count('id'),
+        )
+        
+        today = timezone.now().date()
+        days_since_last_hba1c = [
+            (today - last_hba1c[pid]['last_taken_at'].date()).days if pid in last_hba1c else np.nan
+            for pid in patient_ids
+        ]
+        scores = self._compliance_scores_from_arrays(
+            np.array([encounter_counts.get(pid, {}).get('count', 0) for pid in patient_ids]),
+            np.array(days_since_last_hba1c, dtype=float),
+            np.array([unacknowledged.get(pid, {}).get('count', 0) for pid in patient_ids]),
+        )
+        return dict(zip(patient_ids, scores.tolist()))
+    
+    # فیلدهایی که در حالت دسته‌ای بازنویسی می‌شوند
+    BULK_UPDATE_FIELDS = [
+        'avg_glucose', 'min_glucose', 'max_glucose', 'glucose_std_dev', 'glucose_trend',
+        'avg_hba1c', 'hba1c_trend',
+        'encounters_count', 'medications_count', 'lab_tests_count', 'alerts_count',
+        'compliance_score', 'updated_at',
+    ]
+    
+    def calculate_bulk_patient_analytics(self, patient_ids: Optional[List[int]] = None,
+                                         target_date: Optional[date] = None,
+                                         batch_size: int = 1000) -> int:
+        """
+        محاسبه دسته‌ای آمارهای بیماران با چند کوئری گروهی و upsert یکجا.
+        
+        نتایج با calculate_patient_analytics یکسان است، اما به جای حدود ده کوئری
+        برای هر بیمار، برای هر دسته از بیماران تعداد ثابتی کوئری GROUP BY اجرا می‌شود.
+        
+        Returns:
+            int: تعداد رکوردهای PatientAnalytics نوشته شده
+        """
+        if not target_date:
+            target_date = timezone.now().date()
+        
+        if patient_ids is None:
+            patient_ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+        
+        written = 0
+        for offset in range(0, len(patient_ids), batch_size):
+            chunk = patient_ids[offset:offset + batch_size]
+            rows = self._build_bulk_analytics(chunk, target_date)
+            PatientAnalytics.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['patient', 'date'],
+                update_fields=self.BULK_UPDATE_FIELDS,
+            )
+            written += len(rows)
+        
+        return written
+    
+    @staticmethod
+    def _group_by_patient(queryset, **aggregates) -> Dict[int, Dict]:
+        """اجرای یک کوئری GROUP BY روی patient_id و بازگرداندن نتایج به صورت dict"""
+        rows = queryset.order_by().values('patient_id').annotate(**aggregates)
+        return {row.pop('patient_id'): row for row in rows}
+    
+    def _build_bulk_analytics(self, patient_ids: List[int], target_date: date) -> List[PatientAnalytics]:
+        """ساخت رکوردهای PatientAnalytics (ذخیره نشده) برای یک دسته از بیماران"""
+        end_date = target_date
+        start_date = end_date - timedelta(days=30)
+        
+        labs = LabResult.objects.filter(patient_id__in=patient_ids)
+        
+        # آمارهای قند خون دوره جاری و قبلی
+        glucose_labs = labs.filter(loinc__in=GLUCOSE_LOINC_CODES)
+        glucose_stats = self._group_by_patient(
+            glucose_labs.filter(taken_at__range=[start_date, end_date]).exclude(value=0),
+            avg=Avg('value', output_field=FloatField()),
+            min=Min('value', output_field=FloatField()),
+            max=Max('value', output_field=FloatField()),
+            std=StdDev('value'),
+        )
+        previous_glucose = self._group_by_patient(
+            glucose_labs.filter(taken_at__range=[start_date - timedelta(days=30), start_date]),
+            avg=Avg('value'),
+        )
         
-        labels = []
-        fbs_data = []
-        rbs_data = []
-        ppbs_data = []
+        # آمارهای HbA1c دوره جاری و قبلی
+        hba1c_labs = labs.filter(loinc__in=HBA1C_LOINC_CODES)
+        hba1c_stats = self._group_by_patient(
+            hba1c_labs.filter(taken_at__range=[start_date - timedelta(days=90), end_date]).exclude(value=0),
+            avg=Avg('value', output_field=FloatField()),
+        )
+        previous_hba1c = self._group_by_patient(
+            hba1c_labs.filter(
+                taken_at__range=[start_date - timedelta(days=180), start_date - timedelta(days=90)]
+            ),
+            avg=Avg('value'),
+        )
+
+        # شمارش‌ها
+        encounter_counts = self._group_by_patient(
+            Encounter.objects.filter(patient_id__in=patient_ids, occurred_at__range=[start_date, end_date]),
+            count=Count('id'),
+        )
+        medication_counts = self._group_by_patient(
+            Medication.objects.filter(patient_id__in=patient_ids, start_date__range=[start_date, end_date]),
+            count=Count('id'),
+        )
+        lab_counts = self._group_by_patient(
+            labs.filter(taken_at__range=[start_date, end_date]),
+            count=Count('id'),
+        )
+        alerts = ClinicalAlert.objects.filter(
+            patient_id__in=patient_ids,
+            created_at__date__range=[start_date, end_date]
+        )
+        alert_counts = self._group_by_patient(alerts, count=Count('id'))
+        compliance_scores = self.calculate_compliance_scores(patient_ids, target_date=target_date)
         
-        for result in results:
-            date_str = result.taken_at.strftime('%Y-%m-%d')
-            if date_str not in labels:
-                labels.append(date_str)
+        rows = []
+        for patient_id in patient_ids:
+            analytics = PatientAnalytics(patient_id=patient_id, date=target_date)
+            
+            glucose = glucose_stats.get(patient_id)
+            if glucose:
+                analytics.avg_glucose = glucose['avg']
+                analytics.min_glucose = glucose['min']
+                analytics.max_glucose = glucose['max']
+                analytics.glucose_std_dev = glucose['std']
+                
+                previous = previous_glucose.get(patient_id, {}).get('avg')
+                if previous:
+                    analytics.glucose_trend = self.analytics_service.calculate_trend(
+                        analytics.avg_glucose,
+                        float(previous)
+                    )
+            
+            hba1c = hba1c_stats.get(patient_id)
+            if hba1c:
+                analytics.avg_hba1c = hba1c['avg']
+                
+                previous = previous_hba1c.get(patient_id, {}).get('avg')
+                if previous:
+                    analytics.hba1c_trend = self.analytics_service.calculate_trend(
+                        analytics.avg_hba1c,
+                        float(previous),
+                        threshold=3.0
+                    )
+            
+            analytics.encounters_count = encounter_counts.get(patient_id, {}).get('count', 0)
+            analytics.medications_count = medication_counts.get(patient_id, {}).get('count', 0)
+            analytics.lab_tests_count = lab_counts.get(patient_id, {}).get('count', 0)
+            analytics.alerts_count = alert_counts.get(patient_id, {}).get('count', 0)
             
-            value = float(result.value) if result.value else 0
+            analytics.compliance_score = compliance_scores[patient_id]
             
-            # Map LOINC codes to display labels
-            if result.loinc == '2345-7':  # FBS example
-                fbs_data.append({'x': date_str, 'y': value})
-            elif result.loinc == '2339-0':  # RBS example
-                rbs_data.append({'x': date_str, 'y': value})
-            elif result.loinc == '1558-6':  # PPBS example
-                ppbs_data.append({'x': date_str, 'y': value})
+            rows.append(analytics)
+        
+        return rows
+    
+    def get_latest_patient_analytics(self, patient_ids: List[int]) -> List[PatientAnalytics]:
+        """
+        آخرین رکورد آنالیتیکس هر بیمار با یک کوئری.
+        
+        ردیف‌ها با ROW_NUMBER روی پارتیشن patient_id (به ترتیب نزولی تاریخ)
+        رتبه‌بندی می‌شوند و فقط رتبه اول هر بیمار برگردانده می‌شود.
+        """
+        if not patient_ids:
+            return []
+        
+        return list(
+            PatientAnalytics.objects.filter(patient_id__in=patient_ids).annotate(
+                latest_rank=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('patient_id')],
+                    order_by=F('date').desc()
+                )
+            ).filter(latest_rank=1).select_related('patient').order_by('patient_id')
+        )
+    
+    def get_latest_patient_analytics_page(self, patients: QuerySet, after_patient_id: Optional[int] = None,
+                                          page_size: int = 100) -> Tuple[List[PatientAnalytics], Optional[int]]:
+        """
+        صفحه‌بندی cursor روی بیماران دارای آنالیتیکس (به ترتیب شناسه).
+        
+        هر صفحه فقط شناسه‌های بعد از cursor را با LIMIT می‌خواند، بنابراین
+        هزینه هر صفحه به اندازه پنل پزشک بستگی ندارد.
+        
+        Returns:
+            Tuple: (آخرین آنالیتیکس بیماران صفحه، شناسه آخرین بیمار برای صفحه بعد یا None)
+        """
+        page = patients.filter(
+            Exists(PatientAnalytics.objects.filter(patient=OuterRef('pk')))
+        )
+        if after_patient_id is not None:
+            page = page.filter(id__gt=after_patient_id)
+        
+        patient_ids = list(page.order_by('id').values_list('id', flat=True)[:page_size + 1])
+        next_cursor = patient_ids[page_size - 1] if len(patient_ids) > page_size else None
+        
+        return self.get_latest_patient_analytics(patient_ids[:page_size]), next_cursor
+    
+    def get_glucose_chart_data(self, patient: Patient, period: str = 'month',
+                               max_points: Optional[int] = None, method: str = 'lttb') -> Dict:
+        """
+        داده‌های نمودار قند خون.
+        
+        با max_points هر سری (FBS، RBS، PPBS) جداگانه با downsample_indices به حداکثر
+        max_points نقطه کاهش می‌یابد؛ قله‌ها و افت‌های قند حفظ می‌شوند.
+        """
+        start_date, end_date = self.analytics_service.get_date_range(period)
+        start, end = _day_bounds(start_date, end_date)
+        store = get_lab_series_store()
+        
+        # Map LOINC codes to display labels: FBS, RBS, PPBS
+        points = {}
+        for loinc in ['2345-7', '2339-0', '1558-6']:
+            series = store.get(patient, loinc).window(start, end)
+            values = np.nan_to_num(series.values)
+            indices = np.arange(len(series))
+            if max_points:
+                indices = downsample_indices(series.timestamps, values, max_points, method)
+            labels = series.date_labels()
+            points[loinc] = [{'x': labels[i], 'y': float(values[i])} for i in indices.tolist()]
+        
+        fbs_data = points['2345-7']
+        rbs_data = points['2339-0']
+        ppbs_data = points['1558-6']
+        labels = {point['x'] for data in points.values() for point in data}
         
         return {
             'labels': sorted(labels),
@@ -292,18 +589,13 @@ class PatientAnalyticsService:
         end_date = timezone.now().date()
         start_date = end_date - timedelta(days=365)
         
-        results = LabResult.objects.filter(
-            patient=patient,
-            loinc__in=['4548-4', '17856-6'],
-            taken_at__range=[start_date, end_date]
-        ).order_by('taken_at')
-        
-        data = []
-        for result in results:
-            data.append({
-                'x': result.taken_at.strftime('%Y-%m-%d'),
-                'y': float(result.value) if result.value else 0
-            })
+        series = get_lab_series_store().get_many(patient, HBA1C_LOINC_CODES).window(
+            *_day_bounds(start_date, end_date)
+        )
+        data = [
+            {'x': label, 'y': value}
+            for label, value in zip(series.date_labels(), np.nan_to_num(series.values).tolist())
+        ]
         
         return {
             'labels': [d['x'] for d in data],
@@ -377,13 +669,13 @@ class DoctorAnalyticsService:
             date=target_date
         )
         
-        # آمار بیماران
-        all_patients = Patient.objects.filter(primary_doctor=doctor)
+        # آمار بیماران (primary_doctor به کاربر پزشک اشاره می‌کند)
+        all_patients = Patient.objects.filter(primary_doctor=doctor.user)
         analytics.total_patients = all_patients.count()
         
         # بیماران فعال (حداقل یک ویزیت در 3 ماه گذشته)
         active_patients = all_patients.filter(
-            encounters__occurred_at__gte=end_date - timedelta(days=90)
+            encounter__occurred_at__gte=end_date - timedelta(days=90)
         ).distinct()
         analytics.active_patients = active_patients.count()
         
@@ -423,7 +715,7 @@ class DoctorAnalyticsService:
             created_at__date__range=[start_date, end_date]
         )
         analytics.total_alerts = all_alerts.count()
-        analytics.critical_alerts = all_alerts.filter(severity='critical').count()
+        analytics.critical_alerts = all_alerts.filter(severity='CRITICAL').count()
         
         # محاسبه امتیاز عملکرد
         analytics.performance_score = self._calculate_performance_score(analytics)
@@ -465,39 +757,72 @@ class DoctorAnalyticsService:
         
         return round(score, 2)
     
-    def get_patient_distribution_data(self, doctor: DoctorProfile) -> Dict:
-        """داده‌های توزیع بیماران بر اساس کنترل دیابت"""
-        patients = Patient.objects.filter(primary_doctor=doctor)
+    @staticmethod
+    def _patient_distribution_cache_key(doctor_user_id: int) -> str:
+        return f"{HBA1C_DISTRIBUTION_CACHE_PREFIX}{doctor_user_id}"
+    
+    @classmethod
+    def invalidate_patient_distribution(cls, doctor_user_id: Optional[int]) -> None:
+        """حذف هیستوگرام کش شده HbA1c پنل یک پزشک (شناسه کاربر پزشک)"""
+        if doctor_user_id is not None:
+            cache.delete(cls._patient_distribution_cache_key(doctor_user_id))
+    
+    def get_hba1c_control_histogram(self, doctor: DoctorProfile) -> List[int]:
+        """
+        تعداد بیماران پزشک در هر بازه کنترل دیابت بر اساس آخرین HbA1c.
+        
+        آخرین HbA1c همه بیماران پنل با یک کوئری (ROW_NUMBER روی هر بیمار) خوانده
+        و با NumPy دسته‌بندی می‌شود. نتیجه تا تغییر یک HbA1c از بیماران پزشک کش می‌شود.
+        """
+        # کش با تغییر داده‌ها حذف می‌شود (signals)، پس مقدار کهنه سرو نمی‌شود؛ فقط محاسبه تک‌پرواز است
+        histogram_cache = RefreshingCache(
+            self._patient_distribution_cache_key(doctor.user_id),
+            fresh_timeout=HBA1C_DISTRIBUTION_CACHE_TIMEOUT,
+            stale_timeout=0
+        )
+        return histogram_cache.get_or_compute(lambda: self._calculate_hba1c_control_histogram(doctor))
+    
+    def _calculate_hba1c_control_histogram(self, doctor: DoctorProfile) -> List[int]:
+        return self.calculate_hba1c_control_histograms([doctor.user_id])[doctor.user_id]
+    
+    def calculate_hba1c_control_histograms(self, doctor_user_ids: List[int]) -> Dict[int, List[int]]:
+        """
+        هیستوگرام کنترل دیابت چند پزشک (شناسه کاربر پزشک) با یک کوئری.
+        
+        آخرین HbA1c بیماران همه پزشکان با ROW_NUMBER خوانده و برای هر پزشک جداگانه دسته‌بندی می‌شود.
+        """
+        latest_values = LabResult.objects.filter(
+            patient__primary_doctor_id__in=doctor_user_ids,
+            loinc__in=HBA1C_LOINC_CODES
+        ).annotate(
+            latest_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('patient_id')],
+                order_by=[F('taken_at').desc(), F('id').desc()]
+            )
+        ).filter(latest_rank=1).values_list('patient__primary_doctor_id', 'value')
+        
+        values_by_doctor: Dict[int, List[float]] = {user_id: [] for user_id in doctor_user_ids}
+        for user_id, value in latest_values:
+            if value:
+                values_by_doctor[user_id].append(float(value))
         
-        distribution = {
-            'excellent': 0,  # HbA1c < 7
-            'good': 0,       # HbA1c 7-8
-            'fair': 0,       # HbA1c 8-9
-            'poor': 0        # HbA1c > 9
+        # بازه‌ها: <7، 7-8، 8-9، >=9
+        return {
+            user_id: np.bincount(np.digitize(np.array(values, dtype=float), HBA1C_CONTROL_BINS), minlength=4).tolist()
+            for user_id, values in values_by_doctor.items()
         }
-        
-        for patient in patients:
-            # آخرین HbA1c
-            latest_hba1c = LabResult.objects.filter(
-                test__patient=patient,
-                test__test_type='HBA1C'
-            ).order_by('-test__test_date').first()
-            
-            if latest_hba1c and latest_hba1c.value:
-                value = float(latest_hba1c.value)
-                if value < 7:
-                    distribution['excellent'] += 1
-                elif value < 8:
-                    distribution['good'] += 1
-                elif value < 9:
-                    distribution['fair'] += 1
-                else:
-                    distribution['poor'] += 1
+    
+    def get_patient_distribution_data(self, doctor: DoctorProfile, histogram: Optional[List[int]] = None) -> Dict:
+        """داده‌های توزیع بیماران بر اساس کنترل دیابت (histogram در صورت محاسبه قبلی داده می‌شود)"""
+        # excellent, good, fair, poor
+        if histogram is None:
+            histogram = self.get_hba1c_control_histogram(doctor)
         
         return {
             'labels': ['عالی (<7%)', 'خوب (7-8%)', 'متوسط (8-9%)', 'ضعیف (>9%)'],
             'datasets': [{
-                'data': list(distribution.values()),
+                'data': histogram,
                 'backgroundColor': [
                     'rgba(75, 192, 192, 0.8)',
                     'rgba(54, 162, 235, 0.8)',
@@ -529,14 +854,49 @@ class DoctorAnalyticsService:
         }
 
 
+    def get_compliance_distribution_data(self, doctor: DoctorProfile, target_date: Optional[date] = None) -> Dict:
+        """داده‌های توزیع امتیاز پایبندی بیماران پزشک"""
+        scores = PatientAnalyticsService().calculate_compliance_scores(doctor=doctor, target_date=target_date)
+        values = np.fromiter(scores.values(), dtype=float, count=len(scores))
+        
+        # بازه‌ها: <50، 50-70، 70-85، >=85
+        distribution = np.histogram(values, bins=[0, 50, 70, 85, 100.01])[0]
+        
+        return {
+            'labels': ['ضعیف (<50)', 'متوسط (50-70)', 'خوب (70-85)', 'عالی (≥85)'],
+            'datasets': [{
+                'label': 'تعداد بیماران',
+                'data': distribution.tolist(),
+                'backgroundColor': [
+                    'rgba(255, 99, 132, 0.8)',
+                    'rgba(255, 206, 86, 0.8)',
+                    'rgba(54, 162, 235, 0.8)',
+                    'rgba(75, 192, 192, 0.8)'
+                ],
+                'borderWidth': 1
+            }],
+            'chart_type': 'bar',
+            'options': {
+                'responsive': True,
+                'plugins': {
+                    'title': {
+                        'display': True,
+                        'text': 'توزیع امتیاز پایبندی بیماران'
+                    }
+                }
+            }
+        }
+
+
 class SystemAnalyticsService:
     """سرویس تحلیل داده‌های سیستم"""
     
     def __init__(self):
         self.analytics_service = AnalyticsService()
+        self.rollups = CounterRollupService()
     
     def calculate_system_analytics(self, target_date: Optional[date] = None) -> SystemAnalytics:
-        """محاسبه آمارهای کلی سیستم"""
+        """محاسبه و ذخیره آمارهای کلی سیستم"""
         if not target_date:
             target_date = timezone.now().date()
         
@@ -544,30 +904,21 @@ class SystemAnalyticsService:
         analytics, created = SystemAnalytics.objects.get_or_create(
             date=target_date
         )
-        
-        # آمار کاربران
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        
-        analytics.total_users = User.objects.filter(is_active=True).count()
-        analytics.total_doctors = DoctorProfile.objects.count()
-        analytics.total_patients = Patient.objects.count()
-        
-        # کاربران فعال (ورود در 30 روز گذشته)
-        analytics.active_users = User.objects.filter(
-            last_login__gte=timezone.now() - timedelta(days=30)
-        ).count()
-        
-        # کاربران فعال روزانه
-        analytics.daily_active_users = User.objects.filter(
-            last_login__date=target_date
-        ).count()
-        
-        # آمار داده‌ها
-        analytics.total_encounters = Encounter.objects.count()
-        analytics.total_lab_tests = LabResult.objects.count()
-        analytics.total_medications = Medication.objects.count()
-        analytics.total_alerts = ClinicalAlert.objects.count()
+        self._fill_system_analytics(analytics, target_date)
+        analytics.save()
+        return analytics
+    
+    def _fill_system_analytics(self, analytics: SystemAnalytics, target_date: date) -> SystemAnalytics:
+        """محاسبه آمارهای کلی سیستم روی analytics بدون ذخیره آن"""
+        # آمار کاربران و داده‌ها از جمع شمارنده‌های روزانه
+        totals = self.rollups.get_totals(target_date)
+        self._set_user_statistics(analytics, target_date, totals)
+        analytics.total_patients = totals['patients']
+        
+        analytics.total_encounters = totals['encounters']
+        analytics.total_lab_tests = totals['lab_tests']
+        analytics.total_medications = totals['medications']
+        analytics.total_alerts = totals['alerts']
         
         # میانگین HbA1c سیستم
         recent_hba1c = LabResult.objects.filter(
@@ -587,38 +938,58 @@ class SystemAnalyticsService:
         # شمارش تقریبی API calls (می‌توان از لاگ‌ها استفاده کرد)
         # فعلاً یک مقدار نمونه
         analytics.api_calls = 1000
-        
-        analytics.save()
         return analytics
     
-    def get_system_overview_data(self) -> Dict:
-        """خلاصه‌ای از وضعیت کلی سیستم"""
-        cache_key = 'system_overview_data'
-        cached_data = cache.get(cache_key)
+    def _set_user_statistics(self, analytics: SystemAnalytics, target_date: date,
+                             totals: Optional[Dict[str, int]] = None) -> None:
+        """محاسبه آمار کاربران و پزشکان سیستم از شمارنده‌های روزانه"""
+        if totals is None:
+            totals = self.rollups.get_totals(target_date, entities=['users', 'doctors'])
         
-        if cached_data:
-            return cached_data
+        analytics.total_users = totals['users']
+        analytics.total_doctors = totals['doctors']
         
+        # کاربران فعال (ورود در 30 روز گذشته): کاربرانی که آخرین ورودشان در این بازه است
+        today = timezone.localdate()
+        analytics.active_users = self.rollups.get_net('last_login', today - timedelta(days=30), today)
+        
+        # کاربران فعال روزانه
+        analytics.daily_active_users = self.rollups.get_inserted('last_login', target_date, target_date)
+    
+    def get_system_overview_data(self) -> Dict:
+        """
+        خلاصه‌ای از وضعیت کلی سیستم.
+        
+        پس از 5 دقیقه مقدار کهنه برگردانده و در پس‌زمینه بازسازی می‌شود؛ task
+        refresh_system_overview_cache آن را پیش از کهنه شدن تازه نگه می‌دارد.
+        """
+        return SYSTEM_OVERVIEW_CACHE.get_or_compute(self._calculate_system_overview_data)
+    
+    def refresh_system_overview_data(self) -> Dict:
+        """بازسازی نمای کلی سیستم در کش (برای task زمان‌بندی شده)"""
+        return SYSTEM_OVERVIEW_CACHE.refresh(self._calculate_system_overview_data)
+    
+    def _calculate_system_overview_data(self) -> Dict:
         today = timezone.now().date()
         
-        # آمار امروز
-        today_analytics = self.calculate_system_analytics(today)
+        # آمار امروز؛ فقط خواندنی، چون در مسیر درخواست GET اجرا می‌شود (ذخیره با calculate_daily_analytics)
+        today_analytics = self._fill_system_analytics(SystemAnalytics(date=today), today)
         
         # آمار هفته گذشته برای مقایسه
         week_ago = today - timedelta(days=7)
         week_ago_analytics = SystemAnalytics.objects.filter(date=week_ago).first()
         
-        # محاسبه روندها
+        # محاسبه روندها (تعداد هفته قبل از جمع شمارنده‌ها تا آن تاریخ)
+        week_ago_patients = self.rollups.get_totals(week_ago, entities=['patients'])['patients']
         patient_trend = {
             'current_value': today_analytics.total_patients,
-            'previous_value': week_ago_analytics.total_patients if week_ago_analytics else 0,
+            'previous_value': week_ago_patients,
             'change_percentage': 0,
             'trend': 'stable'
         }
         
-        if week_ago_analytics and week_ago_analytics.total_patients > 0:
-            change = ((today_analytics.total_patients - week_ago_analytics.total_patients) / 
-                     week_ago_analytics.total_patients) * 100
+        if week_ago_patients > 0:
+            change = ((today_analytics.total_patients - week_ago_patients) / week_ago_patients) * 100
             patient_trend['change_percentage'] = round(change, 2)
             patient_trend['trend'] = 'up' if change > 0 else 'down' if change < 0 else 'stable'
         
@@ -660,18 +1031,17 @@ class SystemAnalyticsService:
         }
         
         for item in alert_distribution:
-            alert_dist_dict[item['severity']] = item['count']
+            alert_dist_dict[item['severity'].lower()] = item['count']
         
         data = {
             'total_patients': today_analytics.total_patients,
             'active_patients': Patient.objects.filter(
-                encounters__occurred_at__gte=today - timedelta(days=30)
+                encounter__occurred_at__gte=today - timedelta(days=30)
             ).distinct().count(),
-            'total_encounters_today': Encounter.objects.filter(
-                occurred_at=today
-            ).count(),
+            'total_encounters_today': self.rollups.get_inserted('encounters', today, today),
             'pending_alerts': ClinicalAlert.objects.filter(
-                is_acknowledged=False
+                is_active=True,
+                acknowledged_at__isnull=True
             ).count(),
             'avg_hba1c': today_analytics.avg_system_hba1c or 0,
             'avg_glucose': 0,  # محاسبه میانگین قند خون امروز
@@ -694,35 +1064,41 @@ class SystemAnalyticsService:
             'compliance_rate': 0  # محاسبه نرخ پایبندی کلی
         }
         
-        # کش برای 5 دقیقه
-        cache.set(cache_key, data, 300)
-        
         return data
     
-    def get_trend_chart_data(self, metric: str, period: str = 'month') -> Dict:
-        """داده‌های نمودار روند برای متریک مشخص"""
+    def get_trend_chart_data(self, metric: str, period: str = 'month',
+                             max_points: Optional[int] = None, method: str = 'lttb') -> Dict:
+        """داده‌های نمودار روند برای متریک مشخص (با max_points به حداکثر همین تعداد نقطه کاهش می‌یابد)"""
         start_date, end_date = self.analytics_service.get_date_range(period)
         
         analytics = SystemAnalytics.objects.filter(
             date__range=[start_date, end_date]
         ).order_by('date')
         
-        labels = []
+        dates = []
         data = []
         
         for record in analytics:
-            labels.append(record.date.strftime('%Y-%m-%d'))
-            
             if metric == 'users':
-                data.append(record.total_users)
+                value = record.total_users
             elif metric == 'patients':
-                data.append(record.total_patients)
+                value = record.total_patients
             elif metric == 'encounters':
-                data.append(record.total_encounters)
+                value = record.total_encounters
             elif metric == 'hba1c':
-                data.append(record.avg_system_hba1c or 0)
+                value = record.avg_system_hba1c or 0
             elif metric == 'active_users':
-                data.append(record.daily_active_users)
+                value = record.daily_active_users
+            else:
+                continue
+            dates.append(record.date)
+            data.append(value)
+        
+        if max_points:
+            indices = downsample_indices([d.toordinal() for d in dates], data, max_points, method)
+            dates = [dates[i] for i in indices]
+            data = [data[i] for i in indices]
+        labels = [d.strftime('%Y-%m-%d') for d in dates]
         
         metric_labels = {
             'users': 'تعداد کاربران',
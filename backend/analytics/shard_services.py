@@ -0,0 +1,390 @@
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, FloatField, Max, Q, Sum
+from django.utils import timezone
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from notifications.models import ClinicalAlert
+from gitdm.models import PatientProfile as Patient
+from gitdm.models import DoctorProfile
+from .models import DoctorAnalytics, SystemAnalytics
+from .services import (
+    PatientAnalyticsService, DoctorAnalyticsService, SystemAnalyticsService, HBA1C_LOINC_CODES
+)
+from .aggregate_services import IncrementalAnalyticsService
+from .dashboard_services import DashboardSummaryService
+
+logger = logging.getLogger(__name__)
+
+# مدت نگهداری وضعیت پیشرفت هر اجرا در کش
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+DOCTOR_UPDATE_FIELDS = [
+    'total_patients', 'active_patients', 'new_patients', 'total_encounters',
+    'avg_encounters_per_patient', 'avg_patient_hba1c', 'patients_at_goal',
+    'patients_above_goal', 'total_alerts', 'critical_alerts', 'performance_score', 'updated_at',
+]
+
+
+def split_patient_id_ranges(shards: int) -> List[Tuple[int, int]]:
+    """تقسیم شناسه‌های بیماران به بازه‌های پیوسته با تعداد تقریباً برابر بیمار"""
+    ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+    if not ids:
+        return []
+
+    shards = max(1, min(shards, len(ids)))
+    size, remainder = divmod(len(ids), shards)
+    ranges = []
+    start = 0
+    for index in range(shards):
+        end = start + size + (1 if index < remainder else 0)
+        ranges.append((ids[start], ids[end - 1]))
+        start = end
+    return ranges
+
+
+def _progress_key(run_id: str, shard: Optional[str] = None) -> str:
+    key = f'analytics_shard_run:{run_id}'
+    return f'{key}:{shard}' if shard else key
+
+
+def register_run(run_id: str, ranges: List[Tuple[int, int]]) -> None:
+    """ثبت شاردهای یک اجرا تا get_run_progress کلید پیشرفت هر شارد را بشناسد"""
+    cache.set(_progress_key(run_id), [f'{start_id}-{end_id}' for start_id, end_id in ranges], PROGRESS_TIMEOUT)
+
+
+def get_run_progress(run_id: str) -> Dict:
+    """وضعیت پیشرفت همه شاردهای یک اجرا"""
+    keys = {shard: _progress_key(run_id, shard) for shard in cache.get(_progress_key(run_id), [])}
+    values = cache.get_many(list(keys.values()))
+    return {shard: values[key] for shard, key in keys.items() if key in values}
+
+
+def _report_progress(run_id: Optional[str], shard: str, **values) -> None:
+    # هر شارد فقط کلید خودش را می‌نویسد تا شاردهای موازی به‌روزرسانی یکدیگر را بازنویسی نکنند
+    if not run_id:
+        return
+    key = _progress_key(run_id, shard)
+    progress = cache.get(key, {})
+    progress.update(values)
+    cache.set(key, progress, PROGRESS_TIMEOUT)
+
+
+def _init_worker() -> None:
+    """راه‌اندازی Django در فرایند فرزند و رها کردن اتصال‌های به ارث رسیده"""
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _run_shard_in_worker(start_id: int, end_id: int, target_date: str, mode: str,
+                         run_id: Optional[str], batch_size: int) -> Dict:
+    try:
+        return ShardedAnalyticsService().run_shard(start_id, end_id, target_date, mode, run_id, batch_size)
+    finally:
+        connections.close_all()
+
+
+class ShardedAnalyticsService:
+    """
+    اجرای شارد‌شده آنالیتیکس روزانه.
+
+    شناسه‌های بیماران به چند بازه تقسیم می‌شوند و هر بازه (شارد) در یک فرایند
+    جداگانه یا یک تسک Celery پردازش می‌شود. هر شارد علاوه بر نوشتن PatientAnalytics،
+    مجموع‌های جزئی قابل ادغام برای پزشکان و کل سیستم برمی‌گرداند و مرحله reduce
+    از روی آن‌ها DoctorAnalytics و SystemAnalytics را می‌سازد.
+
+    خروجی شاردها فقط شامل انواع JSON است تا از طریق broker هم قابل انتقال باشد.
+    """
+
+    def __init__(self):
+        self.patient_service = PatientAnalyticsService()
+        self.doctor_service = DoctorAnalyticsService()
+        self.system_service = SystemAnalyticsService()
+
+    # ------------------------------------------------------------------
+    # Map
+    # ------------------------------------------------------------------
+
+    def run_shard(self, start_id: int, end_id: int, target_date, mode: str = 'bulk',
+                  run_id: Optional[str] = None, batch_size: int = 1000) -> Dict:
+        """پردازش یک شارد و بازگرداندن مجموع‌های جزئی"""
+        if isinstance(target_date, str):
+            target_date = date.fromisoformat(target_date)
+        shard = f'{start_id}-{end_id}'
+        started = time.monotonic()
+
+        patients = Patient.objects.filter(id__gte=start_id, id__lte=end_id)
+        patient_ids = list(
+            patients.filter(Q(user__isnull=True) | Q(user__is_active=True))
+            .order_by('id').values_list('id', flat=True)
+        )
+        incremental = IncrementalAnalyticsService()
+        if mode == 'incremental':
+            dirty = set(incremental.get_dirty_patient_ids(target_date))
+            patient_ids = [pid for pid in patient_ids if pid in dirty]
+
+        _report_progress(run_id, shard, status='running', total=len(patient_ids), processed=0, failed=[])
+
+        processed = 0
+        failed: List[int] = []
+        for offset in range(0, len(patient_ids), batch_size):
+            chunk = patient_ids[offset:offset + batch_size]
+            try:
+                if mode == 'incremental':
+                    incremental.rebuild_missing_buckets(chunk, batch_size)
+                    incremental.calculate_patient_analytics_from_buckets(chunk, target_date)
+                else:
+                    self.patient_service.calculate_bulk_patient_analytics(chunk, target_date)
+            except Exception as e:
+                logger.error(f"Analytics shard {shard} failed for patients {chunk[0]}-{chunk[-1]}: {e}")
+                failed.extend(chunk)
+            processed += len(chunk)
+            _report_progress(run_id, shard, processed=processed, failed=failed)
+
+        output = {
+            'shard': shard,
+            'patients': len(patient_ids),
+            'failed': failed,
+            'doctors': self._doctor_partials(patients, target_date),
+            'system': self._system_partials(patients, target_date),
+            'duration': round(time.monotonic() - started, 3),
+        }
+        _report_progress(
+            run_id, shard,
+            status='failed' if failed else 'completed',
+            duration=output['duration']
+        )
+        return output
+
+    def _doctor_partials(self, patients, target_date: date) -> Dict[str, Dict]:
+        """مجموع‌های جزئی آمار پزشکان برای بیماران این شارد (کلید: شناسه کاربر پزشک)"""
+        end_date = target_date
+        start_date = end_date - timedelta(days=30)
+        active_since = end_date - timedelta(days=90)
+        partials: Dict[str, Dict] = {}
+
+        def bucket(user_id) -> Dict:
+            return partials.setdefault(str(user_id), {
+                'total_patients': 0, 'active_patients': 0, 'new_patients': 0,
+                'total_encounters': 0, 'hba1c_sum': 0.0, 'hba1c_count': 0,
+                'patients_at_goal': 0, 'patients_above_goal': 0,
+                'total_alerts': 0, 'critical_alerts': 0,
+            })
+
+        assigned = patients.filter(primary_doctor__isnull=False).order_by()
+        for row in assigned.values('primary_doctor_id').annotate(
+            total=Count('id'),
+            new=Count('id', filter=Q(created_at__date__range=[start_date, end_date])),
+        ):
+            values = bucket(row['primary_doctor_id'])
+            values['total_patients'] += row['total']
+            values['new_patients'] += row['new']
+
+        active = assigned.filter(encounter__occurred_at__gte=active_since)
+        for row in active.values('primary_doctor_id').annotate(count=Count('id', distinct=True)):
+            bucket(row['primary_doctor_id'])['active_patients'] += row['count']
+
+        # همانند calculate_doctor_analytics: بیشترین مقدار HbA1c سه ماه اخیر هر بیمار فعال
+        recent_hba1c = LabResult.objects.filter(
+            patient__in=active.values('id'),
+            loinc__in=HBA1C_LOINC_CODES,
+            taken_at__gte=active_since
+        ).order_by().values('patient_id', 'patient__primary_doctor_id').annotate(
+            latest_value=Max('value', output_field=FloatField())
+        )
+        for row in recent_hba1c:
+            if not row['latest_value']:
+                continue
+            values = bucket(row['patient__primary_doctor_id'])
+            values['hba1c_sum'] += row['latest_value']
+            values['hba1c_count'] += 1
+            if row['latest_value'] < 7:
+                values['patients_at_goal'] += 1
+            else:
+                values['patients_above_goal'] += 1
+
+        alerts = ClinicalAlert.objects.filter(
+            patient__in=assigned.values('id'),
+            created_at__date__range=[start_date, end_date]
+        ).order_by()
+        for row in alerts.values('patient__primary_doctor_id').annotate(
+            total=Count('id'),
+            critical=Count('id', filter=Q(severity='CRITICAL')),
+        ):
+            values = bucket(row['patient__primary_doctor_id'])
+            values['total_alerts'] += row['total']
+            values['critical_alerts'] += row['critical']
+
+        # ویزیت‌ها بر اساس ثبت‌کننده شمارش می‌شوند، نه پزشک اصلی بیمار
+        encounters = Encounter.objects.filter(
+            patient__in=patients.values('id'),
+            occurred_at__range=[start_date, end_date]
+        ).order_by()
+        for row in encounters.values('created_by_id').annotate(count=Count('id')):
+            bucket(row['created_by_id'])['total_encounters'] += row['count']
+
+        return partials
+
+    def _system_partials(self, patients, target_date: date) -> Dict:
+        """مجموع‌های جزئی آمار سیستم برای بیماران این شارد"""
+        patient_ids = patients.values('id')
+        hba1c = LabResult.objects.filter(
+            patient__in=patient_ids,
+            loinc__in=HBA1C_LOINC_CODES,
+            taken_at__gte=target_date - timedelta(days=90)
+        ).exclude(value=0).aggregate(
+            total=Sum('value', output_field=FloatField()),
+            count=Count('id'),
+            at_goal=Count('id', filter=Q(value__lt=7)),
+        )
+        # تعداد کل موجودیت‌ها از شمارنده‌های روزانه خوانده می‌شود (_save_system_analytics)
+        return {
+            'hba1c_sum': hba1c['total'] or 0.0,
+            'hba1c_count': hba1c['count'],
+            'hba1c_at_goal': hba1c['at_goal'],
+        }
+
+    # ------------------------------------------------------------------
+    # Reduce
+    # ------------------------------------------------------------------
+
+    def reduce(self, shard_outputs: List[Dict], target_date) -> Dict:
+        """ادغام خروجی شاردها و محاسبه DoctorAnalytics و SystemAnalytics"""
+        if isinstance(target_date, str):
+            target_date = date.fromisoformat(target_date)
+
+        doctors: Dict[str, Dict] = {}
+        system: Dict[str, float] = {}
+        for output in shard_outputs:
+            for user_id, partial in output['doctors'].items():
+                merged = doctors.setdefault(user_id, {})
+                for key, value in partial.items():
+                    merged[key] = merged.get(key, 0) + value
+            for key, value in output['system'].items():
+                system[key] = system.get(key, 0) + value
+
+        doctor_rows = []
+        for doctor in DoctorProfile.objects.filter(user__is_active=True):
+            doctor_rows.append(self._build_doctor_analytics(doctor, doctors.get(str(doctor.user_id), {}), target_date))
+        DoctorAnalytics.objects.bulk_create(
+            doctor_rows,
+            update_conflicts=True,
+            unique_fields=['doctor', 'date'],
+            update_fields=DOCTOR_UPDATE_FIELDS,
+        )
+        # bulk_create سیگنال post_save ندارد
+        DashboardSummaryService.invalidate(row.doctor.user_id for row in doctor_rows)
+
+        system_analytics = self._save_system_analytics(system, target_date)
+
+        return {
+            'shards': len(shard_outputs),
+            'patients': sum(output['patients'] for output in shard_outputs),
+            'failed': [pid for output in shard_outputs for pid in output['failed']],
+            'doctors': len(doctor_rows),
+            'system_analytics_id': system_analytics.id,
+        }
+
+    def _build_doctor_analytics(self, doctor: DoctorProfile, totals: Dict, target_date: date) -> DoctorAnalytics:
+        analytics = DoctorAnalytics(doctor=doctor, date=target_date)
+        analytics.total_patients = totals.get('total_patients', 0)
+        analytics.active_patients = totals.get('active_patients', 0)
+        analytics.new_patients = totals.get('new_patients', 0)
+        analytics.total_encounters = totals.get('total_encounters', 0)
+
+        if analytics.active_patients > 0:
+            analytics.avg_encounters_per_patient = analytics.total_encounters / analytics.active_patients
+
+        if totals.get('hba1c_count'):
+            analytics.avg_patient_hba1c = totals['hba1c_sum'] / totals['hba1c_count']
+            analytics.patients_at_goal = totals['patients_at_goal']
+            analytics.patients_above_goal = totals['patients_above_goal']
+
+        analytics.total_alerts = totals.get('total_alerts', 0)
+        analytics.critical_alerts = totals.get('critical_alerts', 0)
+        analytics.performance_score = self.doctor_service._calculate_performance_score(analytics)
+        return analytics
+
+    def _save_system_analytics(self, totals: Dict, target_date: date) -> SystemAnalytics:
+        analytics, created = SystemAnalytics.objects.get_or_create(date=target_date)
+
+        counts = self.system_service.rollups.get_totals(target_date)
+        self.system_service._set_user_statistics(analytics, target_date, counts)
+        analytics.total_patients = counts['patients']
+        analytics.total_encounters = counts['encounters']
+        analytics.total_lab_tests = counts['lab_tests']
+        analytics.total_medications = counts['medications']
+        analytics.total_alerts = counts['alerts']
+
+        if totals.get('hba1c_count'):
+            analytics.avg_system_hba1c = totals['hba1c_sum'] / totals['hba1c_count']
+            analytics.system_goal_achievement = (totals['hba1c_at_goal'] / totals['hba1c_count']) * 100
+
+        analytics.api_calls = 1000
+        analytics.save()
+        return analytics
+
+    # ------------------------------------------------------------------
+    # اجرا
+    # ------------------------------------------------------------------
+
+    def run(self, target_date: Optional[date] = None, shards: Optional[int] = None,
+            workers: Optional[int] = None, mode: str = 'bulk', batch_size: int = 1000,
+            run_id: Optional[str] = None) -> Dict:
+        """
+        اجرای کامل map/reduce روی یک process pool محدود.
+
+        با workers=1 شاردها به ترتیب در همین فرایند اجرا می‌شوند (مناسب تست و SQLite).
+        """
+        if not target_date:
+            target_date = timezone.now().date()
+        workers = workers or getattr(settings, 'ANALYTICS_SHARD_WORKERS', None) or os.cpu_count() or 1
+        shards = shards or workers
+        run_id = run_id or uuid.uuid4().hex
+        ranges = split_patient_id_ranges(shards)
+        register_run(run_id, ranges)
+        date_str = target_date.isoformat()
+
+        outputs: List[Dict] = []
+        if workers <= 1 or len(ranges) <= 1:
+            for start_id, end_id in ranges:
+                outputs.append(self.run_shard(start_id, end_id, date_str, mode, run_id, batch_size))
+        else:
+            # اتصال‌های باز نباید به فرایندهای فرزند به ارث برسند
+            connections.close_all()
+            context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+                futures = {
+                    pool.submit(_run_shard_in_worker, start_id, end_id, date_str, mode, run_id, batch_size): (start_id, end_id)
+                    for start_id, end_id in ranges
+                }
+                crashed = []
+                for future in as_completed(futures):
+                    try:
+                        outputs.append(future.result())
+                    except Exception as e:
+                        start_id, end_id = futures[future]
+                        logger.error(f"Analytics shard {start_id}-{end_id} crashed: {e}")
+                        _report_progress(run_id, f'{start_id}-{end_id}', status='crashed', error=str(e))
+                        crashed.append((start_id, end_id))
+
+            # شاردهای از کار افتاده یک بار دیگر در همین فرایند اجرا می‌شوند؛
+            # reduce با خروجی ناقص آمار پزشکان را کمتر از واقع ثبت می‌کند
+            for start_id, end_id in crashed:
+                outputs.append(self.run_shard(start_id, end_id, date_str, mode, run_id, batch_size))
+
+        result = self.reduce(outputs, target_date)
+        result['run_id'] = run_id
+        return result
@@ -0,0 +1,268 @@
+import logging
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from encounters.models import Encounter
+from laboratory.models import LabResult
+from pharmacy.models import MedicationOrder
+from notifications.models import ClinicalAlert
+from django.contrib.auth import get_user_model
+
+from gitdm.models import DoctorProfile, PatientProfile
+from .cohort import CohortIndexService
+from .dashboard_services import DashboardSummaryService
+from .derived_services import PatientRefresh, RollupDelta
+from .lab_series import LabSeriesStore
+from .models import DoctorAnalytics
+from .rollup_services import BACKFILL_SOURCES, _to_day, rollup_day
+from .services import DoctorAnalyticsService, HBA1C_LOINC_CODES
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# مدل منبع -> (فیلد تاریخ، منبع ستون‌های ردیف تجمیع)
+TRACKED_MODELS = {
+    LabResult: ('taken_at', 'lab'),
+    Encounter: ('occurred_at', 'encounter'),
+    MedicationOrder: ('start_date', 'medication'),
+    ClinicalAlert: ('created_at', 'alert'),
+}
+
+# مدل -> موجودیت شمارنده روزانه
+ROLLUP_ENTITIES = {
+    PatientProfile: 'patients',
+    DoctorProfile: 'doctors',
+    Encounter: 'encounters',
+    LabResult: 'lab_tests',
+    MedicationOrder: 'medications',
+    ClinicalAlert: 'alerts',
+}
+
+
+@receiver(pre_save, sender=LabResult)
+@receiver(pre_save, sender=Encounter)
+@receiver(pre_save, sender=MedicationOrder)
+@receiver(pre_save, sender=ClinicalAlert)
+def remember_previous_analytics_state(sender, instance, raw=False, **kwargs):
+    """
+    نگهداری بیمار، روز، روز شمارنده و (برای آزمایش) کد LOINC قبلی رکورد ویرایش‌شده با یک کوئری،
+    تا اگر رکورد جابه‌جا شد یا از HbA1c تغییر کرد، ساختارهای مشتق قبلی هم به‌روز شوند
+    """
+    if raw or not instance.pk:
+        return
+    date_field, _ = TRACKED_MODELS[sender]
+    rollup_field = BACKFILL_SOURCES[ROLLUP_ENTITIES[sender]][1]
+    fields = {'patient_id', date_field, rollup_field} | ({'loinc'} if sender is LabResult else set())
+    previous = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if previous:
+        instance._analytics_previous = {
+            'patient_id': previous['patient_id'],
+            'day': _to_day(previous[date_field]),
+            'rollup_day': _to_day(previous[rollup_field]),
+            'loinc': previous.get('loinc'),
+        }
+
+
+def _schedule_refresh(sender, instance, previous=None):
+    """
+    زمان‌بندی بازسازی ساختارهای مشتق بیمار رکورد (و بیمار قبلی رکورد جابه‌جا شده) پس از commit
+    """
+    date_field, source = TRACKED_MODELS[sender]
+    current = {
+        'patient_id': instance.patient_id,
+        'day': _to_day(getattr(instance, date_field)),
+        'loinc': getattr(instance, 'loinc', None),
+    }
+    dashboard = sender in (Encounter, ClinicalAlert)
+    doctor_ids = [instance.created_by_id] if sender is Encounter else []
+
+    states = [current]
+    if previous and (previous['patient_id'], previous['day'], previous['loinc']) != (
+        current['patient_id'], current['day'], current['loinc']
+    ):
+        states.append(previous)
+
+    for state in states:
+        PatientRefresh.schedule(
+            state['patient_id'],
+            buckets=[(state['day'], source)],
+            hba1c=sender is LabResult and state['loinc'] in HBA1C_LOINC_CODES,
+            dashboard=dashboard,
+            doctor_ids=doctor_ids,
+        )
+
+
+@receiver(post_save, sender=LabResult)
+@receiver(post_save, sender=Encounter)
+@receiver(post_save, sender=MedicationOrder)
+@receiver(post_save, sender=ClinicalAlert)
+def refresh_derived_on_save(sender, instance, created=False, raw=False, **kwargs):
+    """
+    به‌روزرسانی ردیف تجمیع روزانه، شاخص cohort، کش توزیع HbA1c و خلاصه داشبورد
+    پس از ثبت یا ویرایش داده بالینی (یک بار برای هر بیمار پس از commit)
+    """
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_analytics_previous', None)
+    _schedule_refresh(sender, instance, previous)
+
+    if sender is LabResult:
+        # سری‌های زمانی فقط نسخه کش را جلو می‌برند و بدون تأخیر اعلام می‌شوند
+        LabSeriesStore.notify(instance.patient_id, inserted=created)
+        if previous and previous['patient_id'] != instance.patient_id:
+            LabSeriesStore.notify(previous['patient_id'], inserted=False)
+
+
+@receiver(post_delete, sender=LabResult)
+@receiver(post_delete, sender=Encounter)
+@receiver(post_delete, sender=MedicationOrder)
+@receiver(post_delete, sender=ClinicalAlert)
+def refresh_derived_on_delete(sender, instance, **kwargs):
+    """به‌روزرسانی ساختارهای مشتق بیمار پس از حذف داده بالینی"""
+    _schedule_refresh(sender, instance)
+    if sender is LabResult:
+        LabSeriesStore.notify(instance.patient_id, inserted=False)
+
+
+@receiver(pre_save, sender=PatientProfile)
+def remember_previous_primary_doctor(sender, instance, raw=False, **kwargs):
+    """نگهداری پزشک قبلی بیمار برای حذف کش توزیع هر دو پزشک در صورت انتقال بیمار"""
+    if raw or not instance.pk:
+        return
+    instance._previous_primary_doctor_id = PatientProfile.objects.filter(
+        pk=instance.pk
+    ).values_list('primary_doctor_id', flat=True).first()
+
+
+@receiver(post_save, sender=PatientProfile)
+def invalidate_hba1c_distribution_on_transfer(sender, instance, created=False, raw=False, **kwargs):
+    """
+    حذف کش توزیع HbA1c پزشکان قبلی و جدید وقتی بیمار به پزشک دیگری منتقل می‌شود
+    """
+    previous = getattr(instance, '_previous_primary_doctor_id', None)
+    if raw or created or previous == instance.primary_doctor_id:
+        return
+    DoctorAnalyticsService.invalidate_patient_distribution(previous)
+    DoctorAnalyticsService.invalidate_patient_distribution(instance.primary_doctor_id)
+
+
+@receiver(post_save, sender=PatientProfile)
+def invalidate_dashboard_summary_on_assignment(sender, instance, created=False, raw=False, **kwargs):
+    """باطل کردن خلاصه داشبورد پزشکان قبلی و جدید پس از ثبت یا انتقال بیمار"""
+    previous = getattr(instance, '_previous_primary_doctor_id', None)
+    if raw or (not created and previous == instance.primary_doctor_id):
+        return
+    DashboardSummaryService.invalidate([previous, instance.primary_doctor_id])
+
+
+@receiver(post_delete, sender=PatientProfile)
+def invalidate_dashboard_summary_on_patient_delete(sender, instance, **kwargs):
+    DashboardSummaryService.invalidate([instance.primary_doctor_id])
+
+
+@receiver(post_save, sender=DoctorAnalytics)
+def invalidate_dashboard_summary_on_analytics(sender, instance, raw=False, **kwargs):
+    """باطل کردن خلاصه داشبورد پس از محاسبه آنالیتیکس جدید پزشک"""
+    if raw:
+        return
+    DashboardSummaryService.invalidate(
+        DoctorProfile.objects.filter(pk=instance.doctor_id).values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_save, sender=Encounter)
+@receiver(post_save, sender=LabResult)
+@receiver(post_save, sender=MedicationOrder)
+@receiver(post_save, sender=ClinicalAlert)
+def count_rollup_insert(sender, instance, created=False, raw=False, **kwargs):
+    """
+    ثبت درج در شمارنده روزانه موجودیت در روز فیلد تاریخ ردیف (همان روز backfill)؛
+    اگر ویرایش روز ردیف را تغییر داده باشد، شمارش آن به روز جدید منتقل می‌شود
+    """
+    if raw:
+        return
+    entity = ROLLUP_ENTITIES[sender]
+    if created:
+        RollupDelta.schedule(entity, rollup_day(entity, instance), inserted=1)
+        return
+
+    previous = getattr(instance, '_analytics_previous', None)
+    if previous is None:
+        return
+    day = rollup_day(entity, instance)
+    if previous['rollup_day'] != day:
+        RollupDelta.schedule(entity, previous['rollup_day'], deleted=1)
+        RollupDelta.schedule(entity, day, inserted=1)
+
+
+@receiver(post_delete, sender=PatientProfile)
+@receiver(post_delete, sender=DoctorProfile)
+@receiver(post_delete, sender=Encounter)
+@receiver(post_delete, sender=LabResult)
+@receiver(post_delete, sender=MedicationOrder)
+@receiver(post_delete, sender=ClinicalAlert)
+def count_rollup_delete(sender, instance, **kwargs):
+    """ثبت حذف در شمارنده روزانه موجودیت (روز فیلد تاریخ ردیف)"""
+    entity = ROLLUP_ENTITIES[sender]
+    RollupDelta.schedule(entity, rollup_day(entity, instance), deleted=1)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_user_activity(sender, instance, raw=False, **kwargs):
+    """نگهداری وضعیت فعال بودن و آخرین ورود قبلی کاربر برای شمارنده‌های کاربران"""
+    if raw or not instance.pk:
+        return
+    instance._rollup_previous = User.objects.filter(pk=instance.pk).values('is_active', 'last_login').first()
+
+
+@receiver(post_save, sender=User)
+def count_user_rollups(sender, instance, created=False, raw=False, **kwargs):
+    """
+    به‌روزرسانی شمارنده کاربران فعال و آخرین ورود پس از ثبت، فعال/غیرفعال شدن یا ورود کاربر
+    """
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None) or {'is_active': False, 'last_login': None}
+    if created:
+        previous = {'is_active': False, 'last_login': None}
+
+    if instance.is_active != previous['is_active']:
+        # کاربران فعال مانند backfill در روز عضویت شمرده می‌شوند
+        if instance.is_active:
+            RollupDelta.schedule('users', rollup_day('users', instance), inserted=1)
+        else:
+            RollupDelta.schedule('users', rollup_day('users', instance), deleted=1)
+
+    previous_day, current_day = _to_day(previous['last_login']), _to_day(instance.last_login)
+    if current_day is not None and current_day != previous_day:
+        # همان قاعده CounterRollupService.record_login: ورود دوباره در همان روز تغییری ندارد
+        RollupDelta.schedule('last_login', current_day, inserted=1)
+        if previous_day is not None:
+            RollupDelta.schedule('last_login', previous_day, deleted=1)
+
+
+@receiver(post_delete, sender=User)
+def count_user_delete(sender, instance, **kwargs):
+    """حذف کاربر از شمارنده کاربران فعال و آخرین ورود"""
+    if instance.is_active:
+        RollupDelta.schedule('users', rollup_day('users', instance), deleted=1)
+    if instance.last_login:
+        RollupDelta.schedule('last_login', _to_day(instance.last_login), deleted=1)
+
+
+@receiver(post_save, sender=PatientProfile)
+def refresh_cohort_index_on_patient_save(sender, instance, raw=False, **kwargs):
+    """ثبت بیمار جدید در شاخص cohort و به‌روزرسانی پزشک معالج پس از انتقال"""
+    if raw:
+        return
+    PatientRefresh.schedule(instance.pk)
+
+
+@receiver(post_delete, sender=PatientProfile)
+def reset_cohort_index_on_patient_delete(sender, instance, **kwargs):
+    # ردیف شاخص با حذف آبشاری پاک شده؛ نسخه‌های درون حافظه باید کامل بارگذاری شوند
+    CohortIndexService.notify(reset=True)
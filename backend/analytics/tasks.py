@@ -1,11 +1,23 @@
+import os
+import uuid
+
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 from datetime import timedelta
 
-from .models import Report, PatientAnalytics, DoctorAnalytics, SystemAnalytics
+from .models import Report
 from .services import PatientAnalyticsService, DoctorAnalyticsService, SystemAnalyticsService
 from .report_service import ReportGenerationService
+from .report_jobs import ReportJobService, run_report_job
+from .aggregate_services import IncrementalAnalyticsService
+from .shard_services import ShardedAnalyticsService, register_run, split_patient_id_ranges
+from .retention import ANALYTICS_RETENTION_POLICIES, RetentionService
+from .alert_services import CriticalValueAlertService
+from .monthly_reports import MonthlyDoctorReportService
+from .cohort import CohortIndexService
 from gitdm.models import PatientProfile as Patient
 from gitdm.models import DoctorProfile
 
@@ -13,23 +25,42 @@ User = get_user_model()
 
 
 @shared_task
-def calculate_daily_analytics():
-    """محاسبه آنالیتیکس روزانه برای همه بیماران و پزشکان"""
+def calculate_daily_analytics(mode: str = 'incremental'):
+    """
+    محاسبه آنالیتیکس روزانه برای همه بیماران و پزشکان
+    
+    حالت‌ها:
+        incremental: فقط بیماران تغییر کرده، از روی جدول تجمیع روزانه
+        bulk: همه بیماران با کوئری‌های گروهی و upsert دسته‌ای
+        per_patient: مسیر قدیمی (محاسبه تک‌تک بیماران)
+    """
     today = timezone.now().date()
     
     # محاسبه آنالیتیکس بیماران
     patient_service = PatientAnalyticsService()
-    patients = Patient.objects.filter(is_active=True)
+    patients = Patient.objects.filter(Q(user__isnull=True) | Q(user__is_active=True))
     
-    for patient in patients:
+    if mode == 'incremental':
+        try:
+            IncrementalAnalyticsService().calculate_dirty_patient_analytics(today)
+        except Exception as e:
+            print(f"Error calculating incremental patient analytics: {e}")
+    elif mode == 'bulk':
+        patient_ids = list(patients.order_by('id').values_list('id', flat=True))
         try:
-            patient_service.calculate_patient_analytics(patient, today)
+            patient_service.calculate_bulk_patient_analytics(patient_ids, today)
         except Exception as e:
-            print(f"Error calculating analytics for patient {patient.id}: {e}")
+            print(f"Error calculating bulk patient analytics: {e}")
+    else:
+        for patient in patients:
+            try:
+                patient_service.calculate_patient_analytics(patient, today)
+            except Exception as e:
+                print(f"Error calculating analytics for patient {patient.id}: {e}")
     
     # محاسبه آنالیتیکس پزشکان
     doctor_service = DoctorAnalyticsService()
-    doctors = DoctorProfile.objects.filter(is_active=True)
+    doctors = DoctorProfile.objects.filter(user__is_active=True)
     
     for doctor in doctors:
         try:
@@ -47,6 +78,66 @@ def calculate_daily_analytics():
     return f"Analytics calculated for {patients.count()} patients and {doctors.count()} doctors"
 
 
+@shared_task
+def calculate_patient_analytics_shard(start_id: int, end_id: int, target_date: str,
+                                      mode: str = 'bulk', run_id: str = None):
+    """محاسبه آنالیتیکس یک شارد از بیماران (بازه شناسه‌ها)"""
+    return ShardedAnalyticsService().run_shard(start_id, end_id, target_date, mode, run_id)
+
+
+@shared_task
+def reduce_sharded_analytics(shard_outputs, target_date: str):
+    """ادغام خروجی شاردها و محاسبه آنالیتیکس پزشکان و سیستم"""
+    return ShardedAnalyticsService().reduce(shard_outputs, target_date)
+
+
+@shared_task
+def calculate_daily_analytics_sharded(shards: int = None, workers: int = None, mode: str = 'bulk'):
+    """
+    محاسبه آنالیتیکس روزانه به صورت شارد‌شده
+    
+    با broker واقعی، شاردها به صورت یک chord از تسک‌ها پخش می‌شوند و reduce پس از
+    پایان همه آن‌ها اجرا می‌شود؛ در غیر این صورت روی یک process pool محلی اجرا می‌شوند.
+    """
+    today = timezone.now().date()
+    
+    if getattr(settings, 'CELERY_BROKER_URL', None):
+        try:
+            from celery import chord, group
+        except ImportError:
+            chord = None
+        
+        if chord:
+            ranges = split_patient_id_ranges(shards or getattr(settings, 'ANALYTICS_SHARD_COUNT', 8))
+            run_id = uuid.uuid4().hex
+            register_run(run_id, ranges)
+            chord(group(
+                calculate_patient_analytics_shard.s(start_id, end_id, today.isoformat(), mode, run_id)
+                for start_id, end_id in ranges
+            ))(reduce_sharded_analytics.s(today.isoformat()))
+            return f"Dispatched {len(ranges)} analytics shards (run {run_id})"
+    
+    result = ShardedAnalyticsService().run(today, shards=shards, workers=workers, mode=mode)
+    return (
+        f"Analytics calculated for {result['patients']} patients in {result['shards']} shards "
+        f"and {result['doctors']} doctors ({len(result['failed'])} failed)"
+    )
+
+
+@shared_task
+def generate_report_job(report_id: int):
+    """تولید یک گزارش درخواست شده از طریق API (صف reports)"""
+    file_path = run_report_job(report_id)
+    return f"Report {report_id} generated: {file_path}" if file_path else f"Report {report_id} not generated"
+
+
+@shared_task
+def fail_stale_report_jobs():
+    """ناموفق علامت زدن گزارش‌هایی که job آن‌ها از دست رفته است (بیش از STALE_AFTER در صف)"""
+    failed = ReportJobService().fail_stale()
+    return f"Marked {failed} stale report jobs as failed"
+
+
 @shared_task
 def generate_scheduled_reports():
     """تولید گزارش‌های زمان‌بندی شده"""
@@ -54,6 +145,10 @@ def generate_scheduled_reports():
     if timezone.now().day == 1:
         generate_monthly_doctor_reports.delay()
     
+    # آماده‌سازی نمودارهای گزارش ماهانه در روز قبل
+    if (timezone.now() + timedelta(days=1)).day == 1:
+        prerender_monthly_report_charts.delay()
+    
     # گزارش‌های هفتگی سیستم
     if timezone.now().weekday() == 0:
         generate_weekly_system_report.delay()
@@ -62,45 +157,54 @@ def generate_scheduled_reports():
 
 
 @shared_task
-def generate_monthly_doctor_reports():
-    """تولید گزارش ماهانه برای همه پزشکان"""
+def prerender_monthly_report_charts():
+    """رسم پیشاپیش نمودارهای گزارش ماهانه پزشکان تا تولید گزارش‌ها از کش نمودار استفاده کند"""
     service = ReportGenerationService()
-    doctors = DoctorProfile.objects.filter(is_active=True)
+    rendered = 0
     
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=30)
+    for doctor in DoctorProfile.objects.filter(user__is_active=True).select_related('user'):
+        try:
+            rendered += service.prerender_doctor_report_charts(doctor)
+        except Exception as e:
+            print(f"Error pre-rendering charts for doctor {doctor.id}: {e}")
     
-    reports_created = 0
+    return f"Pre-rendered {rendered} report charts"
+
+
+@shared_task
+def generate_doctor_monthly_report(doctor_id: int, start_date: str, end_date: str,
+                                   run_id: str = None, prefetched: dict = None):
+    """تولید و ارسال گزارش ماهانه یک پزشک (با تلاش مجدد پس از خطا)"""
+    return MonthlyDoctorReportService().run_doctor(doctor_id, start_date, end_date, run_id, prefetched)
+
+
+@shared_task
+def generate_monthly_doctor_reports(workers: int = None):
+    """
+    تولید گزارش ماهانه برای همه پزشکان
     
-    for doctor in doctors:
+    داده‌های مشترک پزشکان یک بار جمع‌آوری می‌شود. با broker واقعی، گزارش هر پزشک یک
+    تسک از یک group است؛ در غیر این صورت گزارش‌ها روی یک process pool محلی تولید می‌شوند.
+    پیشرفت اجرا با get_monthly_reports_progress(run_id) قابل پیگیری است.
+    """
+    service = MonthlyDoctorReportService()
+    
+    if getattr(settings, 'CELERY_BROKER_URL', None):
         try:
-            # ایجاد گزارش
-            report = Report.objects.create(
-                report_type='doctor_performance',
-                format='pdf',
-                requested_by=doctor.user,
-                doctor=doctor,
-                start_date=start_date,
-                end_date=end_date,
-                metadata={
-                    'scheduled': True,
-                    'report_period': 'monthly'
-                }
-            )
-            
-            # تولید گزارش
-            service.generate_report(report)
-            
-            # ارسال ایمیل
-            if doctor.user.email:
-                service.send_report_email(report, [doctor.user.email])
-            
-            reports_created += 1
-            
-        except Exception as e:
-            print(f"Error generating report for doctor {doctor.id}: {e}")
+            from celery import group
+        except ImportError:
+            group = None
+        
+        if group:
+            run_id, args = service.plan()
+            group(generate_doctor_monthly_report.s(*doctor_args) for doctor_args in args).apply_async()
+            return f"Dispatched {len(args)} monthly doctor reports (run {run_id})"
     
-    return f"Generated {reports_created} monthly doctor reports"
+    result = service.run(workers=workers)
+    return (
+        f"Generated {result['completed']} monthly doctor reports "
+        f"({len(result['failed'])} failed, run {result['run_id']})"
+    )
 
 
 @shared_task
@@ -146,65 +250,53 @@ def generate_weekly_system_report():
 
 
 @shared_task
-def cleanup_old_analytics():
-    """پاکسازی داده‌های آنالیتیکس قدیمی"""
-    # حذف آنالیتیکس بیش از 1 سال
-    cutoff_date = timezone.now().date() - timedelta(days=365)
+def refresh_system_overview_cache():
+    """
+    بازسازی پیشگیرانه نمای کلی سیستم در کش.
     
-    deleted_counts = {
-        'patient': PatientAnalytics.objects.filter(date__lt=cutoff_date).delete()[0],
-        'doctor': DoctorAnalytics.objects.filter(date__lt=cutoff_date).delete()[0],
-        'system': SystemAnalytics.objects.filter(date__lt=cutoff_date).delete()[0],
-    }
+    باید کمتر از 5 دقیقه یک بار (مثلاً هر 4 دقیقه) اجرا شود تا درخواست‌های داشبورد همیشه مقدار تازه بگیرند.
+    """
+    SystemAnalyticsService().refresh_system_overview_data()
+    return "System overview cache refreshed"
+
+
+@shared_task
+def cleanup_old_analytics(archive: bool = False):
+    """
+    پاکسازی داده‌های آنالیتیکس قدیمی (ANALYTICS_RETENTION_POLICIES).
+    
+    جداول غیر آنالیتیکس (لاگ ممیزی، تاریخچه نسخه‌ها، اعلان‌ها) فقط با apply_retention پاک
+    می‌شوند. حذف در دسته‌های محدود انجام می‌شود؛ با archive=True ردیف‌ها پیش از حذف در
+    RETENTION_ARCHIVE_DIR (پیش‌فرض MEDIA_ROOT/retention) بایگانی می‌شوند.
+    """
+    archive_dir = None
+    if archive:
+        archive_dir = getattr(
+            settings, 'RETENTION_ARCHIVE_DIR', os.path.join(settings.MEDIA_ROOT, 'retention')
+        )
+    
+    deleted_counts = RetentionService(archive_dir=archive_dir).run(ANALYTICS_RETENTION_POLICIES)
     
     return f"Deleted old analytics: {deleted_counts}"
 
 
 @shared_task
 def check_critical_values():
-    """بررسی مقادیر بحرانی و ارسال هشدار"""
-    from notifications.models import ClinicalAlert
-    
-    # بررسی آخرین آنالیتیکس بیماران
-    recent_analytics = PatientAnalytics.objects.filter(
-        date=timezone.now().date()
-    ).select_related('patient')
-    
-    alerts_created = 0
-    
-    for analytics in recent_analytics:
-        # بررسی HbA1c بحرانی
-        if analytics.avg_hba1c and analytics.avg_hba1c > 10:
-            from notifications.models import ClinicalAlert
-            alert, created = ClinicalAlert.objects.get_or_create(
-                patient=analytics.patient,
-                alert_type='HIGH_HBA1C',
-                severity='critical',
-                defaults={
-                    'message': f'HbA1c بحرانی: {analytics.avg_hba1c}% - نیاز به اقدام فوری',
-                    'data': {'hba1c': analytics.avg_hba1c}
-                }
-            )
-            if created:
-                alerts_created += 1
-        
-        # بررسی قند خون بحرانی
-        if analytics.avg_glucose:
-            if analytics.avg_glucose < 50 or analytics.avg_glucose > 400:
-                from notifications.models import ClinicalAlert
-                alert, created = ClinicalAlert.objects.get_or_create(
-                    patient=analytics.patient,
-                    alert_type='HIGH_GLUCOSE' if analytics.avg_glucose > 400 else 'LOW_GLUCOSE',
-                    severity='critical',
-                    defaults={
-                        'message': f'قند خون بحرانی: {analytics.avg_glucose} mg/dL',
-                        'data': {'glucose': analytics.avg_glucose}
-                    }
-                )
-                if created:
-                    alerts_created += 1
-    
+    """بررسی مقادیر بحرانی آنالیتیکس‌های تغییر کرده از اجرای قبلی و ایجاد هشدار"""
+    alerts_created = CriticalValueAlertService().run()
     return f"Created {alerts_created} critical alerts"
 
 
+@shared_task
+def rebuild_cohort_index():
+    """
+    بازسازی شبانه شاخص cohort همه بیماران.
+    
+    سیگنال‌ها شاخص را پس از هر نوشتن به‌روز می‌کنند؛ این task شاخص‌های وابسته به زمان
+    (میانگین قند ۹۰ روز اخیر و داروهای پایان یافته) را جلو می‌برد.
+    """
+    written = CohortIndexService().rebuild()
+    return f"Rebuilt cohort index for {written} patients"
+
+
 # Celery beat schedule moved to env-driven settings if needed
\ No newline at end of file
@@ -1,7 +1,20 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+
+from django.test import TestCase, override_settings
+from django.core.management import call_command
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.core.cache import cache
+from django.db.models import QuerySet
 from datetime import timedelta
+from decimal import Decimal
 from rest_framework.test import APITestCase
 from rest_framework import status
 
@@ -10,7 +23,13 @@ from laboratory.models import LabResult
 from gitdm.models import PatientProfile as Patient
 from gitdm.models import DoctorProfile
 from .models import PatientAnalytics, DoctorAnalytics, SystemAnalytics, Report
+from .models import PatientDailyAggregate, DailyEntityCounter
 from .services import PatientAnalyticsService, DoctorAnalyticsService, SystemAnalyticsService
+from .aggregate_services import IncrementalAnalyticsService
+from .rollup_services import CounterRollupService
+from .report_jobs import ReportJobService
+from .report_service import ReportGenerationService
+from .shard_services import ShardedAnalyticsService, split_patient_id_ranges, get_run_progress
 
 User = get_user_model()
 
@@ -115,16 +134,17 @@ class SystemAnalyticsServiceTest(TestCase):
     def setUp(self):
         self.service = SystemAnalyticsService()
         
-        # ایجاد داده‌های تست
-        for i in range(3):
-            user = User.objects.create_user(email=f'doctor{i}@example.com', password='testpass123')
-            DoctorProfile.objects.create(
-                user=user,
-                medical_code=f'1234{i}'
-            )
-        
-        for i in range(10):
-            Patient.objects.create(full_name=f'بیمار{i} تست', national_id=f'123456789{i}')
+        # ایجاد داده‌های تست؛ شمارنده‌های روزانه پس از commit ثبت می‌شوند
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                user = User.objects.create_user(email=f'doctor{i}@example.com', password='testpass123')
+                DoctorProfile.objects.create(
+                    user=user,
+                    medical_code=f'1234{i}'
+                )
+            
+            for i in range(10):
+                Patient.objects.create(full_name=f'بیمار{i} تست', national_id=f'123456789{i}')
     
     def test_calculate_system_analytics(self):
         """تست محاسبه آنالیتیکس سیستم"""
@@ -135,6 +155,87 @@ class SystemAnalyticsServiceTest(TestCase):
         self.assertEqual(analytics.total_users, 3)  # فقط پزشکان کاربر دارند
 
 
+class CounterRollupTest(TestCase):
+    """تست‌های شمارنده‌های روزانه آمار سیستم"""
+    
+    def setUp(self):
+        self.rollups = CounterRollupService()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user(email='rollup@example.com', password='testpass123')
+            self.patients = [Patient.objects.create(full_name=f'بیمار{i} شمارنده') for i in range(4)]
+    
+    def test_totals_follow_inserts_deletes_and_deactivation(self):
+        """تعداد کل با درج، حذف و غیرفعال شدن کاربر به‌روز می‌شود"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patients[0].delete()
+            self.user.is_active = False
+            self.user.save()
+        
+        totals = self.rollups.get_totals()
+        self.assertEqual(totals['patients'], Patient.objects.count())
+        self.assertEqual(totals['users'], User.objects.filter(is_active=True).count())
+    
+    def test_login_counters(self):
+        """ورود در روز جدید کاربر فعال روزانه را افزایش می‌دهد و ورود تکراری نه"""
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now() - timedelta(days=40)
+            self.user.save()
+            self.user.last_login = timezone.now()
+            self.user.save()
+            self.user.last_login = timezone.now()
+            self.user.save()
+        
+        self.assertEqual(self.rollups.get_inserted('last_login', today, today), 1)
+        self.assertEqual(self.rollups.get_net('last_login', today - timedelta(days=30), today), 1)
+        
+        analytics = SystemAnalyticsService().calculate_system_analytics(today)
+        self.assertEqual(analytics.active_users, 1)
+        self.assertEqual(analytics.daily_active_users, 1)
+    
+    def test_backfill_matches_table_counts(self):
+        """پرکردن شمارنده‌ها از داده‌های موجود همان تعداد جداول را می‌دهد"""
+        DailyEntityCounter.objects.all().delete()
+        Patient.objects.filter(pk=self.patients[0].pk).update(created_at=timezone.now() - timedelta(days=10))
+        
+        call_command('backfill_counter_rollups', stdout=StringIO())
+        
+        totals = self.rollups.get_totals()
+        self.assertEqual(totals['patients'], 4)
+        self.assertEqual(totals['users'], 1)
+        week_ago = timezone.localdate() - timedelta(days=7)
+        self.assertEqual(self.rollups.get_totals(week_ago, entities=['patients'])['patients'], 1)
+    
+    def test_live_counters_use_backfill_dates(self):
+        """شمارنده‌های زنده هر ردیف را در همان روز backfill می‌شمارند، حتی پس از ویرایش تاریخ"""
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            encounter = Encounter.objects.create(patient=self.patients[1], created_by=self.user,
+                                                 occurred_at=now - timedelta(days=3))
+            lab = LabResult.objects.create(patient=self.patients[1], encounter=encounter, loinc='2345-7',
+                                           value=Decimal('120'), unit='mg/dL', taken_at=now - timedelta(days=10))
+            moved = LabResult.objects.create(patient=self.patients[1], encounter=encounter, loinc='2345-7',
+                                             value=Decimal('130'), unit='mg/dL', taken_at=now - timedelta(days=5))
+        with self.captureOnCommitCallbacks(execute=True):
+            lab.taken_at = now - timedelta(days=20)
+            lab.save()
+            moved.delete()
+        
+        def net_by_day():
+            return {
+                (row.entity, row.date): row.inserted - row.deleted
+                for row in DailyEntityCounter.objects.all()
+                if row.inserted != row.deleted
+            }
+        
+        live = net_by_day()
+        self.assertEqual(live[('lab_tests', timezone.localdate(now - timedelta(days=20)))], 1)
+        self.assertNotIn(('lab_tests', timezone.localdate(now - timedelta(days=10))), live)
+        
+        self.rollups.backfill()
+        self.assertEqual(live, net_by_day())
+
+
 class AnalyticsAPITest(APITestCase):
     """تست‌های API آنالیتیکس"""
     
@@ -197,4 +298,1619 @@ class AnalyticsAPITest(APITestCase):
             'patient_id': other_patient.id
         })
         
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class BatchAnalyticsAPITest(APITestCase):
+    """تست‌های API آخرین آنالیتیکس چند بیمار"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='batch@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.create(user=self.user, medical_code='11111')
+        other_user = User.objects.create_user(email='batch2@example.com', password='testpass123', is_doctor=True)
+        
+        today = timezone.now().date()
+        self.patients = []
+        for i in range(5):
+            patient = Patient.objects.create(full_name=f'بیمار{i} پنل', primary_doctor=self.user)
+            self.patients.append(patient)
+            for days_ago in [3, 1, 2]:
+                PatientAnalytics.objects.create(patient=patient, date=today - timedelta(days=days_ago))
+        self.latest_date = today - timedelta(days=1)
+        
+        # بیمار بدون آنالیتیکس و بیمار پزشک دیگر
+        Patient.objects.create(full_name='بیمار بدون آمار', primary_doctor=self.user)
+        self.other_patient = Patient.objects.create(full_name='بیمار دیگر', primary_doctor=other_user)
+        PatientAnalytics.objects.create(patient=self.other_patient, date=today)
+        
+        self.client.force_authenticate(user=self.user)
+    
+    def _get_ids(self, ids):
+        return self.client.get(
+            '/api/analytics/patient-analytics/batch_analytics/', {'patient_ids[]': ids}
+        )
+    
+    def test_latest_row_per_requested_patient(self):
+        """برای هر بیمار فقط آخرین رکورد برگردانده می‌شود"""
+        response = self._get_ids([p.id for p in self.patients] + [self.other_patient.id])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['patient'] for row in response.data], [p.id for p in self.patients])
+        self.assertTrue(all(row['date'] == self.latest_date.isoformat() for row in response.data))
+    
+    def test_query_count_does_not_grow_with_patients(self):
+        """تعداد کوئری‌ها به تعداد بیماران درخواستی بستگی ندارد"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as few:
+            self._get_ids([self.patients[0].id])
+        with CaptureQueriesContext(connection) as many:
+            self._get_ids([p.id for p in self.patients])
+        
+        self.assertEqual(len(few), len(many))
+    
+    def test_cursor_pagination_over_panel(self):
+        """پیمایش کل پنل پزشک با cursor"""
+        seen = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get('/api/analytics/patient-analytics/batch_analytics/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(row['patient'] for row in response.data['results'])
+            if not response.data['next_cursor']:
+                break
+            params['cursor'] = response.data['next_cursor']
+        
+        self.assertEqual(seen, [p.id for p in self.patients])
+    
+    def test_invalid_cursor(self):
+        """cursor نامعتبر خطای 400 می‌دهد"""
+        response = self.client.get('/api/analytics/patient-analytics/batch_analytics/', {'cursor': 'not-a-cursor'})
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REPORT_JOB_WORKERS=0, REPORT_MAX_ACTIVE_PER_USER=1)
+class ReportJobAPITest(APITestCase):
+    """تست‌های صف تولید گزارش"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='reports@example.com', password='testpass123', is_doctor=True)
+        self.client.force_authenticate(user=self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+    
+    def _fake_overview(self, report):
+        file_path = os.path.join(self.media_root, f'system_{report.pk}.csv')
+        with open(file_path, 'w') as f:
+            f.write('metric,value\n')
+        return file_path
+    
+    def test_create_returns_immediately_and_job_completes(self):
+        """ایجاد گزارش فقط آن را در صف قرار می‌دهد و وضعیت از طریق API قابل پیگیری است"""
+        with mock.patch.object(ReportGenerationService, '_generate_system_overview', autospec=True,
+                               side_effect=lambda service, report: self._fake_overview(report)):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/api/analytics/reports/', {
+                    'report_type': 'system_overview', 'format': 'csv'
+                })
+            
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['status'], 'pending')
+            self.assertEqual(response.data['progress'], 0)
+            self.assertIsNone(response.data['download_url'])
+            
+            report_id = response.data['id']
+            download = self.client.get(f'/api/analytics/reports/{report_id}/download/')
+            self.assertEqual(download.status_code, status.HTTP_202_ACCEPTED)
+            
+            for callback in callbacks:
+                callback()
+        
+        detail = self.client.get(f'/api/analytics/reports/{report_id}/')
+        self.assertEqual(detail.data['status'], 'completed')
+        self.assertEqual(detail.data['progress'], 100)
+        self.assertTrue(detail.data['download_url'].endswith(f'/reports/{report_id}/download/'))
+        
+        download = self.client.get(f'/api/analytics/reports/{report_id}/download/')
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        download.close()
+    
+    def test_failed_job_is_recorded(self):
+        """خطای تولید گزارش روی خود گزارش ثبت می‌شود"""
+        with mock.patch.object(ReportGenerationService, '_generate_system_overview',
+                               side_effect=RuntimeError('boom')):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/analytics/reports/', {
+                    'report_type': 'system_overview', 'format': 'csv'
+                })
+        
+        report = Report.objects.get(pk=response.data['id'])
+        self.assertEqual(report.status, 'failed')
+        self.assertEqual(report.error_message, 'boom')
+    
+    def test_per_user_concurrency_limit(self):
+        """کاربر بیش از سقف مجاز گزارش همزمان در صف ندارد"""
+        Report.objects.create(report_type='system_overview', format='csv', requested_by=self.user)
+        
+        response = self.client.post('/api/analytics/reports/', {
+            'report_type': 'system_overview', 'format': 'csv'
+        })
+        
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(Report.objects.count(), 1)
+    
+    def test_limit_is_enforced_when_saving(self):
+        """سقف گزارش‌های همزمان هنگام ذخیره گزارش بررسی می‌شود، نه در یک مرحله جدا"""
+        service = ReportJobService()
+        first = Report(report_type='system_overview', format='csv', requested_by=self.user)
+        second = Report(report_type='system_overview', format='csv', requested_by=self.user)
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(service.create(first))
+            self.assertFalse(service.create(second))
+        
+        self.assertIsNotNone(first.pk)
+        self.assertIsNone(second.pk)
+        self.assertEqual(len(callbacks), 1)
+    
+    def test_lost_jobs_are_failed_after_stale_period(self):
+        """job از دست رفته (ری‌استارت worker) پس از STALE_AFTER ناموفق می‌شود و دانلود دیگر 202 نمی‌دهد"""
+        from .tasks import fail_stale_report_jobs
+        
+        old = timezone.now() - timedelta(hours=2)
+        lost = Report.objects.create(report_type='system_overview', format='csv', requested_by=self.user)
+        interrupted = Report.objects.create(report_type='system_overview', format='csv', requested_by=self.user,
+                                            status='processing', started_at=old)
+        recent = Report.objects.create(report_type='system_overview', format='csv', requested_by=self.user)
+        Report.objects.filter(pk__in=[lost.pk, interrupted.pk]).update(created_at=old)
+        
+        download = self.client.get(f'/api/analytics/reports/{lost.pk}/download/')
+        self.assertEqual(download.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(download.data['status'], 'failed')
+        
+        self.assertEqual(fail_stale_report_jobs(), 'Marked 1 stale report jobs as failed')
+        interrupted.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(interrupted.status, 'failed')
+        self.assertEqual(recent.status, 'pending')
+    
+    @override_settings(CELERY_BROKER_URL='redis://localhost:6379/0')
+    def test_broker_dispatch_uses_task_delay(self):
+        """با broker تنظیم شده گزارش با delay به task فرستاده می‌شود (صف از CELERY_TASK_ROUTES)"""
+        from . import tasks
+        
+        with mock.patch.object(tasks.generate_report_job, 'delay', create=True) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/analytics/reports/', {
+                    'report_type': 'system_overview', 'format': 'csv'
+                })
+        
+        delay.assert_called_once_with(response.data['id'])
+
+
+class StreamingReportWriterTest(APITestCase):
+    """تست‌های خروجی جریانی Excel و CSV"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='export@example.com', password='testpass123', is_doctor=True)
+        self.client.force_authenticate(user=self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        
+        now = timezone.now()
+        self.patient = Patient.objects.create(full_name='بیمار خروجی', primary_doctor=self.user)
+        encounter = Encounter.objects.create(patient=self.patient, created_by=self.user, occurred_at=now)
+        LabResult.objects.bulk_create([
+            LabResult(patient=self.patient, encounter=encounter, loinc='2345-7',
+                      value=Decimal(100 + i), unit='mg/dL', taken_at=now - timedelta(hours=i))
+            for i in range(25)
+        ])
+    
+    def test_excel_writer_streams_generator_rows(self):
+        """برگه‌های Excel از generator نوشته می‌شوند و همه ردیف‌ها ذخیره می‌شوند"""
+        import openpyxl
+        from .report_writers import ReportSection, write_excel
+        
+        file_path = os.path.join(self.media_root, 'rows.xlsx')
+        rows = ((i, f'ردیف {i}') for i in range(5000))
+        write_excel(file_path, [ReportSection('داده', ['شماره', 'عنوان'], rows)])
+        
+        worksheet = openpyxl.load_workbook(file_path, read_only=True)['داده']
+        values = list(worksheet.values)
+        self.assertEqual(values[0], ('شماره', 'عنوان'))
+        self.assertEqual(len(values), 5001)
+        self.assertEqual(values[-1], (4999, 'ردیف 4999'))
+    
+    def test_patient_excel_and_csv_reports(self):
+        """گزارش بیمار در قالب Excel و CSV با همه آزمایش‌ها تولید می‌شود"""
+        import openpyxl
+        
+        with self.settings(MEDIA_ROOT=self.media_root):
+            for report_format in ['excel', 'csv']:
+                report = Report.objects.create(
+                    report_type='patient_summary', format=report_format,
+                    requested_by=self.user, patient=self.patient
+                )
+                file_path = ReportGenerationService().generate_report(report)
+                
+                if report_format == 'excel':
+                    worksheet = openpyxl.load_workbook(file_path, read_only=True)['آزمایش‌ها']
+                    self.assertEqual(len(list(worksheet.values)), 26)
+                else:
+                    with open(file_path, encoding='utf-8-sig') as f:
+                        content = f.read()
+                    self.assertEqual(content.count('2345-7'), 25)
+    
+    def test_export_streams_csv(self):
+        """اکشن export پاسخ CSV را به صورت جریانی برمی‌گرداند"""
+        response = self.client.get('/api/analytics/reports/export/', {
+            'report_type': 'patient_summary', 'patient_id': self.patient.id
+        })
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertEqual(content.count('2345-7'), 25)
+        self.assertIn('بیمار خروجی', content)
+        
+        PatientAnalytics.objects.create(patient=self.patient, date=timezone.now().date(), avg_glucose=112.0)
+        response = self.client.get('/api/analytics/reports/export/', {
+            'report_type': 'system_overview', 'include_detailed_data': 'true'
+        })
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('آنالیتیکس بیماران', content)
+        self.assertIn('112.0', content)
+
+
+class DownsamplingTest(APITestCase):
+    """تست‌های کاهش نقاط نمودارها"""
+    
+    def test_lttb_and_minmax_keep_spikes(self):
+        """هر دو روش تعداد نقاط را محدود و قله تیز را حفظ می‌کنند"""
+        from .downsampling import lttb_indices, minmax_indices
+        
+        x = np.arange(10000)
+        y = np.sin(x / 500.0) * 20 + 120
+        y[4321] = 400
+        
+        for method in (lttb_indices, minmax_indices):
+            indices = method(x, y, 200)
+            self.assertLessEqual(len(indices), 200)
+            self.assertIn(4321, indices)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+        
+        lttb = lttb_indices(x, y, 200)
+        self.assertEqual((lttb[0], lttb[-1]), (0, 9999))
+        self.assertEqual(list(lttb_indices(x[:50], y[:50], 200)), list(range(50)))
+    
+    def test_glucose_chart_api_bounds_points(self):
+        """نمودار قند خون با max_points محدود می‌شود و مقادیر حدی باقی می‌مانند"""
+        user = User.objects.create_user(email='cgm@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.create(user=user, medical_code='55555')
+        patient = Patient.objects.create(full_name='بیمار CGM', primary_doctor=user)
+        encounter = Encounter.objects.create(patient=patient, created_by=user, occurred_at=timezone.now())
+        now = timezone.now()
+        LabResult.objects.bulk_create([
+            LabResult(patient=patient, encounter=encounter, loinc='2339-0',
+                      value=Decimal(350 if i == 700 else 45 if i == 1500 else 110 + i % 7),
+                      unit='mg/dL', taken_at=now - timedelta(minutes=5 * i))
+            for i in range(2000)
+        ])
+        analytics = PatientAnalytics.objects.create(patient=patient, date=now.date())
+        self.client.force_authenticate(user=user)
+        
+        url = f'/api/analytics/patient-analytics/{analytics.pk}/glucose_chart/'
+        response = self.client.get(url, {'max_points': 100, 'method': 'minmax'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        values = [point['y'] for point in response.data['datasets'][1]['data']]
+        self.assertLessEqual(len(values), 100)
+        self.assertIn(350.0, values)
+        self.assertIn(45.0, values)
+        
+        self.assertEqual(len(self.client.get(url, {'max_points': 0}).data['datasets'][1]['data']), 2000)
+        self.assertEqual(self.client.get(url, {'max_points': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LabSeriesStoreTest(TestCase):
+    """تست‌های کش سری‌های زمانی آزمایش"""
+    
+    def setUp(self):
+        from .lab_series import LabSeriesStore
+        
+        cache.clear()
+        self.store = LabSeriesStore(max_series=2)
+        self.user = User.objects.create_user(email='series@example.com', password='testpass123', is_doctor=True)
+        self.patient = Patient.objects.create(full_name='بیمار سری زمانی', primary_doctor=self.user)
+        self.encounter = Encounter.objects.create(patient=self.patient, created_by=self.user, occurred_at=timezone.now())
+        self.now = timezone.now()
+    
+    def _lab(self, value, hours_ago, loinc='2345-7'):
+        return LabResult.objects.create(
+            patient=self.patient, encounter=self.encounter, loinc=loinc,
+            value=Decimal(value), unit='mg/dL', taken_at=self.now - timedelta(hours=hours_ago)
+        )
+    
+    def test_hot_series_served_without_queries(self):
+        """سری داغ بدون کوئری برگردانده و بر اساس زمان مرتب می‌شود"""
+        self._lab('150', 1)
+        self._lab('110', 5)
+        
+        series = self.store.get(self.patient, '2345-7')
+        self.assertEqual(series.values.tolist(), [110.0, 150.0])
+        
+        with self.assertNumQueries(0):
+            again = self.store.get(self.patient, '2345-7')
+        self.assertIs(again, series)
+        self.assertEqual(len(series.window(self.now - timedelta(hours=2))), 1)
+    
+    def test_new_labs_extend_series_and_edits_rebuild_it(self):
+        """آزمایش جدید به سری اضافه و ویرایش باعث بازسازی کامل می‌شود"""
+        first = self._lab('150', 3)
+        self.store.get(self.patient, '2345-7')
+        
+        self._lab('180', 4)
+        with self.assertNumQueries(2):
+            # ردیف‌های جدید و کنترل تعداد
+            series = self.store.get(self.patient, '2345-7')
+        self.assertEqual(series.values.tolist(), [180.0, 150.0])
+        
+        first.value = Decimal('90')
+        first.save()
+        self.assertEqual(self.store.get(self.patient, '2345-7').values.tolist(), [180.0, 90.0])
+        
+        first.delete()
+        self.assertEqual(self.store.get(self.patient, '2345-7').values.tolist(), [180.0])
+    
+    def test_lru_eviction(self):
+        """با عبور از سقف، سری کم‌استفاده‌تر حذف می‌شود"""
+        for loinc in ['2345-7', '2339-0', '1558-6']:
+            self.store.get(self.patient, loinc)
+        
+        self.assertEqual(self.store.get_stats()['series'], 2)
+        with self.assertNumQueries(1):
+            self.store.get(self.patient, '2345-7')
+
+
+class MonthlyDoctorReportTest(TestCase):
+    """تست‌های تولید موازی گزارش‌های ماهانه پزشکان"""
+    
+    def setUp(self):
+        self.doctors = []
+        for i in range(2):
+            user = User.objects.create_user(email=f'monthly{i}@example.com', password='testpass123', is_doctor=True)
+            self.doctors.append(DoctorProfile.objects.create(user=user, medical_code=f'7000{i}'))
+            patient = Patient.objects.create(full_name=f'بیمار ماهانه {i}', primary_doctor=user)
+            encounter = Encounter.objects.create(patient=patient, created_by=user, occurred_at=timezone.now())
+            LabResult.objects.create(
+                patient=patient, encounter=encounter, loinc='4548-4',
+                value=Decimal('6.5') + 2 * i, unit='%', taken_at=timezone.now()
+            )
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+    
+    def test_shared_histograms_match_per_doctor_calculation(self):
+        """هیستوگرام همه پزشکان با یک کوئری همان نتیجه محاسبه جداگانه است"""
+        from .monthly_reports import MonthlyDoctorReportService
+        
+        service = DoctorAnalyticsService()
+        with self.assertNumQueries(2):
+            shared = MonthlyDoctorReportService().collect_shared_data(self.doctors)
+        for doctor in self.doctors:
+            self.assertEqual(shared[doctor.id]['histogram'], service._calculate_hba1c_control_histogram(doctor))
+    
+    def test_failed_doctor_is_retried_without_duplicate_reports(self):
+        """خطای گزارش یک پزشک دوباره تلاش می‌شود و Report تکراری ساخته نمی‌شود"""
+        from django.core import mail
+        from .monthly_reports import MonthlyDoctorReportService, get_monthly_reports_progress
+        from .report_service import ReportGenerationService
+        
+        original = ReportGenerationService.generate_report
+        failures = {'remaining': 1}
+        
+        def flaky(service, report, prefetched=None):
+            if report.doctor_id == self.doctors[0].id and failures['remaining']:
+                failures['remaining'] -= 1
+                raise RuntimeError('اتصال قطع شد')
+            return original(service, report, prefetched)
+        
+        with self.settings(MEDIA_ROOT=self.media_root), \
+                mock.patch.object(ReportGenerationService, 'generate_report', flaky):
+            result = MonthlyDoctorReportService(retries=1, backoff=0).run(workers=1)
+            
+            self.assertEqual(result['completed'], 2)
+            self.assertEqual(result['failed'], [])
+            self.assertEqual(get_monthly_reports_progress(result['run_id']), {'total': 2, 'completed': 2, 'failed': 0})
+            self.assertEqual(Report.objects.filter(status='completed').count(), 2)
+            self.assertEqual(len(mail.outbox), 2)
+            
+            # اجرای مجدد همان دوره گزارش یا ایمیل تکراری نمی‌سازد
+            MonthlyDoctorReportService(retries=0).run(workers=1)
+            self.assertEqual(Report.objects.count(), 2)
+            self.assertEqual(len(mail.outbox), 2)
+
+    
+    def test_pool_progress_is_counted_by_parent(self):
+        """پیشرفت اجرای process pool در کش فرایند والد شمرده می‌شود، نه در کش فرزندان"""
+        from concurrent.futures import Future
+        from django.core.cache.backends.locmem import LocMemCache
+        from . import monthly_reports
+        
+        class ChildProcessPool:
+            """اجرای درون همین فرایند با کش جداگانه، مانند فرزند fork شده با LocMemCache"""
+            def __init__(self, *args, **kwargs):
+                pass
+            
+            def __enter__(self):
+                return self
+            
+            def __exit__(self, *exc_info):
+                return False
+            
+            def submit(self, fn, *args):
+                future = Future()
+                with mock.patch.object(monthly_reports, 'cache', LocMemCache('monthly-child', {})):
+                    future.set_result(fn(*args))
+                return future
+        
+        with self.settings(MEDIA_ROOT=self.media_root), \
+                mock.patch.object(monthly_reports, 'ProcessPoolExecutor', ChildProcessPool), \
+                mock.patch.object(monthly_reports.connections, 'close_all'):
+            result = monthly_reports.MonthlyDoctorReportService(retries=0).run(workers=2)
+        
+        self.assertEqual(result['completed'], 2)
+        self.assertEqual(monthly_reports.get_monthly_reports_progress(result['run_id']),
+                         {'total': 2, 'completed': 2, 'failed': 0})
+
+class AnalyticsBenchmarkTest(TestCase):
+    """تست‌های داده‌ساز و اجرای بنچمارک آنالیتیکس"""
+    
+    def _spec(self):
+        from .benchmark import DatasetSpec
+        return DatasetSpec(patients=20, lab_results=300, encounters=60, medications=40,
+                           patients_per_doctor=10, days=30, seed=7)
+    
+    def test_generator_is_seeded_and_realistic(self):
+        """داده‌ساز با seed یکسان همان توزیع را می‌سازد و جدول‌های مشتق را پر می‌کند"""
+        from pharmacy.models import MedicationOrder
+        from .benchmark import LAB_DISTRIBUTION, SyntheticClinicGenerator
+        
+        created = SyntheticClinicGenerator(self._spec(), stdout=lambda line: None).generate()
+        self.assertEqual(created['doctors'], 2)
+        self.assertEqual(LabResult.objects.count(), 300)
+        self.assertEqual(Encounter.objects.count(), 60)
+        self.assertEqual(MedicationOrder.objects.count(), 40)
+        self.assertTrue(set(LabResult.objects.values_list('loinc', flat=True)) <= set(LAB_DISTRIBUTION))
+        self.assertTrue(PatientDailyAggregate.objects.exists())
+        
+        first = list(LabResult.objects.order_by('id').values_list('loinc', 'value')[:300])
+        SyntheticClinicGenerator(self._spec(), stdout=lambda line: None).generate(rebuild_derived=False)
+        second = list(LabResult.objects.order_by('id').values_list('loinc', 'value')[300:])
+        self.assertEqual(first, second)
+    
+    def test_clear_removes_only_benchmark_data_without_signals(self):
+        """حذف داده‌های ساختگی بدون سیگنال، شمارنده‌ها را از نو می‌سازد و کش مشترک را پاک نمی‌کند"""
+        from .benchmark import SyntheticClinicGenerator, require_benchmark_database
+        from .models import PatientMetricIndex
+        
+        SyntheticClinicGenerator(self._spec(), stdout=lambda line: None).generate()
+        self.assertEqual(PatientMetricIndex.objects.count(), 20)
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = Patient.objects.create(full_name='بیمار واقعی')
+        cache.set('unrelated-key', 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            removed = SyntheticClinicGenerator.clear()
+        self.assertEqual((removed['patients'], removed['encounters'], removed['doctors']), (20, 60, 2))
+        self.assertEqual(list(Patient.objects.values_list('pk', flat=True)), [kept.pk])
+        self.assertFalse(LabResult.objects.exists())
+        self.assertEqual(list(PatientMetricIndex.objects.values_list('patient_id', flat=True)), [kept.pk])
+        self.assertEqual(CounterRollupService().get_totals()['patients'], 1)
+        self.assertFalse(DailyEntityCounter.objects.filter(deleted__gt=0).exists())
+        self.assertEqual(cache.get('unrelated-key'), 1)
+        
+        with self.settings(ALLOW_ANALYTICS_BENCHMARK=False):
+            from django.core.exceptions import ImproperlyConfigured
+            with self.assertRaises(ImproperlyConfigured):
+                require_benchmark_database()
+    
+    def test_run_and_compare_with_baseline(self):
+        """نتایج هر سناریو زمان و تعداد کوئری دارد و کندی یا کوئری بیشتر پسرفت است"""
+        from .benchmark import AnalyticsBenchmark, SyntheticClinicGenerator
+        
+        SyntheticClinicGenerator(self._spec(), stdout=lambda line: None).generate()
+        benchmark = AnalyticsBenchmark(repeat=1, tolerance=0.2)
+        results = benchmark.run(only=['system_overview[cold]', 'dashboard_summary[cold]', 'doctor_report[csv]'])
+        
+        self.assertEqual(set(results['results']), {'system_overview[cold]', 'dashboard_summary[cold]', 'doctor_report[csv]'})
+        self.assertEqual(results['meta']['rows']['lab_results'], 300)
+        for result in results['results'].values():
+            self.assertGreater(result['queries'], 0)
+        self.assertFalse(Report.objects.exists())
+        
+        self.assertFalse(any(row['regression'] for row in benchmark.compare(results, results)))
+        
+        faster = {'results': {name: dict(result, median=result['median'] / 10)
+                              for name, result in results['results'].items()}}
+        fewer_queries = {'results': {name: dict(result, queries=result['queries'] - 1)
+                                     for name, result in results['results'].items()}}
+        self.assertTrue(all(row['regression'] for row in benchmark.compare(results, faster)))
+        self.assertTrue(all(row['regression'] for row in benchmark.compare(results, fewer_queries)))
+
+
+class CriticalValueAlertTest(TestCase):
+    """تست‌های بررسی مجموعه‌ای مقادیر بحرانی"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='critical@example.com', password='testpass123', is_doctor=True)
+        self.patients = [
+            Patient.objects.create(full_name=f'بیمار {i}', primary_doctor=self.user) for i in range(3)
+        ]
+        today = timezone.now().date()
+        PatientAnalytics.objects.create(patient=self.patients[0], date=today, avg_hba1c=11.5)
+        PatientAnalytics.objects.create(patient=self.patients[1], date=today, avg_glucose=450, avg_hba1c=6.5)
+        PatientAnalytics.objects.create(patient=self.patients[2], date=today, avg_glucose=120, avg_hba1c=6.0)
+    
+    def test_creates_alerts_once_and_only_for_changed_rows(self):
+        """هشدار فقط یک بار ساخته می‌شود و اجرای بعدی فقط ردیف‌های تغییر کرده را می‌خواند"""
+        from notifications.models import ClinicalAlert
+        from .alert_services import CriticalValueAlertService
+        from .tasks import check_critical_values
+        
+        self.assertEqual(check_critical_values(), 'Created 2 critical alerts')
+        alerts = set(ClinicalAlert.objects.values_list('patient_id', 'alert_type', 'severity'))
+        self.assertEqual(alerts, {
+            (self.patients[0].pk, 'HIGH_HBA1C', 'CRITICAL'),
+            (self.patients[1].pk, 'HIGH_GLUCOSE', 'CRITICAL'),
+        })
+        self.assertEqual(
+            DailyEntityCounter.objects.get(entity='alerts', date=timezone.localdate()).inserted, 2
+        )
+        # bulk_create سیگنال ندارد؛ شاخص cohort همان‌جا به‌روز می‌شود
+        from .models import PatientMetricIndex
+        self.assertEqual(PatientMetricIndex.objects.get(patient=self.patients[0]).open_alerts, 1)
+        
+        # بدون همپوشانی، ردیف‌های تغییر نکرده دوباره خوانده نمی‌شوند
+        service = CriticalValueAlertService(overlap=timedelta(0))
+        self.assertEqual(service.find_breaches(since=service.get_watermark()), [])
+        self.assertEqual(service.run(), 0)
+        
+        # ردیف تغییر کرده با هشدار فعال موجود، هشدار تکراری نمی‌سازد؛ پس از تأیید هشدار، هشدار جدید ساخته می‌شود
+        PatientAnalytics.objects.filter(patient=self.patients[0]).update(updated_at=timezone.now())
+        self.assertEqual(service.run(), 0)
+        
+        ClinicalAlert.objects.filter(patient=self.patients[0]).update(is_active=False)
+        PatientAnalytics.objects.filter(patient=self.patients[0]).update(updated_at=timezone.now())
+        PatientAnalytics.objects.filter(patient=self.patients[2]).update(avg_glucose=40, updated_at=timezone.now())
+        # خواندن watermark، ردیف‌های بحرانی تغییر کرده و هشدارهای فعال موجود: سه کوئری مستقل از تعداد بیماران
+        with self.assertNumQueries(3):
+            breaches = service.find_breaches(since=service.get_watermark())
+            service._active_alert_keys([row['patient_id'] for row in breaches])
+        self.assertEqual(len(breaches), 2)
+        self.assertEqual(service.run(), 2)
+        self.assertTrue(ClinicalAlert.objects.filter(
+            patient=self.patients[2], alert_type='LOW_GLUCOSE', is_active=True
+        ).exists())
+
+
+class CohortIndexTest(APITestCase):
+    """تست‌های شاخص بیماران و API جستجوی cohort"""
+    
+    def setUp(self):
+        from .cohort import get_cohort_index
+        
+        self.user = User.objects.create_user(email='cohort@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.create(user=self.user, medical_code='22222')
+        other_user = User.objects.create_user(email='cohort2@example.com', password='testpass123', is_doctor=True)
+        
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patients = [
+                Patient.objects.create(full_name=f'بیمار cohort {i}', primary_doctor=self.user) for i in range(4)
+            ]
+            self.other_patient = Patient.objects.create(full_name='بیمار پزشک دیگر', primary_doctor=other_user)
+            
+            # HbA1c بالا و بدون ویزیت اخیر: بیماران 0 و 1 و بیمار پزشک دیگر
+            for patient, hba1c in zip(self.patients + [self.other_patient], [9.8, 10.5, 9.5, 6.8, 11.0]):
+                self._old_lab(patient, hba1c)
+            Encounter.objects.create(patient=self.patients[2], occurred_at=now - timedelta(days=5),
+                                     created_by=self.user)
+        
+        self.index = get_cohort_index()
+        self.index.clear()
+        self.client.force_authenticate(user=self.user)
+    
+    def _old_lab(self, patient, hba1c, taken_at=None):
+        """HbA1c ثبت شده در ویزیت ۲۰۰ روز پیش"""
+        encounter = Encounter.objects.create(
+            patient=patient, occurred_at=timezone.now() - timedelta(days=200), created_by=self.user
+        )
+        return LabResult.objects.create(patient=patient, encounter=encounter, loinc='4548-4',
+                                        value=Decimal(str(hba1c)), unit='%',
+                                        taken_at=taken_at or encounter.occurred_at)
+    
+    POOR_CONTROL_NO_FOLLOWUP = {'all': [
+        {'metric': 'latest_hba1c', 'op': 'gt', 'value': 9},
+        {'metric': 'days_since_encounter', 'op': 'gt', 'value': 90},
+    ]}
+    
+    def test_signals_keep_index_current(self):
+        """ثبت آزمایش، دارو و ویزیت، شاخص بیمار و نسخه درون حافظه را به‌روز می‌کند"""
+        from pharmacy.models import MedicationOrder
+        from .models import PatientMetricIndex
+        
+        patient = self.patients[3]
+        row = PatientMetricIndex.objects.get(patient=patient)
+        self.assertAlmostEqual(row.latest_hba1c, 6.8)
+        self.assertIsNotNone(row.last_encounter_at)
+        self.assertEqual(self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['patient_ids'],
+                         [self.patients[0].pk, self.patients[1].pk, self.other_patient.pk])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._old_lab(patient, 9.9, taken_at=timezone.now())
+            MedicationOrder.objects.create(patient=patient, atc='A10BA02', name='Metformin', dose='500mg',
+                                           start_date=timezone.now().date())
+        self.assertIn(patient.pk, self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['patient_ids'])
+        on_metformin = {'metric': 'med_class', 'op': 'has', 'value': 'metformin'}
+        self.assertEqual(self.index.query(on_metformin)['patient_ids'], [patient.pk])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            encounter = Encounter.objects.create(patient=patient, occurred_at=timezone.now(), created_by=self.user)
+        self.assertNotIn(patient.pk, self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['patient_ids'])
+        with self.captureOnCommitCallbacks(execute=True):
+            encounter.delete()
+        self.assertIn(patient.pk, self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['patient_ids'])
+        
+        # حذف بیمار، بارگذاری کامل ستون‌ها را لازم می‌کند
+        self.patients[1].delete()
+        self.assertNotIn(self.patients[1].pk, self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['patient_ids'])
+    
+    def test_patients_without_encounters_are_overdue(self):
+        """بیمار بدون ویزیت در days_since_encounter بی‌نهایت روز حساب می‌شود"""
+        from .cohort import CohortIndexService
+        
+        never_seen = Patient.objects.create(full_name='بیمار بدون ویزیت', primary_doctor=self.user)
+        CohortIndexService().refresh_patients([never_seen.pk])
+        overdue = {'metric': 'days_since_encounter', 'op': 'gt', 'value': 90}
+        
+        self.assertIn(never_seen.pk, self.index.query(overdue)['patient_ids'])
+        self.assertEqual(self.index.query(overdue)['patient_ids'],
+                         self.index.query({'not': {**overdue, 'op': 'lte'}})['patient_ids'])
+        self.assertNotIn(never_seen.pk, self.index.query({**overdue, 'op': 'lte'})['patient_ids'])
+        self.assertEqual(self.index.query({'metric': 'days_since_encounter', 'op': 'is_null'})['patient_ids'],
+                         [never_seen.pk])
+    
+    def test_query_api_scopes_and_paginates(self):
+        """پزشک فقط بیماران خود را می‌بیند و نتیجه با cursor صفحه‌بندی می‌شود"""
+        url = '/api/analytics/cohorts/query/'
+        response = self.client.post(url, {'predicate': self.POOR_CONTROL_NO_FOLLOWUP, 'page_size': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['patient_ids'], [self.patients[0].pk])
+        
+        response = self.client.post(url, {
+            'predicate': self.POOR_CONTROL_NO_FOLLOWUP, 'page_size': 1, 'cursor': response.data['next_cursor']
+        }, format='json')
+        self.assertEqual(response.data['patient_ids'], [self.patients[1].pk])
+        self.assertIsNone(response.data['next_cursor'])
+        
+        response = self.client.post(url, {'predicate': {'not': {
+            'metric': 'latest_hba1c', 'op': 'between', 'value': [7, 10]
+        }}}, format='json')
+        self.assertEqual(response.data['patient_ids'], [self.patients[1].pk, self.patients[3].pk])
+        
+        response = self.client.post(url, {'predicate': {'metric': 'weight', 'op': 'gt', 'value': 1}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_rebuild_task(self):
+        """بازسازی کامل شاخص همه بیماران را از نو می‌نویسد"""
+        from .models import PatientMetricIndex
+        from .tasks import rebuild_cohort_index
+        
+        PatientMetricIndex.objects.all().delete()
+        self.assertEqual(rebuild_cohort_index(), 'Rebuilt cohort index for 5 patients')
+        self.assertEqual(self.index.query(self.POOR_CONTROL_NO_FOLLOWUP)['count'], 3)
+
+
+class RetentionTest(TestCase):
+    """تست‌های حذف دسته‌ای داده‌های قدیمی"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='retention@example.com', password='testpass123', is_doctor=True)
+        self.patient = Patient.objects.create(full_name='بیمار قدیمی', primary_doctor=self.user)
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+    
+    def test_batched_purge_with_archive(self):
+        """ردیف‌های قدیمی در دسته‌ها حذف و پیش از حذف بایگانی می‌شوند"""
+        import gzip
+        import json
+        from notifications.models import Notification
+        from security.models import AuditLog
+        from versioning.models import RecordVersion
+        from .retention import RetentionService
+        
+        today = timezone.now().date()
+        for days in [400, 401, 402, 10]:
+            PatientAnalytics.objects.create(patient=self.patient, date=today - timedelta(days=days))
+        
+        logs = [AuditLog.objects.create(path='/api/', method='GET', status_code=200) for _ in range(3)]
+        AuditLog.objects.filter(pk__in=[log.pk for log in logs[:2]]).update(
+            created_at=timezone.now() - timedelta(days=500)
+        )
+        
+        old = timezone.now() - timedelta(days=1000)
+        for version in [1, 2]:
+            RecordVersion.objects.create(
+                resource_type='LabResult', resource_id='retention-test', version=version,
+                snapshot={'v': version}, changed_at=old
+            )
+        Notification.objects.create(
+            recipient=self.user, title='قدیمی', message='-', created_at=timezone.now() - timedelta(days=200)
+        )
+        
+        # جداول غیر آنالیتیکس با ورودی RETENTION_DAYS فعال می‌شوند؛
+        # جداول بدون سیگنال حذف از QuerySet.delete (Collector) استفاده نمی‌کنند
+        opted_in = {'security.AuditLog': 365, 'versioning.RecordVersion': 730, 'notifications.Notification': 180}
+        with self.settings(RETENTION_DAYS=opted_in), \
+                mock.patch.object(QuerySet, 'delete', side_effect=AssertionError('collector delete')):
+            removed = RetentionService(batch_size=2, pause=0, archive_dir=self.archive_dir).run()
+        
+        self.assertEqual(removed['analytics.PatientAnalytics'], 3)
+        self.assertEqual(removed['security.AuditLog'], 2)
+        self.assertEqual(removed['versioning.RecordVersion'], 1)
+        self.assertEqual(removed['notifications.Notification'], 1)
+        self.assertNotIn('monitor.HealthCheckResult', removed)
+        
+        self.assertEqual(PatientAnalytics.objects.count(), 1)
+        self.assertEqual(
+            list(RecordVersion.objects.filter(resource_id='retention-test').values_list('version', flat=True)), [2]
+        )
+        
+        archives = sorted(os.listdir(self.archive_dir))
+        self.assertEqual(len(archives), 4)
+        patient_archive = next(name for name in archives if name.startswith('analytics.PatientAnalytics'))
+        with gzip.open(os.path.join(self.archive_dir, patient_archive), 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['patient_id'], self.patient.pk)
+    
+    def test_non_analytics_tables_are_opt_in(self):
+        """لاگ ممیزی فقط با انتخاب صریح حذف می‌شود و پاکسازی زمان‌بندی شده فقط جداول آنالیتیکس را پاک می‌کند"""
+        from security.models import AuditLog
+        from .retention import RetentionService
+        from .tasks import cleanup_old_analytics
+        
+        log = AuditLog.objects.create(path='/api/', method='GET', status_code=200)
+        AuditLog.objects.filter(pk=log.pk).update(created_at=timezone.now() - timedelta(days=500))
+        PatientAnalytics.objects.create(patient=self.patient, date=timezone.now().date() - timedelta(days=400))
+        
+        with self.settings(RETENTION_PAUSE_SECONDS=0):
+            self.assertEqual(cleanup_old_analytics(), "Deleted old analytics: {'analytics.PatientAnalytics': 1, "
+                                                      "'analytics.DoctorAnalytics': 0, 'analytics.SystemAnalytics': 0}")
+            with self.settings(RETENTION_DAYS={'security.AuditLog': 365}):
+                cleanup_old_analytics()
+            self.assertNotIn('security.AuditLog', RetentionService().run())
+            self.assertTrue(AuditLog.objects.filter(pk=log.pk).exists())
+            
+            self.assertEqual(RetentionService().run(models_filter=['security.AuditLog']), {'security.AuditLog': 1})
+    
+    def test_policy_for_missing_model_is_logged(self):
+        """سیاست مدلی که نصب نیست اجرا نمی‌شود و در لاگ هشدار داده می‌شود"""
+        from .retention import RetentionPolicy, RetentionService
+        
+        with self.assertLogs('analytics.retention', level='WARNING') as logs:
+            removed = RetentionService(pause=0).run([RetentionPolicy('monitor.HealthCheckResult', 'checked_at', 90)])
+        
+        self.assertEqual(removed, {})
+        self.assertIn('monitor.HealthCheckResult', logs.output[0])
+
+
+class RefreshingCacheTest(TestCase):
+    """تست‌های لایه کش با قفل تک‌پرواز و سرو مقدار کهنه"""
+    
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+    
+    def _compute(self):
+        self.calls += 1
+        return {'value': self.calls}
+    
+    def test_stale_value_is_served_while_one_refresh_runs(self):
+        """پس از پایان تازگی، مقدار کهنه برگردانده و فقط یک بازسازی زمان‌بندی می‌شود"""
+        from .cache_layer import RefreshingCache
+        
+        refreshing = RefreshingCache('test:overview', fresh_timeout=300)
+        self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 1})
+        self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 1})
+        
+        with mock.patch('analytics.cache_layer.time.time', return_value=time.time() + 301), \
+                mock.patch('analytics.cache_layer._get_executor') as executor:
+            self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 1})
+            self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 1})
+        
+        # دومین درخواست کهنه قفل را گرفته نمی‌یابد و بازسازی دیگری زمان‌بندی نمی‌کند
+        self.assertEqual(executor.return_value.submit.call_count, 1)
+        self.assertEqual(self.calls, 1)
+        
+        _, compute, token = executor.return_value.submit.call_args[0]
+        refreshing._refresh_locked(compute, token)
+        self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 2})
+        self.assertIsNone(cache.get(refreshing.lock_key))
+    
+    def test_cold_miss_waits_for_lock_holder(self):
+        """درخواستی که قفل را نگرفته منتظر نتیجه دارنده قفل می‌ماند و دوباره محاسبه نمی‌کند"""
+        from .cache_layer import RefreshingCache
+        
+        refreshing = RefreshingCache('test:cold', fresh_timeout=300, wait_timeout=1)
+        cache.add(refreshing.lock_key, 'other-worker', 60)
+        
+        def store_from_other_worker(seconds):
+            refreshing._store({'value': 'other'})
+        
+        with mock.patch('analytics.cache_layer.time.sleep', side_effect=store_from_other_worker):
+            self.assertEqual(refreshing.get_or_compute(self._compute), {'value': 'other'})
+        self.assertEqual(self.calls, 0)
+    
+    @override_settings(ANALYTICS_CACHE_REFRESH_WORKERS=0)
+    def test_system_overview_refresh_task(self):
+        """task زمان‌بندی شده نمای کلی را بدون انتظار برای انقضا بازسازی می‌کند"""
+        from .tasks import refresh_system_overview_cache
+        
+        service = SystemAnalyticsService()
+        with mock.patch.object(SystemAnalyticsService, '_calculate_system_overview_data',
+                               side_effect=[{'total_patients': 1}, {'total_patients': 2}]):
+            self.assertEqual(service.get_system_overview_data(), {'total_patients': 1})
+            refresh_system_overview_cache()
+            self.assertEqual(service.get_system_overview_data(), {'total_patients': 2})
+
+    
+    def test_system_overview_is_read_only_and_scheduled(self):
+        """محاسبه نمای کلی در مسیر GET ردیف SystemAnalytics نمی‌نویسد و task آن زمان‌بندی شده است"""
+        from django.conf import settings
+        
+        data = SystemAnalyticsService()._calculate_system_overview_data()
+        self.assertIn('total_patients', data)
+        self.assertFalse(SystemAnalytics.objects.exists())
+        
+        tasks = {entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn('analytics.tasks.refresh_system_overview_cache', tasks)
+
+class DashboardSummaryCacheTest(APITestCase):
+    """تست‌های کش خلاصه داشبورد پزشک"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='dashboard@example.com', password='testpass123', is_doctor=True)
+        self.doctor = DoctorProfile.objects.create(user=self.user, medical_code='44444')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(full_name='بیمار داشبورد', primary_doctor=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/analytics/dashboard/summary/'
+    
+    def test_repeated_summary_is_served_from_cache(self):
+        """درخواست دوم بدون کوئری خلاصه از کش خوانده می‌شود"""
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data['total_patients'], 1)
+        
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.data, first.data)
+        
+        # آمار کلی کش فقط برای پزشکان ادمین
+        stats_url = '/api/analytics/dashboard/summary_cache_stats/'
+        self.assertEqual(self.client.get(stats_url).status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_user(email='dashboard-admin@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.create(user=admin, medical_code='44445', role=DoctorProfile.DoctorRole.ADMIN)
+        self.client.force_authenticate(user=admin)
+        stats = self.client.get(stats_url).data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 50.0)
+    
+    def test_writes_invalidate_summary(self):
+        """ثبت ویزیت، هشدار و انتقال بیمار خلاصه کش شده را باطل می‌کند"""
+        from notifications.models import ClinicalAlert
+        
+        self.client.get(self.url)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Encounter.objects.create(patient=self.patient, created_by=self.user, occurred_at=timezone.now())
+        summary = self.client.get(self.url).data
+        self.assertEqual(summary['total_encounters_today'], 1)
+        self.assertEqual(summary['active_patients'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            alert = ClinicalAlert.objects.create(
+                patient=self.patient, alert_type='HIGH_GLUCOSE', severity='HIGH', message='قند بالا'
+            )
+        self.assertEqual(self.client.get(self.url).data['pending_alerts'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            alert.acknowledged_at = timezone.now()
+            alert.save()
+        self.assertEqual(self.client.get(self.url).data['pending_alerts'], 0)
+        
+        other = User.objects.create_user(email='dashboard2@example.com', password='testpass123', is_doctor=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.primary_doctor = other
+            self.patient.save()
+        self.assertEqual(self.client.get(self.url).data['total_patients'], 0)
+
+
+class ReportMemoTest(TestCase):
+    """تست‌های استفاده دوباره از خروجی گزارش با اثر انگشت داده‌ها"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='memo@example.com', password='testpass123', is_doctor=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(full_name='بیمار تکراری', primary_doctor=self.user)
+            self.encounter = Encounter.objects.create(
+                patient=self.patient, created_by=self.user, occurred_at=timezone.now()
+            )
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+    
+    def _generate(self, service, format='csv', **kwargs):
+        report = Report.objects.create(
+            report_type='patient_summary', format=format,
+            requested_by=self.user, patient=self.patient, **kwargs
+        )
+        return report, service.generate_report(report)
+    
+    def test_unchanged_data_reuses_output(self):
+        """گزارش تکراری بدون تغییر داده‌ها فایل قبلی را برمی‌گرداند و با داده جدید دوباره ساخته می‌شود"""
+        with self.settings(MEDIA_ROOT=self.media_root):
+            service = ReportGenerationService()
+            with mock.patch.object(service, '_collect_patient_data',
+                                   wraps=service._collect_patient_data) as collect:
+                first, first_path = self._generate(service)
+                second, second_path = self._generate(service)
+                
+                self.assertEqual(first_path, second_path)
+                self.assertEqual(collect.call_count, 1)
+                second.refresh_from_db()
+                self.assertTrue(second.metadata.get('memoized'))
+                self.assertEqual(second.fingerprint, first.fingerprint)
+                
+                # بازه تاریخ متفاوت اثر انگشت دیگری دارد
+                self._generate(service, start_date=timezone.now().date() - timedelta(days=7))
+                self.assertEqual(collect.call_count, 2)
+                
+                with self.captureOnCommitCallbacks(execute=True):
+                    LabResult.objects.create(
+                        patient=self.patient, encounter=self.encounter, loinc='2345-7',
+                        value=Decimal('120'), unit='mg/dL', taken_at=timezone.now()
+                    )
+                third, _ = self._generate(service)
+                self.assertEqual(collect.call_count, 3)
+                self.assertNotEqual(third.fingerprint, first.fingerprint)
+                
+                # ویرایش درجای مقدار آزمایش و تأیید هشدار (بدون updated_at) هم خروجی را دوباره می‌سازد
+                lab = LabResult.objects.get(patient=self.patient, loinc='2345-7')
+                lab.value = Decimal('135')
+                with self.captureOnCommitCallbacks(execute=True):
+                    lab.save()
+                fourth, _ = self._generate(service)
+                self.assertEqual(collect.call_count, 4)
+                self.assertNotEqual(fourth.fingerprint, third.fingerprint)
+                
+                from notifications.models import ClinicalAlert
+                with self.captureOnCommitCallbacks(execute=True):
+                    alert = ClinicalAlert.objects.create(patient=self.patient, alert_type='HIGH_GLUCOSE', message='x')
+                fifth, _ = self._generate(service)
+                alert.acknowledged_at = timezone.now()
+                with self.captureOnCommitCallbacks(execute=True):
+                    alert.save()
+                sixth, _ = self._generate(service)
+                self.assertEqual(collect.call_count, 6)
+                self.assertNotEqual(sixth.fingerprint, fifth.fingerprint)
+    
+    def test_patient_pdf_reused_until_profile_changes(self):
+        """PDF تکراری بیمار دوباره استفاده می‌شود و ویرایش پروفایل بیمار یا پزشک آن را دوباره می‌سازد"""
+        with self.settings(MEDIA_ROOT=self.media_root):
+            service = ReportGenerationService()
+            with mock.patch.object(service, '_collect_patient_data',
+                                   wraps=service._collect_patient_data) as collect:
+                first, first_path = self._generate(service, format='pdf')
+                second, second_path = self._generate(service, format='pdf')
+                
+                self.assertEqual(first_path, second_path)
+                self.assertEqual(collect.call_count, 1)
+                second.refresh_from_db()
+                self.assertTrue(second.metadata.get('memoized'))
+                with open(first_path, 'rb') as f:
+                    self.assertEqual(f.read(4), b'%PDF')
+                
+                self.patient.dob = timezone.now().date() - timedelta(days=365 * 50)
+                self.patient.save()
+                third, _ = self._generate(service, format='pdf')
+                self.assertEqual(collect.call_count, 2)
+                self.assertNotEqual(third.fingerprint, second.fingerprint)
+                
+                self.user.full_name = 'دکتر جدید'
+                self.user.save()
+                fourth, _ = self._generate(service, format='pdf')
+                self.assertEqual(collect.call_count, 3)
+                self.assertNotEqual(fourth.fingerprint, third.fingerprint)
+    
+    def test_doctor_report_rebuilt_after_patient_rename(self):
+        """تغییر نام بیمار، گزارش پزشک را که نام بیماران را چاپ می‌کند دوباره می‌سازد"""
+        doctor = DoctorProfile.objects.create(user=self.user, medical_code='55501')
+        with self.settings(MEDIA_ROOT=self.media_root):
+            service = ReportGenerationService()
+            
+            def generate():
+                report = Report.objects.create(
+                    report_type='doctor_performance', format='csv', requested_by=self.user, doctor=doctor
+                )
+                service.generate_report(report)
+                return report
+            
+            first, second = generate(), generate()
+            self.assertEqual(second.fingerprint, first.fingerprint)
+            
+            self.patient.full_name = 'بیمار تغییر نام'
+            self.patient.save()
+            self.assertNotEqual(generate().fingerprint, first.fingerprint)
+    
+    def test_quota_evicts_unreferenced_then_oldest_outputs(self):
+        """با عبور از سهمیه، ابتدا فایل‌های بدون گزارش و سپس قدیمی‌ترین خروجی‌ها حذف می‌شوند"""
+        from .report_memo import ReportMemoService
+        
+        directory = os.path.join(self.media_root, 'reports')
+        os.makedirs(directory)
+        paths = []
+        for index, name in enumerate(['orphan', 'old', 'recent']):
+            path = os.path.join(directory, f'{name}.csv')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (time.time() - 100 + index, time.time() - 100 + index))
+            paths.append(path)
+        for path in paths[1:]:
+            Report.objects.create(
+                report_type='patient_summary', format='csv', status='completed',
+                patient=self.patient, file_path=path, fingerprint='a' * 64
+            )
+        
+        removed = ReportMemoService(directory, quota_bytes=150).enforce_quota()
+        
+        self.assertEqual(removed, 2)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True])
+        self.assertEqual(Report.objects.get(file_path=paths[1]).fingerprint, '')
+        self.assertEqual(Report.objects.get(file_path=paths[2]).fingerprint, 'a' * 64)
+
+
+class ChartCacheTest(TestCase):
+    """تست‌های کش دیسکی نمودارها"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+    
+    def _writer(self, size=100):
+        calls = []
+        
+        def render(path):
+            calls.append(path)
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        return render, calls
+    
+    def test_same_data_and_style_reuse_file(self):
+        """نمودار با داده و سبک یکسان فقط یک بار رسم می‌شود"""
+        from .chart_cache import ChartCache
+        
+        cache_ = ChartCache(self.directory)
+        render, calls = self._writer()
+        data = {'labels': ['a', 'b'], 'datasets': [{'data': [1, 2]}]}
+        
+        first = cache_.get_or_render('glucose', data, {'dpi': 150}, render)
+        second = cache_.get_or_render('glucose', dict(data), {'dpi': 150}, render)
+        other_style = cache_.get_or_render('glucose', data, {'dpi': 100}, render)
+        
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other_style)
+        self.assertEqual(len(calls), 2)
+    
+    def test_lru_eviction_by_size(self):
+        """با عبور از سقف حجم، نمودارهایی که اخیراً استفاده نشده‌اند حذف می‌شوند"""
+        from .chart_cache import ChartCache
+        
+        cache_ = ChartCache(self.directory, max_bytes=250)
+        render, _ = self._writer()
+        paths = [cache_.put(f'key{i}', render) for i in range(2)]
+        
+        # استفاده از اولین نمودار آن را تازه‌ترین می‌کند
+        past = time.time() - 60
+        os.utime(paths[0], (past, past))
+        os.utime(paths[1], (past + 1, past + 1))
+        self.assertEqual(cache_.get('key0'), paths[0])
+        
+        cache_.put('key2', render)
+        
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+        self.assertIsNone(cache_.get('key1'))
+    
+    def test_prerendered_doctor_chart_is_reused(self):
+        """نمودار گرم شده پیش از گزارش ماهانه دوباره رسم نمی‌شود"""
+        user = User.objects.create_user(email='charts@example.com', password='testpass123', is_doctor=True)
+        doctor = DoctorProfile.objects.create(user=user, medical_code='33333')
+        
+        with self.settings(REPORT_CHART_CACHE_DIR=self.directory):
+            service = ReportGenerationService()
+            with mock.patch.object(service, '_render_chart', wraps=service._render_chart) as render:
+                self.assertEqual(service.prerender_doctor_report_charts(doctor), 1)
+                self.assertEqual(service.prerender_doctor_report_charts(doctor), 1)
+                self.assertEqual(render.call_count, 1)
+    
+    def test_patient_pdf_reuses_glucose_chart(self):
+        """PDF بیمار ساخته می‌شود و ساخت دوباره با همان داده‌های قند خون نمودار را از کش می‌خواند"""
+        user = User.objects.create_user(email='pdfchart@example.com', password='testpass123', is_doctor=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = Patient.objects.create(
+                full_name='بیمار PDF', primary_doctor=user, dob=timezone.now().date() - timedelta(days=365 * 40),
+                sex=Patient.Sex.FEMALE
+            )
+            encounter = Encounter.objects.create(patient=patient, created_by=user, occurred_at=timezone.now())
+            for days, value in [(1, '140'), (3, '180')]:
+                LabResult.objects.create(
+                    patient=patient, encounter=encounter, loinc='2345-7', value=Decimal(value), unit='mg/dL',
+                    taken_at=timezone.now() - timedelta(days=days)
+                )
+        
+        with self.settings(MEDIA_ROOT=self.directory):
+            service = ReportGenerationService()
+            paths = []
+            with mock.patch.object(service, '_render_chart', wraps=service._render_chart) as render:
+                # بازه متفاوت، اثر انگشت گزارش را عوض می‌کند ولی نمودار ماهانه قند خون همان است
+                for days in (90, 60):
+                    report = Report.objects.create(
+                        report_type='patient_summary', format='pdf', requested_by=user, patient=patient,
+                        start_date=timezone.now().date() - timedelta(days=days)
+                    )
+                    paths.append(service.generate_report(report))
+                    report.refresh_from_db()
+                    self.assertEqual(report.status, 'completed')
+            
+            self.assertEqual(render.call_count, 1)
+            self.assertNotEqual(paths[0], paths[1])
+            for path in paths:
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(4), b'%PDF')
+
+
+class BulkPatientAnalyticsTest(TestCase):
+    """تست‌های محاسبه دسته‌ای آنالیتیکس بیماران"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='bulk@example.com', password='testpass123', is_doctor=True)
+        self.service = PatientAnalyticsService()
+        now = timezone.now()
+        
+        self.patients = []
+        for i in range(3):
+            patient = Patient.objects.create(full_name=f'بیمار{i} دسته‌ای', primary_doctor=self.user)
+            self.patients.append(patient)
+            
+            encounter = Encounter.objects.create(patient=patient, created_by=self.user, occurred_at=now - timedelta(days=2))
+            for days_ago, value in [(3, 110 + i * 10), (10, 150), (45, 180 - i * 20)]:
+                LabResult.objects.create(
+                    patient=patient, encounter=encounter, loinc='2345-7',
+                    value=Decimal(value), unit='mg/dL', taken_at=now - timedelta(days=days_ago)
+                )
+            LabResult.objects.create(
+                patient=patient, encounter=encounter, loinc='4548-4',
+                value=Decimal('7.2') + i, unit='%', taken_at=now - timedelta(days=5)
+            )
+        
+        # بیمار بدون داده
+        self.patients.append(Patient.objects.create(full_name='بیمار خالی'))
+    
+    def test_bulk_matches_per_patient(self):
+        """نتایج حالت دسته‌ای باید با محاسبه تک‌تک بیماران یکسان باشد"""
+        expected = {
+            patient.id: self.service.calculate_patient_analytics(patient)
+            for patient in self.patients
+        }
+        PatientAnalytics.objects.all().delete()
+        
+        written = self.service.calculate_bulk_patient_analytics(
+            [patient.id for patient in self.patients], batch_size=2
+        )
+        
+        self.assertEqual(written, len(self.patients))
+        for patient_id, scalar in expected.items():
+            bulk = PatientAnalytics.objects.get(patient_id=patient_id, date=scalar.date)
+            for field in ['avg_glucose', 'min_glucose', 'max_glucose', 'glucose_std_dev', 'avg_hba1c']:
+                if getattr(scalar, field) is None:
+                    self.assertIsNone(getattr(bulk, field))
+                else:
+                    self.assertAlmostEqual(getattr(bulk, field), getattr(scalar, field), places=6)
+            for field in ['glucose_trend', 'hba1c_trend', 'encounters_count', 'medications_count',
+                          'lab_tests_count', 'alerts_count', 'compliance_score']:
+                self.assertEqual(getattr(bulk, field), getattr(scalar, field), field)
+    
+    def test_bulk_upserts_existing_rows(self):
+        """اجرای دوباره حالت دسته‌ای رکورد تکراری ایجاد نمی‌کند"""
+        ids = [patient.id for patient in self.patients]
+        self.service.calculate_bulk_patient_analytics(ids)
+        self.service.calculate_bulk_patient_analytics(ids)
+        
+        self.assertEqual(PatientAnalytics.objects.count(), len(self.patients))
+    
+    def test_compliance_scores_match_scalar(self):
+        """امتیاز پایبندی دسته‌ای باید با نسخه تکی یکسان باشد"""
+        from notifications.models import ClinicalAlert
+        
+        now = timezone.now()
+        old_hba1c_patient = Patient.objects.create(full_name='بیمار HbA1c قدیمی', primary_doctor=self.user)
+        encounter = Encounter.objects.create(
+            patient=old_hba1c_patient, created_by=self.user, occurred_at=now - timedelta(days=60)
+        )
+        LabResult.objects.create(
+            patient=old_hba1c_patient, encounter=encounter, loinc='4548-4',
+            value=Decimal('8.1'), unit='%', taken_at=now - timedelta(days=120)
+        )
+        for _ in range(5):
+            ClinicalAlert.objects.create(
+                patient=old_hba1c_patient, alert_type='HIGH_HBA1C', message='هشدار'
+            )
+        ClinicalAlert.objects.create(
+            patient=self.patients[0], alert_type='HIGH_GLUCOSE', message='هشدار'
+        )
+        patients = self.patients + [old_hba1c_patient]
+        
+        end_date = now.date()
+        start_date = end_date - timedelta(days=30)
+        expected = {
+            patient.id: self.service._calculate_compliance_score(patient, start_date, end_date)
+            for patient in patients
+        }
+        by_ids = self.service.calculate_compliance_scores([patient.id for patient in patients])
+        self.assertEqual(by_ids, expected)
+        
+        doctor = DoctorProfile.objects.create(user=self.user, medical_code='54321')
+        by_doctor = self.service.calculate_compliance_scores(doctor=doctor)
+        self.assertEqual(by_doctor, {pid: score for pid, score in expected.items() if pid != self.patients[-1].id})
+        
+        with self.assertRaises(ValueError):
+            self.service.calculate_compliance_scores()
+
+
+class HbA1cDistributionTest(TestCase):
+    """تست‌های توزیع کنترل HbA1c پنل پزشک"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='dist@example.com', password='testpass123', is_doctor=True)
+        self.doctor = DoctorProfile.objects.create(user=self.user, medical_code='22222')
+        self.service = DoctorAnalyticsService()
+        now = timezone.now()
+        
+        self.labs = {}
+        # آخرین مقدار هر بیمار ملاک است
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, (old_value, latest_value) in enumerate(
+                [('9.5', '6.5'), ('6.0', '7.0'), ('7.5', '8.5'), ('6.8', '9.0')]
+            ):
+                patient = Patient.objects.create(full_name=f'بیمار{i} توزیع', primary_doctor=self.user)
+                encounter = Encounter.objects.create(patient=patient, created_by=self.user, occurred_at=now)
+                LabResult.objects.create(
+                    patient=patient, encounter=encounter, loinc='4548-4',
+                    value=Decimal(old_value), unit='%', taken_at=now - timedelta(days=100)
+                )
+                self.labs[i] = LabResult.objects.create(
+                    patient=patient, encounter=encounter, loinc='4548-4',
+                    value=Decimal(latest_value), unit='%', taken_at=now - timedelta(days=1)
+                )
+        self.encounter = encounter
+    
+    def test_histogram_uses_latest_hba1c(self):
+        """هر بیمار بر اساس آخرین HbA1c در یک بازه شمرده می‌شود"""
+        data = self.service.get_patient_distribution_data(self.doctor)
+        
+        self.assertEqual(data['datasets'][0]['data'], [1, 1, 1, 1])
+    
+    def test_histogram_is_cached_until_hba1c_changes(self):
+        """کش فقط با تغییر HbA1c بیماران پزشک حذف می‌شود"""
+        self.service.get_hba1c_control_histogram(self.doctor)
+        with self.assertNumQueries(0):
+            self.service.get_hba1c_control_histogram(self.doctor)
+        
+        # آزمایش غیر HbA1c کش را حذف نمی‌کند
+        with self.captureOnCommitCallbacks(execute=True):
+            LabResult.objects.create(
+                patient=self.labs[0].patient, encounter=self.encounter, loinc='2345-7',
+                value=Decimal('140'), unit='mg/dL', taken_at=timezone.now()
+            )
+        with self.assertNumQueries(0):
+            self.service.get_hba1c_control_histogram(self.doctor)
+        
+        self.labs[0].value = Decimal('10.0')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.labs[0].save()
+        self.assertEqual(self.service.get_hba1c_control_histogram(self.doctor), [0, 1, 1, 2])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.labs[3].delete()
+        self.assertEqual(self.service.get_hba1c_control_histogram(self.doctor), [1, 1, 1, 1])
+
+
+class IncrementalPatientAnalyticsTest(TestCase):
+    """تست‌های آنالیتیکس افزایشی مبتنی بر تجمیع روزانه"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='incremental@example.com', password='testpass123', is_doctor=True)
+        self.service = IncrementalAnalyticsService()
+        self.scalar_service = PatientAnalyticsService()
+        self.now = timezone.now()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(full_name='بیمار افزایشی', primary_doctor=self.user)
+            self.encounter = Encounter.objects.create(
+                patient=self.patient, created_by=self.user, occurred_at=self.now - timedelta(days=2)
+            )
+            for days_ago, value in [(3, 110), (4, 140), (10, 150), (45, 190)]:
+                self._add_lab('2345-7', value, days_ago)
+            self._add_lab('4548-4', Decimal('7.8'), 20)
+            self._add_lab('4548-4', Decimal('8.4'), 150)
+    
+    def _add_lab(self, loinc, value, days_ago):
+        return LabResult.objects.create(
+            patient=self.patient, encounter=self.encounter, loinc=loinc,
+            value=Decimal(value), unit='mg/dL', taken_at=self.now - timedelta(days=days_ago)
+        )
+    
+    def _assert_matches_scalar(self):
+        PatientAnalytics.objects.all().delete()
+        scalar = self.scalar_service.calculate_patient_analytics(self.patient)
+        PatientAnalytics.objects.all().delete()
+        
+        self.service.calculate_patient_analytics_from_buckets([self.patient.id])
+        incremental = PatientAnalytics.objects.get(patient=self.patient)
+        
+        for field in ['avg_glucose', 'min_glucose', 'max_glucose', 'glucose_std_dev', 'avg_hba1c']:
+            self.assertAlmostEqual(getattr(incremental, field), getattr(scalar, field), places=6)
+        for field in ['glucose_trend', 'hba1c_trend', 'encounters_count', 'lab_tests_count',
+                      'medications_count', 'alerts_count', 'compliance_score']:
+            self.assertEqual(getattr(incremental, field), getattr(scalar, field), field)
+    
+    def test_buckets_maintained_on_write(self):
+        """ردیف‌های تجمیع با ثبت، ویرایش و حذف آزمایش به‌روز می‌شوند"""
+        self._assert_matches_scalar()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            lab = self._add_lab('2345-7', 300, 5)
+        self._assert_matches_scalar()
+        
+        lab.taken_at = self.now - timedelta(days=50)
+        with self.captureOnCommitCallbacks(execute=True):
+            lab.save()
+        self._assert_matches_scalar()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            lab.delete()
+        self._assert_matches_scalar()
+    
+    def test_rebuild_matches_signal_maintained_buckets(self):
+        """بازسازی کامل از داده خام همان ردیف‌های نگهداری‌شده با سیگنال را تولید می‌کند"""
+        fields = ['patient_id', 'date', 'glucose_count', 'glucose_sum', 'hba1c_count',
+                  'lab_tests_count', 'encounters_count']
+        maintained = list(PatientDailyAggregate.objects.order_by('date').values(*fields))
+        
+        self.service.rebuild_buckets([self.patient.id])
+        
+        rebuilt = list(PatientDailyAggregate.objects.order_by('date').values(*fields))
+        self.assertEqual(rebuilt, maintained)
+    
+    def test_only_dirty_patients_recalculated(self):
+        """اجرای روزانه فقط بیماران تغییر کرده را محاسبه می‌کند"""
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Patient.objects.create(full_name='بیمار دیگر')
+        
+        self.assertEqual(self.service.calculate_dirty_patient_analytics(), 2)
+        self.assertEqual(self.service.get_dirty_patient_ids(), [])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self._add_lab('2345-7', 120, 1)
+        self.assertEqual(self.service.get_dirty_patient_ids(), [self.patient.id])
+        self.assertNotIn(other.id, self.service.get_dirty_patient_ids())
+
+
+class DerivedRefreshBatchTest(TestCase):
+    """تست‌های بازسازی یک‌باره ساختارهای مشتق هر بیمار پس از commit"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='batch@example.com', password='testpass123', is_doctor=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient = Patient.objects.create(full_name='بیمار دسته‌ای', primary_doctor=self.user)
+            self.encounter = Encounter.objects.create(
+                patient=self.patient, created_by=self.user, occurred_at=timezone.now()
+            )
+    
+    def _add_lab(self, value):
+        return LabResult.objects.create(
+            patient=self.patient, encounter=self.encounter, loinc='2345-7',
+            value=Decimal(value), unit='mg/dL', taken_at=timezone.now()
+        )
+    
+    def test_writes_of_one_transaction_refresh_each_patient_once(self):
+        """چند نوشتن روی یک بیمار در یک تراکنش فقط یک بار ردیف تجمیع و شاخص او را می‌نویسد"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import PatientMetricIndex
+        
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                lab = self._add_lab('120')
+                Encounter.objects.create(patient=self.patient, created_by=self.user, occurred_at=timezone.now())
+                self._add_lab('180')
+                lab.value = Decimal('130')
+                lab.save()
+        
+        def writes(table):
+            return [q for q in queries.captured_queries if q['sql'].startswith(f'INSERT INTO "{table}"')]
+        
+        self.assertEqual(len(writes('analytics_patientdailyaggregate')), 1)
+        self.assertEqual(len(writes('analytics_patientmetricindex')), 1)
+        
+        bucket = PatientDailyAggregate.objects.get(patient=self.patient, date=timezone.localdate())
+        self.assertEqual((bucket.encounters_count, bucket.glucose_count, bucket.glucose_sum), (2, 2, 310))
+        self.assertAlmostEqual(PatientMetricIndex.objects.get(patient=self.patient).avg_glucose, 155)
+    
+    def test_rolled_back_savepoint_discards_its_counters(self):
+        """شمارنده‌های روزانه نوشتن‌های یک savepoint برگشت خورده ثبت نمی‌شوند"""
+        from django.db import transaction
+        
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._add_lab('120')
+            try:
+                with transaction.atomic():
+                    self._add_lab('140')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        
+        self.assertEqual(CounterRollupService().get_inserted('lab_tests', today, today), 1)
+        bucket = PatientDailyAggregate.objects.get(patient=self.patient, date=today)
+        self.assertEqual(bucket.lab_tests_count, 1)
+
+
+class ShardedAnalyticsTest(TestCase):
+    """تست‌های اجرای شارد‌شده آنالیتیکس روزانه"""
+    
+    def setUp(self):
+        self.service = ShardedAnalyticsService()
+        now = timezone.now()
+        
+        self.doctors = []
+        for i in range(2):
+            user = User.objects.create_user(email=f'shard{i}@example.com', password='testpass123', is_doctor=True)
+            self.doctors.append(DoctorProfile.objects.create(user=user, medical_code=f'5555{i}'))
+        
+        for i in range(7):
+            doctor_user = self.doctors[i % 2].user
+            patient = Patient.objects.create(full_name=f'بیمار شارد {i}', primary_doctor=doctor_user)
+            if i % 3 == 0:
+                continue
+            encounter = Encounter.objects.create(patient=patient, created_by=doctor_user, occurred_at=now - timedelta(days=i))
+            LabResult.objects.create(
+                patient=patient, encounter=encounter, loinc='4548-4',
+                value=Decimal('6.0') + Decimal(i) / 2, unit='%', taken_at=now - timedelta(days=10)
+            )
+    
+    def test_split_patient_id_ranges_covers_all_patients(self):
+        """بازه‌ها همه بیماران را بدون هم‌پوشانی پوشش می‌دهند"""
+        ranges = split_patient_id_ranges(3)
+        ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+        
+        self.assertEqual(len(ranges), 3)
+        covered = [pid for start, end in ranges for pid in ids if start <= pid <= end]
+        self.assertEqual(covered, ids)
+    
+    def test_reduce_matches_serial_analytics(self):
+        """نتیجه reduce با محاسبه سریالی پزشکان و سیستم یکسان است"""
+        doctor_service = DoctorAnalyticsService()
+        expected = {doctor.id: doctor_service.calculate_doctor_analytics(doctor) for doctor in self.doctors}
+        expected_system = SystemAnalyticsService().calculate_system_analytics()
+        DoctorAnalytics.objects.all().delete()
+        SystemAnalytics.objects.all().delete()
+        
+        result = self.service.run(shards=3, workers=1)
+        
+        self.assertEqual(result['shards'], 3)
+        self.assertEqual(result['patients'], 7)
+        self.assertEqual(PatientAnalytics.objects.count(), 7)
+        progress = get_run_progress(result['run_id'])
+        self.assertEqual(len(progress), 3)
+        self.assertTrue(all(shard['status'] == 'completed' for shard in progress.values()))
+        
+        for doctor_id, scalar in expected.items():
+            sharded = DoctorAnalytics.objects.get(doctor_id=doctor_id, date=scalar.date)
+            for field in ['total_patients', 'active_patients', 'new_patients', 'total_encounters',
+                          'patients_at_goal', 'patients_above_goal', 'total_alerts', 'critical_alerts']:
+                self.assertEqual(getattr(sharded, field), getattr(scalar, field), field)
+            self.assertAlmostEqual(sharded.avg_patient_hba1c, scalar.avg_patient_hba1c)
+            self.assertAlmostEqual(sharded.performance_score, scalar.performance_score)
+        
+        system = SystemAnalytics.objects.get(date=expected_system.date)
+        for field in ['total_users', 'total_doctors', 'total_patients', 'total_encounters', 'total_lab_tests']:
+            self.assertEqual(getattr(system, field), getattr(expected_system, field), field)
+        self.assertAlmostEqual(system.avg_system_hba1c, expected_system.avg_system_hba1c)
+        self.assertAlmostEqual(system.system_goal_achievement, expected_system.system_goal_achievement)
+    
+    def test_incremental_shards_build_missing_buckets(self):
+        """شارد افزایشی برای بیماران بدون ردیف تجمیع، ردیف‌ها را می‌سازد و همان نتیجه bulk را می‌دهد"""
+        fields = ['lab_tests_count', 'encounters_count', 'avg_hba1c']
+        self.service.run(shards=2, workers=1, mode='bulk')
+        expected = {row['patient_id']: row for row in PatientAnalytics.objects.values('patient_id', *fields)}
+        self.assertTrue(any(row['lab_tests_count'] for row in expected.values()))
+        
+        # داده‌های setUp بدون اجرای callbackهای commit ثبت شده‌اند: ردیف تجمیع و وضعیت ندارند
+        PatientAnalytics.objects.all().delete()
+        self.assertFalse(PatientDailyAggregate.objects.exists())
+        result = self.service.run(shards=2, workers=1, mode='incremental')
+        
+        self.assertEqual(result['patients'], 7)
+        actual = {row['patient_id']: row for row in PatientAnalytics.objects.values('patient_id', *fields)}
+        self.assertEqual(actual, expected)
+    
+    def test_progress_is_kept_per_shard(self):
+        """پیشرفت هر شارد در کلید جداگانه نگهداری می‌شود"""
+        from .shard_services import _report_progress, register_run
+        
+        register_run('run-1', [(1, 3), (4, 7)])
+        _report_progress('run-1', '1-3', status='running', processed=0)
+        _report_progress('run-1', '4-7', status='completed')
+        _report_progress('run-1', '1-3', processed=3)
+        
+        self.assertEqual(get_run_progress('run-1'), {
+            '1-3': {'status': 'running', 'processed': 3},
+            '4-7': {'status': 'completed'},
+        })
+        self.assertEqual(cache.get('analytics_shard_run:run-1:4-7'), {'status': 'completed'})
+    
+    def test_critical_alerts_counted_on_both_paths(self):
+        """هشدارهای بحرانی (severity='CRITICAL') در آنالیتیکس سریالی و شارد‌شده پزشک شمارش می‌شوند"""
+        from notifications.models import ClinicalAlert
+        
+        patient = Patient.objects.filter(primary_doctor=self.doctors[0].user).first()
+        ClinicalAlert.objects.create(
+            patient=patient, alert_type=ClinicalAlert.AlertType.HIGH_HBA1C, severity='CRITICAL', message='critical'
+        )
+        ClinicalAlert.objects.create(
+            patient=patient, alert_type=ClinicalAlert.AlertType.ABNORMAL_TREND, severity='MEDIUM', message='medium'
+        )
+        
+        total = ClinicalAlert.objects.filter(patient__primary_doctor=self.doctors[0].user).count()
+        
+        serial = DoctorAnalyticsService().calculate_doctor_analytics(self.doctors[0])
+        self.assertEqual((serial.total_alerts, serial.critical_alerts), (total, 1))
+        
+        DoctorAnalytics.objects.all().delete()
+        self.service.run(shards=2, workers=1)
+        sharded = DoctorAnalytics.objects.get(doctor=self.doctors[0], date=serial.date)
+        self.assertEqual((sharded.total_alerts, sharded.critical_alerts), (total, 1))
+
+
+class SharedCacheCheckTest(TestCase):
+    """تست بررسی راه‌اندازی برای کش مشترک بین فرایندها"""
+    
+    LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    
+    def test_process_local_cache_is_an_error_unless_allowed(self):
+        from .checks import check_shared_cache
+        
+        with self.settings(CACHES=self.LOCMEM, ALLOW_PROCESS_LOCAL_CACHE=False):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['analytics.E001'])
+        with self.settings(CACHES=self.LOCMEM, ALLOW_PROCESS_LOCAL_CACHE=True):
+            self.assertEqual(check_shared_cache(None), [])
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                               'LOCATION': 'redis://cache:6379/1'}},
+                           ALLOW_PROCESS_LOCAL_CACHE=False):
+            self.assertEqual(check_shared_cache(None), [])
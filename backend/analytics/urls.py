@@ -5,7 +5,8 @@ from .views import (
     DoctorAnalyticsViewSet,
     SystemAnalyticsViewSet,
     ReportViewSet,
-    DashboardViewSet
+    DashboardViewSet,
+    CohortViewSet
 )
 
 router = DefaultRouter()
@@ -14,6 +15,7 @@ router.register(r'doctor-analytics', DoctorAnalyticsViewSet, basename='doctor-an
 router.register(r'system-analytics', SystemAnalyticsViewSet, basename='system-analytics')
 router.register(r'reports', ReportViewSet, basename='reports')
 router.register(r'dashboard', DashboardViewSet, basename='dashboard')
+router.register(r'cohorts', CohortViewSet, basename='cohorts')
 
 app_name = 'analytics'
 
@@ -1,10 +1,15 @@
-from datetime import datetime, timedelta
+import base64
+import binascii
+import time
+from datetime import datetime
+from typing import Optional
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 from django.db.models import Q
 from gitdm.permissions import IsDoctor, IsDoctorAdmin
 from .models import PatientAnalytics, DoctorAnalytics, SystemAnalytics, Report
@@ -15,6 +20,53 @@ from .serializers import (
 )
 from .services import PatientAnalyticsService, DoctorAnalyticsService, SystemAnalyticsService
 from .report_service import ReportGenerationService
+from .dashboard_services import DashboardSummaryService
+from .report_jobs import ACTIVE_STATUSES, ReportJobService
+from .report_writers import iter_csv
+from .downsampling import DOWNSAMPLE_METHODS, MIN_POINTS
+from .cohort import MEDICATION_CLASSES, NUMERIC_METRICS, COMPARISONS, CohortQueryError, get_cohort_index
+
+
+# صفحه‌بندی batch_analytics
+BATCH_PAGE_SIZE = 100
+BATCH_MAX_PAGE_SIZE = 500
+
+# سقف پیش‌فرض و مجاز تعداد نقاط هر سری در پاسخ نمودارها
+CHART_MAX_POINTS = 1000
+CHART_MAX_POINTS_LIMIT = 10000
+
+
+def _encode_cursor(patient_id: int) -> str:
+    """ساخت cursor مات از شناسه آخرین بیمار صفحه"""
+    return base64.urlsafe_b64encode(f'p:{patient_id}'.encode()).decode()
+
+
+def _parse_chart_params(request):
+    """
+    خواندن max_points و method نمودار از query string؛ برای مقدار نامعتبر ValueError.
+    
+    max_points=0 کاهش نقاط را غیرفعال می‌کند.
+    """
+    max_points = int(request.query_params.get('max_points', CHART_MAX_POINTS))
+    method = request.query_params.get('method', 'lttb')
+    if max_points < 0 or max_points > CHART_MAX_POINTS_LIMIT or method not in DOWNSAMPLE_METHODS:
+        raise ValueError('invalid chart parameters')
+    if max_points == 0:
+        return None, method
+    return max(max_points, MIN_POINTS), method
+
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """بازگرداندن شناسه بیمار از cursor؛ برای cursor نامعتبر ValueError"""
+    if not cursor:
+        return None
+    try:
+        prefix, _, value = base64.urlsafe_b64decode(cursor.encode()).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+    if prefix != 'p':
+        raise ValueError('invalid cursor')
+    return int(value)
 
 
 class PatientAnalyticsViewSet(viewsets.ModelViewSet):
@@ -27,9 +79,9 @@ class PatientAnalyticsViewSet(viewsets.ModelViewSet):
         
         # اگر کاربر پزشک است، فقط آنالیتیکس بیماران خودش را ببیند
         if hasattr(user, 'doctor_profile'):
-            doctor = user.doctor_profile
+            # primary_doctor به کاربر پزشک اشاره می‌کند
             return PatientAnalytics.objects.filter(
-                patient__primary_doctor=doctor
+                patient__primary_doctor=user
             ).select_related('patient')
         
         # ادمین‌ها همه را می‌بینند
@@ -75,9 +127,16 @@ class PatientAnalyticsViewSet(viewsets.ModelViewSet):
         analytics = self.get_object()
         patient = analytics.patient
         period = request.query_params.get('period', 'month')
+        try:
+            max_points, method = _parse_chart_params(request)
+        except ValueError:
+            return Response(
+                {'error': 'max_points یا method نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         service = PatientAnalyticsService()
-        chart_data = service.get_glucose_chart_data(patient, period)
+        chart_data = service.get_glucose_chart_data(patient, period, max_points, method)
         
         serializer = ChartDataSerializer(chart_data)
         return Response(serializer.data)
@@ -96,42 +155,55 @@ class PatientAnalyticsViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def batch_analytics(self, request):
-        """دریافت آنالیتیکس برای چند بیمار"""
-        patient_ids = request.query_params.getlist('patient_ids[]')
+        """
+        دریافت آخرین آنالیتیکس چند بیمار.
         
-        if not patient_ids:
-            return Response(
-                {'error': 'patient_ids are required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        با patient_ids[] آخرین رکورد همان بیماران برگردانده می‌شود. بدون آن،
+        کل پنل پزشک با پارامترهای cursor و page_size صفحه‌بندی می‌شود.
+        """
+        patient_ids = request.query_params.getlist('patient_ids[]')
         
-        # فیلتر بر اساس دسترسی
+        # فیلتر بر اساس دسترسی (primary_doctor به کاربر پزشک اشاره می‌کند)
         from gitdm.models import PatientProfile as Patient
-        if hasattr(request.user, 'doctor_profile'):
-            patients = Patient.objects.filter(
-                id__in=patient_ids,
-                primary_doctor=request.user.doctor_profile
-            )
-        elif request.user.is_superuser:
-            patients = Patient.objects.filter(id__in=patient_ids)
+        if request.user.is_superuser:
+            patients = Patient.objects.all()
+        elif hasattr(request.user, 'doctor_profile'):
+            patients = Patient.objects.filter(primary_doctor=request.user)
         else:
             return Response(
                 {'error': 'شما دسترسی به این عملیات ندارید'},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # دریافت آخرین آنالیتیکس هر بیمار
-        analytics_data = []
-        for patient in patients:
-            latest_analytics = PatientAnalytics.objects.filter(
-                patient=patient
-            ).order_by('-date').first()
-            
-            if latest_analytics:
-                analytics_data.append(latest_analytics)
+        service = PatientAnalyticsService()
+        
+        if patient_ids:
+            allowed_ids = list(patients.filter(id__in=patient_ids).values_list('id', flat=True))
+            serializer = PatientAnalyticsSerializer(service.get_latest_patient_analytics(allowed_ids), many=True)
+            return Response(serializer.data)
         
+        try:
+            after_patient_id = _decode_cursor(request.query_params.get('cursor'))
+            page_size = min(int(request.query_params.get('page_size', BATCH_PAGE_SIZE)), BATCH_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response(
+                {'error': 'cursor یا page_size نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if page_size < 1:
+            return Response(
+                {'error': 'cursor یا page_size نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        analytics_data, next_patient_id = service.get_latest_patient_analytics_page(
+            patients, after_patient_id, page_size
+        )
         serializer = PatientAnalyticsSerializer(analytics_data, many=True)
-        return Response(serializer.data)
+        return Response({
+            'results': serializer.data,
+            'next_cursor': _encode_cursor(next_patient_id) if next_patient_id is not None else None,
+        })
 
 
 class DoctorAnalyticsViewSet(viewsets.ModelViewSet):
@@ -194,6 +266,17 @@ class DoctorAnalyticsViewSet(viewsets.ModelViewSet):
         serializer = ChartDataSerializer(chart_data)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def compliance_distribution(self, request, pk=None):
+        """دریافت نمودار توزیع امتیاز پایبندی بیماران"""
+        analytics = self.get_object()
+        
+        service = DoctorAnalyticsService()
+        chart_data = service.get_compliance_distribution_data(analytics.doctor, analytics.date)
+        
+        serializer = ChartDataSerializer(chart_data)
+        return Response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def performance_comparison(self, request):
         """مقایسه عملکرد پزشکان"""
@@ -246,9 +329,16 @@ class SystemAnalyticsViewSet(viewsets.ModelViewSet):
         """دریافت نمودار روند"""
         metric = request.query_params.get('metric', 'users')
         period = request.query_params.get('period', 'month')
+        try:
+            max_points, method = _parse_chart_params(request)
+        except ValueError:
+            return Response(
+                {'error': 'max_points یا method نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         service = SystemAnalyticsService()
-        chart_data = service.get_trend_chart_data(metric, period)
+        chart_data = service.get_trend_chart_data(metric, period, max_points, method)
         
         serializer = ChartDataSerializer(chart_data)
         return Response(serializer.data)
@@ -293,13 +383,24 @@ class ReportViewSet(viewsets.ModelViewSet):
         
         return queryset.select_related('requested_by', 'patient', 'doctor')
     
+    def get_object(self):
+        # job از دست رفته (ری‌استارت worker) به جای pending دائمی، ناموفق نمایش داده می‌شود
+        report = super().get_object()
+        ReportJobService().fail_if_stale(report)
+        return report
+    
     def create(self, request, *args, **kwargs):
-        """ایجاد درخواست گزارش جدید"""
+        """
+        ایجاد درخواست گزارش جدید.
+        
+        گزارش در صف قرار می‌گیرد و پاسخ بلافاصله برمی‌گردد؛ وضعیت و درصد پیشرفت از
+        همین endpoint و فایل نهایی از اکشن download قابل دریافت است.
+        """
         serializer = ReportRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
         # ایجاد گزارش
-        report = Report.objects.create(
+        report = Report(
             report_type=serializer.validated_data['report_type'],
             format=serializer.validated_data['format'],
             requested_by=request.user,
@@ -312,56 +413,96 @@ class ReportViewSet(viewsets.ModelViewSet):
         )
         
         # افزودن بیمار یا پزشک در صورت نیاز
-        if serializer.validated_data.get('patient_id'):
-            patient = get_object_or_404(Patient, id=serializer.validated_data['patient_id'])
-            
-            # بررسی دسترسی
-            if hasattr(request.user, 'doctor_profile'):
-                if patient.primary_doctor != request.user.doctor_profile:
-                    report.delete()
-                    return Response(
-                        {'error': 'شما دسترسی به این بیمار ندارید'},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+        error = self._attach_report_subject(request, report, serializer.validated_data)
+        if error:
+            return error
+        
+        # ذخیره و قرار دادن گزارش در صف تولید با رعایت سقف گزارش‌های همزمان کاربر
+        if not ReportJobService().create(report):
+            return Response(
+                {'error': 'تعداد گزارش‌های در حال تولید شما به حداکثر رسیده است؛ لطفاً پس از تکمیل آن‌ها دوباره تلاش کنید'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+        
+        response_serializer = ReportSerializer(report, context=self.get_serializer_context())
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+    
+    def _attach_report_subject(self, request, report: Report, validated_data: dict) -> Optional[Response]:
+        """تعیین بیمار یا پزشک گزارش پس از بررسی دسترسی؛ در صورت عدم دسترسی پاسخ خطا برمی‌گرداند"""
+        from gitdm.models import PatientProfile as Patient
+        from gitdm.models import DoctorProfile
+        
+        if validated_data.get('patient_id'):
+            patient = get_object_or_404(Patient, id=validated_data['patient_id'])
             
+            # بررسی دسترسی (primary_doctor به کاربر پزشک اشاره می‌کند)
+            if not request.user.is_superuser and patient.primary_doctor_id != request.user.id:
+                return Response(
+                    {'error': 'شما دسترسی به این بیمار ندارید'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
             report.patient = patient
-            report.save()
         
-        if serializer.validated_data.get('doctor_id'):
-            doctor = get_object_or_404(DoctorProfile, id=serializer.validated_data['doctor_id'])
+        if validated_data.get('doctor_id'):
+            doctor = get_object_or_404(DoctorProfile, id=validated_data['doctor_id'])
             
             # بررسی دسترسی
             if not request.user.is_superuser and doctor.user != request.user:
-                report.delete()
                 return Response(
                     {'error': 'شما دسترسی به این پزشک ندارید'},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            
             report.doctor = doctor
-            report.save()
         
-        # شروع پردازش گزارش (می‌تواند با Celery انجام شود)
-        service = ReportGenerationService()
-        try:
-            file_path = service.generate_report(report)
-        except Exception as e:
-            return Response(
-                {'error': f'خطا در تولید گزارش: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        return None
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        خروجی CSV مستقیم بدون ساخت فایل روی سرور.
+        
+        ردیف‌ها هنگام ارسال پاسخ به صورت دسته‌ای از پایگاه داده خوانده می‌شوند،
+        بنابراین مصرف حافظه به حجم گزارش بستگی ندارد.
+        """
+        serializer = ReportRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
         
-        response_serializer = ReportSerializer(report)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        report = Report(
+            report_type=serializer.validated_data['report_type'],
+            format='csv',
+            requested_by=request.user,
+            start_date=serializer.validated_data.get('start_date'),
+            end_date=serializer.validated_data.get('end_date'),
+            metadata={'include_detailed_data': serializer.validated_data.get('include_detailed_data', False)}
+        )
+        error = self._attach_report_subject(request, report, serializer.validated_data)
+        if error:
+            return error
+        
+        try:
+            sections = ReportGenerationService().get_report_sections(report)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(iter_csv(sections), content_type='text/csv; charset=utf-8')
+        filename = f"{report.report_type}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
     
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """دانلود فایل گزارش"""
         report = self.get_object()
         
+        if report.status in ACTIVE_STATUSES:
+            return Response(
+                {'error': 'گزارش هنوز آماده نیست', 'status': report.status, 'progress': report.progress},
+                status=status.HTTP_202_ACCEPTED
+            )
+        
         if report.status != 'completed' or not report.file_path:
             return Response(
-                {'error': 'گزارش هنوز آماده نیست'},
+                {'error': 'گزارش هنوز آماده نیست', 'status': report.status, 'error_message': report.error_message},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
@@ -440,43 +581,9 @@ class DashboardViewSet(viewsets.ViewSet):
         """خلاصه داشبورد برای کاربر فعلی"""
         user = request.user
         
-        from gitdm.models import PatientProfile as Patient
-        from encounters.models import Encounter
-        from notifications.models import ClinicalAlert
         if hasattr(user, 'doctor_profile'):
-            # داشبورد پزشک
-            doctor = user.doctor_profile
-            
-            # آمار امروز
-            today = timezone.now().date()
-            
-            summary_data = {
-                'total_patients': Patient.objects.filter(primary_doctor=doctor).count(),
-                'active_patients': Patient.objects.filter(
-                    primary_doctor=doctor,
-                    encounters__occurred_at__gte=today - timedelta(days=30)
-                ).distinct().count(),
-                'total_encounters_today': Encounter.objects.filter(
-                    created_by=doctor.user,
-                    occurred_at__date=today
-                ).count(),
-                'pending_alerts': ClinicalAlert.objects.filter(
-                    patient__primary_doctor=doctor,
-                    is_acknowledged=False
-                ).count()
-            }
-            
-            # آخرین آنالیتیکس
-            latest_analytics = DoctorAnalytics.objects.filter(
-                doctor=doctor
-            ).order_by('-date').first()
-            
-            if latest_analytics:
-                summary_data.update({
-                    'avg_hba1c': latest_analytics.avg_patient_hba1c or 0,
-                    'goal_achievement_rate': (latest_analytics.patients_at_goal / latest_analytics.active_patients * 100) if latest_analytics.active_patients > 0 else 0,
-                    'performance_score': latest_analytics.performance_score or 0
-                })
+            # داشبورد پزشک (کش شده تا تغییر بعدی داده‌های پزشک)
+            summary_data = DashboardSummaryService().get_summary(user.doctor_profile)
             
         else:
             # داشبورد ادمین
@@ -486,6 +593,11 @@ class DashboardViewSet(viewsets.ViewSet):
         serializer = DashboardSummarySerializer(summary_data)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsDoctorAdmin])
+    def summary_cache_stats(self, request):
+        """آمار کش خلاصه داشبورد (hit، miss و باطل‌سازی)؛ فقط برای ادمین‌ها"""
+        return Response(DashboardSummaryService().get_metrics())
+    
     @action(detail=False, methods=['get'])
     def widgets(self, request):
         """دریافت ویجت‌های داشبورد"""
@@ -542,4 +654,72 @@ class DashboardViewSet(viewsets.ViewSet):
                 }
             ]
         
-        return Response(widgets)
\ No newline at end of file
+        return Response(widgets)
+
+
+class CohortViewSet(viewsets.ViewSet):
+    """
+    جستجوی گروه بیماران (cohort) با شرط‌های ترکیبی روی شاخص‌های پیش‌محاسبه شده.
+    
+    پزشکان فقط بیماران خود را می‌بینند؛ پزشکان ادمین و superuser کل بیماران را.
+    """
+    permission_classes = [IsAuthenticated, IsDoctor]
+    
+    @staticmethod
+    def _sees_all_patients(user) -> bool:
+        if user.is_superuser:
+            return True
+        doctor_profile = getattr(user, 'doctor_profile', None)
+        return doctor_profile is not None and doctor_profile.role == doctor_profile.DoctorRole.ADMIN
+    
+    @action(detail=False, methods=['post'])
+    def query(self, request):
+        """
+        اجرای شرط cohort و برگرداندن شناسه بیماران با صفحه‌بندی cursor.
+        
+        بدنه: {"predicate": {...}, "cursor": "...", "page_size": 100}
+        """
+        predicate = request.data.get('predicate')
+        if not predicate:
+            return Response({'error': 'predicate الزامی است'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            after_patient_id = _decode_cursor(request.data.get('cursor'))
+            page_size = min(int(request.data.get('page_size', BATCH_PAGE_SIZE)), BATCH_MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'cursor یا page_size نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if page_size < 1:
+            return Response(
+                {'error': 'cursor یا page_size نامعتبر است'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        doctor_user_id = None if self._sees_all_patients(request.user) else request.user.id
+        started = time.perf_counter()
+        try:
+            result = get_cohort_index().query(predicate, doctor_user_id, after_patient_id, page_size)
+        except CohortQueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'count': result['count'],
+            'patient_ids': result['patient_ids'],
+            'next_cursor': _encode_cursor(result['next_after']) if result['next_after'] is not None else None,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def metrics(self, request):
+        """شاخص‌ها، عملگرها و گروه‌های دارویی قابل استفاده در شرط‌ها"""
+        return Response({
+            'metrics': list(NUMERIC_METRICS),
+            'operators': list(COMPARISONS) + ['between', 'is_null'],
+            'med_class': {
+                'operators': ['has', 'has_any', 'lacks'],
+                'classes': list(MEDICATION_CLASSES),
+            },
+            'combinators': ['all', 'any', 'not'],
+        })
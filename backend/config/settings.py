@@ -2,6 +2,7 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
 from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -112,12 +113,28 @@ DATABASES = {
 # ------------------------
 # Cache - Django Default
 # ------------------------
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# In-process structures (lab series, cohort index, reference index) and the dashboard
+# summaries are invalidated through version counters in this cache, so every web and
+# worker process must share it. Set DJANGO_CACHE_URL (redis://...) when running more
+# than one process; LocMemCache is only correct for a single process.
+DJANGO_CACHE_URL = os.getenv('DJANGO_CACHE_URL', '')
+if DJANGO_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': DJANGO_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
     }
-}
+
+# Outside DEBUG a process-local cache is a startup error (analytics.E001) unless allowed here
+ALLOW_PROCESS_LOCAL_CACHE = os.getenv('DJANGO_ALLOW_LOCAL_CACHE', str(DEBUG)).lower() in ('true', '1', 'yes')
 
 # ------------------------
 # Background Tasks - Disabled for Simplified Setup
@@ -126,6 +143,31 @@ CACHES = {
 # Background tasks are disabled. For production, consider re-enabling
 # Celery with Redis broker for async task processing.
 
+# Synthetic benchmark data (seed_benchmark_data, run_analytics_benchmark); dedicated databases only
+ALLOW_ANALYTICS_BENCHMARK = os.getenv('DJANGO_ALLOW_BENCHMARK', str(DEBUG)).lower() in ('true', '1', 'yes')
+
+# API report jobs run on their own queue; its worker count caps concurrent report generation
+CELERY_TASK_ROUTES = {
+    'analytics.tasks.generate_report_job': {'queue': 'reports'},
+}
+
+# Periodic tasks, used when Celery beat is re-enabled
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-cohort-index': {
+        'task': 'analytics.tasks.rebuild_cohort_index',
+        'schedule': crontab(hour=3, minute=0),  # Nightly at 3 AM
+    },
+    # Refresh before the 5-minute freshness window of the cached overview runs out
+    'fail-stale-report-jobs': {
+        'task': 'analytics.tasks.fail_stale_report_jobs',
+        'schedule': crontab(minute='*/15'),
+    },
+    'refresh-system-overview-cache': {
+        'task': 'analytics.tasks.refresh_system_overview_cache',
+        'schedule': crontab(minute='*/4'),
+    },
+}
+
 # ------------------------
 # REST Framework
 # ------------------------
@@ -173,12 +215,22 @@ MEDIA_ROOT = BASE_DIR / 'media'
 GAPGPT_API_KEY = os.getenv('GAPGPT_API_KEY')
 GAPGPT_BASE_URL = os.getenv('GAPGPT_BASE_URL', 'https://api.gapgpt.app/v1')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# OpenAI-compatible endpoint, e.g. the local stand-in (manage.py run_llm_standin) for load tests
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
 
 AI_SUMMARIZER_SETTINGS = {
     'MODEL': os.getenv('AI_MODEL', 'gpt-4o'),
     'MAX_TOKENS': int(os.getenv('AI_MAX_TOKENS', '1000')),
     'TEMPERATURE': float(os.getenv('AI_TEMPERATURE', '0.3')),
     'USE_GAPGPT': os.getenv('USE_GAPGPT', 'True').lower() in ('true', '1', 'yes'),
+    # Batch generation limits (generate_summaries)
+    'BATCH_CONCURRENCY': int(os.getenv('AI_BATCH_CONCURRENCY', '8')),
+    'REQUESTS_PER_MINUTE': int(os.getenv('AI_REQUESTS_PER_MINUTE', '500')),
+    'TOKENS_PER_MINUTE': int(os.getenv('AI_TOKENS_PER_MINUTE', '200000')),
+    'MAX_RETRIES': int(os.getenv('AI_MAX_RETRIES', '4')),
+    # Content-hash summary cache (SummaryCacheEntry) and in-process LRU entries (0 disables the LRU)
+    'CACHE_ENABLED': os.getenv('AI_SUMMARY_CACHE', 'True').lower() in ('true', '1', 'yes'),
+    'CACHE_LRU_SIZE': int(os.getenv('AI_SUMMARY_CACHE_LRU_SIZE', '1024')),
     'SYSTEM_PROMPT': """You are a medical AI assistant specialized in creating concise, accurate summaries of patient medical data.
 Focus on key clinical information, diagnoses, medications, and important findings.
 Keep summaries professional, clear, and relevant for healthcare providers."""  # noqa: E501
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Words of the summarized content echoed into the deterministic summary
+SUMMARY_WORDS = 40
+RECORD_MARKER = 'medical information:\n\n'
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StandInConfig:
+    """
+    Behaviour of the stand-in server.
+
+    Response latency is log-normal with median `latency_ms` and spread `latency_sigma`
+    (0 gives a constant latency); streamed responses pay it before the first chunk and
+    `token_delay_ms` between chunks. `rate_limit_rate` and `error_rate` are the share of
+    requests answered with 429 and 500; `requests_per_minute` (0 = unlimited) adds a
+    real token-bucket limit that answers 429 when exceeded. The same seed gives the
+    same sequence of latencies and injected failures.
+    """
+    latency_ms: float = 200.0
+    latency_sigma: float = 0.5
+    token_delay_ms: float = 10.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    requests_per_minute: int = 0
+    retry_after: float = 1.0
+    seed: int = 0
+
+
+def deterministic_summary(messages: List[Dict[str, str]]) -> str:
+    """Same messages always produce the same summary"""
+    content = messages[-1]['content'] if messages else ''
+    # The record itself follows the instruction line (see OpenAIService.build_messages)
+    record = content.split(RECORD_MARKER, 1)[-1]
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()[:8]
+    words = record.split()
+    excerpt = ' '.join(words[:SUMMARY_WORDS]) + (' ...' if len(words) > SUMMARY_WORDS else '')
+    return f"Summary [{digest}]: {excerpt}"
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            return self._send_json(200, {'object': 'list', 'data': [{'id': 'standin', 'object': 'model'}]})
+        self._send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'invalid JSON', 'type': 'invalid_request_error'}})
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+        server: 'StandInLLMServer' = self.server
+        messages = body.get('messages') or []
+        with server.track(messages[-1].get('content', '') if messages else '') as attempt:
+            outcome, latency = server.decide(*attempt)
+            time.sleep(latency)
+            self._respond(body, messages, outcome)
+
+    def _respond(self, body: Dict, messages: List[Dict[str, str]], outcome: int):
+        server: 'StandInLLMServer' = self.server
+        if outcome == 429:
+            return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_exceeded'}},
+                                   {'Retry-After': str(server.config.retry_after)})
+        if outcome == 500:
+            return self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+
+        summary = deterministic_summary(messages)
+        model = body.get('model', 'standin')
+        usage = {
+            'prompt_tokens': sum(_count_tokens(message.get('content', '')) for message in messages),
+            'completion_tokens': _count_tokens(summary),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if body.get('stream'):
+            return self._stream(model, summary, usage, (body.get('stream_options') or {}).get('include_usage'))
+        self._send_json(200, {
+            'id': 'chatcmpl-standin', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': summary}}],
+            'usage': usage,
+        })
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model: str, summary: str, usage: Dict, include_usage: bool):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        base = {'id': 'chatcmpl-standin', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        words = summary.split(' ')
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(self.server.config.token_delay_ms / 1000)
+            piece = word if index == 0 else ' ' + word
+            self._event({**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+        self._event({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if include_usage:
+            self._event({**base, 'choices': [], 'usage': usage})
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _event(self, payload: Dict):
+        self.wfile.write(f'data: {json.dumps(payload)}\n\n'.encode())
+        self.wfile.flush()
+
+
+class StandInLLMServer(ThreadingHTTPServer):
+    """
+    Local HTTP server speaking the OpenAI chat-completions protocol, for load tests
+    and CI without network access or API credits.
+
+    Point OpenAIService at it with OPENAI_API_KEY set to any value and
+    OPENAI_BASE_URL set to `base_url`.
+
+    `inject` is called with the last message of each request and how many times that
+    message has been sent (1 for the first attempt); returning 429 or 500 answers the
+    request with that error instead of the configured behaviour. `attempts` and
+    `max_in_flight` record what the server has seen.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[StandInConfig] = None,
+                 inject: Optional[Callable[[str, int], Optional[int]]] = None):
+        super().__init__((host, port), _Handler)
+        self.config = config or StandInConfig()
+        self.inject = inject
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._bucket_tokens = float(self.config.requests_per_minute)
+        self._bucket_updated = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+        self.counts = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'errors': 0}
+        self.attempts: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def _within_rate_limit(self) -> bool:
+        if not self.config.requests_per_minute:
+            return True
+        now = time.monotonic()
+        rate = self.config.requests_per_minute / 60.0
+        self._bucket_tokens = min(float(self.config.requests_per_minute),
+                                  self._bucket_tokens + (now - self._bucket_updated) * rate)
+        self._bucket_updated = now
+        if self._bucket_tokens >= 1:
+            self._bucket_tokens -= 1
+            return True
+        return False
+
+    @contextmanager
+    def track(self, content: str) -> Iterator[Tuple[str, int]]:
+        """Count a request as in flight while it is answered; yields (content, attempt)"""
+        with self._lock:
+            attempt = self.attempts[content] = self.attempts.get(content, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield content, attempt
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def reset(self) -> None:
+        """Forget counters and attempts (between tests sharing one server)"""
+        with self._lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+            self.attempts = {}
+            self.max_in_flight = self.in_flight
+
+    def decide(self, content: str = '', attempt: int = 1) -> Tuple[int, float]:
+        """(status to answer with, latency in seconds) for the next request"""
+        config = self.config
+        injected = self.inject(content, attempt) if self.inject else None
+        with self._lock:
+            self.counts['requests'] += 1
+            draw = self._random.random()
+            latency = config.latency_ms / 1000
+            if config.latency_sigma:
+                latency *= math.exp(config.latency_sigma * self._random.gauss(0, 1))
+
+            if injected == 429:
+                self.counts['rate_limited'] += 1
+                return 429, min(latency, 0.01)
+            if injected == 500:
+                self.counts['errors'] += 1
+                return 500, latency
+            if not self._within_rate_limit() or draw < config.rate_limit_rate:
+                self.counts['rate_limited'] += 1
+                # Rejections are cheap for a real provider too
+                return 429, min(latency, 0.01)
+            if draw < config.rate_limit_rate + config.error_rate:
+                self.counts['errors'] += 1
+                return 500, latency
+            self.counts['ok'] += 1
+            return 200, latency
+
+    def start(self) -> 'StandInLLMServer':
+        """Serve from a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name='llm-standin', daemon=True)
+        self._thread.start()
+        logger.info(f"LLM stand-in listening on {self.base_url} ({asdict(self.config)})")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'StandInLLMServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,168 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings
+
+from .llm_standin import StandInConfig, StandInLLMServer
+from .services import OpenAIService
+from .summary_batch import BatchSummaryGenerator, SummaryRequest
+
+logger = logging.getLogger(__name__)
+
+MODES = ('batch', 'threads', 'stream')
+PERCENTILES = (50, 90, 95, 99)
+
+_NOTE_SENTENCES = [
+    'Patient reports polyuria and fatigue over the last {weeks} weeks.',
+    'HbA1c {hba1c}% compared with {previous}% at the previous visit.',
+    'Fasting glucose {glucose} mg/dL; no hypoglycemic episodes reported.',
+    'Continues metformin {dose} mg twice daily with good adherence.',
+    'Blood pressure {systolic}/{diastolic} mmHg, BMI {bmi}.',
+    'Foot exam normal; retinal screening due in {months} months.',
+    'Plan: reinforce diet counseling and recheck labs in {months} months.',
+]
+
+
+def synthetic_notes(count: int, chars: int, seed: int = 0) -> List[str]:
+    """Deterministic, distinct clinical notes of roughly `chars` characters"""
+    rng = random.Random(seed)
+    notes = []
+    for index in range(count):
+        parts = [f'Visit note #{index}.']
+        while sum(len(part) + 1 for part in parts) < chars:
+            parts.append(rng.choice(_NOTE_SENTENCES).format(
+                weeks=rng.randint(1, 12), hba1c=round(rng.uniform(5.5, 12), 1),
+                previous=round(rng.uniform(5.5, 12), 1), glucose=rng.randint(70, 320),
+                dose=rng.choice([500, 850, 1000]), systolic=rng.randint(110, 170),
+                diastolic=rng.randint(65, 100), bmi=round(rng.uniform(20, 40), 1), months=rng.choice([3, 6, 12]),
+            ))
+        notes.append(' '.join(parts))
+    return notes
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Percentiles and max in milliseconds"""
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    summary = {f'p{p}': round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+    summary['max'] = round(float(values.max()), 1)
+    summary['mean'] = round(float(values.mean()), 1)
+    return summary
+
+
+class SummaryLoadTest:
+    """
+    End-to-end load test of summary generation through OpenAIService.
+
+    Modes:
+        batch: generate_summaries (async client, rate limiter, retries)
+        threads: generate_summary from `concurrency` threads (the per-record path)
+        stream: stream_summary from `concurrency` threads, also measuring time to first token
+
+    With `standin` set, an in-process StandInLLMServer is started and OpenAIService is
+    pointed at it for the duration of the run; otherwise the configured provider is used
+    (e.g. OPENAI_BASE_URL of a separately started `manage.py run_llm_standin`). The
+    summary cache is disabled unless `use_cache` is set, so every item reaches the API.
+    """
+
+    def __init__(self, items: int = 200, concurrency: int = 16, mode: str = 'batch', content_chars: int = 1200,
+                 seed: int = 0, standin: Optional[StandInConfig] = None, use_cache: bool = False):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}')
+        self.items = items
+        self.concurrency = concurrency
+        self.mode = mode
+        self.content_chars = content_chars
+        self.seed = seed
+        self.standin = standin
+        self.use_cache = use_cache
+
+    def run(self) -> Dict:
+        notes = synthetic_notes(self.items, self.content_chars, self.seed)
+        with ExitStack() as stack:
+            ai_settings = {**settings.AI_SUMMARIZER_SETTINGS, 'CACHE_ENABLED': self.use_cache}
+            server = None
+            if self.standin is not None:
+                server = stack.enter_context(StandInLLMServer(config=self.standin))
+                ai_settings['USE_GAPGPT'] = False
+                stack.enter_context(override_settings(
+                    OPENAI_API_KEY='standin', OPENAI_BASE_URL=server.base_url
+                ))
+            stack.enter_context(override_settings(AI_SUMMARIZER_SETTINGS=ai_settings))
+
+            started = time.monotonic()
+            result = getattr(self, f'_run_{self.mode}')(notes)
+            elapsed = time.monotonic() - started
+
+            result.update({
+                'mode': self.mode,
+                'items': self.items,
+                'concurrency': self.concurrency,
+                'elapsed_seconds': round(elapsed, 3),
+                'throughput_per_second': round(self.items / elapsed, 2) if elapsed else None,
+            })
+            if server is not None:
+                result['server'] = dict(server.counts)
+        return result
+
+    def _run_batch(self, notes: List[str]) -> Dict:
+        generator = BatchSummaryGenerator(OpenAIService(), concurrency=self.concurrency)
+        generator.run([SummaryRequest(content=note) for note in notes])
+        return {
+            'latency_ms': latency_summary(generator.stats.latencies),
+            'generated': generator.stats.generated,
+            'fallbacks': generator.stats.fallbacks,
+            'retries': generator.stats.retries,
+        }
+
+    def _run_threads(self, notes: List[str]) -> Dict:
+        service = OpenAIService()
+
+        def summarize(note):
+            try:
+                started = time.monotonic()
+                summary = service.generate_summary(note)
+                return time.monotonic() - started, summary == service.fallback_summary(note)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(summarize, notes))
+        fallbacks = sum(1 for _, fallback in results if fallback)
+        return {
+            'latency_ms': latency_summary([latency for latency, _ in results]),
+            'generated': len(results) - fallbacks,
+            'fallbacks': fallbacks,
+        }
+
+    def _run_stream(self, notes: List[str]) -> Dict:
+        service = OpenAIService()
+
+        def summarize(note):
+            started = time.monotonic()
+            first = None
+            try:
+                for _ in service.stream_summary(note):
+                    if first is None:
+                        first = time.monotonic() - started
+                return first, time.monotonic() - started, None
+            except Exception as e:
+                return first, time.monotonic() - started, e
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(summarize, notes))
+        return {
+            'time_to_first_token_ms': latency_summary([first for first, _, _ in results if first is not None]),
+            'latency_ms': latency_summary([total for _, total, _ in results]),
+            'errors': sum(1 for _, _, error in results if error is not None),
+        }
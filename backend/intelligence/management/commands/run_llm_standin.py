@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from intelligence.llm_standin import StandInConfig, StandInLLMServer
+
+
+def add_standin_arguments(parser):
+    """گزینه‌های رفتار سرور جایگزین (مشترک با run_summary_load_test)"""
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='میانه تأخیر پاسخ (میلی‌ثانیه)')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='پراکندگی توزیع log-normal تأخیر')
+    parser.add_argument('--token-delay-ms', type=float, default=10.0, help='فاصله بخش‌های پاسخ استریم')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='سهم پاسخ‌های 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='سهم پاسخ‌های 429')
+    parser.add_argument('--rpm', type=int, default=0, help='سقف درخواست در دقیقه (0 یعنی نامحدود)')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='مقدار Retry-After پاسخ‌های 429')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def standin_config(options) -> StandInConfig:
+    return StandInConfig(
+        latency_ms=options['latency_ms'],
+        latency_sigma=options['latency_sigma'],
+        token_delay_ms=options['token_delay_ms'],
+        error_rate=options['error_rate'],
+        rate_limit_rate=options['rate_limit_rate'],
+        requests_per_minute=options['rpm'],
+        retry_after=options['retry_after'],
+        seed=options['seed'],
+    )
+
+
+class Command(BaseCommand):
+    help = 'اجرای سرور محلی سازگار با chat completions برای تست بار بدون مصرف اعتبار API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        add_standin_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = StandInLLMServer(options['host'], options['port'], standin_config(options))
+        self.stdout.write(self.style.SUCCESS(
+            f'سرور جایگزین روی {server.base_url} اجرا شد؛ OPENAI_BASE_URL={server.base_url} و '
+            f'OPENAI_API_KEY دلخواه تنظیم شود (USE_GAPGPT=false)'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'درخواست‌ها: {server.counts}')
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from intelligence.load_test import MODES, SummaryLoadTest
+from .run_llm_standin import add_standin_arguments, standin_config
+
+
+class Command(BaseCommand):
+    help = 'اندازه‌گیری توان عملیاتی و تأخیر انتهایی تولید خلاصه‌های هوش مصنوعی'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default='batch')
+        parser.add_argument('--items', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--content-chars', type=int, default=1200)
+        parser.add_argument('--use-cache', action='store_true', help='فعال نگه داشتن کش خلاصه‌ها')
+        parser.add_argument('--standin', action='store_true',
+                            help='اجرای سرور جایگزین درون همین فرایند به جای سرویس تنظیم شده')
+        parser.add_argument('--json', action='store_true', help='خروجی JSON')
+        add_standin_arguments(parser)
+
+    def handle(self, *args, **options):
+        result = SummaryLoadTest(
+            items=options['items'],
+            concurrency=options['concurrency'],
+            mode=options['mode'],
+            content_chars=options['content_chars'],
+            seed=options['seed'],
+            standin=standin_config(options) if options['standin'] else None,
+            use_cache=options['use_cache'],
+        ).run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['mode']}: {result['items']} items, concurrency {result['concurrency']} -> "
+            f"{result['elapsed_seconds']}s ({result['throughput_per_second']}/s)"
+        )
+        for name in ('latency_ms', 'time_to_first_token_ms'):
+            if result.get(name):
+                values = '  '.join(f'{key}={value}' for key, value in result[name].items())
+                self.stdout.write(f'{name:<24} {values}')
+        for name in ('generated', 'fallbacks', 'retries', 'errors', 'server'):
+            if name in result:
+                self.stdout.write(f'{name:<24} {result[name]}')
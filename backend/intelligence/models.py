@@ -60,6 +60,30 @@ class AISummary(models.Model):
         return f"AI Summary for {self.patient.full_name} - {self.content_type.model}"
 
 
+
+class SummaryCacheEntry(models.Model):
+    """
+    خلاصه تولید شده برای یک محتوا، با کلید hash ورودی‌های درخواست (intelligence.summary_cache).
+
+    محتوای یکسان با همان context، نوع خلاصه، مدل و نسخه prompt دوباره به API فرستاده نمی‌شود.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    summary_type = models.CharField(max_length=32)
+    model = models.CharField(max_length=100)
+    summary = models.TextField()
+    # مصرف توکن تولید اصلی؛ هر hit همین مقدار صرفه‌جویی است
+    total_tokens = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Summary Cache Entry"
+        verbose_name_plural = "Summary Cache Entries"
+
+    def __str__(self) -> str:
+        return f"{self.summary_type} summary {self.key[:12]} ({self.hits} hits)"
+
 class BaselineMetrics(models.Model):
     """
     معیارهای پایه برای هر بیمار جهت مقایسه با داده‌های جدید
@@ -0,0 +1,163 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from references.models import ClinicalReference
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_INDEX_VERSION_KEY = 'intelligence:reference_index:version'
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Title terms count this many times in a reference's document (field boost)
+TITLE_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"\w+(?:-\w+)*")
+
+# Topic -> keywords a summary on that topic tends to mention. Each reference is indexed with
+# the keywords of its topic, since references have no keyword field of their own.
+TOPIC_KEYWORDS = {
+    'diabetes': ['diabetes', 'hba1c', 'metformin', 'insulin', 'sglt2', 'glp-1'],
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens; hyphenated terms (glp-1) also yield their parts"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if '-' in token:
+            tokens.extend(part for part in token.split('-') if part)
+    return tokens
+
+
+def topic_keywords(topic: str) -> List[str]:
+    topic = topic.lower()
+    return [keyword for name, keywords in TOPIC_KEYWORDS.items() if name in topic for keyword in keywords]
+
+
+class _Postings:
+    """Inverted index of one library version: token -> (document rows, BM25 weights)"""
+
+    def __init__(self, references: List[Tuple[int, str, str]]):
+        self.ids = np.array([ref_id for ref_id, _, _ in references], dtype=np.int64)
+        self.topics = [topic.lower() for _, _, topic in references]
+        self._topic_masks: Dict[str, np.ndarray] = {}
+
+        documents = [
+            tokenize(title) * TITLE_WEIGHT + tokenize(topic) + tokenize(' '.join(topic_keywords(topic)))
+            for _, title, topic in references
+        ]
+        lengths = np.array([len(document) for document in documents], dtype=np.float64)
+        average = lengths.mean() if len(lengths) else 0.0
+
+        rows: Dict[str, List[int]] = defaultdict(list)
+        frequencies: Dict[str, List[int]] = defaultdict(list)
+        for row, document in enumerate(documents):
+            for token, count in Counter(document).items():
+                rows[token].append(row)
+                frequencies[token].append(count)
+
+        count = len(documents)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for token, token_rows in rows.items():
+            token_rows = np.array(token_rows, dtype=np.int64)
+            tf = np.array(frequencies[token], dtype=np.float64)
+            idf = math.log(1 + (count - len(token_rows) + 0.5) / (len(token_rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[token_rows] / average)
+            self.postings[token] = (token_rows, idf * tf * (BM25_K1 + 1) / (tf + norm))
+
+    def topic_mask(self, topic_hint: str) -> np.ndarray:
+        """References whose topic contains the hint (same rule as topic__icontains)"""
+        hint = topic_hint.lower()
+        mask = self._topic_masks.get(hint)
+        if mask is None:
+            mask = np.array([hint in topic for topic in self.topics], dtype=bool)
+            self._topic_masks[hint] = mask
+        return mask
+
+    def search(self, tokens: List[str], topic_hint: Optional[str], limit: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(len(self.ids))
+        for token in set(tokens):
+            posting = self.postings.get(token)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        if topic_hint:
+            scores[~self.topic_mask(topic_hint)] = 0
+
+        matched = np.flatnonzero(scores > 0)
+        # Stable sort keeps the model ordering (newest first) between equal scores
+        ranked = matched[np.argsort(-scores[matched], kind='stable')][:limit]
+        return [(int(self.ids[row]), float(scores[row])) for row in ranked]
+
+
+class ReferenceIndex:
+    """
+    In-memory BM25 index over the clinical reference library.
+
+    Built lazily on first use from title, topic and topic keywords of every reference,
+    so linking ranks the whole library instead of scanning the first rows of one topic.
+    Saving or deleting a ClinicalReference bumps a version counter in the shared cache
+    (signals) and each process rebuilds its index on the next search; bulk queryset
+    updates bypass signals and need ReferenceIndex.notify().
+    """
+
+    def __init__(self):
+        self._postings: Optional[_Postings] = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def notify() -> None:
+        """Mark every process's index stale (now and again after commit)"""
+        def bump():
+            cache.add(REFERENCE_INDEX_VERSION_KEY, 0, None)
+            try:
+                cache.incr(REFERENCE_INDEX_VERSION_KEY)
+            except ValueError:
+                cache.set(REFERENCE_INDEX_VERSION_KEY, 1, None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    def postings(self) -> _Postings:
+        version = cache.get(REFERENCE_INDEX_VERSION_KEY, 0)
+        with self._lock:
+            if self._postings is None or self._version != version:
+                references = list(ClinicalReference.objects.values_list('id', 'title', 'topic'))
+                self._postings = _Postings(references)
+                self._version = version
+                logger.info(f"Built clinical reference index over {len(references)} references")
+            return self._postings
+
+    def search(self, text: str, topic_hint: Optional[str] = None, limit: int = 3) -> List[Tuple[int, float]]:
+        """(reference id, score) of the best matching references, best first"""
+        return self.postings().search(tokenize(text), topic_hint, limit)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings = None
+            self._version = None
+
+
+_index: Optional[ReferenceIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_reference_index() -> ReferenceIndex:
+    """Process-wide index instance"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReferenceIndex()
+        return _index
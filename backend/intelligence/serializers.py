@@ -54,10 +54,15 @@ class CreateAISummarySerializer(serializers.Serializer):
         default=True,
         help_text="Process summary asynchronously using background task"
     )
+    stream = serializers.BooleanField(
+        default=False,
+        help_text="Stream the summary as Server-Sent Events while it is generated"
+    )
 
     def create(self, validated_data):
         """Create AI summary using background task or synchronously"""
         async_processing = validated_data.pop('async_processing', True)
+        validated_data.pop('stream', None)
 
         if async_processing:
             # Process asynchronously using Celery task
@@ -112,6 +117,10 @@ class RegenerateAISummarySerializer(serializers.Serializer):
         ],
         default='medical_record'
     )
+    stream = serializers.BooleanField(
+        default=False,
+        help_text="Stream the regenerated summary as Server-Sent Events"
+    )
 
     def validate_summary_id(self, value):
         """Validate that the summary exists"""
@@ -1,39 +1,41 @@
+import json
 import logging
 import statistics
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from decimal import Decimal
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q, Avg, Count, StdDev
 from .models import AISummary, BaselineMetrics, PatternAnalysis, AnomalyDetection, PatternAlert
 from references.models import ClinicalReference
 from laboratory.models import LabResult
 from encounters.models import Encounter
 from pharmacy.models import MedicationOrder as Medication
+from analytics.lab_series import get_lab_series_store
+from .summary_batch import BatchSummaryGenerator, SummaryRequest
+from .summary_cache import SummaryCache, make_cache_key
+from .reference_index import get_reference_index
 import openai
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
-TOPIC_KEYWORDS = {
-    'diabetes': ['diabetes','hba1c','metformin','insulin','sglt2','glp-1'],
-}
-
 class OpenAIService:
     """Service class for AI GPT integration (supports both GapGPT and OpenAI APIs)"""
 
     def __init__(self):
         self.client = None
         self.api_provider = None
+        self.client_options = None
 
         # Prefer GapGPT if configured and enabled
         if settings.AI_SUMMARIZER_SETTINGS['USE_GAPGPT'] and settings.GAPGPT_API_KEY:
             try:
-                self.client = openai.OpenAI(
-                    base_url=settings.GAPGPT_BASE_URL,
-                    api_key=settings.GAPGPT_API_KEY
-                )
+                options = {'base_url': settings.GAPGPT_BASE_URL, 'api_key': settings.GAPGPT_API_KEY}
+                self.client = openai.OpenAI(**options)
+                self.client_options = options
                 self.api_provider = 'GapGPT'
                 logger.info("Initialized GapGPT client")
             except Exception as e:
@@ -43,7 +45,11 @@ class OpenAIService:
         if not self.client and settings.OPENAI_API_KEY:
             try:
                 openai.api_key = settings.OPENAI_API_KEY
-                self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+                options = {'api_key': settings.OPENAI_API_KEY}
+                if getattr(settings, 'OPENAI_BASE_URL', None):
+                    options['base_url'] = settings.OPENAI_BASE_URL
+                self.client = openai.OpenAI(**options)
+                self.client_options = options
                 self.api_provider = 'OpenAI'
                 logger.info("Initialized OpenAI client")
             except Exception as e:
@@ -52,6 +58,39 @@ class OpenAIService:
         if not self.client:
             logger.warning("No AI client configured. Summaries will use fallback truncation.")
 
+    def create_async_client(self) -> Optional['openai.AsyncOpenAI']:
+        """
+        New async client for the configured provider, or None when no provider is configured.
+
+        Retries are disabled on the client because batch generation retries with its own
+        backoff and rate limiting. A new client is created per event loop.
+        """
+        if not self.client_options:
+            return None
+        return openai.AsyncOpenAI(**self.client_options, max_retries=0)
+
+    @staticmethod
+    def fallback_summary(content: str) -> str:
+        """Truncated content used when the AI provider is unavailable or fails"""
+        return content[:500] + "..." if len(content) > 500 else content
+
+    def build_messages(self, content: str, context: Optional[str], summary_type: str) -> List[Dict[str, str]]:
+        """Chat messages for one summary request"""
+        user_message = f"Please summarize the following medical information:\n\n{content}"
+        if context:
+            user_message = f"Patient Context: {context}\n\n{user_message}"
+        return [
+            {"role": "system", "content": self._get_system_prompt(summary_type)},
+            {"role": "user", "content": user_message}
+        ]
+
+    def cache_key(self, content: str, context: Optional[str], summary_type: str) -> str:
+        """Summary cache key for a request (see intelligence.summary_cache)"""
+        return make_cache_key(
+            content, context, summary_type,
+            settings.AI_SUMMARIZER_SETTINGS['MODEL'], self._get_system_prompt(summary_type)
+        )
+
     def generate_summary(
         self,
         content: str,
@@ -69,39 +108,128 @@ class OpenAIService:
         Returns:
             Generated summary text
         """
+        cache = SummaryCache() if SummaryCache.enabled() else None
+        if cache is not None:
+            key = self.cache_key(content, context, summary_type)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info(f"Using cached {summary_type} summary for content of {len(content)} characters")
+                return cached
+
         if not self.client:
             logger.warning("AI client not configured. Falling back to truncated content.")
-            return content[:500] + "..." if len(content) > 500 else content
+            return self.fallback_summary(content)
 
         try:
-            # Build system prompt based on summary type
-            system_prompt = self._get_system_prompt(summary_type)
-
-            # Build user message
-            user_message = f"Please summarize the following medical information:\n\n{content}"
-            if context:
-                user_message = f"Patient Context: {context}\n\n{user_message}"
-
             logger.info(f"Generating summary using {self.api_provider} with model {settings.AI_SUMMARIZER_SETTINGS['MODEL']}")
 
             response = self.client.chat.completions.create(
                 model=settings.AI_SUMMARIZER_SETTINGS['MODEL'],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+                messages=self.build_messages(content, context, summary_type),
                 max_tokens=settings.AI_SUMMARIZER_SETTINGS['MAX_TOKENS'],
                 temperature=settings.AI_SUMMARIZER_SETTINGS['TEMPERATURE']
             )
 
             summary = response.choices[0].message.content.strip()
+            if cache is not None:
+                usage = getattr(response, 'usage', None)
+                cache.set(
+                    key, summary, summary_type, settings.AI_SUMMARIZER_SETTINGS['MODEL'],
+                    total_tokens=getattr(usage, 'total_tokens', 0) or 0
+                )
             logger.info(f"Generated summary of {len(summary)} characters for content of {len(content)} characters using {self.api_provider}")
             return summary
 
         except Exception as e:
             logger.error(f"Error generating {self.api_provider} summary: {str(e)}")
             # Fallback to truncated content
-            return content[:500] + "..." if len(content) > 500 else content
+            return self.fallback_summary(content)
+
+    def stream_summary(
+        self,
+        content: str,
+        context: Optional[str] = None,
+        summary_type: str = "medical_record"
+    ) -> Iterator[str]:
+        """
+        Generate a summary with the streaming API, yielding text deltas as they arrive
+
+        A cached summary or the fallback truncation is yielded as a single chunk. The
+        complete text is cached once the stream finishes. An error after the first delta
+        is re-raised so callers do not persist a partial summary.
+
+        Args:
+            content: The text content to summarize
+            context: Optional context about the patient or medical scenario
+            summary_type: Type of summary to generate
+
+        Yields:
+            Summary text fragments
+        """
+        cache = SummaryCache() if SummaryCache.enabled() else None
+        if cache is not None:
+            key = self.cache_key(content, context, summary_type)
+            cached = cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        if not self.client:
+            logger.warning("AI client not configured. Falling back to truncated content.")
+            yield self.fallback_summary(content)
+            return
+
+        parts = []
+        usage = None
+        try:
+            stream = self.client.chat.completions.create(
+                model=settings.AI_SUMMARIZER_SETTINGS['MODEL'],
+                messages=self.build_messages(content, context, summary_type),
+                max_tokens=settings.AI_SUMMARIZER_SETTINGS['MAX_TOKENS'],
+                temperature=settings.AI_SUMMARIZER_SETTINGS['TEMPERATURE'],
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            logger.error(f"Error streaming {self.api_provider} summary: {str(e)}")
+            if parts:
+                raise
+            yield self.fallback_summary(content)
+            return
+
+        summary = ''.join(parts).strip()
+        if cache is not None and summary:
+            cache.set(
+                key, summary, summary_type, settings.AI_SUMMARIZER_SETTINGS['MODEL'],
+                total_tokens=getattr(usage, 'total_tokens', 0) or 0
+            )
+        logger.info(f"Streamed summary of {len(summary)} characters using {self.api_provider}")
+
+    def generate_summaries(
+        self,
+        items: List[SummaryRequest],
+        concurrency: Optional[int] = None
+    ) -> List[str]:
+        """
+        Generate summaries for many items concurrently (see BatchSummaryGenerator)
+
+        Args:
+            items: SummaryRequest per summary (content, context, summary_type)
+            concurrency: Maximum requests in flight (default AI_SUMMARIZER_SETTINGS['BATCH_CONCURRENCY'])
+
+        Returns:
+            One summary per item, in the same order; failed items use fallback truncation
+        """
+        return BatchSummaryGenerator(self, concurrency=concurrency).run(items)
 
     def _get_system_prompt(self, summary_type: str) -> str:
         """Get specialized system prompt based on summary type"""
@@ -116,19 +244,12 @@ class OpenAIService:
 
         return prompts.get(summary_type, base_prompt)
 
-def link_references(summary_text: str, topic_hint: str = 'diabetes') -> List[ClinicalReference]:
-    """Link clinical references based on summary content and topic"""
-    qs = ClinicalReference.objects.filter(topic__icontains=topic_hint)
-    selected = []
-    text_lower = summary_text.lower()
-    for ref in qs[:20]:
-        score = 0
-        for kw in TOPIC_KEYWORDS.get(topic_hint, []):
-            if kw in text_lower:
-                score += 1
-        if score:
-            selected.append(ref)
-    return selected[:3]
+def link_references(summary_text: str, topic_hint: str = 'diabetes', limit: int = 3) -> List[ClinicalReference]:
+    """Link the clinical references of the topic that best match the summary (BM25 over the reference index)"""
+    ranked = get_reference_index().search(summary_text, topic_hint, limit)
+    references = ClinicalReference.objects.in_bulk([ref_id for ref_id, _ in ranked])
+    # A reference deleted since the index was read is simply skipped
+    return [references[ref_id] for ref_id, _ in ranked if ref_id in references]
 
 def create_ai_summary(
     content: str,
@@ -177,6 +298,121 @@ def create_ai_summary(
     return summary
 
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_ai_summary(
+    content: str,
+    patient_id: Optional[int] = None,
+    content_type_id: Optional[int] = None,
+    object_id: Optional[str] = None,
+    context: Optional[str] = None,
+    summary_type: str = "medical_record",
+    topic_hint: str = "diabetes",
+    summary: Optional['AISummary'] = None
+) -> Iterator[str]:
+    """
+    Stream an AI summary as Server-Sent Events and persist it when the stream completes
+
+    Events:
+        delta: {"text": ...} for every generated fragment
+        done: {"id", "summary", "references"} after the AISummary is saved
+        error: {"message"} if generation fails mid-stream or the summary cannot be saved (nothing is saved)
+
+    Args:
+        content, patient_id, content_type_id, object_id, context, summary_type, topic_hint:
+            Same as create_ai_summary
+        summary: Existing AISummary to update instead of creating a new one (regeneration)
+
+    Yields:
+        SSE-formatted event strings
+    """
+    parts = []
+    try:
+        for delta in OpenAIService().stream_summary(content, context, summary_type):
+            parts.append(delta)
+            yield _sse_event('delta', {'text': delta})
+    except Exception as e:
+        logger.error(f"AI summary stream for patient {patient_id} failed: {str(e)}")
+        yield _sse_event('error', {'message': 'AI summary generation failed'})
+        return
+
+    summary_text = ''.join(parts).strip()
+    try:
+        with transaction.atomic():
+            if summary is None:
+                summary = AISummary.objects.create(
+                    patient_id=patient_id,
+                    content_type_id=content_type_id,
+                    object_id=object_id,
+                    summary=summary_text
+                )
+                references = link_references(summary_text, topic_hint)
+                if references:
+                    summary.references.add(*references)
+            else:
+                summary.summary = summary_text
+                summary.save()
+                references = list(summary.references.all())
+    except Exception as e:
+        # The response has already started; report the failure as an event instead of breaking the stream
+        logger.error(f"Saving streamed AI summary for patient {patient_id} failed: {str(e)}")
+        yield _sse_event('error', {'message': 'AI summary could not be saved'})
+        return
+
+    logger.info(f"Streamed AI summary {summary.id} for patient {summary.patient_id}")
+    yield _sse_event('done', {
+        'id': summary.id,
+        'summary': summary_text,
+        'references': [reference.id for reference in references],
+    })
+
+
+def create_ai_summaries(
+    items: List[Dict[str, Any]],
+    topic_hint: str = "diabetes",
+    concurrency: Optional[int] = None
+) -> List['AISummary']:
+    """
+    Create AI summaries for many records with concurrent generation
+
+    Args:
+        items: Dicts with the create_ai_summary arguments (content, patient_id and optional
+            content_type_id, object_id, context, summary_type)
+        topic_hint: Topic hint for reference linking
+        concurrency: Maximum AI requests in flight
+
+    Returns:
+        Created AISummary instances, in the same order as items
+    """
+    requests = [
+        SummaryRequest(
+            content=item['content'],
+            context=item.get('context'),
+            summary_type=item.get('summary_type', 'medical_record')
+        )
+        for item in items
+    ]
+    summary_texts = OpenAIService().generate_summaries(requests, concurrency=concurrency)
+
+    summaries = []
+    for item, summary_text in zip(items, summary_texts):
+        summary = AISummary.objects.create(
+            patient_id=item['patient_id'],
+            content_type_id=item.get('content_type_id'),
+            object_id=item.get('object_id'),
+            summary=summary_text
+        )
+        references = link_references(summary_text, topic_hint)
+        if references:
+            summary.references.add(*references)
+        summaries.append(summary)
+
+    logger.info(f"Created {len(summaries)} AI summaries in batch")
+    return summaries
+
+
 class BaselineCalculationService:
     """
     سرویس محاسبه معیارهای پایه برای هر بیمار
@@ -192,19 +428,20 @@ class BaselineCalculationService:
         patient = PatientProfile.objects.get(id=patient_id)
         cutoff_date = timezone.now() - timedelta(days=months_back * 30)
         
-        # محاسبه معیارهای آزمایشگاهی
-        lab_data = LabResult.objects.filter(
-            patient=patient,
-            taken_at__gte=cutoff_date
-        )
+        # محاسبه معیارهای آزمایشگاهی از سری زمانی کش شده
+        store = get_lab_series_store()
         
         # HbA1c
-        hba1c_values = lab_data.filter(loinc__in=['4548-4', '17856-6']).values_list('value', flat=True)
-        hba1c_stats = BaselineCalculationService._calculate_stats(list(hba1c_values))
+        hba1c_values = BaselineCalculationService._window_values(
+            store.get_many(patient, ['4548-4', '17856-6']).window(cutoff_date)
+        )
+        hba1c_stats = BaselineCalculationService._calculate_stats(hba1c_values)
         
         # Blood Glucose
-        glucose_values = lab_data.filter(loinc__in=['2345-7', '2339-0', '1558-6']).values_list('value', flat=True)
-        glucose_stats = BaselineCalculationService._calculate_stats(list(glucose_values))
+        glucose_values = BaselineCalculationService._window_values(
+            store.get_many(patient, ['2345-7', '2339-0', '1558-6']).window(cutoff_date)
+        )
+        glucose_stats = BaselineCalculationService._calculate_stats(glucose_values)
         
         # محاسبه الگوهای رفتاری
         encounters_count = Encounter.objects.filter(
@@ -212,7 +449,7 @@ class BaselineCalculationService:
             occurred_at__gte=cutoff_date
         ).count()
         
-        labs_count = lab_data.count()
+        labs_count = LabResult.objects.filter(patient=patient, taken_at__gte=cutoff_date).count()
         months_count = min(months_back, (timezone.now() - cutoff_date).days // 30)
         
         encounters_per_month = encounters_count / months_count if months_count > 0 else 0
@@ -245,7 +482,13 @@ class BaselineCalculationService:
         return baseline
     
     @staticmethod
-    def _calculate_stats(values: List[Decimal]) -> Dict[str, Optional[Decimal]]:
+    def _window_values(series) -> List[float]:
+        """مقادیر عددی یک برش سری زمانی (آزمایش‌های بدون مقدار کنار گذاشته می‌شوند)"""
+        values = series.values
+        return values[~np.isnan(values)].tolist()
+    
+    @staticmethod
+    def _calculate_stats(values: List[float]) -> Dict[str, Optional[Decimal]]:
         """
         محاسبه آمار پایه (میانگین و انحراف معیار)
         """
@@ -335,26 +578,20 @@ class AnomalyDetectionService:
         
         cutoff_date = timezone.now() - timedelta(days=lookback_days)
         
-        # دریافت داده‌های اخیر
+        # دریافت داده‌های اخیر از سری زمانی کش شده
         if metric_type == 'hba1c':
-            recent_data = LabResult.objects.filter(
-                patient=patient,
-                loinc__in=['4548-4', '17856-6'],
-                taken_at__gte=cutoff_date
-            ).order_by('taken_at')
+            loincs = ['4548-4', '17856-6']
         elif metric_type == 'glucose':
-            recent_data = LabResult.objects.filter(
-                patient=patient,
-                loinc__in=['2345-7', '2339-0', '1558-6'],
-                taken_at__gte=cutoff_date
-            ).order_by('taken_at')
+            loincs = ['2345-7', '2339-0', '1558-6']
         else:
             return []
         
-        if recent_data.count() < 3:
+        recent_data = get_lab_series_store().get_many(patient, loincs).window(cutoff_date)
+        if len(recent_data) < 3:
             return []
         
-        values = [float(result.value) for result in recent_data]
+        values = recent_data.values.tolist()
+        timestamps = recent_data.datetimes()
         anomalies = []
         
         # بررسی تغییرات ناگهانی بین نقاط متوالی
@@ -373,7 +610,7 @@ class AnomalyDetectionService:
                     detected_value=Decimal(str(values[i])),
                     expected_value=Decimal(str(values[i-1])),
                     deviation_score=Decimal(str(round(change_percent, 3))),
-                    data_timestamp=list(recent_data)[i].taken_at
+                    data_timestamp=timestamps[i]
                 )
                 anomalies.append(anomaly)
         
@@ -431,17 +668,15 @@ class PatternAnalysisService:
         
         cutoff_date = timezone.now() - timedelta(days=months_back * 30)
         
-        glucose_data = LabResult.objects.filter(
-            patient=patient,
-            loinc__in=['2345-7', '2339-0', '1558-6'],
-            taken_at__gte=cutoff_date
-        ).order_by('taken_at')
+        glucose_data = get_lab_series_store().get_many(
+            patient, ['2345-7', '2339-0', '1558-6']
+        ).window(cutoff_date)
         
-        if glucose_data.count() < 3:
+        if len(glucose_data) < 3:
             return None
         
-        values = [float(result.value) for result in glucose_data]
-        timestamps = [result.taken_at for result in glucose_data]
+        values = glucose_data.values.tolist()
+        timestamps = glucose_data.datetimes()
         
         # تحلیل روند خطی
         trend_analysis = PatternAnalysisService._calculate_linear_trend(values, timestamps)
@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from laboratory.models import LabResult
 from encounters.models import Encounter
+from references.models import ClinicalReference
+from .reference_index import ReferenceIndex
 from .tasks import run_anomaly_detection_for_new_lab, run_pattern_analysis_for_patient
 import logging
 
@@ -37,4 +39,16 @@ def trigger_pattern_analysis_on_encounter(sender, instance, created, **kwargs):
             )
             logger.info(f"Pattern analysis scheduled for patient {instance.patient.id} after new encounter")
         except Exception as e:
-            logger.error(f"Failed to schedule pattern analysis for encounter {instance.id}: {e}")
\ No newline at end of file
+            logger.error(f"Failed to schedule pattern analysis for encounter {instance.id}: {e}")
+
+
+@receiver(post_save, sender=ClinicalReference)
+@receiver(post_delete, sender=ClinicalReference)
+def refresh_reference_index(sender, instance, **kwargs):
+    """
+    نامعتبر کردن نمایهٔ منابع بالینی پس از افزودن، ویرایش یا حذف منبع تا در جستجوی بعدی بازسازی شود
+    """
+    try:
+        ReferenceIndex.notify()
+    except Exception as e:
+        logger.error(f"Failed to invalidate reference index for reference {instance.id}: {e}")
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import openai
+from django.conf import settings
+
+from .summary_cache import SummaryCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200_000
+DEFAULT_MAX_RETRIES = 4
+
+# Full-jitter exponential backoff: sleep uniform(0, min(cap, base * 2 ** attempt))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+
+# Rough prompt size estimate used to reserve tokens-per-minute budget before a call
+CHARS_PER_TOKEN = 4
+
+
+def _setting(name: str, default):
+    return settings.AI_SUMMARIZER_SETTINGS.get(name, default)
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Upper-bound token cost of a chat completion: prompt estimate plus the completion limit"""
+    prompt_chars = sum(len(message['content']) for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens
+
+
+def is_retryable(exc: Exception) -> bool:
+    """429, 5xx, timeouts and connection errors are retried; other API errors are final"""
+    status_code = getattr(exc, 'status_code', None)
+    if status_code is not None:
+        return status_code in (408, 409, 429) or status_code >= 500
+    return isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError, asyncio.TimeoutError))
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Delay requested by the server through the Retry-After header, if any"""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_minute`.
+
+    `acquire(amount)` waits until `amount` tokens are available. Requests larger than
+    the bucket capacity are clamped to it so they cannot block forever.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        # The lock keeps waiters FIFO so a large request is not starved by small ones
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int) -> None:
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+@dataclass
+class SummaryRequest:
+    """One item of a batch; arguments mirror OpenAIService.generate_summary"""
+    content: str
+    context: Optional[str] = None
+    summary_type: str = 'medical_record'
+
+
+@dataclass
+class BatchStats:
+    generated: int = 0
+    cache_hits: int = 0
+    # Items with the same cache key as an earlier item of the same batch
+    duplicates: int = 0
+    fallbacks: int = 0
+    retries: int = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+    # Seconds from the first attempt to the final answer of each API-bound item
+    latencies: List[float] = field(default_factory=list)
+
+
+class BatchSummaryGenerator:
+    """
+    Generate many summaries concurrently with the async OpenAI client.
+
+    At most `concurrency` requests are in flight, every request first takes budget
+    from the requests/tokens-per-minute buckets, and retryable failures (429, 5xx,
+    timeouts) are retried with full-jitter backoff, honoring Retry-After. An item
+    that still fails falls back to the same truncation `generate_summary` uses, so
+    the result list always has one summary per request, in request order.
+
+    Items already in the summary cache, and repeats of the same content within the
+    batch, are not sent to the API.
+    """
+
+    def __init__(self, service, concurrency: Optional[int] = None,
+                 requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 max_retries: Optional[int] = None, backoff_base: float = BACKOFF_BASE_SECONDS,
+                 backoff_cap: float = BACKOFF_CAP_SECONDS):
+        self.service = service
+        self.concurrency = concurrency or _setting('BATCH_CONCURRENCY', DEFAULT_CONCURRENCY)
+        self.requests_per_minute = requests_per_minute or _setting('REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE)
+        self.tokens_per_minute = tokens_per_minute or _setting('TOKENS_PER_MINUTE', DEFAULT_TOKENS_PER_MINUTE)
+        self.max_retries = max_retries if max_retries is not None else _setting('MAX_RETRIES', DEFAULT_MAX_RETRIES)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.stats = BatchStats()
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _fail(self, item: SummaryRequest, exc: Exception) -> Tuple[str, None]:
+        name = type(exc).__name__
+        self.stats.errors[name] = self.stats.errors.get(name, 0) + 1
+        self.stats.fallbacks += 1
+        return self.service.fallback_summary(item.content), None
+
+    async def _generate_one(self, client, limiter: RateLimiter, semaphore: asyncio.Semaphore,
+                            item: SummaryRequest) -> Tuple[str, Optional[int]]:
+        """(summary, total tokens used); tokens is None for a fallback summary"""
+        messages = self.service.build_messages(item.content, item.context, item.summary_type)
+        max_tokens = settings.AI_SUMMARIZER_SETTINGS['MAX_TOKENS']
+        cost = estimate_tokens(messages, max_tokens)
+
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                return await self._attempt(client, limiter, item, messages, max_tokens, cost)
+            finally:
+                self.stats.latencies.append(time.monotonic() - started)
+
+    async def _attempt(self, client, limiter: RateLimiter, item: SummaryRequest, messages: List[Dict[str, str]],
+                       max_tokens: int, cost: int) -> Tuple[str, Optional[int]]:
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(cost)
+            try:
+                response = await client.chat.completions.create(
+                    model=settings.AI_SUMMARIZER_SETTINGS['MODEL'],
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=settings.AI_SUMMARIZER_SETTINGS['TEMPERATURE']
+                )
+                summary = response.choices[0].message.content.strip()
+                self.stats.generated += 1
+                usage = getattr(response, 'usage', None)
+                return summary, getattr(usage, 'total_tokens', 0) or 0
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    logger.error(f"Batch summary failed after {attempt + 1} attempts: {e}")
+                    return self._fail(item, e)
+                self.stats.retries += 1
+                delay = self._backoff(attempt, e)
+                logger.warning(f"Batch summary attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def generate(self, items: List[SummaryRequest]) -> List[Tuple[str, Optional[int]]]:
+        """(summary, total tokens) per item via the API, without consulting the cache"""
+        if not items:
+            return []
+        client = self.service.create_async_client()
+        if client is None:
+            logger.warning("AI client not configured. Falling back to truncated content for the batch.")
+            self.stats.fallbacks += len(items)
+            return [(self.service.fallback_summary(item.content), None) for item in items]
+
+        limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            return await asyncio.gather(*(
+                self._generate_one(client, limiter, semaphore, item) for item in items
+            ))
+        finally:
+            close = getattr(client, 'close', None)
+            if close is not None:
+                await close()
+
+    def run(self, items: List[SummaryRequest]) -> List[str]:
+        """Synchronous entry point for tasks and management commands (must not run inside an event loop)"""
+        started = time.monotonic()
+        cache = SummaryCache() if SummaryCache.enabled() else None
+
+        # The ORM is synchronous, so cache reads and writes happen outside the event loop
+        keys = [self.service.cache_key(item.content, item.context, item.summary_type) for item in items]
+        summaries = cache.get_many(keys) if cache else {}
+        self.stats.cache_hits = sum(1 for key in keys if key in summaries)
+
+        pending: Dict[str, SummaryRequest] = {}
+        for key, item in zip(keys, items):
+            if key not in summaries and key not in pending:
+                pending[key] = item
+        self.stats.duplicates = len(items) - self.stats.cache_hits - len(pending)
+
+        results = asyncio.run(self.generate(list(pending.values())))
+        model = settings.AI_SUMMARIZER_SETTINGS['MODEL']
+        for (key, item), (summary, tokens) in zip(pending.items(), results):
+            summaries[key] = summary
+            if cache and tokens is not None:
+                cache.set(key, summary, item.summary_type, model, total_tokens=tokens)
+
+        logger.info(
+            f"Summarized {len(items)} items in {time.monotonic() - started:.1f}s "
+            f"({self.stats.generated} generated, {self.stats.cache_hits} cached, {self.stats.duplicates} duplicates, "
+            f"{self.stats.fallbacks} fallbacks, {self.stats.retries} retries)"
+        )
+        return [summaries[key] for key in keys]
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import SummaryCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Bump when prompts or post-processing change in a way that should invalidate cached summaries
+PROMPT_VERSION = 'v1'
+
+DEFAULT_LRU_SIZE = 1024
+
+
+def _setting(name: str, default):
+    return settings.AI_SUMMARIZER_SETTINGS.get(name, default)
+
+
+def make_cache_key(content: str, context: Optional[str], summary_type: str, model: str, system_prompt: str) -> str:
+    """SHA-256 of every input that changes the generated summary"""
+    payload = json.dumps(
+        [PROMPT_VERSION, model, summary_type, system_prompt, context or '', content],
+        ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _LRU:
+    """Thread-safe in-process LRU of key -> summary"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_lru: Optional[_LRU] = None
+_lru_lock = threading.Lock()
+
+
+def _get_lru() -> _LRU:
+    global _lru
+    with _lru_lock:
+        size = _setting('CACHE_LRU_SIZE', DEFAULT_LRU_SIZE)
+        if _lru is None or _lru.size != size:
+            _lru = _LRU(size)
+        return _lru
+
+
+class SummaryCache:
+    """
+    Deduplication cache for generated summaries.
+
+    Entries are persisted in SummaryCacheEntry so every worker shares them; an
+    in-process LRU in front avoids the lookup query for hot keys. Each hit bumps the
+    entry's hit counter with a single UPDATE, which is what the statistics use to
+    report the hit rate and tokens saved. Fallback (truncated) summaries are never
+    stored, so a failed call is retried the next time the content is seen.
+    """
+
+    def __init__(self):
+        self.lru = _get_lru()
+
+    @staticmethod
+    def enabled() -> bool:
+        return _setting('CACHE_ENABLED', True)
+
+    def _record_hits(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if keys:
+            SummaryCacheEntry.objects.filter(key__in=keys).update(
+                hits=F('hits') + 1, last_hit_at=timezone.now()
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Cached summaries for the keys that have one"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for key in keys:
+            summary = self.lru.get(key)
+            if summary is not None:
+                found[key] = summary
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            for key, summary in SummaryCacheEntry.objects.filter(key__in=missing).values_list('key', 'summary'):
+                found[key] = summary
+                self.lru.set(key, summary)
+
+        self._record_hits(found)
+        return found
+
+    def set(self, key: str, summary: str, summary_type: str, model: str, total_tokens: int = 0) -> None:
+        self.lru.set(key, summary)
+        try:
+            with transaction.atomic():
+                SummaryCacheEntry.objects.create(
+                    key=key,
+                    summary=summary,
+                    summary_type=summary_type,
+                    model=model,
+                    total_tokens=total_tokens or 0
+                )
+        except IntegrityError:
+            # Another worker generated the same content concurrently; keep the first entry
+            logger.debug(f"Summary cache entry {key[:12]} already exists")
+
+    @staticmethod
+    def statistics() -> Dict:
+        """Hit rate and tokens saved across all workers"""
+        totals = SummaryCacheEntry.objects.aggregate(
+            total_hits=Sum('hits'),
+            tokens_saved=Sum(F('hits') * F('total_tokens'))
+        )
+        entries = SummaryCacheEntry.objects.count()
+        hits = totals['total_hits'] or 0
+        # Every entry was created by exactly one cache miss that called the API
+        lookups = hits + entries
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': entries,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'tokens_saved': totals['tokens_saved'] or 0,
+        }
+
+    @staticmethod
+    def clear_local() -> None:
+        _get_lru().clear()
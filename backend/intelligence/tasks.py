@@ -1,5 +1,5 @@
 from celery import shared_task
-from .services import create_ai_summary, link_references
+from .services import create_ai_summary, create_ai_summaries, link_references
 from .models import AISummary
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
@@ -59,6 +59,38 @@ def create_summary_with_references(
         logger.error(f"Error creating AI summary for patient {patient_id}: {str(e)}")
         raise
 
+@shared_task
+def create_summaries_batch(items, topic_hint="diabetes", concurrency=None):
+    """Create AI summaries for many records with concurrent, rate-limited generation.
+
+    Args:
+        items: List of dicts with patient_id, content and optional content_type_model,
+            object_id, context and summary_type (same meaning as create_summary_with_references)
+        topic_hint: Optional topic hint for linking references
+        concurrency: Maximum AI requests in flight (default from AI_SUMMARIZER_SETTINGS)
+
+    Returns:
+        IDs of the created AISummary objects, in item order
+    """
+    content_types = {}
+    prepared = []
+    for item in items:
+        item = dict(item)
+        model = item.pop('content_type_model', None)
+        if model:
+            if model not in content_types:
+                content_types[model] = ContentType.objects.filter(model=model.lower()).values_list(
+                    'id', flat=True
+                ).first()
+                if content_types[model] is None:
+                    logger.warning(f"ContentType not found for model: {model}")
+            item['content_type_id'] = content_types[model]
+        prepared.append(item)
+
+    summaries = create_ai_summaries(prepared, topic_hint=topic_hint, concurrency=concurrency)
+    logger.info(f"Successfully created {len(summaries)} AI summaries in batch")
+    return [summary.id for summary in summaries]
+
 @shared_task
 def generate_summary_for_existing_record(summary_id, new_content, context=None, summary_type="medical_record"):
     """Regenerate AI summary for an existing AISummary record.
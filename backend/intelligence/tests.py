@@ -1,3 +1,370 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from gitdm.models import PatientProfile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .llm_standin import StandInConfig, StandInLLMServer, deterministic_summary
+from .models import AISummary, SummaryCacheEntry
+from .services import OpenAIService
+from .summary_batch import BatchSummaryGenerator, SummaryRequest, TokenBucket
+from .summary_cache import SummaryCache
+
+User = get_user_model()
+
+
+def _inject_failures(content, attempt):
+    """محتوای دارای 'always-fail' همیشه 500 و 'rate-limited' در تلاش اول 429 می‌گیرد"""
+    if 'always-fail' in content:
+        return 500
+    if 'rate-limited' in content and attempt == 1:
+        return 429
+    return None
+
+
+class _StandInServerTestCase(TestCase):
+    """سرور جایگزین محلی (llm_standin) برای همه تست‌های کلاس؛ OpenAIService به آن متصل می‌شود"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StandInLLMServer(config=StandInConfig(), inject=_inject_failures).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.config = StandInConfig(latency_ms=50, latency_sigma=0, token_delay_ms=0, retry_after=0)
+        self.server.reset()
+        # LRU درون فرایند با rollback پایگاه داده پاک نمی‌شود
+        SummaryCache.clear_local()
+        settings_override = override_settings(
+            GAPGPT_API_KEY='test-key',
+            GAPGPT_BASE_URL=self.server.base_url,
+            AI_SUMMARIZER_SETTINGS={**settings.AI_SUMMARIZER_SETTINGS, 'USE_GAPGPT': True},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def api_calls(self):
+        return sum(self.server.attempts.values())
+
+    @staticmethod
+    def expected_summary(content, context=None, summary_type='medical_record'):
+        """خلاصه‌ای که سرور جایگزین برای این درخواست برمی‌گرداند"""
+        return deterministic_summary(OpenAIService().build_messages(content, context, summary_type))
+
+    def reported_tokens(self, content, context=None, summary_type='medical_record'):
+        """total_tokens گزارش شده توسط سرور جایگزین برای این درخواست"""
+        import openai
+
+        client = openai.OpenAI(api_key='standin', base_url=self.server.base_url, max_retries=0)
+        return client.chat.completions.create(
+            model='m', messages=OpenAIService().build_messages(content, context, summary_type)
+        ).usage.total_tokens
+
+
+class BatchSummaryGenerationTest(_StandInServerTestCase):
+    """تست‌های تولید موازی خلاصه‌ها در برابر سرور محلی"""
+
+    def test_batch_keeps_order_and_bounds_concurrency(self):
+        """نتیجه‌ها به ترتیب ورودی هستند و تعداد درخواست‌های همزمان از حد مجاز بیشتر نمی‌شود"""
+        items = [SummaryRequest(content=f'record {i}') for i in range(12)]
+        summaries = OpenAIService().generate_summaries(items, concurrency=3)
+
+        self.assertEqual(summaries, [self.expected_summary(f'record {i}') for i in range(12)])
+        self.assertLessEqual(self.server.max_in_flight, 3)
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_retries_rate_limits_and_falls_back_on_persistent_errors(self):
+        """429 دوباره تلاش می‌شود و خطای ماندگار به خلاصه کوتاه شده برمی‌گردد"""
+        long_failure = 'always-fail ' + 'x' * 600
+        items = [SummaryRequest(content='rate-limited record'), SummaryRequest(content=long_failure)]
+        generator = BatchSummaryGenerator(OpenAIService(), concurrency=2, max_retries=2, backoff_base=0.01)
+
+        summaries = generator.run(items)
+
+        self.assertEqual(summaries[0], self.expected_summary('rate-limited record'))
+        self.assertEqual(summaries[1], long_failure[:500] + '...')
+        self.assertEqual(self.server.attempts[generator.service.build_messages(
+            long_failure, None, 'medical_record')[-1]['content']], 3)
+        self.assertEqual(generator.stats.generated, 1)
+        self.assertEqual(generator.stats.fallbacks, 1)
+        self.assertEqual(generator.stats.retries, 3)
+
+    def test_token_bucket_limits_rate(self):
+        """با ظرفیت یک و نرخ ۶۰۰ در دقیقه، سه درخواست حداقل ۰٫۲ ثانیه طول می‌کشد"""
+        async def take_three():
+            bucket = TokenBucket(600, capacity=1)
+            for _ in range(3):
+                await bucket.acquire(1)
+
+        started = time.monotonic()
+        asyncio.run(take_three())
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+
+class SummaryCacheTest(_StandInServerTestCase):
+    """تست‌های حذف تکرار خلاصه‌های محتوای یکسان"""
+
+    def test_identical_content_is_generated_once(self):
+        """محتوای تکراری از کش خوانده می‌شود؛ تغییر context یا نوع خلاصه کلید جدید می‌سازد"""
+        service = OpenAIService()
+        first = service.generate_summary('HbA1c 8.2%', summary_type='lab_results')
+        self.assertEqual(service.generate_summary('HbA1c 8.2%', summary_type='lab_results'), first)
+        SummaryCache.clear_local()
+        self.assertEqual(OpenAIService().generate_summary('HbA1c 8.2%', summary_type='lab_results'), first)
+        self.assertEqual(self.api_calls(), 1)
+
+        service.generate_summary('HbA1c 8.2%', summary_type='encounter')
+        service.generate_summary('HbA1c 8.2%', context='age 60', summary_type='lab_results')
+        self.assertEqual(self.api_calls(), 3)
+
+    def test_batch_skips_cached_and_repeated_items(self):
+        """در دسته، محتوای کش شده و تکرارهای همان دسته به API فرستاده نمی‌شوند"""
+        service = OpenAIService()
+        service.generate_summary('record 0')
+        generator = BatchSummaryGenerator(service, concurrency=2)
+        summaries = generator.run([SummaryRequest(content=f'record {i % 3}') for i in range(6)])
+
+        self.assertEqual(summaries, [self.expected_summary(f'record {i % 3}') for i in range(6)])
+        self.assertEqual(self.api_calls(), 3)
+        self.assertEqual((generator.stats.cache_hits, generator.stats.duplicates, generator.stats.generated), (2, 2, 2))
+
+    def test_failed_calls_are_not_cached(self):
+        """خلاصه کوتاه شده پس از خطا در کش ذخیره نمی‌شود"""
+        generator = BatchSummaryGenerator(OpenAIService(), max_retries=0)
+        generator.run([SummaryRequest(content='always-fail record')])
+        generator.run([SummaryRequest(content='always-fail record')])
+        self.assertEqual(self.api_calls(), 2)
+
+    def test_statistics_report_hit_rate_and_tokens_saved(self):
+        """آمار خلاصه‌ها نرخ hit و توکن‌های صرفه‌جویی شده را نشان می‌دهد"""
+        service = OpenAIService()
+        for _ in range(3):
+            service.generate_summary('metformin 500mg BID')
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='stats@example.com', password='testpass123'))
+        response = client.get('/api/ai-summaries/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary_cache'], {
+            'entries': 1, 'hits': 2, 'misses': 1, 'hit_rate': 0.6667,
+            'tokens_saved': 2 * self.reported_tokens('metformin 500mg BID'),
+        })
+
+
+class StreamingSummaryTest(_StandInServerTestCase):
+    """تست‌های ارسال خلاصه به صورت Server-Sent Events"""
+
+    def setUp(self):
+        super().setUp()
+        self.patient = PatientProfile.objects.create(full_name='بیمار استریم')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='stream@example.com', password='testpass123'))
+
+    @staticmethod
+    def _read_events(response):
+        """(زمان دریافت، نام رویداد، داده) هر رویداد SSE"""
+        started = time.monotonic()
+        events = []
+        for chunk in response.streaming_content:
+            for block in chunk.decode().strip().split('\n\n'):
+                name, data = block.split('\n', 1)
+                events.append((time.monotonic() - started, name[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_create_streams_tokens_and_persists_summary(self):
+        """اولین بخش پیش از پایان تولید می‌رسد و متن کامل در AISummary ذخیره می‌شود"""
+        self.server.config.token_delay_ms = 200
+        response = self.client.post('/api/ai-summaries/', {
+            'patient_id': self.patient.id, 'content': 'HbA1c 9.1%', 'stream': True
+        }, format='json', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/event-stream'))
+        events = self._read_events(response)
+
+        expected = self.expected_summary('HbA1c 9.1%')
+        self.assertEqual([name for _, name, _ in events], ['delta'] * len(expected.split(' ')) + ['done'])
+        self.assertLess(events[0][0], events[-1][0] - 0.3)
+        done = events[-1][2]
+        self.assertEqual(''.join(data['text'] for _, name, data in events if name == 'delta'), expected)
+        self.assertEqual(done['summary'], expected)
+        self.assertEqual(AISummary.objects.get(pk=done['id']).summary, expected)
+        self.assertEqual(SummaryCacheEntry.objects.get().total_tokens, self.reported_tokens('HbA1c 9.1%'))
+
+    def test_create_rejects_unknown_patient_before_streaming(self):
+        """بیمار ناموجود پیش از شروع استریم و بدون فراخوانی مدل با 400 رد می‌شود"""
+        response = self.client.post('/api/ai-summaries/', {
+            'patient_id': self.patient.id + 1000, 'content': 'HbA1c 9.1%', 'stream': True
+        }, format='json', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'event: error', response.content)
+        self.assertEqual(self.api_calls(), 0)
+        self.assertFalse(AISummary.objects.exists())
+
+    def test_save_failure_is_sent_as_error_event(self):
+        """خطای ذخیره پس از تولید متن به صورت رویداد error ارسال می‌شود و چیزی ذخیره نمی‌شود"""
+        from unittest import mock
+
+        with mock.patch('intelligence.services.link_references', side_effect=RuntimeError('index unavailable')):
+            response = self.client.post('/api/ai-summaries/', {
+                'patient_id': self.patient.id, 'content': 'HbA1c 9.1%', 'stream': True
+            }, format='json', HTTP_ACCEPT='text/event-stream')
+            events = self._read_events(response)
+
+        self.assertEqual([name for _, name, _ in events],
+                         ['delta'] * len(self.expected_summary('HbA1c 9.1%').split(' ')) + ['error'])
+        self.assertFalse(AISummary.objects.exists())
+
+    def test_regenerate_streams_into_existing_summary(self):
+        """بازتولید استریم شده، همان AISummary را به‌روز می‌کند"""
+        summary = AISummary.objects.create(patient=self.patient, summary='old')
+        response = self.client.post(f'/api/ai-summaries/{summary.id}/regenerate/', {
+            'summary_id': summary.id, 'content': 'new labs', 'stream': True
+        }, format='json')
+
+        events = self._read_events(response)
+        self.assertEqual(events[-1][1], 'done')
+        self.assertEqual(events[-1][2]['id'], summary.id)
+        summary.refresh_from_db()
+        self.assertEqual(summary.summary, self.expected_summary('new labs'))
+        self.assertEqual(AISummary.objects.count(), 1)
+
+
+class LLMStandInTest(TestCase):
+    """تست‌های سرور جایگزین محلی و ابزار تست بار"""
+
+    def test_standin_is_deterministic_and_injects_rate_limits(self):
+        """پاسخ هر پیام ثابت است و با rate_limit_rate=1 همه درخواست‌ها 429 می‌گیرند"""
+        import openai
+
+        messages = [{'role': 'user', 'content': 'Please summarize the following medical information:\n\nHbA1c 7.9%'}]
+        with StandInLLMServer(config=StandInConfig(latency_ms=1, latency_sigma=0)) as server:
+            client = openai.OpenAI(api_key='standin', base_url=server.base_url, max_retries=0)
+            first = client.chat.completions.create(model='m', messages=messages)
+            second = client.chat.completions.create(model='m', messages=messages)
+            streamed = ''.join(
+                chunk.choices[0].delta.content or ''
+                for chunk in client.chat.completions.create(model='m', messages=messages, stream=True)
+                if chunk.choices
+            )
+        self.assertEqual(first.choices[0].message.content, second.choices[0].message.content)
+        self.assertEqual(streamed, first.choices[0].message.content)
+        self.assertIn('HbA1c 7.9%', streamed)
+
+        with StandInLLMServer(config=StandInConfig(latency_ms=1, rate_limit_rate=1)) as server:
+            client = openai.OpenAI(api_key='standin', base_url=server.base_url, max_retries=0)
+            with self.assertRaises(openai.RateLimitError):
+                client.chat.completions.create(model='m', messages=messages)
+
+    def test_load_test_reports_throughput_and_tail_latency(self):
+        """ابزار تست بار در برابر سرور درون فرایند، توان و صدک‌های تأخیر را گزارش می‌کند"""
+        from .load_test import SummaryLoadTest
+
+        result = SummaryLoadTest(
+            items=20, concurrency=5, content_chars=200,
+            standin=StandInConfig(latency_ms=5, rate_limit_rate=0.1, retry_after=0.01)
+        ).run()
+
+        self.assertEqual(result['generated'], 20)
+        self.assertEqual(result['server']['ok'], 20)
+        self.assertEqual(result['server']['requests'], 20 + result['retries'])
+        self.assertGreater(result['throughput_per_second'], 0)
+        self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertFalse(SummaryCacheEntry.objects.exists())
+
+
+class BaselineCalculationTest(TestCase):
+    """تست محاسبه معیارهای پایه از سری زمانی کش شده آزمایش‌ها"""
+
+    def test_baseline_reads_lab_windows_from_series_store(self):
+        """میانگین و انحراف معیار فقط از آزمایش‌های پنجره محاسبه و مقادیر از کش سری خوانده می‌شوند"""
+        from datetime import timedelta
+        from decimal import Decimal
+
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from encounters.models import Encounter
+        from laboratory.models import LabResult
+
+        from analytics.lab_series import get_lab_series_store
+        from .services import BaselineCalculationService
+
+        cache.clear()
+        user = User.objects.create_user(email='baseline@example.com', password='testpass123', is_doctor=True)
+        patient = PatientProfile.objects.create(full_name='بیمار معیار پایه', primary_doctor=user)
+        now = timezone.now()
+        encounter = Encounter.objects.create(patient=patient, created_by=user, occurred_at=now)
+        for loinc, value, days_ago in [('4548-4', '7.0', 10), ('17856-6', '8.0', 40), ('4548-4', '12.0', 400),
+                                       ('2345-7', '120', 5), ('1558-6', '140', 20)]:
+            LabResult.objects.create(patient=patient, encounter=encounter, loinc=loinc, value=Decimal(value),
+                                     unit='%', taken_at=now - timedelta(days=days_ago))
+        store = get_lab_series_store()
+        store.get_many(patient, ['4548-4', '17856-6'])
+        store.get_many(patient, ['2345-7', '2339-0', '1558-6'])
+
+        with CaptureQueriesContext(connection) as queries:
+            baseline = BaselineCalculationService.calculate_baseline_metrics(patient.id)
+
+        self.assertEqual((baseline.avg_hba1c, baseline.std_hba1c), (Decimal('7.5'), Decimal('0.71')))
+        self.assertEqual(baseline.avg_blood_glucose, Decimal('130'))
+        self.assertEqual(baseline.data_points_count, 4)
+        self.assertFalse([q for q in queries.captured_queries if '"laboratory_labresult"."value"' in q['sql']])
+
+
+class ReferenceIndexTest(TestCase):
+    """تست‌های نمایهٔ معکوس منابع بالینی و رتبه‌بندی BM25 در link_references"""
+
+    def setUp(self):
+        from .reference_index import get_reference_index
+        get_reference_index().clear()
+
+    def _reference(self, title, topic='diabetes', year=2020):
+        from references.models import ClinicalReference
+        return ClinicalReference.objects.create(title=title, source='Journal', year=year, topic=topic)
+
+    def test_ranks_by_title_relevance_across_whole_library(self):
+        """منابع مرتبط‌تر اول می‌آیند، حتی اگر بعد از بیست منبع اول موضوع باشند"""
+        from .services import link_references
+
+        for index in range(25):
+            self._reference(f'General diabetes care review {index}', year=2024)
+        sglt2 = self._reference('SGLT2 inhibitors and heart failure outcomes', year=2001)
+        glp1 = self._reference('GLP-1 receptor agonists for weight loss', year=2000)
+        self._reference('SGLT2 inhibitors in hypertension', topic='cardiology')
+
+        linked = link_references('Started an SGLT2 inhibitor; history of heart failure.', 'diabetes')
+        self.assertEqual(linked[0], sglt2)
+        self.assertEqual(len(linked), 3)
+        self.assertTrue(all('diabetes' in reference.topic for reference in linked))
+
+        self.assertEqual(link_references('Consider glp-1 therapy for weight loss', 'diabetes')[0], glp1)
+        self.assertEqual(link_references('Unrelated orthopedic follow-up', 'diabetes'), [])
+
+    def test_index_refreshes_when_references_change(self):
+        """افزودن و حذف منبع بدون بازسازی دستی در نتیجه‌ها دیده می‌شود"""
+        from .services import link_references
+
+        self._reference('Metformin first-line therapy')
+        self.assertEqual(len(link_references('Continues metformin', 'diabetes')), 1)
+
+        insulin = self._reference('Basal insulin titration')
+        linked = link_references('Basal insulin dose increased', 'diabetes')
+        self.assertEqual(linked[0], insulin)
+
+        insulin.delete()
+        linked = link_references('Basal insulin dose increased', 'diabetes')
+        self.assertNotIn(insulin, linked)
+        self.assertEqual(len(linked), 1)
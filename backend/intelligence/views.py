@@ -2,10 +2,16 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from django.contrib.contenttypes.models import ContentType
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+import json
 from drf_spectacular.utils import extend_schema, extend_schema_view
 import logging
 
+from gitdm.models import PatientProfile
 from .models import AISummary, BaselineMetrics, PatternAnalysis, AnomalyDetection, PatternAlert
 from .serializers import (
     AISummarySerializer,
@@ -21,10 +27,30 @@ from .serializers import (
     PatternAnalysisRequestSerializer
 )
 from .tasks import generate_summary_for_existing_record
+from .summary_cache import SummaryCache
+from .services import stream_ai_summary
 
 logger = logging.getLogger(__name__)
 
 
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients send Accept: text/event-stream; non-streamed responses are rendered as an error event"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode(self.charset)
+
+
+def _event_stream_response(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # Disable proxy buffering (nginx) so each event reaches the client immediately
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @extend_schema_view(
     list=extend_schema(
         summary="List AI summaries",
@@ -47,6 +73,7 @@ class AISummaryViewSet(viewsets.ModelViewSet):
     """ViewSet for AI summaries with GapGPT/OpenAI integration"""
     queryset = AISummary.objects.all().select_related('patient', 'content_type')
     permission_classes = [IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
 
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
@@ -67,10 +94,34 @@ class AISummaryViewSet(viewsets.ModelViewSet):
         return queryset.order_by('-created_at')
 
     def create(self, request, *args, **kwargs):
-        """Create AI summary with enhanced response"""
+        """Create AI summary with enhanced response (stream=true relays tokens as Server-Sent Events)"""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        if serializer.validated_data['stream']:
+            data = serializer.validated_data
+            # Validate before the 200 response starts; tokens would otherwise be spent on a summary that cannot be saved
+            if not PatientProfile.objects.filter(pk=data['patient_id']).exists():
+                return Response({'patient_id': ['Patient not found']}, status=status.HTTP_400_BAD_REQUEST)
+            content_type_id = None
+            if data.get('content_type_model'):
+                content_type_id = ContentType.objects.filter(
+                    model=data['content_type_model'].lower()
+                ).values_list('id', flat=True).first()
+                if content_type_id is None:
+                    return Response(
+                        {'content_type_model': ['Unknown content type']}, status=status.HTTP_400_BAD_REQUEST
+                    )
+            return _event_stream_response(stream_ai_summary(
+                content=data['content'],
+                patient_id=data['patient_id'],
+                content_type_id=content_type_id,
+                object_id=data.get('object_id'),
+                context=data.get('context'),
+                summary_type=data['summary_type'],
+                topic_hint=data['topic_hint']
+            ))
+
         result = serializer.save()
 
         # Handle different response types based on processing method
@@ -94,6 +145,14 @@ class AISummaryViewSet(viewsets.ModelViewSet):
         serializer = RegenerateAISummarySerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        if serializer.validated_data['stream']:
+            return _event_stream_response(stream_ai_summary(
+                content=serializer.validated_data['content'],
+                context=serializer.validated_data.get('context'),
+                summary_type=serializer.validated_data.get('summary_type', 'medical_record'),
+                summary=summary
+            ))
+
         # Start background task for regeneration
         task_result = generate_summary_for_existing_record.delay(
             summary_id=summary.id,
@@ -165,6 +224,7 @@ class AISummaryViewSet(viewsets.ModelViewSet):
             'average_summary_length': self.get_queryset()
             .aggregate(avg_length=Avg(Length('summary')))['avg_length'],
             'total_references_linked': sum(s.references.count() for s in self.get_queryset()),
+            'summary_cache': SummaryCache.statistics(),
         }
 
         # Add patient-specific stats if patient_id provided
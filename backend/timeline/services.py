@@ -1,3 +1,4 @@
+import numpy as np
 from django.utils import timezone
 from django.db.models import Q
 from datetime import timedelta
@@ -201,17 +202,58 @@ class TimelineVisualizationService:
     سرویس تولید داده‌های تجسم تایم‌لاین
     """
     
+    # ترتیب شدت برای انتخاب مهم‌ترین رویداد هر بازه زمانی
+    SEVERITY_RANK = {
+        MedicalTimeline.Severity.LOW: 0,
+        MedicalTimeline.Severity.NORMAL: 1,
+        MedicalTimeline.Severity.HIGH: 2,
+        MedicalTimeline.Severity.CRITICAL: 3,
+    }
+    
     @staticmethod
-    def prepare_timeline_chart_data(patient, start_date=None, end_date=None):
-        """آماده‌سازی داده‌ها برای نمودار تایم‌لاین"""
+    def downsample_events(events, max_points):
+        """
+        کاهش رویدادها به حداکثر max_points با حفظ شدیدترین رویداد هر بازه زمانی.
+        
+        بازه کل به max_points بازه مساوی تقسیم و از هر بازه شدیدترین (و در صورت برابری،
+        جدیدترین) رویداد نگه داشته می‌شود؛ رویدادهای بحرانی تا زمانی که دو رویداد بحرانی
+        در یک بازه نیفتند حذف نمی‌شوند. ترتیب اصلی رویدادها حفظ می‌شود.
+        """
+        events = list(events)
+        if len(events) <= max_points:
+            return events
+        
+        times = np.array([event.occurred_at.timestamp() for event in events])
+        ranks = np.array([
+            TimelineVisualizationService.SEVERITY_RANK.get(event.severity, 1) for event in events
+        ])
+        span = (times.max() - times.min()) or 1
+        buckets = np.minimum(((times - times.min()) / span * max_points).astype(int), max_points - 1)
+        
+        order = np.lexsort((-times, -ranks, buckets))
+        _, first = np.unique(buckets[order], return_index=True)
+        return [events[i] for i in np.sort(order[first])]
+    
+    @staticmethod
+    def prepare_timeline_chart_data(patient, start_date=None, end_date=None, max_points=None):
+        """
+        آماده‌سازی داده‌ها برای نمودار تایم‌لاین.
+        
+        بدون max_points فقط 100 رویداد آخر بازه برگردانده می‌شود؛ با max_points همه رویدادهای
+        بازه خوانده و با downsample_events به حداکثر max_points رویداد کاهش می‌یابند.
+        """
         if not start_date:
             start_date = timezone.now() - timedelta(days=365)  # یک سال گذشته
         if not end_date:
             end_date = timezone.now()
         
-        events = TimelineService.get_patient_timeline(
-            patient, start_date, end_date
-        )
+        if max_points:
+            events = TimelineService.get_patient_timeline(patient, start_date, end_date, limit=None)
+            events = TimelineVisualizationService.downsample_events(events.iterator(), max_points)
+        else:
+            events = TimelineService.get_patient_timeline(
+                patient, start_date, end_date
+            )
         
         # تبدیل به فرمت مناسب برای نمودار
         chart_data = []
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
@@ -248,4 +248,27 @@ class TimelineVisualizationTestCase(TestCase):
         
         response = self.client.get(f'/patient/{self.patient_profile.id}/timeline/')
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, 'دسترسی غیرمجاز')
\ No newline at end of file
+        self.assertContains(response, 'دسترسی غیرمجاز')
+
+
+class TimelineDownsamplingTestCase(SimpleTestCase):
+    def test_downsampling_keeps_critical_events(self):
+        """کاهش رویدادها تعداد را محدود می‌کند و رویداد بحرانی را نگه می‌دارد"""
+        from .services import TimelineVisualizationService
+        
+        now = timezone.now()
+        events = [
+            MedicalTimeline(
+                title=f'رویداد {i}',
+                severity=MedicalTimeline.Severity.NORMAL,
+                occurred_at=now - timedelta(hours=i)
+            )
+            for i in range(500)
+        ]
+        events[250].severity = MedicalTimeline.Severity.CRITICAL
+        
+        sampled = TimelineVisualizationService.downsample_events(events, 20)
+        
+        self.assertLessEqual(len(sampled), 20)
+        self.assertIn(events[250], sampled)
+        self.assertEqual(sampled, sorted(sampled, key=events.index))